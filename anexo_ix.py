@@ -0,0 +1,264 @@
+"""
+Leitura do CSV do Anexo IX (sep=';') para a base_normativa_ncm, em operações de coluna.
+
+Usado pela página Base Normativa e pelos scripts extrator_anexo_ix.py e
+carregar_dados_anexo_ix.py: uma leitura (UTF-8 e, se falhar, latin-1), uma checagem
+de colunas, a limpeza de NCM/CEST com str.replace e os registros (uma linha por NCM,
+a primeira do arquivo vence) com drop_duplicates/to_dict. comparar_com_base faz o
+"dry-run": o que a carga mudaria nas regras já gravadas, sem gravar nada, e
+atualizar_cest_em_massa grava o CEST de todos os NCMs de uma vez.
+"""
+from collections import defaultdict
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+import pandas as pd
+
+from consultas_paginadas import MAX_THREADS_CONSULTA, buscar_paginado, em_paralelo, lotes
+from esquema_banco import erro_funcao_inexistente
+
+FATOR_ART_17 = 0.7  # MVA remanescente: 70% da MVA (Art. 17)
+# Tentativas de encoding, na ordem (latin-1 sempre decodifica: fica por último)
+ENCODINGS_ANEXO_IX = ("utf-8-sig", "latin-1")
+COLUNA_NCM = "ncm"
+# Colunas aceitas, na ordem de preferência (nomes já em minúsculas)
+COLUNAS_DESCRICAO = ("descricao do produto", "descricao")
+COLUNAS_MVA = ("mva", "mva_st_interna", "mva_original")
+TAMANHO_MINIMO_NCM = 2
+TAMANHO_MINIMO_CEST = 4
+DESCRICAO_MAX = 500
+# Campos comparados no dry-run (os que existirem dos dois lados)
+CAMPOS_COMPARADOS = ("descricao", "cest", "mva_st_interna", "mva_remanescente")
+
+
+class ErroEsquemaAnexoIX(ValueError):
+    """CSV sem as colunas obrigatórias do Anexo IX."""
+
+
+def ler_csv_anexo_ix(origem: str | Path | BinaryIO | bytes) -> pd.DataFrame:
+    """CSV do Anexo IX como texto (dtype=str, preserva zeros à esquerda), colunas em minúsculas."""
+    if isinstance(origem, (str, Path)):
+        dados = Path(origem).read_bytes()
+    elif isinstance(origem, bytes):
+        dados = origem
+    else:
+        origem.seek(0)
+        dados = origem.read()
+    for encoding in ENCODINGS_ANEXO_IX:
+        try:
+            df = pd.read_csv(BytesIO(dados), sep=";", encoding=encoding, dtype=str)
+            break
+        except UnicodeDecodeError:
+            continue
+    df.columns = df.columns.str.strip().str.lower()
+    return df
+
+
+def _primeira_coluna(df: pd.DataFrame, opcoes: tuple[str, ...]) -> str | None:
+    return next((c for c in opcoes if c in df.columns), None)
+
+
+def validar_esquema(df: pd.DataFrame) -> list[str]:
+    """
+    Confere as colunas: sem ncm levanta ErroEsquemaAnexoIX; sem descrição, CEST ou
+    MVA a carga segue, e os avisos voltam na lista.
+    """
+    if COLUNA_NCM not in df.columns:
+        raise ErroEsquemaAnexoIX(
+            f"Coluna 'ncm' não encontrada no arquivo (colunas: {', '.join(df.columns) or 'nenhuma'})."
+        )
+    avisos = []
+    if _primeira_coluna(df, COLUNAS_DESCRICAO) is None:
+        avisos.append("Sem coluna de descrição ('descricao do produto' ou 'descricao').")
+    if "cest" not in df.columns:
+        avisos.append("Sem coluna 'cest': regras só por NCM.")
+    if _primeira_coluna(df, COLUNAS_MVA) is None:
+        avisos.append("Sem coluna 'mva': MVA não será gravada.")
+    return avisos
+
+
+def _apenas_digitos(serie: pd.Series) -> pd.Series:
+    return serie.fillna("").astype(str).str.replace(r"\D", "", regex=True)
+
+
+def normalizar_anexo_ix(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tabela limpa, uma linha por linha válida do CSV (na ordem do arquivo): ncm e cest
+    só com dígitos (CEST com menos de 4 dígitos vira None), descricao (até 500
+    caracteres, None se vazia), mva em % (NaN se ausente ou inválida; aceita "40",
+    "69,43" e "40%") e, com MVA, mva_st_interna (decimal) e mva_remanescente (Art. 17),
+    com 0 no lugar de MVA inválida. Linhas com NCM de menos de 2 dígitos são descartadas.
+    """
+    validar_esquema(df)
+    ncm = _apenas_digitos(df[COLUNA_NCM])
+    validas = ncm.str.len() >= TAMANHO_MINIMO_NCM
+    tabela = pd.DataFrame({COLUNA_NCM: ncm[validas]})
+
+    if "cest" in df.columns:
+        cest = _apenas_digitos(df.loc[validas, "cest"])
+        tabela["cest"] = cest.where(cest.str.len() >= TAMANHO_MINIMO_CEST, None)
+    else:
+        tabela["cest"] = None
+
+    col_descricao = _primeira_coluna(df, COLUNAS_DESCRICAO)
+    if col_descricao:
+        descricao = df.loc[validas, col_descricao].fillna("").astype(str).str.strip().str[:DESCRICAO_MAX]
+        tabela["descricao"] = descricao.where(descricao != "", None)
+    else:
+        tabela["descricao"] = None
+
+    col_mva = _primeira_coluna(df, COLUNAS_MVA)
+    if col_mva:
+        texto = df.loc[validas, col_mva].fillna("").astype(str).str.strip()
+        mva = pd.to_numeric(texto.str.replace(",", ".", regex=False).str.replace("%", "", regex=False), errors="coerce")
+        tabela["mva"] = mva
+        tabela["mva_st_interna"] = mva.fillna(0) / 100
+        tabela["mva_remanescente"] = tabela["mva_st_interna"] * FATOR_ART_17
+    return tabela.reset_index(drop=True)
+
+
+def carregar_anexo_ix(origem: str | Path | BinaryIO | bytes) -> tuple[pd.DataFrame, list[str]]:
+    """ler_csv_anexo_ix + validar_esquema + normalizar_anexo_ix: (tabela limpa, avisos)."""
+    df = ler_csv_anexo_ix(origem)
+    avisos = validar_esquema(df)
+    tabela = normalizar_anexo_ix(df)
+    descartadas = len(df) - len(tabela)
+    if descartadas:
+        avisos.append(f"{descartadas} linha(s) sem NCM válido ignorada(s).")
+    repetidos = int(tabela.duplicated(COLUNA_NCM).sum())
+    if repetidos:
+        avisos.append(f"{repetidos} linha(s) com NCM repetido: vale a primeira de cada NCM.")
+    return tabela, avisos
+
+
+def registros_anexo_ix(tabela: pd.DataFrame, fixos: dict | None = None) -> list[dict]:
+    """
+    Registros para base_normativa_ncm: a primeira linha de cada NCM, com ncm, cest,
+    descricao e, se houver MVA, mva_st_interna e mva_remanescente; fixos entra em todos.
+    """
+    colunas = [c for c in (COLUNA_NCM, "cest", "descricao", "mva_st_interna", "mva_remanescente") if c in tabela.columns]
+    unicos = tabela.drop_duplicates(COLUNA_NCM)[colunas]
+    unicos = unicos.astype(object).where(unicos.notna(), None)
+    if fixos:
+        unicos = unicos.assign(**fixos)
+    return unicos.to_dict("records")
+
+
+def mapa_ncm_cest(tabela: pd.DataFrame) -> dict[str, str]:
+    """NCM -> CEST: o primeiro CEST válido de cada NCM (mesmo que não seja o da primeira linha)."""
+    com_cest = tabela.dropna(subset=["cest"]).drop_duplicates(COLUNA_NCM)
+    return dict(zip(com_cest[COLUNA_NCM], com_cest["cest"]))
+
+
+# --- Dry-run ---
+
+def linhas_base_normativa(supabase) -> list[dict]:
+    """Linhas atuais de base_normativa_ncm para comparar_com_base (só as colunas que existirem)."""
+    for colunas in ("ncm, descricao, cest, mva_st_interna, mva_remanescente", "ncm, descricao, cest", "ncm, descricao"):
+        try:
+            return buscar_paginado(lambda: supabase.table("base_normativa_ncm").select(colunas).order("ncm"))
+        except Exception:
+            continue
+    return []
+
+
+def _diferentes(novo: pd.Series, atual: pd.Series, numerico: bool) -> pd.Series:
+    if numerico:
+        a = pd.to_numeric(novo, errors="coerce").to_numpy(dtype=float)
+        b = pd.to_numeric(atual, errors="coerce").to_numpy(dtype=float)
+        return pd.Series(~np.isclose(a, b, equal_nan=True), index=novo.index)
+    return novo.fillna("").astype(str) != atual.fillna("").astype(str)
+
+
+def comparar_com_base(registros: list[dict], atuais: list[dict]) -> dict:
+    """
+    Dry-run da carga: compara os registros (registros_anexo_ix) com as linhas atuais
+    da base, por NCM (a primeira linha de cada NCM no banco). Retorna {"novos",
+    "alterados", "iguais", "so_no_banco"} (contagens) e "detalhe": DataFrame com
+    ncm, situacao ("novo", "alterado", "só no banco") e campos (os que mudam).
+    """
+    novo = pd.DataFrame(registros, columns=None if registros else [COLUNA_NCM])
+    atual = pd.DataFrame(atuais, columns=None if atuais else [COLUNA_NCM])
+    atual = atual.assign(**{COLUNA_NCM: _apenas_digitos(atual[COLUNA_NCM])}).drop_duplicates(COLUNA_NCM)
+    campos = [c for c in CAMPOS_COMPARADOS if c in novo.columns and c in atual.columns]
+    juntos = novo[[COLUNA_NCM] + campos].merge(
+        atual[[COLUNA_NCM] + campos], on=COLUNA_NCM, how="outer", suffixes=("", "_atual"), indicator=True, sort=True
+    )
+    ambos = juntos[juntos["_merge"] == "both"]
+    mudancas = pd.DataFrame({c: _diferentes(ambos[c], ambos[f"{c}_atual"], c.startswith("mva")) for c in campos}, index=ambos.index)
+    alterado = mudancas.any(axis=1) if campos else pd.Series(False, index=ambos.index)
+
+    detalhe = pd.concat([
+        pd.DataFrame({COLUNA_NCM: juntos.loc[juntos["_merge"] == "left_only", COLUNA_NCM], "situacao": "novo", "campos": ""}),
+        pd.DataFrame({
+            COLUNA_NCM: ambos.loc[alterado, COLUNA_NCM],
+            "situacao": "alterado",
+            "campos": mudancas[alterado].apply(lambda linha: ", ".join(linha.index[linha]), axis=1) if alterado.any() else "",
+        }),
+        pd.DataFrame({COLUNA_NCM: juntos.loc[juntos["_merge"] == "right_only", COLUNA_NCM], "situacao": "só no banco", "campos": ""}),
+    ], ignore_index=True)
+    return {
+        "novos": int((juntos["_merge"] == "left_only").sum()),
+        "alterados": int(alterado.sum()),
+        "iguais": int((~alterado).sum()),
+        "so_no_banco": int((juntos["_merge"] == "right_only").sum()),
+        "detalhe": detalhe,
+    }
+
+
+# --- CEST em massa ---
+
+def _escalar(dados) -> int:
+    """Valor devolvido por uma função SQL escalar (o PostgREST pode embrulhar em lista/dict)."""
+    while isinstance(dados, (list, dict)):
+        if not dados:
+            return 0
+        dados = dados[0] if isinstance(dados, list) else next(iter(dados.values()))
+    return int(dados or 0)
+
+
+def atualizar_cest_em_massa(supabase, mapa: dict[str, str], max_threads: int = MAX_THREADS_CONSULTA) -> dict:
+    """
+    Grava o CEST de cada NCM do mapa (mapa_ncm_cest) em base_normativa_ncm, só nas
+    linhas em que ele muda. Primeiro tenta a função atualizar_cest_base_normativa
+    (migration 017): um único UPDATE ... FROM com todos os pares. Só se a função não
+    existir (erro_funcao_inexistente), um UPDATE por CEST com os NCMs no filtro in_
+    (lotes de TAMANHO_LOTE_IDS), em paralelo; outros erros da RPC são relançados.
+    Retorna {"modo": "rpc" | "lotes", "alteradas", "requisicoes", "erros"}.
+    """
+    if not mapa:
+        return {"modo": "rpc", "alteradas": 0, "requisicoes": 0, "erros": []}
+    try:
+        resp = supabase.rpc(
+            "atualizar_cest_base_normativa",
+            {"p_pares": [{"ncm": ncm, "cest": cest} for ncm, cest in mapa.items()]},
+        ).execute()
+        return {"modo": "rpc", "alteradas": _escalar(resp.data), "requisicoes": 1, "erros": []}
+    except Exception as exc:
+        if not erro_funcao_inexistente(exc):
+            raise
+
+    ncms_por_cest: dict[str, list[str]] = defaultdict(list)
+    for ncm, cest in mapa.items():
+        ncms_por_cest[cest].append(ncm)
+    tarefas = {
+        (cest, tuple(lote)): (
+            lambda cest=cest, lote=lote: supabase.table("base_normativa_ncm")
+            .update({"cest": cest}, count="exact", returning="minimal")
+            .in_("ncm", lote)
+            .or_(f"cest.is.null,cest.neq.{cest}")
+            .execute()
+        )
+        for cest, ncms in ncms_por_cest.items()
+        for lote in lotes(ncms)
+    }
+    alteradas = 0
+    erros = []
+    for (cest, lote), resp in em_paralelo(tarefas, max_threads, capturar_erros=True).items():
+        if isinstance(resp, Exception):
+            erros.append(f"CEST {cest} (NCM {', '.join(lote)}): {resp}")
+        else:
+            alteradas += resp.count or 0
+    return {"modo": "lotes", "alteradas": alteradas, "requisicoes": 1 + len(tarefas), "erros": erros}
@@ -1,14 +1,19 @@
 import hashlib
+import logging
 import os
-import re
 from datetime import datetime
+from functools import partial
 from io import BytesIO
 from pathlib import Path
+import shutil
+import tempfile
+import threading
+import time
+import uuid
 import zipfile
 
 import pandas as pd
 import streamlit as st
-import xmltodict
 from supabase import create_client, Client  # type: ignore
 
 try:
@@ -19,15 +24,93 @@ except ImportError:
 
 from streamlit_option_menu import option_menu
 
-try:
-    from reportlab.lib import colors
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import cm
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-    HAS_REPORTLAB = True
-except ImportError:
-    HAS_REPORTLAB = False
+from impressoes_nfe import (
+    STATUS_CONFIRMADOS,
+    IndiceImpressoes,
+    arquivo_conhecido,
+    impressao_xml,
+    mensagem_arquivo_conhecido,
+)
+from ingestao_nfe import LIMIAR_PARALELO, analisar_nfe, analisar_zip_em_paralelo, analisar_zip_sequencial
+from armazem_resultados import ArmazemResultados, ListaEmDisco
+from consultas_paginadas import buscar_paginado, buscar_por_ids, em_paralelo, lotes
+from esquema_banco import EsquemaBanco, detectar_esquema, erro_funcao_inexistente
+from anexo_ix import (
+    ErroEsquemaAnexoIX,
+    carregar_anexo_ix,
+    comparar_com_base,
+    linhas_base_normativa,
+    registros_anexo_ix,
+)
+from busca_auditoria import (
+    NOTAS_POR_PAGINA,
+    ORDENACOES,
+    SelecaoNotas,
+    buscar_ids_notas,
+    buscar_pagina_notas,
+    nomes_clientes,
+)
+from cache_auditoria import CacheAuditoria, montar_tabela_auditoria
+from exportacao_auditoria import (
+    FORMATOS_EXPORTACAO,
+    LIMITE_LINHAS_EXCEL,
+    LINHAS_POR_BLOCO,
+    excede_limite_excel,
+    gerar_exportacao,
+)
+from kpis_auditoria import calcular_kpis_auditoria
+from pipeline_importacao import PipelineImportacao
+from relatorio_pdf import (
+    COLUNAS_RELATORIO_PDF,
+    HAS_REPORTLAB,
+    MODOS_RELATORIO_PDF,
+    gerar_relatorio_pdf,
+    modo_padrao,
+)
+from reprocessamento_st import carregar_base_normativa, reclassificar_incremental, reprocessar_notas
+from fila_importacao import (
+    DIR_IMPORTACOES,
+    JOB_CONCLUIDO,
+    JOB_ERRO,
+    JOB_EXECUTANDO,
+    JOB_INTERROMPIDO,
+    JOB_NA_FILA,
+    FilaImportacao,
+    iniciar_em_segundo_plano,
+    listar_xmls_zip,
+    status_efetivo,
+)
+from nfe_parser import (
+    _extrair_cst_icms,
+    extrair_data_emissao_ide,
+    extrair_impostos_item,
+    extrair_registro_nfe,
+    limpar_cnpj,
+    limpar_ncm,
+    safe_float,
+)
+from regras_st import (
+    BADGE_ANTECIPACAO_PENDENTE,
+    BADGE_OPERACAO_COMUM,
+    BADGE_ST_RECOLHIDA,
+    DIAGNOSTICO_ANTECIPACAO_PENDENTE,
+    DIAGNOSTICO_CFOP_XML,
+    DIAGNOSTICO_ERRO_ST,
+    DIAGNOSTICO_ST_RECOLHIDA,
+    STATUS_IRREGULAR_ST,
+    STATUS_SUJEITO_ST,
+    COLUNAS_CLASSIFICACAO_ST,
+    EstatisticasMatch,
+    IndiceRegrasST,
+    _sanitizar_cest,
+    _sanitizar_ncm,
+    cfop_indica_st,
+    cfop_inicia_51,
+    cfop_inicia_54_ou_64,
+    cfop_inicia_61,
+    cfop_substituicao,
+    preparar_base_normativa,
+)
 
 # Tenta carregar variáveis do .env, se python-dotenv estiver instalado
 try:
@@ -531,21 +614,18 @@ def pagina_gestao_clientes() -> None:
     supabase = require_supabase()
 
     # 4 Cards de KPIs no topo (glassmorphism)
-    try:
-        resp_c = supabase.table("clientes").select("id", count="exact").limit(1).execute()
-        total_clientes = resp_c.count or 0
-    except Exception:
-        total_clientes = 0
-    try:
-        resp_n = supabase.table("notas_fiscais").select("id", count="exact").limit(1).execute()
-        total_notas = resp_n.count or 0
-    except Exception:
-        total_notas = 0
-    try:
-        resp_i = supabase.table("itens_nota").select("id", count="exact").limit(1).execute()
-        total_itens = resp_i.count or 0
-    except Exception:
-        total_itens = 0
+    # Contagens independentes: disparadas juntas
+    contagens = em_paralelo(
+        {
+            tabela: (lambda t=tabela: supabase.table(t).select("id", count="exact").limit(1).execute().count or 0)
+            for tabela in ("clientes", "notas_fiscais", "itens_nota")
+        },
+        capturar_erros=True,
+    )
+    total_clientes, total_notas, total_itens = (
+        0 if isinstance(v, Exception) else v
+        for v in (contagens["clientes"], contagens["notas_fiscais"], contagens["itens_nota"])
+    )
     _render_premium_cards_generic([
         ("Total de Clientes", total_clientes, "blue"),
         ("Total de Notas", total_notas, "green"),
@@ -597,6 +677,7 @@ def pagina_gestao_clientes() -> None:
 
                     if response.data:
                         st.success("Cliente cadastrado com sucesso! (CNPJ: " + formatar_cnpj(cnpj_limpo) + ")")
+                        _clientes_auditoria.clear()
                         st.session_state.cnpj_cadastro = ""
                     else:
                         st.warning(
@@ -631,6 +712,121 @@ def pagina_gestao_clientes() -> None:
         st.dataframe(clientes_exibir, use_container_width=True)
 
 
+# Colunas de impostos de itens_nota (migration 007)
+COLUNAS_IMPOSTOS_ITEM = (
+    "icms_bc", "icms_aliq", "icms_valor",
+    "icms_st_bc", "icms_st_aliq", "icms_st_valor",
+    "pis_bc", "pis_aliq", "pis_valor",
+    "cofins_bc", "cofins_aliq", "cofins_valor",
+    "ipi_bc", "ipi_aliq", "ipi_valor",
+    "ibs_valor", "cbs_valor",
+)
+# Tamanho dos lotes do gravador em massa (notas por SELECT/INSERT e itens por INSERT)
+LOTE_NOTAS = 500
+LOTE_ITENS = 1000
+# Bytes por bloco ao copiar um upload para o disco
+TAMANHO_BLOCO_COPIA = 1024 * 1024
+# Intervalo (segundos) entre detecções das colunas opcionais do banco
+TTL_ESQUEMA_BANCO = 600
+
+
+@st.cache_resource
+def _cache_esquema_banco() -> dict:
+    """Esquema detectado (detectar_esquema), compartilhado por todas as sessões do servidor."""
+    return {"esquema": None, "verificado_em": 0.0, "lock": threading.Lock()}
+
+
+def _obter_esquema_banco(supabase: Client) -> EsquemaBanco:
+    """
+    Colunas opcionais existentes (migrations 004–013), detectadas no máximo a cada
+    TTL_ESQUEMA_BANCO segundos. Se a detecção falhar, vale o último esquema conhecido
+    ou, sem nenhum, o esquema completo.
+    """
+    cache = _cache_esquema_banco()
+    if cache["esquema"] is not None and time.monotonic() - cache["verificado_em"] < TTL_ESQUEMA_BANCO:
+        return cache["esquema"]
+    with cache["lock"]:
+        if cache["esquema"] is not None and time.monotonic() - cache["verificado_em"] < TTL_ESQUEMA_BANCO:
+            return cache["esquema"]
+        try:
+            cache["esquema"] = detectar_esquema(supabase)
+        except Exception:
+            if cache["esquema"] is None:
+                cache["esquema"] = EsquemaBanco.completo()
+        cache["verificado_em"] = time.monotonic()
+        return cache["esquema"]
+
+
+def _montar_registro_nota(
+    numero_nfe: str,
+    cliente_id: str | None,
+    valor_total: float,
+    icms_total: float,
+    cnpj_destinatario: str | None = None,
+    data_emissao: str | None = None,
+    totais_impostos: dict | None = None,
+    uf_origem: str | None = None,
+    cst_principal: str | None = None,
+) -> dict:
+    """Linha de notas_fiscais (cnpj_destinatario só dígitos; opcionais só quando presentes)."""
+    cnpj_gravar = limpar_cnpj(cnpj_destinatario) if cnpj_destinatario else None
+    nota_data = {
+        "numero_nfe": numero_nfe,
+        "cliente_id": cliente_id,
+        "valor_total": float(valor_total),
+        "icms_total": float(icms_total),
+        "data_importacao": datetime.now().isoformat(),
+    }
+    if cnpj_gravar is not None:
+        nota_data["cnpj_destinatario"] = cnpj_gravar
+    if data_emissao:
+        nota_data["data_emissao"] = data_emissao
+    if uf_origem:
+        nota_data["uf_origem"] = str(uf_origem).strip().upper()[:2]
+    if cst_principal:
+        nota_data["cst_principal"] = str(cst_principal).strip()[:50]
+    if totais_impostos:
+        for k, v in totais_impostos.items():
+            if v is not None:
+                nota_data[k] = float(v)
+    return nota_data
+
+
+def _montar_registro_item(item: dict, nota_id: str) -> dict:
+    """
+    Linha de itens_nota (status_st: SUJEITO A ST quando NCM na base ou CFOP 54/64;
+    categoria_st e demais colunas de classificação quando vierem da análise).
+    """
+    item_data = {
+        "nota_id": nota_id,
+        "codigo_produto": item.get("codigo_produto") or None,
+        "descricao": item.get("descricao") or None,
+        "ncm": limpar_ncm(item.get("ncm")),
+        "cest": item.get("cest") or None,
+        "cfop": item.get("cfop") or None,
+        "valor_unitario": float(item.get("valor_unitario", 0)),
+        "valor_total": float(item.get("valor_total", 0)),
+    }
+    if item.get("status_st") is not None:
+        item_data["status_st"] = item["status_st"]
+    # Campos de impostos (ICMS, ICMS-ST, PIS, COFINS, IPI, IBS, CBS)
+    for col in COLUNAS_IMPOSTOS_ITEM:
+        if col in item and item[col] is not None:
+            item_data[col] = float(item[col])
+    if "cst" in item and item["cst"] is not None:
+        item_data["cst"] = str(item["cst"]).strip()
+    # Classificação da auditoria (migration 016), quando calculada na análise
+    for col in COLUNAS_CLASSIFICACAO_ST:
+        if col in item:
+            item_data[col] = item[col]
+    return item_data
+
+
+def _gravar_itens(supabase: Client, itens_data: list[dict], esquema: EsquemaBanco):
+    """INSERT em itens_nota só com as colunas que existem no banco."""
+    return supabase.table("itens_nota").insert(esquema.filtrar("itens_nota", itens_data)).execute()
+
+
 def salvar_nota_e_itens(
     supabase: Client,
     numero_nfe: str,
@@ -661,48 +857,25 @@ def salvar_nota_e_itens(
         if response_existente.data and len(response_existente.data) > 0:
             return False, f"Nota {numero_nfe} já existe no banco de dados"
         
-        cnpj_gravar = limpar_cnpj(cnpj_destinatario) if cnpj_destinatario else None
-        # Insere a nota fiscal (cnpj_destinatario só dígitos)
-        nota_data = {
-            "numero_nfe": numero_nfe,
-            "cliente_id": cliente_id,
-            "valor_total": float(valor_total),
-            "icms_total": float(icms_total),
-            "data_importacao": datetime.now().isoformat(),
-        }
-        if cnpj_gravar is not None:
-            nota_data["cnpj_destinatario"] = cnpj_gravar
-        if data_emissao:
-            nota_data["data_emissao"] = data_emissao
-        if uf_origem:
-            nota_data["uf_origem"] = str(uf_origem).strip().upper()[:2]
-        if cst_principal:
-            nota_data["cst_principal"] = str(cst_principal).strip()[:50]
-        if totais_impostos:
-            for k, v in totais_impostos.items():
-                if v is not None:
-                    nota_data[k] = float(v)
+        nota_data = _montar_registro_nota(
+            numero_nfe,
+            cliente_id,
+            valor_total,
+            icms_total,
+            cnpj_destinatario=cnpj_destinatario,
+            data_emissao=data_emissao,
+            totais_impostos=totais_impostos,
+            uf_origem=uf_origem,
+            cst_principal=cst_principal,
+        )
         
-        # Tenta gravar; se alguma coluna não existir, faz fallback gradual preservando data_emissao.
-        try:
-            response_nota = supabase.table("notas_fiscais").insert(nota_data).execute()
-        except Exception as exc:
-            msg = str(exc)
-            if "PGRST204" in msg or "42703" in msg:
-                # Primeiro tenta sem cnpj_destinatario (mantém data_emissao)
-                nota_data.pop("cnpj_destinatario", None)
-                nota_data.pop("uf_origem", None)
-                nota_data.pop("cst_principal", None)
-                for k in ("icms_bc_total", "icms_st_total", "pis_total", "cofins_total", "ipi_total", "ibs_total", "cbs_total"):
-                    nota_data.pop(k, None)
-                try:
-                    response_nota = supabase.table("notas_fiscais").insert(nota_data).execute()
-                except Exception:
-                    # Último fallback: remove data_emissao se coluna inexistente
-                    nota_data.pop("data_emissao", None)
-                    response_nota = supabase.table("notas_fiscais").insert(nota_data).execute()
-            else:
-                raise
+        # Grava só as colunas que existem no banco (migrations detectadas antes)
+        esquema = _obter_esquema_banco(supabase)
+        response_nota = (
+            supabase.table("notas_fiscais")
+            .insert(esquema.filtrar("notas_fiscais", [nota_data])[0])
+            .execute()
+        )
         
         if not response_nota.data or len(response_nota.data) == 0:
             st.error(
@@ -713,66 +886,11 @@ def salvar_nota_e_itens(
         
         nota_id = response_nota.data[0]["id"]
         
-        # Insere os itens da nota (status_st: SUJEITO A ST quando NCM na base ou CFOP 54/64)
+        # Insere os itens da nota
         if itens:
-            itens_data = []
-            for item in itens:
-                ncm_item = limpar_ncm(item.get("ncm"))
-                item_data = {
-                    "nota_id": nota_id,
-                    "codigo_produto": item.get("codigo_produto") or None,
-                    "descricao": item.get("descricao") or None,
-                    "ncm": ncm_item,
-                    "cest": item.get("cest") or None,
-                    "cfop": item.get("cfop") or None,
-                    "valor_unitario": float(item.get("valor_unitario", 0)),
-                    "valor_total": float(item.get("valor_total", 0)),
-                }
-                if item.get("status_st") is not None:
-                    item_data["status_st"] = item["status_st"]
-                # Campos de impostos (ICMS, ICMS-ST, PIS, COFINS, IPI, IBS, CBS)
-                for col in (
-                    "icms_bc", "icms_aliq", "icms_valor",
-                    "icms_st_bc", "icms_st_aliq", "icms_st_valor",
-                    "pis_bc", "pis_aliq", "pis_valor",
-                    "cofins_bc", "cofins_aliq", "cofins_valor",
-                    "ipi_bc", "ipi_aliq", "ipi_valor",
-                    "ibs_valor", "cbs_valor",
-                ):
-                    if col in item and item[col] is not None:
-                        item_data[col] = float(item[col])
-                if "cst" in item and item["cst"] is not None:
-                    item_data["cst"] = str(item["cst"]).strip()
-                itens_data.append(item_data)
-            
+            itens_data = [_montar_registro_item(item, nota_id) for item in itens]
             if itens_data:
-                try:
-                    response_itens = supabase.table("itens_nota").insert(itens_data).execute()
-                except Exception as ins_exc:
-                    err_str = str(ins_exc)
-                    cols_inexistentes = (
-                        "42703" in err_str
-                        or "does not exist" in err_str.lower()
-                        or "PGRST204" in err_str
-                        or "Could not find" in err_str
-                        or "schema cache" in err_str.lower()
-                    )
-                    if cols_inexistentes:
-                        # Colunas de impostos não existem; insere sem elas
-                        for d in itens_data:
-                            for col in (
-                                "icms_bc", "icms_aliq", "icms_valor",
-                                "icms_st_bc", "icms_st_aliq", "icms_st_valor",
-                                "pis_bc", "pis_aliq", "pis_valor",
-                                "cofins_bc", "cofins_aliq", "cofins_valor",
-                                "ipi_bc", "ipi_aliq", "ipi_valor",
-                                "ibs_valor", "cbs_valor",
-                                "cst",
-                            ):
-                                d.pop(col, None)
-                        response_itens = supabase.table("itens_nota").insert(itens_data).execute()
-                    else:
-                        raise
+                response_itens = _gravar_itens(supabase, itens_data, esquema)
                 if not response_itens.data:
                     st.error(
                         "Erro ao salvar itens no Supabase. "
@@ -787,6 +905,118 @@ def salvar_nota_e_itens(
         return False, f"Erro ao salvar nota {numero_nfe}: {exc}"
 
 
+def salvar_notas_em_lote(
+    supabase: Client,
+    notas: list[dict],
+    esquema: EsquemaBanco | None = None,
+) -> list[dict]:
+    """
+    Gravador em massa: recebe várias notas já montadas (mesmos argumentos de
+    salvar_nota_e_itens, em dicts com a chave "itens") e grava em lotes.
+    Por lote de LOTE_NOTAS: 1 SELECT de duplicidade com in_(), 1 upsert das notas
+    (on_conflict numero_nfe, ignorando duplicadas, devolvendo os ids) e INSERTs de
+    itens em blocos de LOTE_ITENS, só com as colunas do esquema (padrão:
+    _obter_esquema_banco).
+    Retorna, na ordem de entrada, {"numero_nfe", "status", "mensagem"} com status
+    "Gravada", "Ja existente" ou "Falha ao gravar" (vocabulário do processar_xml).
+    """
+    if esquema is None:
+        esquema = _obter_esquema_banco(supabase)
+    resultados: list[dict] = [
+        {"numero_nfe": str(n["numero_nfe"]), "status": "Falha ao gravar", "mensagem": ""}
+        for n in notas
+    ]
+    vistos: set[str] = set()
+
+    for inicio in range(0, len(notas), LOTE_NOTAS):
+        indices = list(range(inicio, min(inicio + LOTE_NOTAS, len(notas))))
+        numeros = [resultados[i]["numero_nfe"] for i in indices]
+        try:
+            resp = (
+                supabase.table("notas_fiscais")
+                .select("numero_nfe")
+                .in_("numero_nfe", numeros)
+                .execute()
+            )
+            existentes = {str(r["numero_nfe"]) for r in (resp.data or [])}
+        except Exception as exc:
+            for i in indices:
+                resultados[i]["mensagem"] = f"Erro ao salvar nota {resultados[i]['numero_nfe']}: {exc}"
+            continue
+
+        # Notas novas (a primeira ocorrência de cada número dentro do upload vence)
+        novos: list[int] = []
+        for i in indices:
+            numero = resultados[i]["numero_nfe"]
+            if numero in existentes or numero in vistos:
+                resultados[i]["status"] = "Ja existente"
+                resultados[i]["mensagem"] = f"Nota {numero} já existe no banco de dados"
+            else:
+                vistos.add(numero)
+                novos.append(i)
+        if not novos:
+            continue
+
+        linhas = []
+        for i in novos:
+            n = notas[i]
+            linhas.append(_montar_registro_nota(
+                resultados[i]["numero_nfe"],
+                n.get("cliente_id"),
+                n.get("valor_total", 0.0),
+                n.get("icms_total", 0.0),
+                cnpj_destinatario=n.get("cnpj_destinatario"),
+                data_emissao=n.get("data_emissao"),
+                totais_impostos=n.get("totais_impostos"),
+                uf_origem=n.get("uf_origem"),
+                cst_principal=n.get("cst_principal"),
+            ))
+        try:
+            resp_notas = (
+                supabase.table("notas_fiscais")
+                .upsert(esquema.filtrar("notas_fiscais", linhas), on_conflict="numero_nfe", ignore_duplicates=True)
+                .execute()
+            )
+        except Exception as exc:
+            for i in novos:
+                resultados[i]["mensagem"] = f"Erro ao salvar nota {resultados[i]['numero_nfe']}: {exc}"
+            continue
+        ids_por_numero = {str(r["numero_nfe"]): r["id"] for r in (resp_notas.data or [])}
+
+        # Itens de todas as notas gravadas, em blocos grandes
+        itens_data: list[dict] = []
+        dono_item: list[int] = []
+        for i in novos:
+            numero = resultados[i]["numero_nfe"]
+            nota_id = ids_por_numero.get(numero)
+            if nota_id is None:
+                # Gravada por outra importação entre o SELECT e o upsert
+                resultados[i]["status"] = "Ja existente"
+                resultados[i]["mensagem"] = f"Nota {numero} já existe no banco de dados"
+                continue
+            resultados[i]["status"] = "Gravada"
+            resultados[i]["mensagem"] = f"Nota {numero} e {len(notas[i].get('itens') or [])} item(ns) salvos com sucesso"
+            for item in notas[i].get("itens") or []:
+                itens_data.append(_montar_registro_item(item, nota_id))
+                dono_item.append(i)
+
+        # Blocos de itens são independentes entre si: gravados em paralelo
+        gravacoes = em_paralelo(
+            {
+                j: (lambda bloco=itens_data[j : j + LOTE_ITENS]: _gravar_itens(supabase, bloco, esquema))
+                for j in range(0, len(itens_data), LOTE_ITENS)
+            },
+            capturar_erros=True,
+        )
+        for j, resp_itens in gravacoes.items():
+            if isinstance(resp_itens, Exception) or not resp_itens.data:
+                for i in set(dono_item[j : j + LOTE_ITENS]):
+                    resultados[i]["status"] = "Falha ao gravar"
+                    resultados[i]["mensagem"] = f"Nota {resultados[i]['numero_nfe']} salva, mas houve erro ao salvar itens"
+
+    return resultados
+
+
 def verificar_st_produto(supabase: Client, ncm: str) -> list | None:
     """
     Consulta regras de ST por NCM na tabela regras_st_pr.
@@ -804,34 +1034,6 @@ def verificar_st_produto(supabase: Client, ncm: str) -> list | None:
         return None
 
 
-def limpar_ncm(valor: str | None) -> str | None:
-    """
-    Normalização total: remove qualquer caractere não numérico do NCM.
-    Ex: 85.27 -> 8527; 8527.10.00 -> 85271000. Usado no XML e no banco.
-    """
-    if not valor:
-        return None
-    s = str(valor).strip()
-    if not s:
-        return None
-    ncm = re.sub(r"\D", "", s)
-    return ncm if ncm else None
-
-
-def limpar_cnpj(valor: str | None) -> str | None:
-    """
-    Remove pontos, traços e barras do CNPJ antes de gravar ou comparar.
-    Ex: 23.420.405/0001-84 -> 23420405000184. Retorna só os 14 dígitos.
-    """
-    if not valor:
-        return None
-    s = str(valor).strip()
-    if not s:
-        return None
-    cnpj = re.sub(r"\D", "", s)
-    return cnpj if cnpj else None
-
-
 def formatar_cnpj(valor: str | None) -> str:
     """
     Máscara de exibição: 23420405000184 -> 23.420.405/0001-84.
@@ -843,97 +1045,101 @@ def formatar_cnpj(valor: str | None) -> str:
     return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
 
 
-# Sinalização quando há match ST mas a nota está com ICMS-ST zerado
-STATUS_IRREGULAR_ST = "❌ IRREGULAR: SUJEITO A ST NÃO RECOLHIDA"
-STATUS_SUJEITO_ST = "⚠️ SUJEITO A ST (PR)"
-# Badges e mensagens no Painel de Auditoria — Lógica Tripla
-BADGE_ST_RECOLHIDA = "✅ ST RECOLHIDA (OK)"
-BADGE_ANTECIPACAO_PENDENTE = "🚨 ANTECIPAÇÃO PENDENTE"
-BADGE_OPERACAO_COMUM = "⚪ OPERAÇÃO COMUM"
-BADGE_SUJEITO_ST = "⚠️ SUJEITO A ST"  # fallback
-DIAGNOSTICO_ERRO_ST = "🚨 ERRO: ST não identificada no XML"
-DIAGNOSTICO_ANTECIPACAO_PENDENTE = "Item sujeito a ST no PR. Recolhimento obrigatório pelo destinatário"
-DIAGNOSTICO_ST_RECOLHIDA = "ST recolhida na origem. CFOP de substituição tributária."
-DIAGNOSTICO_NCM_BASE = "Identificado por NCM (Base PR)"
-DIAGNOSTICO_CFOP_XML = "⚠️ NCM ausente na base, mas ST identificada no XML"
-DIAGNOSTICO_NCM_MAIS_CFOP = "✅ Confirmado (NCM + CFOP)"
+# --- Cache da base normativa ---
 
-# Cache em memória da base normativa de NCM (já sanitizada)
-BASE_NORMATIVA_CACHE: list[dict] | None = None
+# Intervalo mínimo (segundos) entre verificações de versão da base normativa no banco
+TTL_VERSAO_BASE_NORMATIVA = 60
 
 
-# CFOPs de substituição tributária (ST recolhida na origem)
-CFOPS_SUBSTITUICAO = ("5401", "5403", "5405", "6401", "6403", "6405")
-
-
-def cfop_substituicao(cfop: str | None) -> bool:
-    """Retorna True se o CFOP for de substituição (5401, 5403, 5405, 6401, 6403, 6405)."""
-    if not cfop:
-        return False
-    s = str(cfop).strip()
-    return s in CFOPS_SUBSTITUICAO
-
+@st.cache_resource
+def _cache_base_normativa() -> dict:
+    """
+    Estado compartilhado por todas as sessões do servidor: índice de regras,
+    versão da base (_versao_base_normativa) e horário da última verificação.
+    """
+    return {"indice": None, "versao": None, "verificado_em": 0.0, "lock": threading.Lock()}
 
-def cfop_indica_st(cfop: str | None) -> bool:
-    """Retorna True se o CFOP indica operação com ST (prefixo 54 ou 64)."""
-    if not cfop:
-        return False
-    s = str(cfop).strip()
-    return s.startswith("54") or s.startswith("64")
 
+def _versao_base_normativa(supabase: Client) -> tuple:
+    """
+    Versão da base_normativa_ncm: (total de linhas, maior updated_at).
+    Sem a coluna updated_at (migration 014), a versão é só o total de linhas.
+    """
+    def _ultima_alteracao():
+        resp = (
+            supabase.table("base_normativa_ncm")
+            .select("updated_at")
+            .order("updated_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+        return resp.data[0].get("updated_at") if resp.data else None
 
-def cfop_inicia_54_ou_64(cfop: str | None) -> bool:
-    """Retorna True se o CFOP inicia em 5.4 ou 6.4 (ST recolhida na origem)."""
-    if not cfop:
-        return False
-    s = str(cfop).strip()
-    return s.startswith("54") or s.startswith("64")
+    versao = em_paralelo(
+        {
+            "total": lambda: supabase.table("base_normativa_ncm").select("ncm", count="exact").limit(1).execute().count,
+            "ultima": _ultima_alteracao,
+        },
+        capturar_erros=True,
+    )
+    if isinstance(versao["total"], Exception):
+        raise versao["total"]
+    ultima = None if isinstance(versao["ultima"], Exception) else versao["ultima"]
+    return (versao["total"], ultima)
 
 
-def cfop_inicia_61(cfop: str | None) -> bool:
-    """Retorna True se o CFOP inicia em 6.1 (operação interestadual)."""
-    if not cfop:
-        return False
-    s = str(cfop).strip()
-    return s.startswith("61")
+def _carregar_base_normativa(supabase: Client) -> list[dict]:
+    """Lê base_normativa_ncm inteira (carregar_base_normativa) já preparada para o match."""
+    return carregar_base_normativa(supabase)
 
 
-def cfop_inicia_51(cfop: str | None) -> bool:
-    """Retorna True se o CFOP inicia em 5.1 (venda interna)."""
-    if not cfop:
-        return False
-    s = str(cfop).strip()
-    return s.startswith("51")
+def _obter_base_normativa(supabase: Client) -> IndiceRegrasST:
+    """
+    Índice da base normativa compartilhado entre sessões. A versão no banco é
+    conferida no máximo a cada TTL_VERSAO_BASE_NORMATIVA segundos e o índice só
+    é remontado quando ela muda (uma vez por mudança, não por sessão).
+    """
+    cache = _cache_base_normativa()
+    if cache["indice"] is not None and time.monotonic() - cache["verificado_em"] < TTL_VERSAO_BASE_NORMATIVA:
+        return cache["indice"]
+    with cache["lock"]:
+        # Outra sessão pode ter verificado enquanto esperávamos o lock
+        if cache["indice"] is not None and time.monotonic() - cache["verificado_em"] < TTL_VERSAO_BASE_NORMATIVA:
+            return cache["indice"]
+        try:
+            versao = _versao_base_normativa(supabase)
+        except Exception:
+            versao = cache["versao"]
+        if cache["indice"] is None or versao != cache["versao"]:
+            cache["indice"] = IndiceRegrasST(_carregar_base_normativa(supabase))
+            cache["versao"] = versao
+        cache["verificado_em"] = time.monotonic()
+        return cache["indice"]
 
 
-def cfop_5405_ou_5403(cfop: str | None) -> bool:
-    """Retorna True se o CFOP for exatamente 5405 ou 5403 (prova por CFOP no diagnóstico)."""
-    if not cfop:
-        return False
-    s = str(cfop).strip()
-    return s in ("5405", "5403")
+def _invalidar_base_normativa() -> None:
+    """Força a remontagem do índice na próxima busca (após importação ou pelo botão de atualizar)."""
+    cache = _cache_base_normativa()
+    with cache["lock"]:
+        cache["indice"] = None
+        cache["versao"] = None
+        cache["verificado_em"] = 0.0
 
 
-def _sanitizar_ncm(valor: str | None) -> str:
-    """
-    Limpa NCM para comparação: remove pontos, espaços e demais não-dígitos.
-    Ex: "12.34.56.78" ou "1234 5678" -> "12345678".
-    """
-    if not valor:
-        return ""
-    s = str(valor).strip().replace(".", "").replace(" ", "")
-    return re.sub(r"\D", "", s)
+# --- Log e estatísticas do match ---
 
+# Log por busca (nível DEBUG) só com DEBUG_REGRAS_ST=1 no ambiente; contadores sempre ativos
+DEBUG_REGRAS_ST = os.getenv("DEBUG_REGRAS_ST", "").strip().lower() in ("1", "true", "sim")
+logger_match = logging.getLogger("regras_st.match")
+if DEBUG_REGRAS_ST:
+    logger_match.setLevel(logging.DEBUG)
+    if not logger_match.handlers:
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger_match.addHandler(_handler)
 
-def _sanitizar_cest(valor: str | None) -> str:
-    """
-    Limpa CEST para comparação: remove pontos, espaços e demais não-dígitos.
-    Ex: "03.001.00" -> "0300100".
-    """
-    if not valor:
-        return ""
-    s = str(valor).strip().replace(".", "").replace(" ", "")
-    return re.sub(r"\D", "", s)
+# Contadores por critério, agregados entre sessões (exibidos na página Base Normativa)
+ESTATISTICAS_MATCH = EstatisticasMatch()
 
 
 def buscar_regra_st(supabase: Client, ncm: str, cest: str | None = None) -> dict | None:
@@ -943,87 +1149,43 @@ def buscar_regra_st(supabase: Client, ncm: str, cest: str | None = None) -> dict
     - 1) Se CEST informado: match exato por CEST na base.
     - 2) Se não encontrar ou sem CEST: match por NCM (exato ou prefixo 2/4/6 dígitos).
     """
-    global BASE_NORMATIVA_CACHE
-
     ncm_xml_limpo = _sanitizar_ncm(ncm)
     cest_xml_limpo = _sanitizar_cest(cest) if cest else ""
 
     if not ncm_xml_limpo or len(ncm_xml_limpo) < 2:
-        print(f"Buscando NCM {ncm_xml_limpo or ncm!r} na base... Encontrado: Não (NCM inválido)")
+        ESTATISTICAS_MATCH.registrar("ncm_invalido")
+        logger_match.debug("Buscando NCM %r na base... Encontrado: Não (NCM inválido)", ncm_xml_limpo or ncm)
         return None
 
     try:
-        if BASE_NORMATIVA_CACHE is None:
-            try:
-                resp = (
-                    supabase.table("base_normativa_ncm")
-                    .select("ncm, descricao, cest")
-                    .execute()
-                )
-            except Exception:
-                resp = (
-                    supabase.table("base_normativa_ncm")
-                    .select("ncm, descricao")
-                    .execute()
-                )
-            BASE_NORMATIVA_CACHE = []
-            for row in resp.data or []:
-                base_raw = row.get("ncm")
-                base_limpo = _sanitizar_ncm(base_raw)
-                if not base_limpo:
-                    continue
-                r = dict(row)
-                r["_ncm_limpo"] = base_limpo
-                r["_cest_limpo"] = _sanitizar_cest(row.get("cest"))
-                BASE_NORMATIVA_CACHE.append(r)
-
-        if not BASE_NORMATIVA_CACHE:
-            print(f"Buscando NCM {ncm_xml_limpo} na base... Encontrado: Não (base vazia)")
+        base = _obter_base_normativa(supabase)
+        if not base:
+            ESTATISTICAS_MATCH.registrar("base_vazia")
+            logger_match.debug("Buscando NCM %s na base... Encontrado: Não (base vazia)", ncm_xml_limpo)
             return None
 
-        escolhido: dict | None = None
-        regra_ncm: str = ""
-
-        # 1) Match por CEST (mais específico) — quando informado
-        if cest_xml_limpo and len(cest_xml_limpo) >= 4:
-            for row in BASE_NORMATIVA_CACHE:
-                base_cest = row.get("_cest_limpo")
-                if base_cest and base_cest == cest_xml_limpo:
-                    escolhido = row
-                    regra_ncm = str(row.get("ncm", ""))
-                    print(f"Match encontrado para o CEST {cest_xml_limpo} (regra NCM {regra_ncm})")
-                    return escolhido
-
-        # 2) Fallback: NCM — match exato
-        for row in BASE_NORMATIVA_CACHE:
-            base_limpo = row.get("_ncm_limpo")
-            if base_limpo and base_limpo == ncm_xml_limpo:
-                escolhido = row
-                regra_ncm = str(row.get("ncm", ""))
-                break
-
-        # 3) Fallback: NCM — regra de prefixo (2, 4 ou 6 dígitos)
-        if escolhido is None:
-            for length in (6, 4, 2):
-                if len(ncm_xml_limpo) < length:
-                    continue
-                for row in BASE_NORMATIVA_CACHE:
-                    base_limpo = row.get("_ncm_limpo")
-                    if base_limpo and len(base_limpo) == length and ncm_xml_limpo.startswith(base_limpo):
-                        escolhido = row
-                        regra_ncm = str(row.get("ncm", ""))
-                        break
-                if escolhido is not None:
-                    break
-
+        escolhido, criterio = base.casar(ncm_xml_limpo, cest_xml_limpo)
+        ESTATISTICAS_MATCH.registrar(criterio)
         if escolhido is not None:
-            print(f"Match encontrado para o NCM {ncm_xml_limpo} através da regra {regra_ncm}")
+            if criterio == "cest":
+                logger_match.debug("Match encontrado para o CEST %s (regra NCM %s)", cest_xml_limpo, escolhido.get("ncm", ""))
+            else:
+                logger_match.debug("Match encontrado para o NCM %s através da regra %s", ncm_xml_limpo, escolhido.get("ncm", ""))
         else:
-            print(f"Buscando NCM {ncm_xml_limpo} na base... Encontrado: Não")
+            logger_match.debug("Buscando NCM %s na base... Encontrado: Não", ncm_xml_limpo)
         return escolhido
     except Exception as exc:
+        ESTATISTICAS_MATCH.registrar("erro")
         st.error(f"Erro ao consultar base normativa para NCM {ncm}: {exc}")
-        print(f"Buscando NCM {ncm_xml_limpo} na base... Encontrado: Não (erro)")
+        logger_match.warning("Erro ao consultar base normativa para NCM %s: %s", ncm_xml_limpo, exc)
+        return None
+
+
+def _versao_regras_st(supabase: Client) -> str | None:
+    """Versão da base normativa gravada com a classificação dos itens (None se a base não carregar)."""
+    try:
+        return _obter_base_normativa(supabase).versao
+    except Exception:
         return None
 
 
@@ -1059,40 +1221,40 @@ def reprocessar_st_sessao(
     """
     Refazer Análise: verifica se o NCM de cada item (do XML/banco) existe na
     base_normativa_ncm. Se existir, exibe "⚠️ SUJEITO A ST (PR)" na tela.
+    Notas e itens são lidos em lotes (buscar_por_ids), não uma consulta por nota.
     """
+    numeros = [
+        str(nota.get("Número da Nota"))
+        for nota in resumo_notas
+        if nota.get("Número da Nota") and nota.get("Número da Nota") != "N/A"
+    ]
+    itens_por_numero: dict[str, list[dict]] = {}
+    try:
+        id_por_numero = {
+            str(n["numero_nfe"]): str(n["id"])
+            for n in buscar_por_ids(
+                lambda lote: supabase.table("notas_fiscais").select("id, numero_nfe").in_("numero_nfe", lote).order("id"),
+                numeros,
+            )
+        }
+        numero_por_id = {nota_id: numero for numero, nota_id in id_por_numero.items()}
+        for item in buscar_por_ids(
+            lambda lote: supabase.table("itens_nota").select("id, nota_id, ncm, cest, cfop").in_("nota_id", lote).order("id"),
+            numero_por_id,
+            paralelo=True,
+        ):
+            itens_por_numero.setdefault(numero_por_id[str(item["nota_id"])], []).append(item)
+    except Exception as exc:
+        st.error(f"Erro ao reprocessar ST das notas: {exc}")
+
     notas_atualizadas = []
     for nota in resumo_notas:
-        numero_nfe = nota.get("Número da Nota")
-        sujeito_st_pr = False
-
-        if numero_nfe and numero_nfe != "N/A":
-            try:
-                response_nota = (
-                    supabase.table("notas_fiscais")
-                    .select("id")
-                    .eq("numero_nfe", str(numero_nfe))
-                    .limit(1)
-                    .execute()
-                )
-                if response_nota.data:
-                    nota_id = response_nota.data[0]["id"]
-                    response_itens = (
-                        supabase.table("itens_nota")
-                        .select("ncm, cest, cfop")
-                        .eq("nota_id", nota_id)
-                        .execute()
-                    )
-                    for item in response_itens.data or []:
-                        ncm = item.get("ncm")
-                        if not ncm:
-                            continue
-                        if ncm_na_base_normativa(supabase, ncm, item.get("cest")):
-                            sujeito_st_pr = True
-            except Exception as exc:
-                st.error(
-                    f"Erro ao reprocessar ST da nota {numero_nfe}: {exc}"
-                )
-
+        itens = itens_por_numero.get(str(nota.get("Número da Nota")), [])
+        sujeito_st_pr = any(
+            ncm_na_base_normativa(supabase, item["ncm"], item.get("cest"))
+            for item in itens
+            if item.get("ncm")
+        )
         nota_atualizada = dict(nota)
         nota_atualizada["Sujeito a ST (PR)"] = (
             "⚠️ SUJEITO A ST (PR)" if sujeito_st_pr else "Não"
@@ -1102,177 +1264,44 @@ def reprocessar_st_sessao(
     return notas_atualizadas
 
 
-def safe_float(valor: object, default: float = 0.0) -> float:
-    try:
-        return float(valor)
-    except (TypeError, ValueError):
-        return default
-
-
-def extrair_valor_ipi(item: dict) -> float:
-    try:
-        ipi = item.get("imposto", {}).get("IPI", {})
-        if not isinstance(ipi, dict):
-            return 0.0
-        if "IPITrib" in ipi:
-            return safe_float(ipi["IPITrib"].get("vIPI"))
-        return safe_float(ipi.get("vIPI"))
-    except Exception:
-        return 0.0
-
-
-def extrair_valor_icms_origem(item: dict) -> float:
-    try:
-        icms = item.get("imposto", {}).get("ICMS", {})
-        if not isinstance(icms, dict) or not icms:
-            return 0.0
-        # Pega o primeiro bloco ICMS encontrado (ICMS00, ICMS10, etc)
-        for _, icms_val in icms.items():
-            if isinstance(icms_val, dict):
-                return safe_float(icms_val.get("vICMS"))
-        return 0.0
-    except Exception:
-        return 0.0
-
-
-def extrair_valor_frete(item: dict) -> float:
-    try:
-        prod = item.get("prod", {})
-        return safe_float(prod.get("vFrete"))
-    except Exception:
-        return 0.0
-
-
-def _primeiro_bloco(objeto: dict) -> dict | None:
-    """Retorna o primeiro sub-bloco dict de um objeto (ex: ICMS00, ICMS10...)."""
-    if not isinstance(objeto, dict):
-        return None
-    for v in objeto.values():
-        if isinstance(v, dict):
-            return v
-    return None
-
-
-def extrair_data_emissao_ide(ide: dict) -> str | None:
-    """
-    Extrai a data de emissão (YYYY-MM-DD) do bloco ide da NF-e.
-    Aceita dhEmi (datetime) ou dEmi (date) em vários formatos.
-    """
-    if not isinstance(ide, dict):
-        return None
-    dh = ide.get("dhEmi") or ide.get("dEmi") or ide.get("dhemi") or ide.get("demi") or ""
-    if not dh:
-        return None
-    dh = str(dh)
-    if "T" in dh:
-        return dh.split("T")[0]  # "2024-01-15"
-    if len(dh) == 10 and dh[4] == "-":
-        return dh
-    if "/" in dh:
-        parts = dh.split("/")
-        if len(parts) == 3:
-            return f"{parts[2]}-{parts[1].zfill(2)}-{parts[0].zfill(2)}"
-    return None
-
-
-def _extrair_cst_icms(icms: dict) -> str | None:
-    """
-    Extrai CST do bloco ICMS do item.
-    Retorna CST (2 dígitos) ou CSOSN (1 dígito para Simples Nacional) ou None.
-    """
-    if not isinstance(icms, dict):
-        return None
-    bloco = _primeiro_bloco(icms)
-    if not bloco:
-        return None
-    cst = bloco.get("CST") or bloco.get("cst")
-    if cst is not None and str(cst).strip():
-        return str(cst).strip()
-    csosn = bloco.get("CSOSN") or bloco.get("csosn")
-    if csosn is not None and str(csosn).strip():
-        return str(csosn).strip()
-    # Fallback: deriva do nome do bloco (ICMS00 -> 00, ICMS10 -> 10)
-    for k, v in icms.items():
-        if isinstance(v, dict) and k.startswith("ICMS"):
-            suf = k.replace("ICMS", "").strip()
-            if suf.isdigit():
-                return suf.zfill(2)
-    return None
-
-
-def extrair_impostos_item(item: dict) -> dict:
+class ResolvedorClientes:
     """
-    Extrai base, alíquota e valor de ICMS, ICMS-ST, PIS, COFINS, IPI, IBS e CBS do item.
-    Também extrai CST (Código de Situação Tributária) do bloco ICMS.
-    Retorna dict com chaves em snake_case para persistência.
+    Resolução de clientes durante uma importação: cada CNPJ (ou id do cliente
+    selecionado) é consultado em clientes uma única vez e servido da memória
+    nas notas seguintes. Erros de consulta não ficam em cache.
     """
-    imp = item.get("imposto", {}) or {}
-    resultado = {
-        "icms_bc": None, "icms_aliq": None, "icms_valor": None,
-        "icms_st_bc": None, "icms_st_aliq": None, "icms_st_valor": None,
-        "pis_bc": None, "pis_aliq": None, "pis_valor": None,
-        "cofins_bc": None, "cofins_aliq": None, "cofins_valor": None,
-        "ipi_bc": None, "ipi_aliq": None, "ipi_valor": None,
-        "ibs_valor": None, "cbs_valor": None,
-        "cst": None,
-    }
-
-    try:
-        # ICMS (ICMS00, ICMS10, ICMS20, ICMS30, ICMS40, ICMS51, ICMS60, ICMS70, ICMS90, ICMSPart, ICMSST...)
-        icms = imp.get("ICMS", {}) or {}
-        bloco = _primeiro_bloco(icms)
-        if bloco:
-            resultado["icms_bc"] = safe_float(bloco.get("vBC"))
-            resultado["icms_aliq"] = safe_float(bloco.get("pICMS"))
-            resultado["icms_valor"] = safe_float(bloco.get("vICMS"))
-            resultado["icms_st_bc"] = safe_float(bloco.get("vBCST"))
-            resultado["icms_st_aliq"] = safe_float(bloco.get("pICMSST")) or safe_float(bloco.get("pMST"))
-            resultado["icms_st_valor"] = safe_float(bloco.get("vICMSST")) or safe_float(bloco.get("vST"))
-            resultado["cst"] = _extrair_cst_icms(icms)
-        # ICMSST pode estar em bloco próprio (ex: grupo ICMSST)
-        icms_st = imp.get("ICMSST", {}) or {}
-        if isinstance(icms_st, dict):
-            st_bloco = _primeiro_bloco(icms_st) or icms_st
-            if isinstance(st_bloco, dict) and not resultado["icms_st_valor"]:
-                resultado["icms_st_bc"] = safe_float(st_bloco.get("vBCST"))
-                resultado["icms_st_aliq"] = safe_float(st_bloco.get("pICMSST")) or safe_float(st_bloco.get("pMST"))
-                resultado["icms_st_valor"] = safe_float(st_bloco.get("vICMSST")) or safe_float(st_bloco.get("vST"))
-
-        # PIS (PISAliq/PIS01, PISNT/PIS04, PISOutr, PISST...)
-        pis = imp.get("PIS", {}) or {}
-        bloco_pis = _primeiro_bloco(pis) or pis
-        if isinstance(bloco_pis, dict):
-            resultado["pis_bc"] = safe_float(bloco_pis.get("vBC"))
-            resultado["pis_aliq"] = safe_float(bloco_pis.get("pPIS"))
-            resultado["pis_valor"] = safe_float(bloco_pis.get("vPIS"))
-
-        # COFINS (COFINSAliq/COFINS01, COFINSNT/COFINS04, COFINSOutr, COFINSST...)
-        cofins = imp.get("COFINS", {}) or {}
-        bloco_cof = _primeiro_bloco(cofins) or cofins
-        if isinstance(bloco_cof, dict):
-            resultado["cofins_bc"] = safe_float(bloco_cof.get("vBC"))
-            resultado["cofins_aliq"] = safe_float(bloco_cof.get("pCOFINS"))
-            resultado["cofins_valor"] = safe_float(bloco_cof.get("vCOFINS"))
-
-        # IPI (IPITrib)
-        ipi = imp.get("IPI", {}) or {}
-        ipi_trib = ipi.get("IPITrib", ipi) if isinstance(ipi, dict) else {}
-        if isinstance(ipi_trib, dict):
-            resultado["ipi_bc"] = safe_float(ipi_trib.get("vBC"))
-            resultado["ipi_aliq"] = safe_float(ipi_trib.get("pIPI"))
-            resultado["ipi_valor"] = safe_float(ipi_trib.get("vIPI"))
-
-        # IBS e CBS (Reforma Tributária - quando disponível)
-        ibs = imp.get("IBS", {}) or {}
-        cbs = imp.get("CBS", {}) or {}
-        if isinstance(ibs, dict):
-            resultado["ibs_valor"] = safe_float(ibs.get("vIBS")) or safe_float(ibs.get("vValor"))
-        if isinstance(cbs, dict):
-            resultado["cbs_valor"] = safe_float(cbs.get("vCBS")) or safe_float(cbs.get("vValor"))
-    except Exception:
-        pass
 
-    return resultado
+    def __init__(self, supabase: Client):
+        self.supabase = supabase
+        self._por_cnpj: dict[str, dict | None] = {}
+        self._por_id: dict[str, dict | None] = {}
+
+    def por_id(self, cliente_id: str) -> dict | None:
+        """Cliente pelo id (None se não existir)."""
+        chave = str(cliente_id)
+        if chave not in self._por_id:
+            resp = (
+                self.supabase.table("clientes")
+                .select("id, razao_social, nome_fantasia")
+                .eq("id", chave)
+                .limit(1)
+                .execute()
+            )
+            self._por_id[chave] = resp.data[0] if resp.data else None
+        return self._por_id[chave]
+
+    def por_cnpj(self, cnpj: str) -> dict | None:
+        """Cliente pelo CNPJ (normalizado com limpar_cnpj; None se não cadastrado)."""
+        chave = limpar_cnpj(cnpj) or cnpj
+        if chave not in self._por_cnpj:
+            resp = (
+                self.supabase.table("clientes")
+                .select("id, razao_social, nome_fantasia, cnpj")
+                .eq("cnpj", chave)
+                .execute()
+            )
+            self._por_cnpj[chave] = resp.data[0] if resp.data else None
+        return self._por_cnpj[chave]
 
 
 def processar_xml(
@@ -1283,329 +1312,776 @@ def processar_xml(
     resumo_notas: list,
     alertas_notas: list,
     cliente_id_manual: str | None = None,
+    clientes: "ResolvedorClientes | None" = None,
+    exibir: bool = True,
 ) -> None:
     """
     Processa um XML de NF-e e extrai informações, acumulando nos dados consolidados.
     Se cliente_id_manual for informado, todas as notas são vinculadas a esse cliente
     e a validação de CNPJ do destinatário é ignorada (sem alerta NF_DESTINATARIO_NAO_CADASTRADO).
+    clientes: resolvedor compartilhado pela importação (evita consultar clientes a cada nota).
+    exibir=False (modo streaming): sem mensagens por nota; erros vão para alertas_notas.
     """
     try:
-        # Parseia o XML usando xmltodict
-        xml_dict = xmltodict.parse(xml_string)
-        
-        # Extrai infNFe
-        inf_nfe = {}
+        # Extração incremental (apenas os campos usados) e classificação ST
+        registro = extrair_registro_nfe(xml_string)
+        analise = analisar_nfe(
+            registro, lambda ncm, cest: buscar_regra_st(supabase, ncm, cest), _versao_regras_st(supabase)
+        )
+        _registrar_nfe_analisada(
+            analise,
+            nome_arquivo,
+            supabase,
+            todos_itens,
+            resumo_notas,
+            alertas_notas,
+            cliente_id_manual=cliente_id_manual,
+            clientes=clientes,
+            exibir=exibir,
+        )
+    except Exception as exc:
+        if exibir:
+            st.error(f"Erro ao processar o XML {nome_arquivo}: {exc}")
+        else:
+            alertas_notas.append(f"Erro ao processar o XML {nome_arquivo}: {exc}")
+
+
+def _registrar_nfe_analisada(
+    analise: dict,
+    nome_arquivo: str,
+    supabase: Client,
+    todos_itens: list,
+    resumo_notas: list,
+    alertas_notas: list,
+    cliente_id_manual: str | None = None,
+    clientes: "ResolvedorClientes | None" = None,
+    exibir: bool = True,
+) -> None:
+    """
+    Parte com banco e tela do processamento de uma NF-e já classificada (analisar_nfe):
+    resolve o cliente, grava nota e itens e acumula itens, resumo e alertas.
+    """
+    pendente = _preparar_nfe_analisada(
+        analise, nome_arquivo, supabase, todos_itens, alertas_notas,
+        cliente_id_manual=cliente_id_manual, clientes=clientes, exibir=exibir,
+    )
+    if pendente["nota"] is None:
+        _concluir_nfe_analisada(pendente, "Sem numero", "", resumo_notas, exibir=exibir)
+        return
+    sucesso, mensagem = salvar_nota_e_itens(supabase, **pendente["nota"])
+    if sucesso:
+        status_banco = "Gravada"
+    elif "já existe" in mensagem.lower():
+        status_banco = "Ja existente"
+    else:
+        status_banco = "Falha ao gravar"
+    _concluir_nfe_analisada(pendente, status_banco, mensagem, resumo_notas, exibir=exibir)
+
+
+def _preparar_nfe_analisada(
+    analise: dict,
+    nome_arquivo: str,
+    supabase: Client,
+    todos_itens: list,
+    alertas_notas: list,
+    cliente_id_manual: str | None = None,
+    clientes: "ResolvedorClientes | None" = None,
+    exibir: bool = True,
+) -> dict:
+    """
+    Resolve o cliente, exibe avisos/alertas e acumula os itens de uma NF-e analisada.
+    Com exibir=False (modo streaming) nada vai para a tela: avisos entram em alertas_notas.
+    Retorna {"nota": argumentos de salvar_nota_e_itens (None se sem número), "resumo": linha do resumo}.
+    """
+    n_nf = analise["numero_nfe"]
+    cnpj_destinatario = analise["cnpj_destinatario"]
+    clientes = clientes or ResolvedorClientes(supabase)
+
+    alerta_cliente = None
+    nome_cliente = None
+    cliente = None
+    # Só valida CNPJ no banco se não houver cliente selecionado manualmente
+    if cliente_id_manual:
         try:
-            if "NFe" in xml_dict:
-                inf_nfe = xml_dict["NFe"].get("infNFe", {})
-            elif "nfeProc" in xml_dict:
-                inf_nfe = xml_dict["nfeProc"].get("NFe", {}).get("infNFe", {})
+            cliente_manual = clientes.por_id(cliente_id_manual)
+            if cliente_manual:
+                nome_cliente = cliente_manual.get("nome_fantasia") or cliente_manual.get("razao_social", "N/A")
             else:
-                for key in xml_dict:
-                    if isinstance(xml_dict[key], dict) and "infNFe" in xml_dict[key]:
-                        inf_nfe = xml_dict[key]["infNFe"]
-                        break
-        except (KeyError, AttributeError, TypeError):
-            st.error(f"❌ Erro ao processar estrutura do XML: {nome_arquivo}")
-            return
-        
-        # Extrai número da nota (nNF) e data de emissão da NF-e (obrigatório nas próximas importações)
-        n_nf = None
-        data_emissao = None
-        try:
-            ide_raw = inf_nfe.get("ide", {})
-            ide = ide_raw[0] if isinstance(ide_raw, list) and ide_raw else (ide_raw if isinstance(ide_raw, dict) else {})
-            n_nf = ide.get("nNF") or ide.get("nnf") or "N/A"
-            data_emissao = extrair_data_emissao_ide(ide)
-        except (KeyError, AttributeError, TypeError):
-            n_nf = "N/A"
-        
-        # Extrai o CNPJ do destinatário (sempre limpo: só dígitos)
-        cnpj_destinatario = None
-        try:
-            dest = inf_nfe.get("dest", {})
-            raw_cnpj_dest = dest.get("CNPJ") or dest.get("cnpj")
-            cnpj_destinatario = limpar_cnpj(raw_cnpj_dest) if raw_cnpj_dest else None
-        except (KeyError, AttributeError, TypeError):
-            pass
-
-        # Extrai UF do emitente (origem da mercadoria) para auditoria de ST
-        uf_origem = None
-        try:
-            emit = inf_nfe.get("emit", {})
-            ender = emit.get("enderEmit", {}) if isinstance(emit, dict) else {}
-            uf_raw = ender.get("UF") or ender.get("uf") if isinstance(ender, dict) else None
-            uf_origem = str(uf_raw).strip().upper()[:2] if uf_raw else None
-        except (KeyError, AttributeError, TypeError):
-            pass
-        
-        alerta_cliente = None
-        nome_cliente = None
-        # Só valida CNPJ no banco se não houver cliente selecionado manualmente
-        if cliente_id_manual:
-            try:
-                resp = supabase.table("clientes").select("id, razao_social, nome_fantasia").eq("id", str(cliente_id_manual)).limit(1).execute()
-                if resp.data:
-                    nome_cliente = resp.data[0].get("nome_fantasia") or resp.data[0].get("razao_social", "N/A")
-                else:
-                    nome_cliente = "Cliente selecionado"
-            except Exception:
                 nome_cliente = "Cliente selecionado"
-        elif cnpj_destinatario:
-            cnpj_busca = limpar_cnpj(cnpj_destinatario) or cnpj_destinatario
-            try:
-                response = (
-                    supabase.table("clientes")
-                    .select("id, razao_social, nome_fantasia, cnpj")
-                    .eq("cnpj", cnpj_busca)
-                    .execute()
-                )
-                if response.data and len(response.data) > 0:
-                    cliente = response.data[0]
-                    nome_cliente = cliente.get("nome_fantasia") or cliente.get("razao_social", "N/A")
-                else:
-                    alerta_cliente = "ERRO: NF_DESTINATARIO_NAO_CADASTRADO"
+        except Exception:
+            nome_cliente = "Cliente selecionado"
+    elif cnpj_destinatario:
+        try:
+            cliente = clientes.por_cnpj(cnpj_destinatario)
+            if cliente:
+                nome_cliente = cliente.get("nome_fantasia") or cliente.get("razao_social", "N/A")
+            else:
+                alerta_cliente = "ERRO: NF_DESTINATARIO_NAO_CADASTRADO"
+                if exibir:
                     st.error(f"❌ {alerta_cliente} - Nota {n_nf} ({nome_arquivo})")
-            except Exception as exc:
+        except Exception as exc:
+            if exibir:
                 st.error(f"Erro ao consultar cliente no banco de dados ({nome_arquivo}): {exc}")
+            else:
+                alertas_notas.append(f"Erro ao consultar cliente no banco de dados ({nome_arquivo}): {exc}")
+    elif exibir:
+        st.warning(f"CNPJ do destinatário não encontrado no XML ({nome_arquivo}).")
+    else:
+        alertas_notas.append(f"CNPJ do destinatário não encontrado no XML ({nome_arquivo}).")
+
+    for aviso in analise["avisos"]:
+        if exibir:
+            st.warning(f"{aviso} ({nome_arquivo})")
         else:
-            st.warning(f"CNPJ do destinatário não encontrado no XML ({nome_arquivo}).")
-        
-        # Extrai todos os itens (det)
-        det = inf_nfe.get("det", [])
-        if not isinstance(det, list):
-            det = [det]
+            alertas_notas.append(f"{aviso} ({nome_arquivo})")
+    for item in analise["itens_exibir"]:
+        todos_itens.append({"Arquivo": nome_arquivo, **item})
+
+    # Verifica alerta de CFOP interestadual
+    if analise["tem_cfop_6"]:
+        alerta_cfop = "⚠️ Operação Interestadual Detectada - Verificar Antecipação ICMS-ST"
+        if exibir:
+            st.warning(f"{alerta_cfop} - Nota {n_nf} ({nome_arquivo})")
+        if alerta_cliente:
+            alertas_notas.append(f"Nota {n_nf}: {alerta_cliente} | {alerta_cfop}")
+        else:
+            alertas_notas.append(f"Nota {n_nf}: {alerta_cfop}")
+    elif alerta_cliente:
+        alertas_notas.append(f"Nota {n_nf}: {alerta_cliente}")
+
+    v_nf = analise["v_nf"]
+    v_icms = analise["v_icms"]
+
+    # Cliente: prioridade ao selecionado manualmente; senão o encontrado pelo CNPJ (normalizado)
+    cliente_id = None
+    if cliente_id_manual:
+        cliente_id = str(cliente_id_manual)
+    elif cliente:
+        cliente_id = cliente["id"]
+
+    nota = _nota_para_gravacao(analise, cliente_id)
+
+    resumo = {
+        "Número da Nota": n_nf,
+        "Nome do Cliente": nome_cliente or "N/A",
+        "Valor Total (vNF)": v_nf,
+        "Valor ICMS (vICMS)": v_icms,
+        "CFOP": analise["cfop_principal"],
+        "CST": analise["cst_principal"] or "—",
+        "Sujeito a ST (PR)": "⚠️ SUJEITO A ST (PR)" if analise["sujeito_st_pr"] else "Não",
+        "Status Banco": "Nao gravada",
+        "Arquivo": nome_arquivo,
+    }
+    return {"nota": nota, "resumo": resumo}
 
-        # Valor de ICMS-ST da nota (vST no total) para sinalização de irregularidade
-        v_st = "0.00"
-        try:
-            total_tot = inf_nfe.get("total", {}).get("ICMSTot", {})
-            v_st = total_tot.get("vST") or total_tot.get("vICMSST") or "0.00"
-        except (KeyError, AttributeError, TypeError):
-            pass
-        try:
-            icms_st_zerado = float(v_st or 0) == 0
-        except (ValueError, TypeError):
-            icms_st_zerado = True
-
-        # Processa cada item e identifica CFOPs e CSTs
-        tem_cfop_6 = False
-        cfops_encontrados = set()
-        csts_encontrados: set[str] = set()
-        itens_para_salvar = []
-        ncm_cache: dict[str, dict | None] = {}
-        sujeito_st_pr = False
-        
-        for item in det:
+
+def _nota_para_gravacao(analise: dict, cliente_id: str | None) -> dict | None:
+    """Argumentos de salvar_nota_e_itens/salvar_notas_em_lote para a NF-e analisada (None se sem número)."""
+    n_nf = analise["numero_nfe"]
+    if n_nf == "N/A":
+        return None
+    v_nf = analise["v_nf"]
+    v_icms = analise["v_icms"]
+    return {
+        "numero_nfe": str(n_nf),
+        "cliente_id": cliente_id,
+        "valor_total": float(v_nf) if v_nf else 0.0,
+        "icms_total": float(v_icms) if v_icms else 0.0,
+        "itens": analise["itens_salvar"],
+        "cnpj_destinatario": analise["cnpj_destinatario"],
+        "data_emissao": analise["data_emissao"],
+        "totais_impostos": analise["totais_impostos"],
+        "uf_origem": analise["uf_origem"],
+        "cst_principal": analise["cst_principal"],
+    }
+
+
+def _concluir_nfe_analisada(pendente: dict, status_banco: str, mensagem: str, resumo_notas: list, exibir: bool = True) -> None:
+    """Exibe o resultado da gravação e adiciona a nota ao resumo."""
+    if not exibir:
+        pass
+    elif status_banco == "Gravada":
+        st.success(f"💾 {mensagem}")
+    elif status_banco == "Ja existente":
+        st.info(f"ℹ️ {mensagem}")
+    elif status_banco == "Falha ao gravar":
+        st.warning(f"⚠️ {mensagem}")
+    resumo_notas.append({**pendente["resumo"], "Status Banco": status_banco})
+
+
+def _gravar_pendentes_em_lote(
+    supabase: Client,
+    pendentes: list[dict],
+    resumo_notas: list,
+    impressoes: IndiceImpressoes | None = None,
+    exibir: bool = True,
+) -> None:
+    """
+    Grava as notas preparadas com salvar_notas_em_lote e conclui cada uma na ordem.
+    Com impressoes, registra no índice os arquivos cuja nota ficou confirmada no banco.
+    """
+    gravados = salvar_notas_em_lote(supabase, [p["nota"] for p in pendentes if p["nota"] is not None])
+    _concluir_pendentes(pendentes, gravados, resumo_notas, impressoes, exibir=exibir)
+    pendentes.clear()
+
+
+def _concluir_pendentes(
+    pendentes: list[dict],
+    gravados: list[dict],
+    resumo_notas: list,
+    impressoes: IndiceImpressoes | None = None,
+    exibir: bool = True,
+) -> None:
+    """
+    Conclui, na ordem, as notas preparadas a partir do retorno de salvar_notas_em_lote
+    (um resultado por nota com número) e registra no índice as confirmadas.
+    """
+    resultados = iter(gravados)
+    confirmados = []
+    for pendente in pendentes:
+        if pendente["nota"] is None:
+            _concluir_nfe_analisada(pendente, "Sem numero", "", resumo_notas, exibir=exibir)
+        else:
+            r = next(resultados)
+            _concluir_nfe_analisada(pendente, r["status"], r["mensagem"], resumo_notas, exibir=exibir)
+            if pendente.get("impressao") and r["status"] in STATUS_CONFIRMADOS:
+                confirmados.append((*pendente["impressao"], r["numero_nfe"]))
+    if impressoes is not None:
+        impressoes.registrar(confirmados)
+
+
+# --- Arquivos já importados (impressão SHA-256/chave de acesso) ---
+
+@st.cache_resource
+def _indice_impressoes() -> IndiceImpressoes:
+    """Índice de XMLs já importados do servidor (SQLite em DIR_IMPORTACOES)."""
+    return IndiceImpressoes(DIR_IMPORTACOES / "impressoes.sqlite3")
+
+
+def _resumir_arquivo_conhecido(
+    numero_nfe: str | None, mensagem: str, nome_arquivo: str, resumo_notas: list, exibir: bool = True
+) -> None:
+    """XML reconhecido pelo índice: entra no resumo como "Ja existente", sem parsing nem banco."""
+    if exibir:
+        st.info(f"ℹ️ {mensagem} ({nome_arquivo})")
+    resumo_notas.append({
+        "Número da Nota": numero_nfe or "—",
+        "Nome do Cliente": "—",
+        "Valor Total (vNF)": None,
+        "Valor ICMS (vICMS)": None,
+        "CFOP": "—",
+        "CST": "—",
+        "Sujeito a ST (PR)": "—",
+        "Status Banco": "Ja existente",
+        "Arquivo": nome_arquivo,
+    })
+
+
+def _processar_xml_com_impressao(xml_bytes: bytes, nome_arquivo: str, supabase: Client, todos_itens: list, resumo_notas: list, alertas_notas: list, exibir: bool = True, **kwargs) -> None:
+    """
+    processar_xml precedido da consulta ao índice de arquivos já importados; quando a
+    nota fica confirmada no banco, o arquivo entra no índice. exibir=False (modo
+    streaming): sem mensagens por arquivo, como em _processar_zip_em_disco.
+    """
+    impressoes = _indice_impressoes()
+    sha, chave = impressao_xml(xml_bytes)
+    numero = impressoes.buscar(sha, chave)
+    if numero is not None:
+        _resumir_arquivo_conhecido(numero, mensagem_arquivo_conhecido(numero), nome_arquivo, resumo_notas, exibir=exibir)
+        return
+    n_antes = len(resumo_notas)
+    processar_xml(
+        xml_bytes.decode("utf-8", errors="ignore"),
+        nome_arquivo,
+        supabase,
+        todos_itens,
+        resumo_notas,
+        alertas_notas,
+        exibir=exibir,
+        **kwargs,
+    )
+    novas = resumo_notas[n_antes:]
+    if len(novas) == 1 and novas[0]["Status Banco"] in STATUS_CONFIRMADOS:
+        impressoes.registrar([(sha, chave, str(novas[0]["Número da Nota"]))])
+
+
+def _processar_zip_em_disco(
+    uploaded_file,
+    nome_arquivo: str,
+    xmls_no_zip: list[str] | None,
+    supabase: Client,
+    todos_itens: list,
+    resumo_notas: list,
+    alertas_notas: list,
+    cliente_id_manual: str | None = None,
+    clientes: "ResolvedorClientes | None" = None,
+    paralelo: bool = True,
+    exibir: bool = True,
+) -> None:
+    """
+    ZIP copiado em blocos para um arquivo temporário em disco e lido membro a membro
+    (xmls_no_zip=None: lista os XMLs do arquivo em disco).
+    paralelo (e ao menos LIMIAR_PARALELO XMLs): workers leem, extraem e classificam
+    cada XML (analisar_zip_em_paralelo); senão, o mesmo no processo atual. Aqui só
+    gravamos e exibimos os resultados, na ordem dos arquivos.
+    A gravação usa salvar_notas_em_lote, em blocos de LOTE_NOTAS notas. XMLs já
+    importados (índice de impressões, consultado por quem lê o membro) não passam
+    pelo parsing nem pelo banco.
+    exibir=False (modo streaming): sem mensagens por nota; erros vão para alertas_notas.
+    """
+    def erro(mensagem: str) -> None:
+        if exibir:
+            st.error(mensagem)
+        else:
+            alertas_notas.append(mensagem)
+
+    base_normativa = _obter_base_normativa(supabase).linhas
+    impressoes = _indice_impressoes()
+    pendentes: list[dict] = []
+    with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp:
+        uploaded_file.seek(0)
+        shutil.copyfileobj(uploaded_file, tmp, length=TAMANHO_BLOCO_COPIA)
+        caminho_zip = tmp.name
+    try:
+        if xmls_no_zip is None:
+            xmls_no_zip = listar_xmls_zip(caminho_zip)
+        progresso = st.progress(0.0)
+        total = len(xmls_no_zip) or 1
+        if paralelo and len(xmls_no_zip) >= LIMIAR_PARALELO:
+            resultados = analisar_zip_em_paralelo(caminho_zip, xmls_no_zip, base_normativa, impressoes=impressoes)
+        else:
+            resultados = analisar_zip_sequencial(caminho_zip, xmls_no_zip, base_normativa, impressoes=impressoes)
+        vistos: dict[str, str] = {}
+        n_conhecidos = 0
+        for idx, resultado in enumerate(resultados):
+            xml_path = resultado["membro"]
+            xml_nome = xml_path.split('/')[-1] if '/' in xml_path else xml_path
+            progresso.progress((idx + 1) / total)
+            conhecido = arquivo_conhecido(resultado, vistos)
+            if conhecido is not None:
+                n_conhecidos += 1
+                _resumir_arquivo_conhecido(
+                    conhecido["numero_nfe"], conhecido["mensagem"], f"{nome_arquivo}/{xml_nome}", resumo_notas, exibir=exibir
+                )
+                continue
+            if resultado.get("etapa") == "leitura":
+                erro(f"Erro ao processar XML {xml_path} do ZIP {nome_arquivo}: {resultado['erro']}")
+                continue
+            if exibir:
+                st.markdown(f"  - Processando: `{xml_nome}`")
+            if "erro" in resultado:
+                erro(f"Erro ao processar o XML {nome_arquivo}/{xml_nome}: {resultado['erro']}")
+                continue
             try:
-                prod = item.get("prod", {})
-                
-                codigo_produto = prod.get("cProd") or prod.get("cEAN") or "N/A"
-                descricao = prod.get("xProd") or "N/A"
-                ncm = prod.get("NCM") or "N/A"
-                cest = prod.get("CEST") or None
-                cfop = prod.get("CFOP") or "N/A"
-                valor_total = prod.get("vProd") or "0.00"
-                quantidade = prod.get("qCom") or "1.00"
-                valor_ipi = extrair_valor_ipi(item)
-                valor_frete = extrair_valor_frete(item)
-                icms_origem = extrair_valor_icms_origem(item)
-                
-                # Calcula valor unitário
+                pendente = _preparar_nfe_analisada(
+                    resultado["analise"],
+                    f"{nome_arquivo}/{xml_nome}",
+                    supabase,
+                    todos_itens,
+                    alertas_notas,
+                    cliente_id_manual=cliente_id_manual,
+                    clientes=clientes,
+                    exibir=exibir,
+                )
+                pendente["impressao"] = resultado.get("impressao")
+                pendentes.append(pendente)
+            except Exception as exc:
+                erro(f"Erro ao processar o XML {nome_arquivo}/{xml_nome}: {exc}")
+            if len(pendentes) >= LOTE_NOTAS:
+                _gravar_pendentes_em_lote(supabase, pendentes, resumo_notas, impressoes, exibir=exibir)
+        _gravar_pendentes_em_lote(supabase, pendentes, resumo_notas, impressoes, exibir=exibir)
+        if n_conhecidos:
+            st.info(f"{n_conhecidos} XML(s) já importado(s) ignorado(s); {len(xmls_no_zip) - n_conhecidos} processado(s).")
+    finally:
+        os.unlink(caminho_zip)
+
+
+# --- Importação em pipeline ---
+
+def _fontes_upload(uploaded_files, zips: list[zipfile.ZipFile | None]):
+    """(nome, ler) de cada XML do upload, na ordem: XMLs avulsos e membros dos ZIPs já abertos."""
+    for uploaded_file, zip_ref in zip(uploaded_files, zips):
+        if zip_ref is None:
+            yield uploaded_file.name, uploaded_file.getvalue
+            continue
+        for membro in zip_ref.namelist():
+            if membro.lower().endswith(".xml"):
+                yield f"{uploaded_file.name}/{membro.split('/')[-1]}", partial(zip_ref.read, membro)
+
+
+def _importar_em_pipeline(uploaded_files, supabase: Client, cliente_id: str | None) -> ArmazemResultados:
+    """
+    Importa XMLs e ZIPs do upload com PipelineImportacao: uma thread lê os XMLs, outra
+    confere o índice de impressões, extrai, classifica e resolve o cliente
+    (_preparar_nfe_analisada sem tela) e outra grava com salvar_notas_em_lote, em lotes
+    de LOTE_PIPELINE notas. Aqui, na thread do Streamlit, só concluímos cada lote
+    gravado (resumo, índice, progresso).
+    Memória limitada como no modo streaming: cada ZIP vai para um arquivo temporário
+    (como em _processar_zip_em_disco) e é lido membro a membro, as filas seguram os
+    XMLs em trânsito e itens, resumo e alertas vão para ArmazemResultados. Sem
+    mensagens por nota: erros e avisos vão para os alertas.
+    """
+    return _armazem_da_sessao(
+        uploaded_files, cliente_id, "pipeline",
+        lambda armazem: _executar_pipeline(uploaded_files, supabase, cliente_id, armazem),
+    )
+
+
+def _executar_pipeline(uploaded_files, supabase: Client, cliente_id_manual: str | None, armazem: ArmazemResultados) -> None:
+    todos_itens = armazem.lista("itens")
+    resumo_notas = armazem.lista("resumo")
+    alertas_notas = armazem.lista("alertas")
+    indice = _obter_base_normativa(supabase)
+    esquema = _obter_esquema_banco(supabase)
+    impressoes = _indice_impressoes()
+    clientes = ResolvedorClientes(supabase)
+
+    selecionados = []
+    zips: list[zipfile.ZipFile | None] = []
+    caminhos_zip: list[str] = []
+    try:
+        for uploaded_file in uploaded_files:
+            extensao = uploaded_file.name.lower().split('.')[-1] if '.' in uploaded_file.name else ''
+            if extensao == 'xml':
+                selecionados.append(uploaded_file)
+                zips.append(None)
+            elif extensao == 'zip':
+                with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp:
+                    uploaded_file.seek(0)
+                    shutil.copyfileobj(uploaded_file, tmp, length=TAMANHO_BLOCO_COPIA)
+                    caminhos_zip.append(tmp.name)
                 try:
-                    valor_unitario = float(valor_total) / float(quantidade) if float(quantidade) > 0 else 0.0
-                except (ValueError, TypeError):
-                    valor_unitario = 0.0
-                
-                # Coleta CFOPs únicos
-                if cfop != "N/A":
-                    cfops_encontrados.add(str(cfop))
-                    if str(cfop).startswith("6"):
-                        tem_cfop_6 = True
-
-
-                # Verifica se o NCM/CEST está na base normativa (CEST primeiro, depois NCM)
-                regra_st = None
-                if ncm and ncm != "N/A":
-                    cache_key = f"{ncm}|{cest or ''}"
-                    if cache_key not in ncm_cache:
-                        ncm_cache[cache_key] = buscar_regra_st(supabase, ncm, cest)
-                    regra_st = ncm_cache[cache_key]
-                    if regra_st:
-                        sujeito_st_pr = True
-
-                # CFOP 54 ou 64: OBRIGATORIAMENTE marca como SUJEITO A ST (alerta mesmo sem NCM na base)
-                st_por_cfop = cfop_indica_st(cfop)
-                if st_por_cfop:
-                    sujeito_st_pr = True
-                sujeito_st_item = bool(regra_st) or st_por_cfop
-
-                # Feedback visual: Status ST e MVA Remanescente (irregular se ST zerado na nota)
-                if sujeito_st_item:
-                    status_st = STATUS_IRREGULAR_ST if icms_st_zerado else STATUS_SUJEITO_ST
-                else:
-                    status_st = "Não"
-                mva_remanescente_val = None
-                if regra_st and regra_st.get("mva_remanescente") is not None:
-                    mva_val = regra_st["mva_remanescente"]
-                    mva_remanescente_val = f"{float(mva_val) * 100:.1f}%" if mva_val else None
-
-                # Impostos extraídos do XML (base, alíquota, valor, cst)
-                impostos = extrair_impostos_item(item)
-                if impostos.get("cst"):
-                    csts_encontrados.add(str(impostos["cst"]).strip())
-                cst_exibir = impostos.get("cst") or "—"
-
-                # Dados para exibição
-                todos_itens.append({
-                    "Arquivo": nome_arquivo,
-                    "Numero Nota": n_nf,
-                    "Código do Produto": codigo_produto,
-                    "Descrição": descricao,
-                    "NCM": ncm,
-                    "CFOP": cfop,
-                    "CST": cst_exibir,
-                    "Valor Produto": safe_float(valor_total),
-                    "IPI": valor_ipi,
-                    "Frete": valor_frete,
-                    "ICMS Origem": icms_origem,
-                    "Status ST": status_st,
-                    "MVA Remanescente": mva_remanescente_val,
-                })
-
-                # Dados para salvar no banco (NCM normalizado: só dígitos; status_st para Painel)
-                ncm_limpo = limpar_ncm(ncm) if ncm and ncm != "N/A" else None
-                status_st_gravar = (STATUS_IRREGULAR_ST if icms_st_zerado else STATUS_SUJEITO_ST) if sujeito_st_item else None
-                item_salvar = {
-                    "codigo_produto": codigo_produto if codigo_produto != "N/A" else None,
-                    "descricao": descricao if descricao != "N/A" else None,
-                    "ncm": ncm_limpo,
-                    "cest": cest,
-                    "cfop": cfop if cfop != "N/A" else None,
-                    "valor_unitario": valor_unitario,
-                    "valor_total": float(valor_total) if valor_total else 0.0,
-                    "status_st": status_st_gravar,
-                }
-                # Adiciona impostos ao item (base, alíquota, valor, cst)
-                for k, v in impostos.items():
-                    if v is not None:
-                        if k == "cst":
-                            item_salvar[k] = str(v).strip()
-                        elif isinstance(v, (int, float)):
-                            item_salvar[k] = float(v)
-                        else:
-                            item_salvar[k] = v
-                itens_para_salvar.append(item_salvar)
-            except (KeyError, AttributeError, TypeError) as e:
-                st.warning(f"Erro ao processar item ({nome_arquivo}): {e}")
-                continue
-        
-        # Determina CFOP principal (primeiro encontrado ou "Múltiplos" se houver vários)
-        cfop_principal = "N/A"
-        if cfops_encontrados:
-            if len(cfops_encontrados) == 1:
-                cfop_principal = list(cfops_encontrados)[0]
+                    zips.append(zipfile.ZipFile(caminhos_zip[-1], 'r'))
+                    selecionados.append(uploaded_file)
+                except zipfile.BadZipFile:
+                    st.error(f"❌ Arquivo ZIP inválido: {uploaded_file.name}")
             else:
-                cfop_principal = f"Múltiplos ({', '.join(sorted(cfops_encontrados))})"
+                st.warning(f"Tipo de arquivo não suportado: {uploaded_file.name} (extensão: {extensao})")
+        total = sum(
+            1 if z is None else sum(1 for m in z.namelist() if m.lower().endswith(".xml"))
+            for z in zips
+        )
+        if not total:
+            st.warning("Nenhum arquivo XML encontrado no upload.")
+            return
+        st.info(f"{total} XML(s) para importar em pipeline (leitura, análise e gravação simultâneas).")
+
+        vistos: dict[str, str] = {}
+
+        def analisar(nome: str, xml_bytes: bytes) -> dict:
+            # Roda na thread de análise: itens e alertas da nota seguem no resultado e
+            # só a thread do Streamlit escreve no armazém.
+            sha, chave = impressao_xml(xml_bytes)
+            numero = impressoes.buscar(sha, chave)
+            if numero is not None:
+                return {"nome": nome, "conhecido": numero, "mensagem": mensagem_arquivo_conhecido(numero)}
+            if sha in vistos:
+                return {"nome": nome, "conhecido": None, "mensagem": f"Arquivo idêntico a {vistos[sha]}"}
+            vistos[sha] = nome
+            registro = extrair_registro_nfe(xml_bytes.decode("utf-8", errors="ignore"))
+            analise = analisar_nfe(registro, lambda ncm, cest: indice.casar(ncm, cest)[0], indice.versao)
+            itens: list[dict] = []
+            alertas: list[str] = []
+            pendente = _preparar_nfe_analisada(
+                analise, nome, supabase, itens, alertas,
+                cliente_id_manual=cliente_id_manual, clientes=clientes, exibir=False,
+            )
+            pendente.update(impressao=(sha, chave), itens=itens, alertas=alertas)
+            return pendente
 
-        # Determina CST principal (primeiro encontrado ou "Múltiplos" se houver vários)
-        cst_principal = None
-        if csts_encontrados:
-            cst_principal = list(csts_encontrados)[0] if len(csts_encontrados) == 1 else f"Múltiplos ({', '.join(sorted(csts_encontrados))})"
-        
-        # Verifica alerta de CFOP interestadual
-        if tem_cfop_6:
-            alerta_cfop = "⚠️ Operação Interestadual Detectada - Verificar Antecipação ICMS-ST"
-            st.warning(f"{alerta_cfop} - Nota {n_nf} ({nome_arquivo})")
-            if alerta_cliente:
-                alertas_notas.append(f"Nota {n_nf}: {alerta_cliente} | {alerta_cfop}")
-            else:
-                alertas_notas.append(f"Nota {n_nf}: {alerta_cfop}")
-        elif alerta_cliente:
-            alertas_notas.append(f"Nota {n_nf}: {alerta_cliente}")
-        
-        # Extrai valores totais da nota (ICMSTot)
-        v_nf = "0.00"
-        v_icms = "0.00"
-        totais_impostos = {}
+        def gravar_lote(lote: list[dict]) -> list[dict]:
+            notas = [p["nota"] for p in lote if "erro" not in p and "conhecido" not in p and p["nota"] is not None]
+            return salvar_notas_em_lote(supabase, notas, esquema) if notas else []
+
+        pipeline = PipelineImportacao(_fontes_upload(selecionados, zips), analisar, gravar_lote)
+        progresso = st.progress(0.0)
+        concluidos = 0
         try:
-            total = inf_nfe.get("total", {}).get("ICMSTot", {})
-            v_nf = total.get("vNF") or "0.00"
-            v_icms = total.get("vICMS") or "0.00"
-            totais_impostos = {
-                "icms_bc_total": safe_float(total.get("vBC")),
-                "icms_st_total": safe_float(total.get("vST") or total.get("vICMSST")),
-                "pis_total": safe_float(total.get("vPIS")),
-                "cofins_total": safe_float(total.get("vCOFINS")),
-                "ipi_total": safe_float(total.get("vIPI")),
-                "ibs_total": safe_float(total.get("vIBS")),
-                "cbs_total": safe_float(total.get("vCBS")),
-            }
-        except (KeyError, AttributeError, TypeError):
-            st.warning(f"Não foi possível extrair valores totais de {nome_arquivo}")
-        
-        # Cliente: prioridade ao selecionado manualmente; senão busca por CNPJ (normalizado)
-        cliente_id = None
-        if cliente_id_manual:
-            cliente_id = str(cliente_id_manual)
-        elif cnpj_destinatario:
-            cnpj_busca = limpar_cnpj(cnpj_destinatario) or cnpj_destinatario
-            try:
-                response_cliente = (
-                    supabase.table("clientes")
-                    .select("id")
-                    .eq("cnpj", cnpj_busca)
-                    .execute()
+            for lote, gravados in pipeline.executar():
+                pendentes = []
+                for item in lote:
+                    if "erro" in item:
+                        alertas_notas.append(f"Erro ao processar o XML {item['nome']}: {item['erro']}")
+                    elif "conhecido" in item:
+                        _resumir_arquivo_conhecido(item["conhecido"], item["mensagem"], item["nome"], resumo_notas, exibir=False)
+                    else:
+                        todos_itens.extend(item["itens"])
+                        alertas_notas.extend(item["alertas"])
+                        pendentes.append(item)
+                _concluir_pendentes(pendentes, gravados, resumo_notas, impressoes, exibir=False)
+                concluidos += len(lote)
+                progresso.progress(min(1.0, concluidos / total), text=f"{concluidos}/{total} XML(s)")
+        except Exception as exc:
+            st.error(f"Importação em pipeline interrompida: {exc}")
+        tempos = pipeline.tempos
+        st.caption(
+            f"Tempo ocupado por etapa — leitura: {tempos['leitura']:.1f} s, análise: {tempos['analise']:.1f} s, "
+            f"gravação: {tempos['gravacao']:.1f} s (etapa mais lenta: {pipeline.etapa_mais_lenta()})."
+        )
+    finally:
+        for zip_ref in zips:
+            if zip_ref is not None:
+                zip_ref.close()
+        for caminho in caminhos_zip:
+            os.unlink(caminho)
+
+
+# --- Importação em streaming ---
+
+# Linhas por página nas tabelas do modo streaming
+LINHAS_POR_PAGINA = 100
+
+
+def _armazem_da_sessao(uploaded_files, cliente_id: str | None, modo: str, importar) -> ArmazemResultados:
+    """
+    ArmazemResultados do upload, preenchido por importar(armazem). Fica na sessão
+    (st.session_state["importacao_streaming"]) e os reruns da paginação não
+    reimportam o mesmo upload no mesmo modo.
+    """
+    assinatura = [modo, str(cliente_id)] + [
+        getattr(f, "file_id", None) or f"{f.name}:{f.size}" for f in uploaded_files
+    ]
+    anterior = st.session_state.get("importacao_streaming")
+    if anterior and anterior["assinatura"] == assinatura and os.path.exists(anterior["caminho"]):
+        return ArmazemResultados(anterior["caminho"])
+
+    armazem = ArmazemResultados.novo(DIR_IMPORTACOES)
+    importar(armazem)
+    armazem.gravar_tudo()
+
+    if anterior:
+        Path(anterior["caminho"]).unlink(missing_ok=True)
+    st.session_state["importacao_streaming"] = {"assinatura": assinatura, "caminho": str(armazem.caminho_db)}
+    return armazem
+
+
+def _importar_em_streaming(uploaded_files, supabase: Client, cliente_id: str | None, paralelo: bool) -> ArmazemResultados:
+    """
+    Importa o upload com memória limitada: cada ZIP vai para o disco e é lido membro a
+    membro; notas gravadas em blocos de LOTE_NOTAS e resultados em ArmazemResultados
+    (guardado na sessão por _armazem_da_sessao).
+    """
+    return _armazem_da_sessao(
+        uploaded_files, cliente_id, "streaming",
+        lambda armazem: _executar_streaming(uploaded_files, supabase, cliente_id, paralelo, armazem),
+    )
+
+
+def _executar_streaming(uploaded_files, supabase: Client, cliente_id: str | None, paralelo: bool, armazem: ArmazemResultados) -> None:
+    todos_itens = armazem.lista("itens")
+    resumo_notas = armazem.lista("resumo")
+    alertas_notas = armazem.lista("alertas")
+    clientes_importacao = ResolvedorClientes(supabase)
+    for uploaded_file in uploaded_files:
+        nome_arquivo = uploaded_file.name
+        extensao = nome_arquivo.lower().split('.')[-1] if '.' in nome_arquivo else ''
+        try:
+            if extensao == 'zip':
+                st.markdown(f"### 📦 Processando ZIP: `{nome_arquivo}`")
+                _processar_zip_em_disco(
+                    uploaded_file,
+                    nome_arquivo,
+                    None,
+                    supabase,
+                    todos_itens,
+                    resumo_notas,
+                    alertas_notas,
+                    cliente_id_manual=cliente_id,
+                    clientes=clientes_importacao,
+                    paralelo=paralelo,
+                    exibir=False,
                 )
-                if response_cliente.data and len(response_cliente.data) > 0:
-                    cliente_id = response_cliente.data[0]["id"]
-            except Exception:
-                pass
+            elif extensao == 'xml':
+                _processar_xml_com_impressao(
+                    uploaded_file.read(),
+                    nome_arquivo,
+                    supabase,
+                    todos_itens,
+                    resumo_notas,
+                    alertas_notas,
+                    cliente_id_manual=cliente_id,
+                    clientes=clientes_importacao,
+                    exibir=False,
+                )
+            else:
+                st.warning(f"Tipo de arquivo não suportado: {nome_arquivo} (extensão: {extensao})")
+        except zipfile.BadZipFile:
+            st.error(f"❌ Arquivo ZIP inválido: {nome_arquivo}")
+        except Exception as exc:
+            st.error(f"Erro ao processar {nome_arquivo}: {exc}")
 
-        # Salva a nota e itens no banco de dados
-        status_banco = "Nao gravada"
-        if n_nf != "N/A":
-            sucesso, mensagem = salvar_nota_e_itens(
-                supabase,
-                str(n_nf),
-                cliente_id,
-                float(v_nf) if v_nf else 0.0,
-                float(v_icms) if v_icms else 0.0,
-                itens_para_salvar,
-                cnpj_destinatario=cnpj_destinatario,
-                data_emissao=data_emissao,
-                totais_impostos=totais_impostos,
-                uf_origem=uf_origem,
-                cst_principal=cst_principal,
-            )
-            if sucesso:
-                status_banco = "Gravada"
-                st.success(f"💾 {mensagem}")
+
+def _pagina_selecionada(lista: ListaEmDisco, chave: str) -> list:
+    """Linhas da página escolhida (LINHAS_POR_PAGINA por página), com seletor e legenda."""
+    total_paginas = max(1, -(-len(lista) // LINHAS_POR_PAGINA))
+    pagina = 1
+    if total_paginas > 1:
+        pagina = int(st.number_input(
+            f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1, step=1, key=chave
+        ))
+    st.caption(f"{len(lista)} linha(s) · página {pagina} de {total_paginas}")
+    return lista.pagina(pagina, LINHAS_POR_PAGINA)
+
+
+def _tabela_paginada(lista: ListaEmDisco, chave: str, colunas: list[str] | None = None) -> None:
+    df = pd.DataFrame(_pagina_selecionada(lista, chave))
+    if colunas:
+        df = df[[c for c in colunas if c in df.columns]]
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
+
+def _exibir_resultados_em_disco(armazem: ArmazemResultados) -> None:
+    """Cards e tabelas paginadas da importação em streaming ou pipeline (lidos do disco, página a página)."""
+    resumo_notas = armazem.lista("resumo")
+    todos_itens = armazem.lista("itens")
+    alertas_notas = armazem.lista("alertas")
+    if not resumo_notas:
+        st.warning("Nenhuma nota foi processada dos arquivos XML enviados.")
+        return
+
+    st.markdown("---")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Total de Notas Processadas", len(resumo_notas))
+    with col2:
+        st.metric("Soma dos Valores Totais (vNF)", f"R$ {resumo_notas.somar('Valor Total (vNF)'):,.2f}")
+    with col3:
+        st.metric("Soma dos Valores de ICMS (vICMS)", f"R$ {resumo_notas.somar('Valor ICMS (vICMS)'):,.2f}")
+    st.success("Cruzamento concluído com a base normativa!")
+    logger_match.info("Estatísticas do match após importação: %s", ESTATISTICAS_MATCH.resumo())
+
+    st.markdown("---")
+    st.subheader("📋 Resumo das Notas Processadas")
+    _tabela_paginada(
+        resumo_notas,
+        "pagina_resumo_streaming",
+        ["Número da Nota", "Nome do Cliente", "Valor Total (vNF)", "Valor ICMS (vICMS)", "CFOP", "CST", "Sujeito a ST (PR)", "Status Banco", "Arquivo"],
+    )
+    if todos_itens:
+        st.markdown("---")
+        with st.expander("📦 Itens por nota (Status ST e MVA Remanescente)", expanded=False):
+            _tabela_paginada(todos_itens, "pagina_itens_streaming")
+    if alertas_notas:
+        st.markdown("---")
+        st.subheader("⚠️ Alertas")
+        for alerta in _pagina_selecionada(alertas_notas, "pagina_alertas_streaming"):
+            if "ERRO: NF_DESTINATARIO_NAO_CADASTRADO" in alerta:
+                st.error(alerta)
             else:
-                if "já existe" in mensagem.lower():
-                    status_banco = "Ja existente"
-                    st.info(f"ℹ️ {mensagem}")
-                else:
-                    status_banco = "Falha ao gravar"
-                    st.warning(f"⚠️ {mensagem}")
-        else:
-            status_banco = "Sem numero"
-        
-        # Adiciona ao resumo de notas
-        resumo_notas.append({
-            "Número da Nota": n_nf,
-            "Nome do Cliente": nome_cliente or "N/A",
-            "Valor Total (vNF)": v_nf,
-            "Valor ICMS (vICMS)": v_icms,
-            "CFOP": cfop_principal,
-            "CST": cst_principal or "—",
-            "Sujeito a ST (PR)": "⚠️ SUJEITO A ST (PR)" if sujeito_st_pr else "Não",
-            "Status Banco": status_banco,
-            "Arquivo": nome_arquivo,
-        })
-            
-    except Exception as exc:
-        st.error(f"Erro ao processar o XML {nome_arquivo}: {exc}")
+                st.warning(alerta)
+    st.info("Nos modos streaming e pipeline, reanalise as notas importadas pelo Painel de Auditoria (🔄 Reprocessar Selecionadas).")
+
+
+# --- Importação em segundo plano ---
+
+ROTULOS_STATUS_JOB = {
+    JOB_NA_FILA: "⏳ Na fila",
+    JOB_EXECUTANDO: "🔄 Executando",
+    JOB_CONCLUIDO: "✅ Concluída",
+    JOB_INTERROMPIDO: "⏸️ Interrompida",
+    JOB_ERRO: "❌ Erro",
+}
+
+
+@st.cache_resource
+def _fila_importacao() -> FilaImportacao:
+    """Fila de importações do servidor (SQLite em DIR_IMPORTACOES)."""
+    return FilaImportacao()
+
+
+def _gravador_lote_job(supabase: Client, cliente_id_manual: str | None):
+    """
+    gravar_lote do job: resolve clientes e grava com salvar_notas_em_lote, sem mensagens
+    na tela (roda fora da sessão do Streamlit).
+    """
+    clientes = ResolvedorClientes(supabase)
+
+    def gravar(analises: list[dict]) -> list[dict]:
+        notas: list[dict] = []
+        for analise in analises:
+            cliente_id = str(cliente_id_manual) if cliente_id_manual else None
+            if not cliente_id and analise["cnpj_destinatario"]:
+                try:
+                    cliente = clientes.por_cnpj(analise["cnpj_destinatario"])
+                    cliente_id = cliente["id"] if cliente else None
+                except Exception:
+                    cliente_id = None
+            notas.append(_nota_para_gravacao(analise, cliente_id))
+        gravadas = iter(salvar_notas_em_lote(supabase, [n for n in notas if n is not None]))
+        return [
+            next(gravadas) if nota is not None else {"status": "Sem numero", "numero_nfe": None, "mensagem": ""}
+            for nota in notas
+        ]
+
+    return gravar
+
+
+def _iniciar_job(supabase: Client, job: dict) -> bool:
+    return iniciar_em_segundo_plano(
+        _fila_importacao(),
+        job["id"],
+        _obter_base_normativa(supabase).linhas,
+        _gravador_lote_job(supabase, job["cliente_id"]),
+        impressoes=_indice_impressoes(),
+    )
+
+
+def _enviar_zip_segundo_plano(uploaded_file, nome_arquivo: str, supabase: Client, cliente_id: str | None) -> None:
+    """Salva o ZIP em DIR_IMPORTACOES e cria o job (uma vez por arquivo enviado na sessão)."""
+    enviados = st.session_state.setdefault("jobs_enviados", {})
+    chave = getattr(uploaded_file, "file_id", None) or f"{nome_arquivo}:{uploaded_file.size}"
+    if chave in enviados:
+        st.info(f"📦 `{nome_arquivo}` já enviado para importação em segundo plano (acompanhe abaixo).")
+        return
+    DIR_IMPORTACOES.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=DIR_IMPORTACOES, suffix=".zip", delete=False) as tmp:
+        uploaded_file.seek(0)
+        shutil.copyfileobj(uploaded_file, tmp, length=TAMANHO_BLOCO_COPIA)
+        caminho_zip = tmp.name
+    try:
+        total = len(listar_xmls_zip(caminho_zip))
+    except zipfile.BadZipFile:
+        os.unlink(caminho_zip)
+        st.error(f"❌ Arquivo ZIP inválido: {nome_arquivo}")
+        return
+    fila = _fila_importacao()
+    job_id = fila.criar_job(nome_arquivo, caminho_zip, total, cliente_id=str(cliente_id) if cliente_id else None)
+    enviados[chave] = job_id
+    _iniciar_job(supabase, fila.obter_job(job_id))
+    st.info(f"📦 `{nome_arquivo}`: {total} XML(s) enviados para importação em segundo plano.")
+
+
+def _exibir_importacoes_em_segundo_plano(supabase: Client) -> None:
+    """Progresso dos jobs da fila, com opção de retomar os interrompidos."""
+    fila = _fila_importacao()
+    jobs = fila.listar_jobs(limite=10)
+    if not jobs:
+        return
+    st.subheader("📦 Importações em segundo plano")
+    for job in jobs:
+        status = status_efetivo(job)
+        st.markdown(
+            f"**{job['nome_arquivo']}** — {ROTULOS_STATUS_JOB.get(status, status)} · "
+            f"{job['processadas']}/{job['total']} XML(s) · {job['gravadas']} gravada(s) · "
+            f"{job['duplicadas']} já existente(s) · {job['erros']} erro(s)"
+        )
+        st.progress(min(job["fracao"], 1.0))
+        if job.get("mensagem"):
+            st.caption(job["mensagem"])
+        if status in (JOB_INTERROMPIDO, JOB_ERRO):
+            if st.button("▶️ Retomar", key=f"retomar_job_{job['id']}"):
+                if not os.path.exists(job["caminho_zip"]):
+                    st.error("O ZIP deste job não está mais disponível no servidor. Envie o arquivo novamente.")
+                elif _iniciar_job(supabase, job):
+                    st.rerun()
+        if status == JOB_CONCLUIDO and (job["erros"] or job["sem_numero"]):
+            with st.expander("Ver XMLs com erro", expanded=False):
+                st.dataframe(
+                    pd.DataFrame([r for r in fila.resultados(job["id"]) if r["status"] not in ("Gravada", "Ja existente")]),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+    st.button("🔄 Atualizar progresso", key="atualizar_progresso_jobs")
 
 
 def pagina_analise_xml() -> None:
@@ -1657,6 +2133,43 @@ def pagina_analise_xml() -> None:
 
     st.markdown(f"**Importando notas para:** {nome_cliente_auditoria}")
 
+    processamento_paralelo = st.checkbox(
+        "⚡ Processamento paralelo de ZIPs (multi-core)",
+        value=True,
+        help=f"ZIPs com {LIMIAR_PARALELO} ou mais XMLs são lidos e classificados em vários processos; a gravação continua na ordem dos arquivos.",
+    )
+
+    importacao_segundo_plano = st.checkbox(
+        "🕒 Importar ZIPs em segundo plano (retomável)",
+        value=False,
+        help="O ZIP é gravado no servidor e importado por um worker; recarregar a página não reinicia a importação.",
+    )
+
+    importacao_streaming = st.checkbox(
+        "💾 Modo streaming (memória limitada)",
+        value=False,
+        help="Para uploads muito grandes: ZIPs lidos do disco um XML por vez, resultados gravados em disco e exibidos em páginas.",
+    )
+
+    importacao_pipeline = st.checkbox(
+        "🔀 Importação em pipeline (leitura, análise e gravação simultâneas)",
+        value=False,
+        help="Lê, classifica e grava as notas em etapas paralelas ligadas por filas limitadas: a análise não espera o banco e o banco não espera a análise. Sem mensagens por nota; avisos vão para os Alertas.",
+    )
+
+    with st.expander("♻️ XMLs já importados", expanded=False):
+        impressoes = _indice_impressoes()
+        st.caption(
+            f"{impressoes.total()} arquivo(s) no índice local (SHA-256 e chave de acesso). "
+            "Reenvios são marcados como já existentes sem leitura do XML nem consulta ao banco. "
+            "Limpe o índice se notas forem apagadas do banco."
+        )
+        if st.button("Limpar índice", key="limpar_indice_impressoes"):
+            impressoes.limpar()
+            st.rerun()
+
+    _exibir_importacoes_em_segundo_plano(supabase)
+
     uploaded_files = st.file_uploader(
         "Selecione um ou mais arquivos XML de NF-e ou arquivos ZIP contendo XMLs",
         type=["xml", "zip"],
@@ -1665,17 +2178,33 @@ def pagina_analise_xml() -> None:
 
     if uploaded_files is not None and len(uploaded_files) > 0:
         st.success(f"{len(uploaded_files)} arquivo(s) recebido(s)")
+
+        if importacao_streaming and not importacao_segundo_plano:
+            armazem = _importar_em_streaming(uploaded_files, supabase, cliente_id_auditoria, processamento_paralelo)
+            _exibir_resultados_em_disco(armazem)
+            return
+        
+        if importacao_pipeline and not importacao_segundo_plano:
+            armazem = _importar_em_pipeline(uploaded_files, supabase, cliente_id_auditoria)
+            _exibir_resultados_em_disco(armazem)
+            return
         
         # Listas para acumular dados
         todos_itens = []
         resumo_notas = []
         alertas_notas = []
+        # Clientes consultados uma vez por importação (CNPJ/id -> cliente)
+        clientes_importacao = ResolvedorClientes(supabase)
         
         # Processa cada arquivo
         for uploaded_file in uploaded_files:
             nome_arquivo = uploaded_file.name
             extensao = nome_arquivo.lower().split('.')[-1] if '.' in nome_arquivo else ''
             
+            if extensao == 'zip' and importacao_segundo_plano:
+                _enviar_zip_segundo_plano(uploaded_file, nome_arquivo, supabase, cliente_id_auditoria)
+                continue
+
             if extensao == 'zip':
                 # Processa arquivo ZIP
                 st.markdown(f"### 📦 Processando ZIP: `{nome_arquivo}`")
@@ -1698,6 +2227,20 @@ def pagina_analise_xml() -> None:
                             continue
                         
                         st.info(f"Encontrados {len(xmls_no_zip)} arquivo(s) XML no ZIP")
+
+                        if processamento_paralelo and len(xmls_no_zip) >= LIMIAR_PARALELO:
+                            _processar_zip_em_disco(
+                                uploaded_file,
+                                nome_arquivo,
+                                xmls_no_zip,
+                                supabase,
+                                todos_itens,
+                                resumo_notas,
+                                alertas_notas,
+                                cliente_id_manual=cliente_id_auditoria,
+                                clientes=clientes_importacao,
+                            )
+                            continue
                         
                         # Processa cada XML dentro do ZIP
                         for xml_path in xmls_no_zip:
@@ -1707,18 +2250,18 @@ def pagina_analise_xml() -> None:
                                 
                                 # Lê o conteúdo do XML do ZIP
                                 xml_bytes = zip_ref.read(xml_path)
-                                xml_string = xml_bytes.decode("utf-8", errors="ignore")
                                 
-                                # Processa o XML
+                                # Processa o XML (pula arquivos já importados)
                                 st.markdown(f"  - Processando: `{xml_nome}`")
-                                processar_xml(
-                                    xml_string,
+                                _processar_xml_com_impressao(
+                                    xml_bytes,
                                     f"{nome_arquivo}/{xml_nome}",
                                     supabase,
                                     todos_itens,
                                     resumo_notas,
                                     alertas_notas,
                                     cliente_id_manual=cliente_id_auditoria,
+                                    clientes=clientes_importacao,
                                 )
                             except Exception as exc:
                                 st.error(f"Erro ao processar XML {xml_path} do ZIP {nome_arquivo}: {exc}")
@@ -1738,17 +2281,17 @@ def pagina_analise_xml() -> None:
                 try:
                     # Lê o conteúdo do XML
                     xml_bytes = uploaded_file.read()
-                    xml_string = xml_bytes.decode("utf-8", errors="ignore")
                     
-                    # Processa o XML
-                    processar_xml(
-                        xml_string,
+                    # Processa o XML (pula arquivos já importados)
+                    _processar_xml_com_impressao(
+                        xml_bytes,
                         nome_arquivo,
                         supabase,
                         todos_itens,
                         resumo_notas,
                         alertas_notas,
                         cliente_id_manual=cliente_id_auditoria,
+                        clientes=clientes_importacao,
                     )
                 except Exception as exc:
                     st.error(f"Erro ao processar o XML {nome_arquivo}: {exc}")
@@ -1784,6 +2327,7 @@ def pagina_analise_xml() -> None:
                 st.metric("Soma dos Valores de ICMS (vICMS)", f"R$ {soma_valores_icms:,.2f}")
             
             st.success("Cruzamento concluído com a base normativa!")
+            logger_match.info("Estatísticas do match após importação: %s", ESTATISTICAS_MATCH.resumo())
             
             # Tabela resumo das notas
             st.markdown("---")
@@ -1846,252 +2390,188 @@ def pagina_analise_xml() -> None:
             st.warning("Nenhuma nota foi processada dos arquivos XML enviados.")
 
 
-def _gerar_pdf_auditoria(
-    itens_antecipacao: list[dict],
-    nome_cliente: str,
-    valor_total_antecipacao: float,
-) -> bytes | None:
+def _gerar_pdf_auditoria(chave: str, nome_cliente: str, valor_total_antecipacao: float, modo: str):
     """
-    Gera PDF do relatório de auditoria focado em itens de Antecipação Pendente.
-    Retorna bytes do PDF ou None se reportlab não disponível.
+    Callable do botão de PDF: gera (numa thread do download_button, sem st.*) o
+    relatório dos itens de Antecipação Pendente da tabela em cache, página a página,
+    num arquivo temporário (relatorio_pdf).
     """
-    if not HAS_REPORTLAB or not itens_antecipacao:
-        return None
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    # Cabeçalho profissional
-    titulo = ParagraphStyle(
-        name="TituloRelatorio",
-        parent=styles["Heading1"],
-        fontSize=18,
-        spaceAfter=12,
-        textColor=colors.HexColor("#1a1a1a"),
+    cache = _cache_auditoria()
+    return lambda: gerar_relatorio_pdf(
+        cache.blocos(chave, "antecipacao_pendente", COLUNAS_RELATORIO_PDF, linhas_por_bloco=LINHAS_POR_BLOCO),
+        nome_cliente,
+        valor_total_antecipacao,
+        modo,
     )
-    elements.append(Paragraph("Relatório de Auditoria de ICMS-ST", titulo))
-    elements.append(Spacer(1, 0.5*cm))
-
-    # Cliente e data
-    dados_cabecalho = f"<b>Cliente:</b> {nome_cliente}<br/><b>Data da análise:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-    elements.append(Paragraph(dados_cabecalho, styles["Normal"]))
-    elements.append(Spacer(1, 1*cm))
-
-    # Tabela: NCM, Descrição, Valor, Diagnóstico Fiscal
-    headers = ["NCM", "Descrição", "Valor (R$)", "Diagnóstico Fiscal"]
-    data = [[h for h in headers]]
-    for item in itens_antecipacao:
-        desc = str(item.get("Descrição", item.get("descricao", "—")) or "—")
-        if len(desc) > 50:
-            desc = desc[:50] + "…"
-        valor = float(item.get("Valor Item", item.get("valor_total", 0)) or 0)
-        valor_str = f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        diag = str(item.get("Diagnóstico Fiscal", item.get("diagnostico", "—")) or "—")
-        if len(diag) > 80:
-            diag = diag[:80] + "…"
-        data.append([str(item.get("NCM", item.get("ncm", "—")) or "—"), desc, valor_str, diag])
-
-    col_widths = [3*cm, 6*cm, 3*cm, 6*cm]
-    t = Table(data, colWidths=col_widths, repeatRows=1)
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#2c3e50")),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-        ("ALIGN", (2, 0), (2, -1), "RIGHT"),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 10),
-        ("FONTSIZE", (0, 1), (-1, -1), 9),
-        ("BOTTOMPADDING", (0, 0), (-1, 0), 10),
-        ("TOPPADDING", (0, 0), (-1, 0), 10),
-        ("BOTTOMPADDING", (0, 1), (-1, -1), 6),
-        ("TOPPADDING", (0, 1), (-1, -1), 6),
-        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
-        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f8f9fa")]),
-    ]))
-    elements.append(t)
-    elements.append(Spacer(1, 1*cm))
-
-    # Totalização
-    elements.append(Paragraph("<b>Totalização</b>", styles["Heading2"]))
-    total_str = f"R$ {valor_total_antecipacao:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    total_text = f"Valor total de base de cálculo sujeito à antecipação de ICMS-ST: <b>{total_str}</b>"
-    elements.append(Paragraph(total_text, styles["Normal"]))
-    elements.append(Spacer(1, 0.5*cm))
-    elements.append(Paragraph("Itens listados requerem regularização pelo destinatário no Estado do Paraná.", styles["Normal"]))
-
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer.getvalue()
+
+
+logger_auditoria = logging.getLogger("auditoria.kpis")
+
+# Ids de notas por chamada da RPC auditoria_kpis (as somas de cada lote são acumuladas)
+LOTE_IDS_RPC_KPIS = 1000
+
+
+def _kpis_auditoria_no_banco(supabase: Client, nota_ids: list) -> dict | None:
+    """
+    KPIs agregados no banco pela função auditoria_kpis (migration 015): só os números
+    trafegam, em chamadas de até LOTE_IDS_RPC_KPIS ids somadas aqui. None se a
+    função não existir (marcado na sessão para não repetir a chamada a cada rerun)
+    ou se esta chamada falhar (erro registrado no log; a próxima tenta de novo).
+    """
+    if st.session_state.get("rpc_auditoria_kpis_indisponivel"):
+        return None
+    chamadas = {
+        i: lambda lote=lote: supabase.rpc("auditoria_kpis", {"p_nota_ids": [str(n) for n in lote]}).execute()
+        for i, lote in enumerate(lotes(nota_ids, LOTE_IDS_RPC_KPIS))
+    }
+    try:
+        respostas = em_paralelo(chamadas)
+    except Exception as exc:
+        if erro_funcao_inexistente(exc):
+            logger_auditoria.info("RPC auditoria_kpis indisponível, cálculo local: %s", exc)
+            st.session_state["rpc_auditoria_kpis_indisponivel"] = True
+        else:
+            logger_auditoria.warning("Falha na RPC auditoria_kpis, cálculo local nesta chamada: %s", exc)
+        return None
+    kpis = {"total_itens": 0, "st_recolhida": 0, "antecipacao_pendente": 0, "irregulars": 0, "valor_risco": 0.0}
+    for resp in respostas.values():
+        linhas = resp.data or []
+        linha = linhas[0] if isinstance(linhas, list) and linhas else linhas
+        if not isinstance(linha, dict):
+            return None
+        for chave in kpis:
+            kpis[chave] += type(kpis[chave])(linha.get(chave) or 0)
+    return kpis
 
 
 def _compute_auditoria_kpis(supabase: Client, nota_ids: list) -> dict:
-    """Calcula os KPIs (total_itens, st_recolhida, antecipacao_pendente, irregulars, valor_risco) para as notas."""
+    """
+    Calcula os KPIs (total_itens, st_recolhida, antecipacao_pendente, irregulars, valor_risco) para as notas.
+    Usa a função auditoria_kpis do banco quando existir; senão busca os itens e
+    classifica em conjunto (calcular_kpis_auditoria), sem laço por item, reaproveitando
+    a classificação gravada nos itens quando ela é da versão atual da base.
+    """
+    kpis = _kpis_auditoria_no_banco(supabase, nota_ids)
+    if kpis is not None:
+        return kpis
     try:
-        resp_itens = supabase.table("itens_nota").select("id, nota_id, ncm, cest, valor_total, status_st, cfop").in_("nota_id", nota_ids).execute()
-        itens_raw = resp_itens.data or []
-        resp_notas = supabase.table("notas_fiscais").select("id, uf_origem").in_("id", nota_ids).execute()
+        # Com a migration 016, itens já classificados na versão atual da base só são lidos e somados
+        colunas_itens = _obter_esquema_banco(supabase).colunas(
+            "itens_nota", ("id", "nota_id", "ncm", "cest", "valor_total", "status_st", "cfop", *COLUNAS_CLASSIFICACAO_ST)
+        )
+        lidos = em_paralelo({
+            "itens": lambda: buscar_por_ids(
+                lambda lote: supabase.table("itens_nota").select(colunas_itens).in_("nota_id", lote).order("id"),
+                nota_ids,
+                paralelo=True,
+            ),
+            "notas": lambda: buscar_por_ids(
+                lambda lote: supabase.table("notas_fiscais").select("id, uf_origem").in_("id", lote).order("id"),
+                nota_ids,
+            ),
+        })
+        itens_raw, notas_uf = lidos["itens"], lidos["notas"]
         mapa_uf_origem: dict[str, str] = {}
-        for n in (resp_notas.data or []):
+        for n in notas_uf:
             uf = n.get("uf_origem")
             mapa_uf_origem[str(n["id"])] = str(uf).strip().upper() if uf else ""
     except Exception:
         return {}
-    ncm_base_cache: dict[str, bool] = {}
-    st_recolhida = 0
-    antecipacao_pendente = 0
-    irregulars = 0
-    valor_risco = 0.0
-    for item in itens_raw:
-        valor = float(item.get("valor_total", 0) or 0)
-        ncm = item.get("ncm")
-        cest = item.get("cest")
-        cfop = item.get("cfop")
-        nota_id = str(item.get("nota_id", ""))
-        uf_origem = mapa_uf_origem.get(nota_id, "")
-        status_db = (item.get("status_st") or "").strip()
-        sujeito_st = bool(item.get("status_st"))
-        irregular_db = sujeito_st and (STATUS_IRREGULAR_ST in status_db or "IRREGULAR" in status_db)
-        cache_key = f"{ncm}|{cest or ''}"
-        if cache_key not in ncm_base_cache:
-            ncm_base_cache[cache_key] = buscar_regra_st(supabase, ncm, cest) is not None
-        ncm_na_base = ncm_base_cache[cache_key]
-        cfop_54_64 = cfop_inicia_54_ou_64(cfop)
-        cfop_61 = cfop_inicia_61(cfop)
-        cfop_51 = cfop_inicia_51(cfop)
-        irregular = irregular_db or (cfop_51 and ncm_na_base)
-        if irregular:
-            irregulars += 1
-        elif ncm_na_base and cfop_54_64:
-            st_recolhida += 1
-        elif (cfop_61 and uf_origem and uf_origem != "PR") or (ncm_na_base and not cfop_54_64 and not cfop_51):
-            antecipacao_pendente += 1
-            valor_risco += valor
-    return {
-        "total_itens": len(itens_raw),
-        "st_recolhida": st_recolhida,
-        "antecipacao_pendente": antecipacao_pendente,
-        "irregulars": irregulars,
-        "valor_risco": valor_risco,
-    }
+    try:
+        indice = _obter_base_normativa(supabase)
+    except Exception as exc:
+        st.error(f"Erro ao consultar base normativa: {exc}")
+        indice = IndiceRegrasST([])
+    return calcular_kpis_auditoria(itens_raw, mapa_uf_origem, indice)
 
 
-def _exibir_resultados_auditoria(supabase: Client, nota_ids: list) -> None:
-    """Exibe resumo (KPIs), tabela de validação de sujeição e filtro."""
-    itens_auditoria: list[dict] = []
-    mapa_nota: dict[str, str] = {}
+def _cache_auditoria() -> CacheAuditoria:
+    """Cache colunar da sessão com as tabelas de detalhes já montadas."""
+    if "auditoria_cache" not in st.session_state:
+        st.session_state["auditoria_cache"] = CacheAuditoria()
+    return st.session_state["auditoria_cache"]
 
-    mapa_cliente: dict[str, str] = {}
+
+def _chave_auditoria(supabase: Client, nota_ids: list) -> str:
+    """Chave da seleção no cache: muda com a base normativa e a cada reprocessamento."""
     try:
-        resp_notas = (
-            supabase.table("notas_fiscais")
-            .select("id, numero_nfe, cliente_id, uf_origem")
-            .in_("id", nota_ids)
-            .execute()
-        )
-        mapa_uf_origem: dict[str, str] = {}
-        for n in resp_notas.data or []:
-            mapa_nota[str(n["id"])] = n.get("numero_nfe", "")
-            uf = n.get("uf_origem")
-            mapa_uf_origem[str(n["id"])] = str(uf).strip().upper() if uf else ""
-        ids_clientes = {str(n["cliente_id"]) for n in (resp_notas.data or []) if n.get("cliente_id")}
-        if ids_clientes:
-            resp_c = supabase.table("clientes").select("id, nome_fantasia, razao_social").in_("id", list(ids_clientes)).execute()
-            for c in resp_c.data or []:
-                mapa_cliente[str(c["id"])] = c.get("nome_fantasia") or c.get("razao_social") or str(c["id"])
+        _obter_base_normativa(supabase)
+    except Exception:
+        pass
+    return CacheAuditoria.chave(
+        nota_ids, _cache_base_normativa()["versao"], st.session_state.get("auditoria_geracao", 0)
+    )
 
-        try:
-            resp_itens = (
-                supabase.table("itens_nota")
-                .select("id, nota_id, descricao, ncm, cest, valor_total, status_st, codigo_produto, cfop, cst")
-                .in_("nota_id", nota_ids)
-                .execute()
-            )
-        except Exception:
-            resp_itens = (
-                supabase.table("itens_nota")
-                .select("id, nota_id, descricao, ncm, cest, valor_total, status_st, codigo_produto, cfop")
-                .in_("nota_id", nota_ids)
-                .execute()
-            )
-        itens_raw = resp_itens.data or []
+
+def _kpis_em_cache(supabase: Client, nota_ids: list) -> dict | None:
+    """KPIs da seleção se a tabela de detalhes já estiver no cache da sessão."""
+    resumo = _cache_auditoria().resumo(_chave_auditoria(supabase, nota_ids))
+    if resumo is None:
+        return None
+    return {k: resumo[k] for k in ("total_itens", "st_recolhida", "antecipacao_pendente", "irregulars", "valor_risco")}
+
+
+def _carregar_tabela_auditoria(supabase: Client, nota_ids: list, chave: str) -> None:
+    """Busca notas, itens e clientes da seleção, classifica em conjunto e guarda no cache."""
+    esquema = _obter_esquema_banco(supabase)
+    colunas_notas = esquema.colunas("notas_fiscais", ("id", "numero_nfe", "cliente_id", "uf_origem"))
+    colunas_itens = esquema.colunas("itens_nota", (
+        "id", "nota_id", "descricao", "ncm", "cest", "valor_total", "status_st", "codigo_produto", "cfop", "cst",
+        *COLUNAS_CLASSIFICACAO_ST,
+    ))
+    # Notas e itens não dependem um do outro; os clientes esperam pelas notas
+    lidos = em_paralelo({
+        "notas": lambda: buscar_por_ids(
+            lambda lote: supabase.table("notas_fiscais").select(colunas_notas).in_("id", lote).order("id"),
+            nota_ids,
+        ),
+        "itens": lambda: buscar_por_ids(
+            lambda lote: supabase.table("itens_nota").select(colunas_itens).in_("nota_id", lote).order("id"),
+            nota_ids,
+            paralelo=True,
+        ),
+    })
+    notas_sel, itens_raw = lidos["notas"], lidos["itens"]
+    ids_clientes = {str(n["cliente_id"]) for n in notas_sel if n.get("cliente_id")}
+    mapa_cliente = nomes_clientes(supabase, ids_clientes) if ids_clientes else {}
+
+    try:
+        indice = _obter_base_normativa(supabase)
     except Exception as exc:
-        st.error(f"Erro ao carregar itens: {exc}")
-        return
+        st.error(f"Erro ao consultar base normativa: {exc}")
+        indice = IndiceRegrasST([])
+    df = montar_tabela_auditoria(itens_raw, notas_sel, indice)
 
-    # Cache NCM -> na base normativa (para diagnóstico fiscal)
-    ncm_base_cache: dict[str, bool] = {}
-
-    for item in itens_raw:
-        valor = float(item.get("valor_total", 0) or 0)
-        sujeito_st = bool(item.get("status_st"))
-        status_db = (item.get("status_st") or "").strip()
-        irregular_db = sujeito_st and (STATUS_IRREGULAR_ST in status_db or "IRREGULAR" in status_db)
-
-        # Lógica de status: NCM na base + CFOP + UF de origem
-        ncm = item.get("ncm")
-        cest = item.get("cest")
-        cfop = item.get("cfop")
-        nota_id = str(item.get("nota_id", ""))
-        uf_origem = mapa_uf_origem.get(nota_id, "")
-        cache_key = f"{ncm}|{cest or ''}"
-        if cache_key not in ncm_base_cache:
-            ncm_base_cache[cache_key] = buscar_regra_st(supabase, ncm, cest) is not None
-        ncm_na_base = ncm_base_cache[cache_key]
-        cfop_subst = cfop_substituicao(cfop)
-        cfop_54_64 = cfop_inicia_54_ou_64(cfop)
-        cfop_61 = cfop_inicia_61(cfop)
-        cfop_51 = cfop_inicia_51(cfop)
-
-        # Status visual — Lógica atualizada:
-        # ❌ IRREGULAR: já irregular no XML OU CFOP 5.1 (venda interna) que deveria ter ST
-        # ✅ ST RECOLHIDA: NCM na base + CFOP 5.4 ou 6.4
-        # 🚨 ANTECIPAÇÃO PENDENTE: CFOP 6.1 de fora do PR (ST na entrada) OU NCM na base + CFOP comum
-        irregular = irregular_db or (cfop_51 and ncm_na_base)
-        if irregular:
-            status_badge = "❌ IRREGULAR"
-            diagnostico = DIAGNOSTICO_ERRO_ST
-        elif ncm_na_base and cfop_54_64:
-            status_badge = BADGE_ST_RECOLHIDA
-            diagnostico = DIAGNOSTICO_ST_RECOLHIDA
-        elif (cfop_61 and uf_origem and uf_origem != "PR") or (ncm_na_base and not cfop_54_64 and not cfop_51):
-            status_badge = BADGE_ANTECIPACAO_PENDENTE
-            diagnostico = DIAGNOSTICO_ANTECIPACAO_PENDENTE
-        elif sujeito_st and not ncm_na_base and cfop_indica_st(cfop):
-            status_badge = "⚠️ SUJEITO A ST (via CFOP)"
-            diagnostico = DIAGNOSTICO_CFOP_XML
-            print(f"⚠️ NCM ausente na base, mas ST identificada no XML. NCM={ncm!r}, CFOP={cfop!r}")
-        else:
-            status_badge = BADGE_OPERACAO_COMUM
-            diagnostico = "NCM não sujeito a ST na base normativa do PR."
-
-        itens_auditoria.append({
-            "Status": status_badge,
-            "Diagnóstico Fiscal": diagnostico,
-            "Número NF": mapa_nota.get(str(item.get("nota_id", "")), "—"),
-            "Código": item.get("codigo_produto") or "—",
-            "Descrição": (str(item.get("descricao") or "—")[:80] + "…") if len(str(item.get("descricao") or "")) > 80 else (item.get("descricao") or "—"),
-            "NCM": item.get("ncm") or "—",
-            "CEST": item.get("cest") or "—",
-            "CFOP": item.get("cfop") or "—",
-            "CST": item.get("cst") or "—",
-            "Valor Item": valor,
-            "_sujeito_st": sujeito_st,
-            "_irregular": irregular,
-        })
+    nomes_uniq = list(dict.fromkeys(mapa_cliente.get(str(n.get("cliente_id", "")), "") for n in notas_sel if n.get("cliente_id")))
+    nomes_uniq = [x for x in nomes_uniq if x]
+    nome_cliente_pdf = nomes_uniq[0] if len(nomes_uniq) == 1 else (", ".join(nomes_uniq[:3]) + ("..." if len(nomes_uniq) > 3 else "")) if nomes_uniq else "Não identificado"
+    _cache_auditoria().guardar(chave, df, meta={"nome_cliente": nome_cliente_pdf})
 
-    if not itens_auditoria:
+
+def _exibir_resultados_auditoria(supabase: Client, nota_ids: list) -> None:
+    """
+    Exibe resumo (KPIs), tabela de validação de sujeição e filtro. A tabela é
+    montada uma vez por seleção (_cache_auditoria); filtros, ordenação e exportação
+    leem do cache, sem voltar ao banco.
+    """
+    cache = _cache_auditoria()
+    chave = _chave_auditoria(supabase, nota_ids)
+    if not cache.contem(chave):
+        try:
+            _carregar_tabela_auditoria(supabase, nota_ids, chave)
+        except Exception as exc:
+            st.error(f"Erro ao carregar itens: {exc}")
+            return
+    resumo = cache.resumo(chave)
+    if not resumo["total_itens"]:
         st.warning("Nenhum item encontrado nas notas selecionadas.")
         return
 
-    df = pd.DataFrame(itens_auditoria)
-    total_notas = len(set(str(x) for x in nota_ids))
-    total_itens = len(df)
-    itens_st = int(df["_sujeito_st"].sum())
-    irregulars = int(df["_irregular"].sum())
-    antecipacao_pendente = int((df["Status"] == BADGE_ANTECIPACAO_PENDENTE).sum())
-    st_recolhida = int((df["Status"] == BADGE_ST_RECOLHIDA).sum())
-    valor_risco = float(df.loc[df["Status"] == BADGE_ANTECIPACAO_PENDENTE, "Valor Item"].sum())
+    total_itens = resumo["total_itens"]
+    irregulars = resumo["irregulars"]
+    antecipacao_pendente = resumo["antecipacao_pendente"]
+    st_recolhida = resumo["st_recolhida"]
+    valor_risco = resumo["valor_risco"]
 
     # Guarda KPIs no session_state para exibir no topo da página
     st.session_state["auditoria_kpis"] = {
@@ -2108,21 +2588,25 @@ def _exibir_resultados_auditoria(supabase: Client, nota_ids: list) -> None:
     _render_premium_cards(total_itens, st_recolhida, antecipacao_pendente, valor_risco)
 
     # Botão PDF estilizado abaixo dos cards
-    df_pendente_cards = df[df["Status"] == BADGE_ANTECIPACAO_PENDENTE].copy()
-    nomes_uniq = list(dict.fromkeys(mapa_cliente.get(str(n.get("cliente_id", "")), "") for n in (resp_notas.data or []) if n.get("cliente_id")))
-    nomes_uniq = [x for x in nomes_uniq if x]
-    nome_cliente_pdf = nomes_uniq[0] if len(nomes_uniq) == 1 else (", ".join(nomes_uniq[:3]) + ("..." if len(nomes_uniq) > 3 else "")) if nomes_uniq else "Não identificado"
-    if HAS_REPORTLAB and not df_pendente_cards.empty:
-        pdf_bytes_btn = _gerar_pdf_auditoria(df_pendente_cards.to_dict("records"), nome_cliente_pdf, valor_risco)
-        if pdf_bytes_btn:
-            st.download_button(
-                "📄 Exportar Relatório PDF",
-                data=pdf_bytes_btn,
-                file_name=f"relatorio_auditoria_icms_st_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
-                mime="application/pdf",
-                type="primary",
-                key="btn_pdf_auditoria",
-            )
+    nome_cliente_pdf = cache.meta(chave).get("nome_cliente", "Não identificado")
+    if HAS_REPORTLAB and antecipacao_pendente:
+        modos_pdf = list(MODOS_RELATORIO_PDF)
+        modo_pdf = st.radio(
+            "Conteúdo do PDF",
+            modos_pdf,
+            index=modos_pdf.index(modo_padrao(antecipacao_pendente)),
+            format_func=MODOS_RELATORIO_PDF.get,
+            horizontal=True,
+            key="auditoria_pdf_modo",
+        )
+        st.download_button(
+            "📄 Exportar Relatório PDF",
+            data=_gerar_pdf_auditoria(chave, nome_cliente_pdf, valor_risco, modo_pdf),
+            file_name=f"relatorio_auditoria_icms_st_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+            mime="application/pdf",
+            type="primary",
+            key="btn_pdf_auditoria",
+        )
     elif antecipacao_pendente == 0:
         st.caption("Nenhum item com Antecipação Pendente. O PDF será gerado quando houver itens a regularizar.")
 
@@ -2132,24 +2616,34 @@ def _exibir_resultados_auditoria(supabase: Client, nota_ids: list) -> None:
         f"Foram analisados **{total_itens}** itens: **{st_recolhida}** ST recolhida, **{antecipacao_pendente}** antecipação pendente e **{irregulars}** possíveis irregularidades."
     )
 
-    # 3. Filtros
-    filtro_col1, filtro_col2 = st.columns(2)
+    # 3. Filtros e ordenação (lidos do cache colunar)
+    filtro_col1, filtro_col2, filtro_col3, filtro_col4 = st.columns([1, 1, 1, 1])
     with filtro_col1:
         mostrar_apenas_st = st.checkbox("Mostrar apenas itens com ST", value=False)
     with filtro_col2:
         mostrar_apenas_pendente = st.checkbox("🚨 Apenas Antecipação Pendente (foco)", value=False)
+    with filtro_col3:
+        ordenar_por = st.selectbox("Ordenar por", ["—", "Valor Item", "Número NF", "NCM", "Status"], key="auditoria_itens_ordem")
+    with filtro_col4:
+        ordem_decrescente = st.checkbox("Decrescente", value=True, key="auditoria_itens_decrescente")
     if mostrar_apenas_pendente:
-        df_exibir = df[df["Status"] == BADGE_ANTECIPACAO_PENDENTE].copy()
+        filtro = "antecipacao_pendente"
     elif mostrar_apenas_st:
-        df_exibir = df[df["_sujeito_st"]].copy()
+        filtro = "sujeitos_st"
     else:
-        df_exibir = df.copy()
+        filtro = "todos"
 
     # 4. Tabela de Detalhes (AgGrid com destaque para Antecipação Pendente)
     st.subheader("📋 Tabela de Detalhes — Validação de Sujeição")
     colunas_exibir = ["Status", "Diagnóstico Fiscal", "Número NF", "Descrição", "NCM", "CEST", "CFOP", "CST", "Valor Item"]
-    colunas_exibir = [c for c in colunas_exibir if c in df_exibir.columns]
-    df_tabela = df_exibir[colunas_exibir].copy()
+    df_exibir = cache.ler(
+        chave,
+        filtro,
+        colunas_exibir,
+        ordenar_por=None if ordenar_por == "—" else ordenar_por,
+        decrescente=ordem_decrescente,
+    )
+    df_tabela = df_exibir.copy()
     df_tabela["Valor Item"] = df_tabela["Valor Item"].apply(lambda x: f"R$ {x:,.2f}")
 
     if HAS_AGGRID:
@@ -2177,42 +2671,111 @@ def _exibir_resultados_auditoria(supabase: Client, nota_ids: list) -> None:
     else:
         st.dataframe(df_tabela, use_container_width=True, hide_index=True)
 
-    # 4. Exportação (Excel, HTML)
+    # 4. Exportação (Excel, CSV compactado, Parquet, HTML): gerada no clique, em blocos lidos do cache
     st.markdown("---")
     st.subheader("📥 Exportar Relatório")
-    col_ex1, col_ex2, _ = st.columns([1, 1, 2])
-    with col_ex1:
-        buffer_xlsx = BytesIO()
-        df_export = df_exibir[colunas_exibir].copy()
-        try:
-            df_export.to_excel(buffer_xlsx, index=False, engine="openpyxl")
-        except Exception:
-            df_export.to_csv(buffer_xlsx, index=False, sep=";")
-            buffer_xlsx.seek(0)
-            st.download_button(
-                "📥 Gerar Relatório (CSV)",
-                data=buffer_xlsx.getvalue(),
-                file_name=f"auditoria_st_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                mime="text/csv",
-            )
-        else:
-            buffer_xlsx.seek(0)
-            st.download_button(
-                "📥 Gerar Relatório (Excel)",
-                data=buffer_xlsx.getvalue(),
-                file_name=f"auditoria_st_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            )
-    with col_ex2:
-        html_report = df_export.to_html(index=False, classes="table", escape=False)
+    ordem_export = None if ordenar_por == "—" else ordenar_por
+    if excede_limite_excel(len(df_exibir)):
+        st.warning(
+            f"⚠️ {len(df_exibir):,} linhas: o Excel aceita até {LIMITE_LINHAS_EXCEL:,} linhas por planilha "
+            "(com o cabeçalho) e o arquivo .xlsx sairá cortado. Use o CSV compactado ou o Parquet."
+        )
+
+    def _exportar(formato: str):
+        # Executado pelo download_button numa thread própria: sem st.* aqui
+        return lambda: gerar_exportacao(
+            formato,
+            cache.blocos(chave, filtro, colunas_exibir, ordem_export, ordem_decrescente, LINHAS_POR_BLOCO),
+            colunas_exibir,
+        )
+
+    sufixo = datetime.now().strftime("%Y%m%d_%H%M")
+    rotulos = {
+        "xlsx": "📥 Gerar Relatório (Excel)",
+        "csv.gz": "📥 Gerar Relatório (CSV compactado)",
+        "parquet": "📥 Exportar Parquet (BI)",
+    }
+    col_ex1, col_ex2, col_ex3, col_ex4 = st.columns(4)
+    for coluna, (formato, (extensao, mime, _, disponivel)) in zip(
+        (col_ex1, col_ex2, col_ex3), FORMATOS_EXPORTACAO.items()
+    ):
+        with coluna:
+            if disponivel:
+                st.download_button(
+                    rotulos[formato],
+                    data=_exportar(formato),
+                    file_name=f"auditoria_st_{sufixo}.{extensao}",
+                    mime=mime,
+                    key=f"btn_export_{formato}",
+                )
+            else:
+                st.caption(f"{rotulos[formato]}: instale {'openpyxl' if formato == 'xlsx' else 'pyarrow'}.")
+    with col_ex4:
         st.download_button(
             "📥 Gerar Relatório (HTML/PDF)",
-            data=html_report,
-            file_name=f"auditoria_st_{datetime.now().strftime('%Y%m%d_%H%M')}.html",
+            data=lambda: df_exibir.to_html(index=False, classes="table", escape=False),
+            file_name=f"auditoria_st_{sufixo}.html",
             mime="text/html",
         )
 
 
+# --- Busca paginada do Painel de Auditoria ---
+
+# Validade (segundos) das páginas e da lista de clientes em cache
+TTL_BUSCA_AUDITORIA = 300
+
+
+@st.cache_data(ttl=TTL_BUSCA_AUDITORIA, show_spinner=False)
+def _clientes_auditoria(_supabase: Client) -> list[tuple]:
+    """Opções do filtro de cliente: (nome, id, cnpj só dígitos), em ordem de razão social."""
+    clientes = buscar_paginado(
+        lambda: _supabase.table("clientes").select("id, razao_social, nome_fantasia, cnpj").order("razao_social").order("id")
+    )
+    return [
+        (c.get("nome_fantasia") or c.get("razao_social") or str(c["id"]), c["id"], limpar_cnpj(c.get("cnpj")))
+        for c in clientes
+    ]
+
+
+@st.cache_data(ttl=TTL_BUSCA_AUDITORIA, max_entries=200, show_spinner=False)
+def _pagina_notas_auditoria(
+    _supabase: Client,
+    versao_esquema: tuple,
+    filtros: tuple,
+    busca: str,
+    pagina: int,
+    ordem: str,
+    decrescente: bool,
+) -> tuple[list[dict], int, dict]:
+    """
+    (notas da página, total do filtro, cliente_id -> nome dos clientes da página).
+    Em cache por filtros, versão do esquema, página e ordenação; busca (token único
+    gerado a cada clique em Buscar Notas) força releitura a cada nova busca. O cache
+    é do processo, compartilhado entre sessões: um contador por sessão repetiria a
+    chave de outra sessão e devolveria dados lidos antes.
+    """
+    esquema = _obter_esquema_banco(_supabase)
+    notas, total = buscar_pagina_notas(_supabase, esquema, filtros, pagina, ordem, decrescente)
+    ids_clientes = {str(n["cliente_id"]) for n in notas if n.get("cliente_id")}
+    try:
+        nomes = nomes_clientes(_supabase, ids_clientes) if ids_clientes else {}
+    except Exception:
+        nomes = {}
+    return notas, total, nomes
+
+
+@st.cache_data(ttl=TTL_BUSCA_AUDITORIA, max_entries=20, show_spinner=False)
+def _ids_notas_auditoria(_supabase: Client, versao_esquema: tuple, filtros: tuple, busca: str) -> list[str]:
+    """Ids de todas as notas do filtro (usado quando a seleção parte de "todas")."""
+    return buscar_ids_notas(_supabase, _obter_esquema_banco(_supabase), filtros)
+
+
+def _selecao_auditoria() -> SelecaoNotas:
+    if "auditoria_selecao" not in st.session_state:
+        st.session_state["auditoria_selecao"] = SelecaoNotas()
+    return st.session_state["auditoria_selecao"]
+
+
 def pagina_painel_auditoria() -> None:
     """Painel de Auditoria: filtros, tabela de notas e reprocessamento ST."""
     st.header("📋 Painel de Auditoria")
@@ -2222,7 +2785,8 @@ def pagina_painel_auditoria() -> None:
     # 1. Dashboard de KPIs — 4 cards no topo (sempre visíveis)
     nota_ids = st.session_state.get("auditoria_nota_ids", [])
     if nota_ids:
-        kpis = _compute_auditoria_kpis(supabase, nota_ids)
+        # Tabela da seleção já no cache da sessão: KPIs sem ida ao banco
+        kpis = _kpis_em_cache(supabase, nota_ids) or _compute_auditoria_kpis(supabase, nota_ids)
         if kpis:
             st.session_state["auditoria_kpis"] = kpis
     kpis = st.session_state.get("auditoria_kpis", {})
@@ -2240,24 +2804,12 @@ def pagina_painel_auditoria() -> None:
     col_f1, col_f2, col_f3 = st.columns([2, 1, 1])
 
     with col_f1:
-        # Carrega clientes; armazena (id, cnpj_limpo) para filtrar também notas sem vínculo por CNPJ
+        # Clientes em cache; (nome, id, cnpj_limpo) para filtrar também notas sem vínculo por CNPJ
+        opcoes_cliente = [("Todos os clientes", None, None)]
         try:
-            resp_clientes = (
-                supabase.table("clientes")
-                .select("id, razao_social, nome_fantasia, cnpj")
-                .order("razao_social")
-                .execute()
-            )
-            clientes = resp_clientes.data or []
-            opcoes_cliente = [("Todos os clientes", None, None)]
-            for c in clientes:
-                nome = c.get("nome_fantasia") or c.get("razao_social") or str(c["id"])
-                cnpj_limpo = limpar_cnpj(c.get("cnpj"))
-                opcoes_cliente.append((nome, c["id"], cnpj_limpo))
+            opcoes_cliente += _clientes_auditoria(supabase)
         except Exception as exc:
             st.error(f"Erro ao carregar clientes: {exc}")
-            clientes = []
-            opcoes_cliente = [("Todos os clientes", None, None)]
 
         idx_cliente = st.selectbox(
             "Cliente",
@@ -2275,137 +2827,58 @@ def pagina_painel_auditoria() -> None:
         data_final = st.date_input("Data emissão (final)", value=None)
 
     if st.button("🔍 Buscar Notas"):
-        st.session_state["auditoria_buscar"] = True
+        # Filtros congelados até a próxima busca: mexer nos widgets não refaz a consulta
+        st.session_state["auditoria_filtros"] = (cliente_id, cliente_cnpj, data_inicial, data_final)
+        # Token único (não um contador): as chaves do st.cache_data valem para todas as sessões
+        st.session_state["auditoria_busca"] = uuid.uuid4().hex
+        st.session_state["auditoria_selecao"] = SelecaoNotas()
+        st.session_state.pop("auditoria_pagina", None)
         st.session_state.pop("auditoria_nota_ids", None)
         st.session_state.pop("auditoria_kpis", None)
 
-    if not st.session_state.get("auditoria_buscar", False):
+    if "auditoria_filtros" not in st.session_state:
         st.info("Defina os filtros e clique em 'Buscar Notas' para carregar as notas.")
         return
-
-    # 2. Query de notas
+    filtros = st.session_state["auditoria_filtros"]
+    busca = st.session_state.get("auditoria_busca", "")
+    selecao = _selecao_auditoria()
+
+    # 2. Query de notas: uma página por vez, filtrada e ordenada no banco
+    esquema = _obter_esquema_banco(supabase)
+    col_ord1, col_ord2, col_ord3 = st.columns([2, 1, 1])
+    with col_ord1:
+        ordem = st.selectbox("Ordenar por", list(ORDENACOES), key="auditoria_ordem")
+    with col_ord2:
+        decrescente = st.checkbox("Decrescente", value=True, key="auditoria_decrescente")
+    pagina = int(st.session_state.get("auditoria_pagina", 1))
     try:
-        inicio = datetime.combine(data_inicial, datetime.min.time()).isoformat() + "Z" if data_inicial else None
-        fim = datetime.combine(data_final, datetime.max.time()).isoformat() + "Z" if data_final else None
-
-        def _exec_query(com_cnpj: bool, com_data_emissao: bool = True, com_cst: bool = True):
-            base_cols = "id, numero_nfe, cliente_id, cnpj_destinatario, valor_total, icms_total, data_importacao, data_emissao" if com_cnpj else "id, numero_nfe, cliente_id, valor_total, icms_total, data_importacao, data_emissao"
-            if com_cst:
-                base_cols += ", cst_principal"
-            if not com_data_emissao:
-                base_cols = base_cols.replace(", data_emissao", "")
-            q = supabase.table("notas_fiscais").select(base_cols).order("data_emissao" if com_data_emissao else "data_importacao", desc=True)
-            if cliente_id:
-                q = q.eq("cliente_id", str(cliente_id))
-            if inicio:
-                col_data = "data_emissao" if com_data_emissao else "data_importacao"
-                val = str(inicio)[:10] if com_data_emissao else inicio
-                q = q.gte(col_data, val)
-            if fim:
-                col_data = "data_emissao" if com_data_emissao else "data_importacao"
-                val = str(fim)[:10] if com_data_emissao else fim
-                q = q.lte(col_data, val)
-            return q.execute()
-
-        usar_data_emissao = True  # Controle para saber se usamos data_emissao ou data_importacao
-        try:
-            resp = _exec_query(com_cnpj=True, com_data_emissao=True)
-            notas = list(resp.data or [])
-        except Exception as exc:
-            exc_str = str(exc)
-            if "cnpj_destinatario" in exc_str or "data_emissao" in exc_str or "cst_principal" in exc_str or "42703" in exc_str:
-                try:
-                    # Tenta manter data_emissao (só remove cnpj_destinatario)
-                    resp = _exec_query(com_cnpj=False, com_data_emissao=True)
-                    notas = list(resp.data or [])
-                    usar_data_emissao = True
-                except Exception:
-                    try:
-                        # Tenta sem cst_principal (migration 013 não executada)
-                        resp = _exec_query(com_cnpj=False, com_data_emissao=True, com_cst=False)
-                        notas = list(resp.data or [])
-                        usar_data_emissao = True
-                    except Exception:
-                        try:
-                            # Último fallback: usa data_importacao (coluna data_emissao inexistente)
-                            resp = _exec_query(com_cnpj=False, com_data_emissao=False, com_cst=False)
-                            notas = resp.data or []
-                            usar_data_emissao = False
-                        except Exception:
-                            raise exc
-            else:
-                raise
-
-        if usar_data_emissao:
-            # Inclui também notas sem cliente_id mas com cnpj_destinatario igual ao do cliente
-            if cliente_id and cliente_cnpj and len(cliente_cnpj) == 14:
-                extras = []
-                try:
-                    q2 = (
-                        supabase.table("notas_fiscais")
-                        .select("id, numero_nfe, cliente_id, cnpj_destinatario, valor_total, icms_total, data_importacao, data_emissao")
-                        .is_("cliente_id", None)
-                        .eq("cnpj_destinatario", cliente_cnpj)
-                        .order("data_emissao", desc=True)
-                    )
-                    if inicio:
-                        q2 = q2.gte("data_emissao", str(inicio)[:10])
-                    if fim:
-                        q2 = q2.lte("data_emissao", str(fim)[:10])
-                    resp2 = q2.execute()
-                    extras = resp2.data or []
-                except Exception:
-                    try:
-                        q2 = (
-                            supabase.table("notas_fiscais")
-                            .select("id, numero_nfe, cliente_id, cnpj_destinatario, valor_total, icms_total, data_importacao")
-                            .is_("cliente_id", None)
-                            .eq("cnpj_destinatario", cliente_cnpj)
-                            .order("data_importacao", desc=True)
-                        )
-                        if inicio:
-                            q2 = q2.gte("data_importacao", inicio)
-                        if fim:
-                            q2 = q2.lte("data_importacao", fim)
-                        resp2 = q2.execute()
-                        extras = resp2.data or []
-                    except Exception:
-                        pass
-                ids_vistos = {n["id"] for n in notas}
-                for n in extras:
-                    if n["id"] not in ids_vistos:
-                        notas.append(n)
-                        ids_vistos.add(n["id"])
-                notas.sort(key=lambda x: x.get("data_emissao") or x.get("data_importacao") or "", reverse=True)
-
-        if not usar_data_emissao and (data_inicial or data_final):
-            st.warning("⚠️ Filtro usando **data de importação** (coluna data_emissao ainda não disponível). Execute a migration 006 para filtrar por data de emissão da NF-e.")
+        notas, total_notas, mapa_cliente = _pagina_notas_auditoria(
+            supabase, esquema.versao, filtros, busca, pagina, ordem, decrescente
+        )
     except Exception as exc:
         st.error(f"Erro ao buscar notas: {exc}")
-        notas = []
+        return
+    total_paginas = max(1, -(-total_notas // NOTAS_POR_PAGINA))
+    with col_ord3:
+        if total_paginas > 1:
+            # O valor escolhido já está em session_state no rerun seguinte (lido acima)
+            st.number_input(
+                f"Página (de {total_paginas})",
+                min_value=1,
+                max_value=total_paginas,
+                value=min(pagina, total_paginas),
+                step=1,
+                key="auditoria_pagina",
+            )
+
+    if not esquema.tem("notas_fiscais", "data_emissao") and (filtros[2] or filtros[3]):
+        st.warning("⚠️ Filtro usando **data de importação** (coluna data_emissao ainda não disponível). Execute a migration 006 para filtrar por data de emissão da NF-e.")
 
     if not notas:
         st.warning("Nenhuma nota encontrada para os filtros informados.")
         return
 
-    # Mapeia cliente_id -> nome
-    ids_clientes = {str(n["cliente_id"]) for n in notas if n.get("cliente_id")}
-    mapa_cliente: dict[str, str] = {}
-    if ids_clientes:
-        try:
-            resp_c = (
-                supabase.table("clientes")
-                .select("id, razao_social, nome_fantasia")
-                .in_("id", list(ids_clientes))
-                .execute()
-            )
-            for c in resp_c.data or []:
-                nome = c.get("nome_fantasia") or c.get("razao_social") or str(c["id"])
-                mapa_cliente[str(c["id"])] = nome
-        except Exception:
-            pass
-
-    # 3. Tabela de Resultados com coluna Selecionar
+    # 3. Tabela de Resultados com coluna Selecionar (só a página atual)
     st.subheader("Notas Encontradas")
     def _col_cliente(n: dict) -> str:
         nome = mapa_cliente.get(str(n.get("cliente_id", "")), "")
@@ -2416,9 +2889,19 @@ def pagina_painel_auditoria() -> None:
             return f"CNPJ {formatar_cnpj(cnpj)} (sem vínculo)"
         return "—"
 
+    col_sel1, col_sel2, col_sel3 = st.columns([1, 1, 2])
+    with col_sel1:
+        if st.button("☑️ Selecionar todas"):
+            selecao.selecionar_todas()
+            st.session_state["auditoria_selecao_versao"] = st.session_state.get("auditoria_selecao_versao", 0) + 1
+    with col_sel2:
+        if st.button("⬜ Limpar seleção"):
+            selecao.limpar()
+            st.session_state["auditoria_selecao_versao"] = st.session_state.get("auditoria_selecao_versao", 0) + 1
+
     df_notas = pd.DataFrame([
         {
-            "Selecionar": True,
+            "Selecionar": selecao.selecionada(n["id"]),
             "Número NF": n.get("numero_nfe", ""),
             "Cliente": _col_cliente(n),
             "Valor Total": float(n.get("valor_total", 0)),
@@ -2431,6 +2914,10 @@ def pagina_painel_auditoria() -> None:
     ])
 
     colunas_tabela = ["Selecionar", "Número NF", "Cliente", "Valor Total", "ICMS Total", "CST", "Data Emissão"]
+    # Chave por busca/página/ordem/seleção: as edições de uma página não vazam para outra
+    chave_editor = "auditoria_editor_{}_{}_{}_{}_{}".format(
+        busca, pagina, ordem, decrescente, st.session_state.get("auditoria_selecao_versao", 0)
+    )
     df_editado = st.data_editor(
         df_notas[[c for c in colunas_tabela if c in df_notas.columns]],
         use_container_width=True,
@@ -2440,7 +2927,15 @@ def pagina_painel_auditoria() -> None:
             "Valor Total": st.column_config.NumberColumn("Valor Total", format="R$ %.2f"),
             "ICMS Total": st.column_config.NumberColumn("ICMS Total", format="R$ %.2f"),
         },
+        key=chave_editor,
     )
+    for i, marcada in df_editado["Selecionar"].items():
+        selecao.definir(df_notas.loc[i, "_nota_id"], bool(marcada))
+    with col_sel3:
+        st.caption(
+            f"{selecao.quantidade(total_notas)} de {total_notas} nota(s) selecionada(s) · "
+            f"página {pagina} de {total_paginas}"
+        )
 
     # 4. Botões Reprocessar e Visualizar Resultados
     st.markdown("---")
@@ -2452,50 +2947,43 @@ def pagina_painel_auditoria() -> None:
 
     nota_ids_selecionados: list = []
     if reprocessar_clicked or visualizar_clicked:
-        selecionados = df_editado[df_editado["Selecionar"]].index.tolist()
-        if not selecionados:
+        try:
+            nota_ids_selecionados = selecao.ids(
+                lambda: _ids_notas_auditoria(supabase, esquema.versao, filtros, busca)
+            )
+        except Exception as exc:
+            st.error(f"Erro ao buscar notas: {exc}")
+        if not nota_ids_selecionados:
             st.warning("Selecione pelo menos uma nota.")
-        else:
-            nota_ids_selecionados = [df_notas.loc[i, "_nota_id"] for i in selecionados]
 
-    # 5. Reprocessar (se clicou)
+    # 5. Reprocessar (se clicou): itens lidos em blocos, só os alterados são gravados
     if reprocessar_clicked and nota_ids_selecionados:
-        total_itens = 0
-        itens_st_encontrados = 0
         progress_bar = st.progress(0.0)
         status_text = st.empty()
 
-        for idx, nota_id in enumerate(nota_ids_selecionados):
-            status_text.text(f"Reprocessando nota {idx + 1}/{len(nota_ids_selecionados)}...")
-            progress_bar.progress((idx) / len(nota_ids_selecionados))
+        def _progresso(feitas: int, total: int, resumo: dict) -> None:
+            progress_bar.progress(feitas / total)
+            status_text.text(
+                f"Reprocessadas {feitas}/{total} nota(s) · {resumo['itens']} item(ns) · {resumo['alterados']} alterado(s)"
+            )
 
-            try:
-                resp_itens = (
-                    supabase.table("itens_nota")
-                    .select("id, ncm, cest, cfop")
-                    .eq("nota_id", nota_id)
-                    .execute()
-                )
-                itens = resp_itens.data or []
-                for item in itens:
-                    total_itens += 1
-                    ncm = item.get("ncm")
-                    cest = item.get("cest")
-                    cfop = item.get("cfop")
-                    regra = buscar_regra_st(supabase, ncm, cest) if ncm else None
-                    st_por_cfop = cfop_indica_st(cfop)
-                    sujeito = bool(regra) or st_por_cfop
-                    status_st = STATUS_SUJEITO_ST if sujeito else None
-                    mva_rem = regra.get("mva_remanescente") if regra else None
-                    if status_st:
-                        itens_st_encontrados += 1
-
-                    supabase.table("itens_nota").update({
-                        "status_st": status_st,
-                        "mva_remanescente": float(mva_rem) if mva_rem is not None else None,
-                    }).eq("id", item["id"]).execute()
-            except Exception as exc:
-                st.error(f"Erro ao reprocessar nota {nota_id}: {exc}")
+        try:
+            resumo = reprocessar_notas(
+                supabase,
+                nota_ids_selecionados,
+                _obter_base_normativa(supabase),
+                ao_progredir=_progresso,
+                estatisticas=ESTATISTICAS_MATCH,
+                esquema=esquema,
+            )
+            # Status dos itens mudou: tabelas em cache da sessão deixam de valer
+            st.session_state["auditoria_geracao"] = st.session_state.get("auditoria_geracao", 0) + 1
+            st.success(
+                f"Reprocessamento concluído: {resumo['itens']} item(ns), {resumo['itens_st']} sujeito(s) a ST, "
+                f"{resumo['alterados']} atualizado(s) no banco."
+            )
+        except Exception as exc:
+            st.error(f"Erro ao reprocessar notas: {exc}")
 
         progress_bar.progress(1.0)
         status_text.empty()
@@ -2509,65 +2997,72 @@ def pagina_painel_auditoria() -> None:
         _exibir_resultados_auditoria(supabase, nota_ids_para_exibir)
 
 
+def _exibir_reclassificacao_base_normativa() -> None:
+    """Relatório da última reclassificação incremental (itens atingidos pela mudança das regras)."""
+    resultado = st.session_state.get("reclassificacao_base_normativa")
+    if not resultado:
+        return
+    if resultado.get("erro"):
+        st.error(
+            f"Erro ao reclassificar itens após a importação: {resultado['erro']}. "
+            "Reprocesse as notas pelo Painel de Auditoria."
+        )
+    elif not resultado["alterados"]:
+        st.info(
+            f"Regras alteradas: {resultado['ncms']} NCM(s), {resultado['cests']} CEST(s). "
+            f"{resultado['itens']} item(ns) conferido(s); nenhuma classificação mudou."
+        )
+    else:
+        st.success(
+            f"Regras alteradas: {resultado['ncms']} NCM(s), {resultado['cests']} CEST(s). "
+            f"{resultado['alterados']} de {resultado['itens']} item(ns) conferido(s) reclassificado(s)."
+        )
+        st.dataframe(
+            pd.DataFrame(resultado["relatorio"]).rename(columns={
+                "cliente": "Cliente",
+                "notas": "Notas",
+                "itens_alterados": "Itens alterados",
+                "passaram_a_st": "Passaram a ST",
+                "deixaram_st": "Deixaram ST",
+            }).drop(columns=["cliente_id"]),
+            use_container_width=True,
+            hide_index=True,
+        )
+    if st.button("Fechar relatório", key="fechar_reclassificacao"):
+        st.session_state.pop("reclassificacao_base_normativa", None)
+        st.rerun()
+
+
+def _registros_anexo_ix_upload(arquivo) -> tuple[list[dict], list[str]]:
+    """
+    Registros de base_normativa_ncm a partir do CSV do Anexo IX enviado
+    (anexo_ix.carregar_anexo_ix) e avisos da leitura. ErroEsquemaAnexoIX sem coluna ncm.
+    """
+    tabela, avisos = carregar_anexo_ix(arquivo)
+    tabela["descricao"] = tabela["descricao"].fillna("")
+    registros = registros_anexo_ix(tabela, {
+        "segmento": "",
+        "tipo_base": "MVA",
+        "data_inicio_vigencia": datetime.now().strftime("%Y-%m-%d"),
+        "versao": 1,
+    })
+    return registros, avisos
+
+
 def _importar_anexo_ix_upload(supabase: Client, arquivo) -> tuple[int, str]:
     """
-    Processa CSV do Anexo IX (sep=';', encoding latin-1).
+    Processa CSV do Anexo IX (sep=';', UTF-8 ou latin-1) com anexo_ix.
     Colunas: ncm, descricao, cest, mva (opcional).
     NCM e CEST: só dígitos (remove pontos/espaços).
     """
-    import io
     try:
-        arquivo.seek(0)
-        df = pd.read_csv(io.BytesIO(arquivo.read()), sep=";", encoding="latin-1")
+        registros, _ = _registros_anexo_ix_upload(arquivo)
+    except ErroEsquemaAnexoIX as e:
+        return 0, str(e)
     except Exception as e:
         return 0, f"Erro ao ler CSV: {e}"
-    df.columns = df.columns.str.strip().str.lower()
-    if "ncm" not in df.columns:
-        return 0, "Coluna 'ncm' não encontrada no arquivo."
-    # NCM só dígitos (limpeza no ato)
-    df["ncm"] = df["ncm"].astype(str).str.replace(r"\D", "", regex=True)
-    df = df[df["ncm"].str.len() >= 2]
-    df = df[~df["ncm"].isin(["", "nan", "None"])]
-    if df.empty:
-        return 0, "Nenhum NCM válido no arquivo."
-    # CEST: normaliza (só dígitos)
-    if "cest" in df.columns:
-        df["cest"] = df["cest"].astype(str).str.replace(r"\D", "", regex=True)
-    # MVA: decimal (40 -> 0.40)
-    if "mva" in df.columns:
-        df["mva"] = pd.to_numeric(df["mva"], errors="coerce").fillna(0)
-        df["mva_st_interna"] = df["mva"] / 100
-        df["mva_remanescente"] = df["mva_st_interna"] * 0.7
-    # Descrição: planilha usa "descricao do produto", tabela usa "descricao"
-    desc_col = "descricao do produto" if "descricao do produto" in df.columns else "descricao"
-    registros = []
-    for _, row in df.drop_duplicates(subset=["ncm"]).iterrows():
-        ncm = str(row["ncm"]).strip()
-        if not ncm:
-            continue
-        desc = None
-        if desc_col in df.columns and pd.notna(row.get(desc_col)):
-            desc = str(row[desc_col]).strip()[:500]
-        cest = str(row.get("cest", "")).strip() if pd.notna(row.get("cest")) else None
-        if cest and len(cest) < 4:
-            cest = None
-        reg = {
-            "ncm": ncm,
-            "descricao": desc or "",
-            "segmento": "",
-            "tipo_base": "MVA",
-            "data_inicio_vigencia": datetime.now().strftime("%Y-%m-%d"),
-            "versao": 1,
-        }
-        if cest:
-            reg["cest"] = cest
-        if "mva_st_interna" in df.columns:
-            reg["mva_st_interna"] = float(row.get("mva_st_interna", 0) or 0)
-        if "mva_remanescente" in df.columns:
-            reg["mva_remanescente"] = float(row.get("mva_remanescente", 0) or 0)
-        registros.append(reg)
     if not registros:
-        return 0, "Nenhum registro a importar."
+        return 0, "Nenhum NCM válido no arquivo."
 
     def _mensagem_erro(exc: Exception) -> str:
         if hasattr(exc, "args") and exc.args and isinstance(exc.args[0], dict):
@@ -2592,7 +3087,6 @@ def _importar_anexo_ix_upload(supabase: Client, arquivo) -> tuple[int, str]:
 
 def pagina_base_normativa() -> None:
     """Página Base Normativa (Anexo IX): contador, upload, listagem e teste de busca."""
-    global BASE_NORMATIVA_CACHE
     st.header("📚 Base Normativa (Anexo IX)")
     st.caption("NCMs na tabela base_normativa_ncm. Importe a planilha do Anexo IX ou use o script scripts/extrator_anexo_ix.py.")
 
@@ -2612,6 +3106,45 @@ def pagina_base_normativa() -> None:
 
     st.metric("Total de NCMs na Base", len(registros))
 
+    # Estatísticas agregadas do match (desde o início do servidor ou do último "Zerar")
+    with st.expander("📊 Estatísticas do match NCM/CEST", expanded=False):
+        resumo_match = ESTATISTICAS_MATCH.resumo()
+        if resumo_match["total"]:
+            st.caption(
+                f"{resumo_match['total']} busca(s), {resumo_match['acertos']} com regra "
+                f"({resumo_match['taxa_acerto']:.1%}). Log por busca: defina DEBUG_REGRAS_ST=1."
+            )
+            st.dataframe(
+                pd.DataFrame(
+                    sorted(resumo_match["por_criterio"].items(), key=lambda kv: -kv[1]),
+                    columns=["Critério", "Buscas"],
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+        else:
+            st.caption("Nenhuma busca registrada. Log por busca: defina DEBUG_REGRAS_ST=1.")
+        if st.button("Zerar estatísticas", key="zerar_estatisticas_match"):
+            ESTATISTICAS_MATCH.zerar()
+            st.rerun()
+
+    # Regras em memória (compartilhadas entre sessões; remontadas quando a base muda)
+    col_regras, col_atualizar = st.columns([3, 1])
+    with col_atualizar:
+        if st.button("🔄 Atualizar regras", help="Recarrega a base normativa usada na análise de XML em todas as sessões."):
+            _invalidar_base_normativa()
+            try:
+                indice = _obter_base_normativa(supabase)
+                st.success(f"Regras atualizadas: {len(indice)} NCM(s) em memória.")
+            except Exception as exc:
+                st.error(f"Erro ao recarregar base normativa: {exc}")
+    with col_regras:
+        versao = _cache_base_normativa()["versao"]
+        if versao and versao[1]:
+            st.caption(f"Versão das regras em memória: {versao[0]} NCM(s), atualizada em {versao[1]}.")
+        else:
+            st.caption(f"Regras em memória conferidas com o banco a cada {TTL_VERSAO_BASE_NORMATIVA} s.")
+
     # Upload da planilha Anexo IX (CSV)
     st.subheader("Re-importar Anexo IX")
     arquivo = st.file_uploader(
@@ -2620,14 +3153,53 @@ def pagina_base_normativa() -> None:
         key="anexo_ix_csv",
     )
     if arquivo is not None:
-        if st.button("Importar para base_normativa_ncm"):
+        col_simular, col_importar = st.columns(2)
+        if col_simular.button("Simular importação (dry-run)", key="simular_anexo_ix"):
+            try:
+                registros, avisos = _registros_anexo_ix_upload(arquivo)
+                diff = comparar_com_base(registros, linhas_base_normativa(supabase))
+            except ErroEsquemaAnexoIX as exc:
+                st.error(str(exc))
+            except Exception as exc:
+                st.error(f"Erro ao simular a importação: {exc}")
+            else:
+                for aviso in avisos:
+                    st.warning(aviso)
+                st.info(
+                    f"{len(registros)} NCM(s) no arquivo: {diff['novos']} novo(s), {diff['alterados']} alterado(s), "
+                    f"{diff['iguais']} sem alteração. {diff['so_no_banco']} NCM(s) só no banco (mantidos). Nada foi gravado."
+                )
+                if not diff["detalhe"].empty:
+                    st.dataframe(
+                        diff["detalhe"].rename(columns={"ncm": "NCM", "situacao": "Situação", "campos": "Campos alterados"}),
+                        use_container_width=True,
+                        hide_index=True,
+                    )
+        if col_importar.button("Importar para base_normativa_ncm"):
+            # Regras antes da importação, para reclassificar só os itens atingidos
+            try:
+                regras_antigas = _carregar_base_normativa(supabase)
+            except Exception:
+                regras_antigas = None
             n, msg = _importar_anexo_ix_upload(supabase, arquivo)
             if n > 0:
                 st.success(msg)
-                BASE_NORMATIVA_CACHE = None
+                _invalidar_base_normativa()
+                if regras_antigas is not None:
+                    try:
+                        with st.spinner("Reclassificando itens afetados pelas regras alteradas..."):
+                            st.session_state["reclassificacao_base_normativa"] = reclassificar_incremental(
+                                supabase,
+                                regras_antigas,
+                                _carregar_base_normativa(supabase),
+                                esquema=_obter_esquema_banco(supabase),
+                            )
+                    except Exception as exc:
+                        st.session_state["reclassificacao_base_normativa"] = {"erro": str(exc)}
                 st.rerun()
             else:
                 st.error(msg)
+    _exibir_reclassificacao_base_normativa()
 
     # Teste de busca: NCM 8202 (Serrote)
     st.subheader("Teste de busca (Serrote 8202)")
@@ -0,0 +1,142 @@
+"""
+Armazém em disco dos resultados de uma importação (modo streaming).
+
+ListaEmDisco substitui as listas todos_itens/resumo_notas/alertas_notas quando o
+upload é grande demais para a memória: append/len/fatia funcionam como numa lista,
+mas as linhas vão para um SQLite temporário em blocos e a tela lê por páginas.
+"""
+import json
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Iterator
+
+# Linhas acumuladas em memória antes de cada INSERT em bloco
+TAMANHO_BUFFER = 500
+
+
+class ArmazemResultados:
+    """Arquivo SQLite com as listas de uma importação (uma tabela de linhas JSON por lista)."""
+
+    def __init__(self, caminho_db: str | Path):
+        self.caminho_db = Path(caminho_db)
+        self._conn = sqlite3.connect(self.caminho_db, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS linhas (lista TEXT NOT NULL, seq INTEGER NOT NULL, dados TEXT NOT NULL,"
+            " PRIMARY KEY (lista, seq))"
+        )
+        self._conn.commit()
+        self._listas: dict[str, ListaEmDisco] = {}
+
+    @classmethod
+    def novo(cls, diretorio: str | Path | None = None) -> "ArmazemResultados":
+        """Armazém vazio num arquivo novo (em diretorio ou no temporário do sistema)."""
+        if diretorio is not None:
+            Path(diretorio).mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(prefix="resultados_", suffix=".sqlite3", dir=diretorio, delete=False) as tmp:
+            caminho = tmp.name
+        return cls(caminho)
+
+    def lista(self, nome: str) -> "ListaEmDisco":
+        if nome not in self._listas:
+            self._listas[nome] = ListaEmDisco(self, nome)
+        return self._listas[nome]
+
+    def gravar_tudo(self) -> None:
+        for lista in self._listas.values():
+            lista.flush()
+
+    def fechar(self) -> None:
+        self.gravar_tudo()
+        self._conn.close()
+
+    def apagar(self) -> None:
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
+        self.caminho_db.unlink(missing_ok=True)
+
+
+class ListaEmDisco:
+    """Lista de dicts/strings persistida em ArmazemResultados, com buffer de TAMANHO_BUFFER linhas."""
+
+    def __init__(self, armazem: ArmazemResultados, nome: str):
+        self._armazem = armazem
+        self.nome = nome
+        self._buffer: list[Any] = []
+        with armazem._lock:
+            self._gravadas = armazem._conn.execute(
+                "SELECT COUNT(*) FROM linhas WHERE lista = ?", (nome,)
+            ).fetchone()[0]
+
+    def append(self, valor: Any) -> None:
+        self._buffer.append(valor)
+        if len(self._buffer) >= TAMANHO_BUFFER:
+            self.flush()
+
+    def extend(self, valores) -> None:
+        for valor in valores:
+            self.append(valor)
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        inicio = self._gravadas
+        with self._armazem._lock:
+            self._armazem._conn.executemany(
+                "INSERT INTO linhas (lista, seq, dados) VALUES (?, ?, ?)",
+                [(self.nome, inicio + i, json.dumps(v, ensure_ascii=False, default=str)) for i, v in enumerate(self._buffer)],
+            )
+            self._armazem._conn.commit()
+        self._gravadas += len(self._buffer)
+        self._buffer.clear()
+
+    def __len__(self) -> int:
+        return self._gravadas + len(self._buffer)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def _ler(self, inicio: int, fim: int) -> list[Any]:
+        """Linhas [inicio, fim) (fim já limitado a len)."""
+        self.flush()
+        with self._armazem._lock:
+            rows = self._armazem._conn.execute(
+                "SELECT dados FROM linhas WHERE lista = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (self.nome, inicio, fim),
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def __getitem__(self, indice):
+        n = len(self)
+        if isinstance(indice, slice):
+            inicio, fim, passo = indice.indices(n)
+            linhas = self._ler(inicio, fim) if fim > inicio else []
+            return linhas[::passo] if passo != 1 else linhas
+        if indice < 0:
+            indice += n
+        if not 0 <= indice < n:
+            raise IndexError(indice)
+        return self._ler(indice, indice + 1)[0]
+
+    def __iter__(self) -> Iterator[Any]:
+        for inicio in range(0, len(self), TAMANHO_BUFFER):
+            yield from self._ler(inicio, inicio + TAMANHO_BUFFER)
+
+    def pagina(self, numero: int, tamanho: int) -> list[Any]:
+        """Página numero (a partir de 1) com até tamanho linhas."""
+        inicio = max(0, (numero - 1) * tamanho)
+        return self[inicio : inicio + tamanho]
+
+    def somar(self, chave: str) -> float:
+        """Soma numérica de uma chave dos dicts (valores não numéricos contam como 0)."""
+        self.flush()
+        with self._armazem._lock:
+            total = self._armazem._conn.execute(
+                "SELECT TOTAL(CAST(json_extract(dados, '$.' || json_quote(?)) AS REAL)) FROM linhas WHERE lista = ?",
+                (chave, self.nome),
+            ).fetchone()[0]
+        return float(total or 0.0)
@@ -0,0 +1,152 @@
+"""
+Busca de notas do Painel de Auditoria filtrada, ordenada e paginada no banco.
+
+Em vez de ler todas as notas do cliente e montar a tabela inteira a cada rerun,
+cada página vem de uma consulta com range() e count, e a seleção (SelecaoNotas)
+guarda só as exceções: "todas menos estas" ou "só estas". Assim "selecionar
+todas" vale para as notas de todas as páginas sem carregá-las na tela.
+O cache das páginas fica no app.
+"""
+from datetime import date, datetime
+from typing import Callable, Iterable
+
+from consultas_paginadas import buscar_paginado, buscar_por_ids
+from esquema_banco import EsquemaBanco
+
+# Notas por página no editor do painel
+NOTAS_POR_PAGINA = 100
+# Rótulo -> coluna de ordenação ("data" = data_emissao ou, sem a migration 006, data_importacao)
+ORDENACOES = {
+    "Data Emissão": "data",
+    "Número NF": "numero_nfe",
+    "Valor Total": "valor_total",
+    "ICMS Total": "icms_total",
+}
+COLUNAS_NOTA_AUDITORIA = (
+    "id", "numero_nfe", "cliente_id", "cnpj_destinatario", "valor_total", "icms_total",
+    "data_importacao", "data_emissao", "cst_principal",
+)
+
+
+def coluna_data(esquema: EsquemaBanco) -> str:
+    """data_emissao quando a migration 006 foi aplicada; senão data_importacao."""
+    return "data_emissao" if esquema.tem("notas_fiscais", "data_emissao") else "data_importacao"
+
+
+def aplicar_filtros(
+    q,
+    esquema: EsquemaBanco,
+    cliente_id: str | None,
+    cliente_cnpj: str | None,
+    data_inicial: date | None,
+    data_final: date | None,
+):
+    """
+    Filtros do painel na consulta de notas_fiscais: cliente (com as notas sem vínculo
+    cujo cnpj_destinatario é o do cliente, num único or_) e período na coluna de data.
+    """
+    if cliente_id:
+        if cliente_cnpj and len(cliente_cnpj) == 14 and esquema.tem("notas_fiscais", "cnpj_destinatario"):
+            q = q.or_(f"cliente_id.eq.{cliente_id},and(cliente_id.is.null,cnpj_destinatario.eq.{cliente_cnpj})")
+        else:
+            q = q.eq("cliente_id", str(cliente_id))
+    col_data = coluna_data(esquema)
+    if data_inicial:
+        q = q.gte(col_data, _limite_data(data_inicial, col_data, inicio=True))
+    if data_final:
+        q = q.lte(col_data, _limite_data(data_final, col_data, inicio=False))
+    return q
+
+
+def _limite_data(dia: date, col_data: str, inicio: bool) -> str:
+    """data_emissao é DATE (AAAA-MM-DD); data_importacao é timestamp (dia inteiro)."""
+    if col_data == "data_emissao":
+        return dia.isoformat()
+    return datetime.combine(dia, datetime.min.time() if inicio else datetime.max.time()).isoformat() + "Z"
+
+
+def buscar_pagina_notas(
+    supabase,
+    esquema: EsquemaBanco,
+    filtros: tuple,
+    pagina: int,
+    ordem: str = "Data Emissão",
+    decrescente: bool = True,
+    tamanho: int = NOTAS_POR_PAGINA,
+) -> tuple[list[dict], int]:
+    """
+    (notas da página, total de notas do filtro). filtros: (cliente_id, cliente_cnpj,
+    data_inicial, data_final). pagina começa em 1; ordem é um rótulo de ORDENACOES.
+    """
+    coluna = ORDENACOES.get(ordem, "data")
+    if coluna == "data":
+        coluna = coluna_data(esquema)
+    inicio = max(0, (pagina - 1) * tamanho)
+    q = supabase.table("notas_fiscais").select(
+        esquema.colunas("notas_fiscais", COLUNAS_NOTA_AUDITORIA), count="exact"
+    )
+    resp = (
+        aplicar_filtros(q, esquema, *filtros)
+        .order(coluna, desc=decrescente)
+        .order("id")
+        .range(inicio, inicio + tamanho - 1)
+        .execute()
+    )
+    linhas = resp.data or []
+    total = resp.count if resp.count is not None else inicio + len(linhas)
+    return linhas, total
+
+
+def buscar_ids_notas(supabase, esquema: EsquemaBanco, filtros: tuple) -> list[str]:
+    """Ids de todas as notas do filtro (só a coluna id, paginado), para a seleção entre páginas."""
+    linhas = buscar_paginado(
+        lambda: aplicar_filtros(supabase.table("notas_fiscais").select("id"), esquema, *filtros).order("id")
+    )
+    return [str(r["id"]) for r in linhas]
+
+
+def nomes_clientes(supabase, ids: Iterable) -> dict[str, str]:
+    """cliente_id -> nome fantasia (ou razão social) dos ids informados."""
+    return {
+        str(c["id"]): c.get("nome_fantasia") or c.get("razao_social") or str(c["id"])
+        for c in buscar_por_ids(
+            lambda lote: supabase.table("clientes").select("id, razao_social, nome_fantasia").in_("id", lote).order("id"),
+            ids,
+        )
+    }
+
+
+class SelecaoNotas:
+    """
+    Seleção de notas entre páginas: com todas=True, marcadas são as desmarcadas
+    (todas menos estas); com todas=False, marcadas são as escolhidas.
+    """
+
+    def __init__(self, todas: bool = True):
+        self.todas = todas
+        self.marcadas: set[str] = set()
+
+    def selecionada(self, nota_id) -> bool:
+        return (str(nota_id) in self.marcadas) != self.todas
+
+    def definir(self, nota_id, selecionada: bool) -> None:
+        if selecionada != self.todas:
+            self.marcadas.add(str(nota_id))
+        else:
+            self.marcadas.discard(str(nota_id))
+
+    def selecionar_todas(self) -> None:
+        self.todas, self.marcadas = True, set()
+
+    def limpar(self) -> None:
+        self.todas, self.marcadas = False, set()
+
+    def quantidade(self, total: int) -> int:
+        """Notas selecionadas, dado o total do filtro (as marcadas pertencem ao filtro)."""
+        return total - len(self.marcadas) if self.todas else len(self.marcadas)
+
+    def ids(self, todos_ids: Callable[[], list[str]]) -> list[str]:
+        """Ids selecionados; todos_ids() só é chamado quando a seleção parte de "todas"."""
+        if not self.todas:
+            return sorted(self.marcadas)
+        return [i for i in todos_ids() if i not in self.marcadas]
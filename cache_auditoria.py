@@ -0,0 +1,227 @@
+"""
+Cache colunar, por sessão, dos itens auditados no Painel de Auditoria.
+
+A tabela de detalhes (itens classificados de uma seleção de notas) é montada uma
+vez, em conjunto (kpis_auditoria.classificar_itens_auditoria), e guardada em
+Parquet num diretório da sessão; filtros, ordenação e exportação leem dela (com
+filtro e seleção de colunas no próprio pyarrow) em vez de voltar ao Supabase a
+cada rerun. Sem pyarrow, as tabelas ficam em memória como DataFrame.
+"""
+from collections import OrderedDict
+import hashlib
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+from kpis_auditoria import classificar_itens_auditoria
+from regras_st import (
+    BADGE_ANTECIPACAO_PENDENTE,
+    BADGE_OPERACAO_COMUM,
+    BADGE_ST_RECOLHIDA,
+    DIAGNOSTICO_ANTECIPACAO_PENDENTE,
+    DIAGNOSTICO_CFOP_XML,
+    DIAGNOSTICO_ERRO_ST,
+    DIAGNOSTICO_ST_RECOLHIDA,
+    IndiceRegrasST,
+)
+
+# Seleções guardadas por sessão (as mais antigas saem primeiro)
+MAX_SELECOES_CACHE = 4
+# Filtros da tabela de detalhes: nome -> (coluna, valor)
+FILTROS_AUDITORIA = {
+    "todos": None,
+    "sujeitos_st": ("_sujeito_st", True),
+    "antecipacao_pendente": ("Status", BADGE_ANTECIPACAO_PENDENTE),
+}
+DESCRICAO_MAX = 80
+
+
+def montar_tabela_auditoria(
+    itens: list[dict],
+    notas: list[dict],
+    indice: IndiceRegrasST,
+) -> pd.DataFrame:
+    """
+    Tabela de detalhes da auditoria (Status, Diagnóstico Fiscal, Número NF, Código,
+    Descrição, NCM, CEST, CFOP, CST, Valor Item, _sujeito_st, _irregular), com a
+    mesma classificação das KPIs.
+    """
+    uf_por_nota = {str(n["id"]): str(n.get("uf_origem") or "").strip().upper() for n in notas}
+    numero_por_nota = {str(n["id"]): n.get("numero_nfe", "") for n in notas}
+    df = classificar_itens_auditoria(itens, uf_por_nota, indice)
+    for coluna in ("codigo_produto", "descricao", "cst"):
+        if coluna not in df.columns:
+            df[coluna] = None
+
+    status = np.select(
+        [df["irregular"], df["st_recolhida"], df["antecipacao"], df["st_via_cfop"]],
+        ["❌ IRREGULAR", BADGE_ST_RECOLHIDA, BADGE_ANTECIPACAO_PENDENTE, "⚠️ SUJEITO A ST (via CFOP)"],
+        default=BADGE_OPERACAO_COMUM,
+    )
+    diagnostico = np.select(
+        [df["irregular"], df["st_recolhida"], df["antecipacao"], df["st_via_cfop"]],
+        [DIAGNOSTICO_ERRO_ST, DIAGNOSTICO_ST_RECOLHIDA, DIAGNOSTICO_ANTECIPACAO_PENDENTE, DIAGNOSTICO_CFOP_XML],
+        default="NCM não sujeito a ST na base normativa do PR.",
+    )
+    descricao = _ou_traco(df["descricao"])
+    longa = descricao.str.len() > DESCRICAO_MAX
+    descricao = descricao.where(~longa, descricao.str[:DESCRICAO_MAX] + "…")
+    return pd.DataFrame({
+        "Status": status,
+        "Diagnóstico Fiscal": diagnostico,
+        "Número NF": df["nota_id"].astype(str).map(numero_por_nota).fillna("—").astype(str),
+        "Código": _ou_traco(df["codigo_produto"]),
+        "Descrição": descricao,
+        "NCM": _ou_traco(df["ncm"]),
+        "CEST": _ou_traco(df["cest"]),
+        "CFOP": _ou_traco(df["cfop"]),
+        "CST": _ou_traco(df["cst"]),
+        "Valor Item": df["valor_total"].astype(float),
+        "_sujeito_st": df["sujeito_st"].astype(bool),
+        "_irregular": df["irregular"].astype(bool),
+    })
+
+
+def _ou_traco(serie: pd.Series) -> pd.Series:
+    """Texto da coluna, com "—" no lugar de vazios (como o `x or "—"` da tela)."""
+    return serie.where(serie.notna() & serie.astype(bool), "—").astype(str)
+
+
+def resumo_tabela(df: pd.DataFrame) -> dict:
+    """KPIs da tabela de detalhes (mesmas chaves de calcular_kpis_auditoria) + itens sujeitos a ST."""
+    pendente = df["Status"] == BADGE_ANTECIPACAO_PENDENTE
+    return {
+        "total_itens": len(df),
+        "st_recolhida": int((df["Status"] == BADGE_ST_RECOLHIDA).sum()),
+        "antecipacao_pendente": int(pendente.sum()),
+        "irregulars": int(df["_irregular"].sum()),
+        "valor_risco": float(df.loc[pendente, "Valor Item"].sum()),
+        "itens_st": int(df["_sujeito_st"].sum()),
+    }
+
+
+class CacheAuditoria:
+    """
+    Tabelas de detalhes por chave de seleção (chave()), em Parquet num diretório
+    próprio ou, sem pyarrow, em memória. Guarda também o resumo e metadados de cada
+    tabela para os cards não precisarem relê-la.
+    """
+
+    def __init__(self, diretorio: str | Path | None = None, max_selecoes: int = MAX_SELECOES_CACHE):
+        self.diretorio = Path(diretorio) if diretorio else Path(tempfile.mkdtemp(prefix="auditoria_"))
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.max_selecoes = max_selecoes
+        # chave -> {"resumo", "meta", "df" (só sem pyarrow)}
+        self._entradas: OrderedDict[str, dict] = OrderedDict()
+
+    @staticmethod
+    def chave(nota_ids: Iterable, *versoes) -> str:
+        """Chave da seleção: ids distintos ordenados + versões (base normativa, reprocessamentos)."""
+        texto = "|".join(sorted({str(i) for i in nota_ids})) + "#" + "|".join(str(v) for v in versoes)
+        return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+    def _caminho(self, chave: str) -> Path:
+        return self.diretorio / f"{chave}.parquet"
+
+    def contem(self, chave: str) -> bool:
+        return chave in self._entradas
+
+    def guardar(self, chave: str, df: pd.DataFrame, meta: dict | None = None) -> dict:
+        """Guarda a tabela (substituindo a anterior da mesma chave) e devolve o resumo."""
+        entrada = {"resumo": resumo_tabela(df), "meta": dict(meta or {})}
+        if HAS_PYARROW:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), self._caminho(chave))
+        else:
+            entrada["df"] = df.reset_index(drop=True)
+        self._entradas[chave] = entrada
+        self._entradas.move_to_end(chave)
+        while len(self._entradas) > self.max_selecoes:
+            antiga, _ = self._entradas.popitem(last=False)
+            self._caminho(antiga).unlink(missing_ok=True)
+        return entrada["resumo"]
+
+    def resumo(self, chave: str) -> dict | None:
+        entrada = self._entradas.get(chave)
+        return entrada["resumo"] if entrada else None
+
+    def meta(self, chave: str) -> dict:
+        entrada = self._entradas.get(chave)
+        return entrada["meta"] if entrada else {}
+
+    def ler(
+        self,
+        chave: str,
+        filtro: str = "todos",
+        colunas: list[str] | None = None,
+        ordenar_por: str | None = None,
+        decrescente: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Linhas da tabela guardada, com um dos FILTROS_AUDITORIA, só as colunas pedidas
+        e ordenadas por ordenar_por (estável). KeyError se a chave não estiver no cache.
+        """
+        entrada = self._entradas[chave]
+        self._entradas.move_to_end(chave)
+        condicao = FILTROS_AUDITORIA[filtro]
+        if not HAS_PYARROW:
+            df = entrada["df"]
+            if condicao:
+                df = df[df[condicao[0]] == condicao[1]]
+            if ordenar_por:
+                df = df.sort_values(ordenar_por, ascending=not decrescente, kind="stable")
+            return (df[colunas] if colunas else df).reset_index(drop=True)
+
+        tabela = pq.read_table(self._caminho(chave))
+        if condicao:
+            tabela = tabela.filter(pc.equal(tabela[condicao[0]], condicao[1]))
+        if ordenar_por:
+            tabela = tabela.take(pc.sort_indices(
+                tabela, sort_keys=[(ordenar_por, "descending" if decrescente else "ascending")]
+            ))
+        if colunas:
+            tabela = tabela.select(colunas)
+        return tabela.to_pandas()
+
+    def blocos(
+        self,
+        chave: str,
+        filtro: str = "todos",
+        colunas: list[str] | None = None,
+        ordenar_por: str | None = None,
+        decrescente: bool = False,
+        linhas_por_bloco: int = 10_000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Mesmas linhas de ler(), em DataFrames de até linhas_por_bloco linhas (para
+        exportação). Sem ordenação, o Parquet é lido por lotes, sem carregar a tabela.
+        """
+        if ordenar_por or not HAS_PYARROW:
+            df = self.ler(chave, filtro, colunas, ordenar_por, decrescente)
+            for inicio in range(0, len(df), linhas_por_bloco):
+                yield df.iloc[inicio : inicio + linhas_por_bloco]
+            return
+        self._entradas.move_to_end(chave)
+        condicao = FILTROS_AUDITORIA[filtro]
+        lidas = list(dict.fromkeys((colunas or []) + ([condicao[0]] if condicao else []))) or None
+        for lote in pq.ParquetFile(self._caminho(chave)).iter_batches(batch_size=linhas_por_bloco, columns=lidas):
+            if condicao:
+                lote = lote.filter(pc.equal(lote.column(condicao[0]), condicao[1]))
+            df = lote.to_pandas()
+            yield df[colunas] if colunas else df
+
+    def limpar(self) -> None:
+        """Apaga as tabelas e o diretório da sessão."""
+        self._entradas.clear()
+        shutil.rmtree(self.diretorio, ignore_errors=True)
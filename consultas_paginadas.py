@@ -0,0 +1,93 @@
+"""
+Leitura paginada do Supabase/PostgREST para seleções grandes e consultas concorrentes.
+
+Listas de ids vão em lotes no filtro in_ (a URL do PostgREST tem limite de
+tamanho) e cada consulta é lida com range() até esgotar, em vez de confiar numa
+única resposta (o PostgREST corta em max-rows sem avisar). Os lotes podem ser
+lidos em threads, e em_paralelo dispara consultas independentes de uma vez
+(cada ida ao Supabase custa 100–300 ms). Sem Streamlit: quem chama monta a
+consulta, e as funções passadas às threads não podem chamar st.*.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+# Ids por filtro in_ (UUIDs de 36 caracteres: ~6 KB de URL por lote)
+TAMANHO_LOTE_IDS = 150
+# Linhas por range(); não deve passar do max-rows do PostgREST (1000 no Supabase)
+TAMANHO_PAGINA = 1000
+# Threads para ler lotes ou consultas independentes em paralelo
+MAX_THREADS_CONSULTA = 4
+
+
+def lotes(valores: Iterable, tamanho: int = TAMANHO_LOTE_IDS) -> list[list]:
+    """Valores distintos (na ordem em que aparecem) em listas de até tamanho itens."""
+    distintos = list(dict.fromkeys(valores))
+    return [distintos[i : i + tamanho] for i in range(0, len(distintos), tamanho)]
+
+
+def buscar_paginado(montar: Callable[[], Any], tamanho_pagina: int = TAMANHO_PAGINA) -> list[dict]:
+    """
+    Todas as linhas da consulta montar() (query builder sem execute), lidas com
+    range() em páginas de tamanho_pagina. A consulta deve ter order() determinístico.
+    Só a página vazia encerra a leitura: uma página curta pode ser o max-rows do
+    servidor menor que tamanho_pagina, e a próxima começa depois do que veio.
+    """
+    linhas: list[dict] = []
+    inicio = 0
+    while True:
+        pagina = montar().range(inicio, inicio + tamanho_pagina - 1).execute().data or []
+        if not pagina:
+            return linhas
+        linhas.extend(pagina)
+        inicio += len(pagina)
+
+
+def buscar_por_ids(
+    montar: Callable[[list], Any],
+    ids: Iterable,
+    tamanho_lote: int = TAMANHO_LOTE_IDS,
+    tamanho_pagina: int = TAMANHO_PAGINA,
+    paralelo: bool = False,
+    max_threads: int = MAX_THREADS_CONSULTA,
+) -> list[dict]:
+    """
+    Linhas de montar(lote) para cada lote de ids, paginadas com buscar_paginado e
+    concatenadas na ordem dos lotes. montar recebe a lista do lote e devolve a
+    consulta com o filtro in_ (e order) aplicado. paralelo: lotes lidos em threads.
+    """
+    grupos = lotes(ids, tamanho_lote)
+    if not grupos:
+        return []
+
+    def ler(lote: list) -> list[dict]:
+        return buscar_paginado(lambda: montar(lote), tamanho_pagina)
+
+    if paralelo and len(grupos) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_threads, len(grupos))) as executor:
+            resultados = list(executor.map(ler, grupos))
+    else:
+        resultados = [ler(lote) for lote in grupos]
+    return [linha for resultado in resultados for linha in resultado]
+
+
+def em_paralelo(
+    tarefas: dict[Any, Callable[[], Any]],
+    max_threads: int = MAX_THREADS_CONSULTA,
+    capturar_erros: bool = False,
+) -> dict[Any, Any]:
+    """
+    Executa consultas independentes em threads e devolve {nome: resultado}.
+    capturar_erros=False: depois que todas terminam, relança a exceção da primeira
+    tarefa (na ordem do dict) que falhou. True: a exceção vira o resultado da tarefa.
+    """
+    if not tarefas:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_threads, len(tarefas))) as executor:
+        futuros = {nome: executor.submit(tarefa) for nome, tarefa in tarefas.items()}
+    resultados: dict[Any, Any] = {}
+    for nome, futuro in futuros.items():
+        erro = futuro.exception()
+        if erro is not None and not capturar_erros:
+            raise erro
+        resultados[nome] = erro if erro is not None else futuro.result()
+    return resultados
@@ -0,0 +1,122 @@
+"""
+Colunas opcionais do banco (migrations 004–016) detectadas antes das gravações e buscas.
+
+Em vez de mandar a consulta, esperar o erro PGRST204/42703 e repetir com menos
+colunas (2 a 3 idas ao banco por nota em esquemas antigos), detectar_esquema
+confere uma vez quais colunas existem e EsquemaBanco monta as listas de colunas
+e as linhas já no formato do esquema. O cache fica com quem chama.
+"""
+from typing import Iterable
+
+from consultas_paginadas import em_paralelo
+
+# Colunas que dependem de migrations, por tabela (migration entre parênteses)
+COLUNAS_OPCIONAIS: dict[str, tuple[str, ...]] = {
+    "notas_fiscais": (
+        "cnpj_destinatario",  # 004
+        "data_emissao",  # 006
+        "icms_bc_total", "icms_st_total", "pis_total", "cofins_total", "ipi_total",  # 007
+        "ibs_total", "cbs_total",  # 008
+        "uf_origem",  # 012
+        "cst_principal",  # 013
+    ),
+    "itens_nota": (
+        "icms_bc", "icms_aliq", "icms_valor",  # 007
+        "icms_st_bc", "icms_st_aliq", "icms_st_valor",
+        "pis_bc", "pis_aliq", "pis_valor",
+        "cofins_bc", "cofins_aliq", "cofins_valor",
+        "ipi_bc", "ipi_aliq", "ipi_valor",
+        "ibs_valor", "cbs_valor",
+        "cst",  # 013
+        "categoria_st", "diagnostico_st", "regra_st", "versao_regras_st",  # 016
+        "cfop_st", "cfop_interestadual", "cfop_venda_interna",
+    ),
+}
+
+
+def erro_coluna_inexistente(exc: Exception) -> bool:
+    """True se o erro do PostgREST indica coluna ausente (migration não executada)."""
+    err_str = str(exc)
+    return (
+        "42703" in err_str
+        or "does not exist" in err_str.lower()
+        or "PGRST204" in err_str
+        or "Could not find" in err_str
+        or "schema cache" in err_str.lower()
+    )
+
+
+# Função ausente no PostgREST (schema cache) ou no Postgres
+CODIGOS_FUNCAO_INEXISTENTE = ("PGRST202", "42883")
+
+
+def erro_funcao_inexistente(exc: Exception) -> bool:
+    """True se o erro da RPC é "função não encontrada" (migration não executada)."""
+    codigo = getattr(exc, "code", None)
+    if codigo is None and exc.args and isinstance(exc.args[0], dict):
+        codigo = exc.args[0].get("code")
+    return str(codigo) in CODIGOS_FUNCAO_INEXISTENTE
+
+
+class EsquemaBanco:
+    """Colunas opcionais presentes em cada tabela; colunas fora de COLUNAS_OPCIONAIS contam como existentes."""
+
+    def __init__(self, presentes: dict[str, set[str]]):
+        self.presentes = {tabela: set(colunas) for tabela, colunas in presentes.items()}
+
+    @classmethod
+    def completo(cls) -> "EsquemaBanco":
+        """Esquema com todas as migrations aplicadas."""
+        return cls({tabela: set(colunas) for tabela, colunas in COLUNAS_OPCIONAIS.items()})
+
+    @property
+    def versao(self) -> tuple:
+        """Identifica o esquema (chave de cache): colunas opcionais presentes, ordenadas."""
+        return tuple(sorted((tabela, tuple(sorted(colunas))) for tabela, colunas in self.presentes.items()))
+
+    def tem(self, tabela: str, coluna: str) -> bool:
+        if coluna not in COLUNAS_OPCIONAIS.get(tabela, ()):
+            return True
+        return coluna in self.presentes.get(tabela, set())
+
+    def ausentes(self, tabela: str) -> list[str]:
+        """Colunas opcionais de tabela que não existem no banco."""
+        return [c for c in COLUNAS_OPCIONAIS.get(tabela, ()) if not self.tem(tabela, c)]
+
+    def colunas(self, tabela: str, colunas: Iterable[str]) -> str:
+        """Lista para select(): colunas pedidas que existem, na ordem dada."""
+        return ", ".join(c for c in colunas if self.tem(tabela, c))
+
+    def filtrar(self, tabela: str, linhas: list[dict]) -> list[dict]:
+        """Cópias das linhas sem as colunas opcionais ausentes (prontas para insert/upsert)."""
+        remover = set(self.ausentes(tabela))
+        if not remover:
+            return linhas
+        return [{k: v for k, v in linha.items() if k not in remover} for linha in linhas]
+
+
+def detectar_esquema(supabase, opcionais: dict[str, tuple[str, ...]] = COLUNAS_OPCIONAIS) -> EsquemaBanco:
+    """
+    Confere as colunas opcionais com select(...).limit(0): uma consulta por tabela
+    quando tudo existe; senão uma por coluna, em paralelo. Erros que não são de
+    coluna ausente (rede, permissão) são relançados.
+    """
+    def presentes(tabela: str, colunas: tuple[str, ...]) -> set[str]:
+        try:
+            supabase.table(tabela).select(",".join(colunas)).limit(0).execute()
+            return set(colunas)
+        except Exception as exc:
+            if not erro_coluna_inexistente(exc):
+                raise
+        testes = em_paralelo(
+            {c: (lambda c=c: supabase.table(tabela).select(c).limit(0).execute()) for c in colunas},
+            capturar_erros=True,
+        )
+        for resultado in testes.values():
+            if isinstance(resultado, Exception) and not erro_coluna_inexistente(resultado):
+                raise resultado
+        return {c for c, resultado in testes.items() if not isinstance(resultado, Exception)}
+
+    return EsquemaBanco(em_paralelo(
+        {tabela: (lambda t=tabela, cs=colunas: presentes(t, cs)) for tabela, colunas in opcionais.items()}
+    ))
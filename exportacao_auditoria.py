@@ -0,0 +1,114 @@
+"""
+Exportação em fluxo dos resultados da auditoria (Excel, CSV compactado, Parquet).
+
+As linhas chegam em blocos (DataFrames de até LINHAS_POR_BLOCO linhas, lidos do
+cache_auditoria) e vão direto para um arquivo temporário: o xlsx usa o modo
+write_only do openpyxl (memória constante), o CSV sai em gzip e o Parquet é
+escrito por row group. Nada monta o relatório inteiro em memória.
+"""
+import gzip
+import io
+import tempfile
+from typing import BinaryIO, Callable, Iterable
+
+import pandas as pd
+
+try:
+    from openpyxl import Workbook
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Linhas por planilha no Excel (inclui a linha de cabeçalho)
+LIMITE_LINHAS_EXCEL = 1_048_576
+# Linhas por bloco lido do cache e escrito no arquivo
+LINHAS_POR_BLOCO = 10_000
+
+
+def excede_limite_excel(total_linhas: int) -> bool:
+    """True se total_linhas de dados (mais o cabeçalho) não cabem numa planilha."""
+    return total_linhas + 1 > LIMITE_LINHAS_EXCEL
+
+
+def exportar_xlsx(blocos: Iterable[pd.DataFrame], destino: BinaryIO, colunas: list[str]) -> int:
+    """
+    Escreve os blocos numa planilha xlsx (openpyxl write_only). Linhas além do
+    limite do Excel são descartadas. Retorna o número de linhas de dados escritas.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Auditoria")
+    ws.append(colunas)
+    escritas = 0
+    maximo = LIMITE_LINHAS_EXCEL - 1
+    for bloco in blocos:
+        for linha in bloco[colunas].itertuples(index=False, name=None):
+            if escritas >= maximo:
+                break
+            ws.append([None if pd.isna(v) else v for v in linha])
+            escritas += 1
+    wb.save(destino)
+    return escritas
+
+
+def exportar_csv_gzip(blocos: Iterable[pd.DataFrame], destino: BinaryIO, colunas: list[str], sep: str = ";") -> int:
+    """CSV (separador ;, UTF-8) compactado em gzip, bloco a bloco. Retorna as linhas escritas."""
+    escritas = 0
+    with gzip.GzipFile(fileobj=destino, mode="wb") as compactado:
+        texto = io.TextIOWrapper(compactado, encoding="utf-8", newline="")
+        pd.DataFrame(columns=colunas).to_csv(texto, index=False, sep=sep)
+        for bloco in blocos:
+            bloco[colunas].to_csv(texto, index=False, header=False, sep=sep)
+            escritas += len(bloco)
+        texto.flush()
+        texto.detach()
+    return escritas
+
+
+def exportar_parquet(blocos: Iterable[pd.DataFrame], destino: BinaryIO, colunas: list[str]) -> int:
+    """Parquet com um row group por bloco (esquema do primeiro bloco). Retorna as linhas escritas."""
+    escritas = 0
+    escritor = None
+    try:
+        for bloco in blocos:
+            tabela = pa.Table.from_pandas(bloco[colunas], preserve_index=False)
+            if escritor is None:
+                escritor = pq.ParquetWriter(destino, tabela.schema)
+            escritor.write_table(tabela.cast(escritor.schema))
+            escritas += len(bloco)
+        if escritor is None:
+            escritor = pq.ParquetWriter(
+                destino, pa.Table.from_pandas(pd.DataFrame(columns=colunas), preserve_index=False).schema
+            )
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return escritas
+
+
+# Formato -> (extensão, MIME, função de escrita, disponível)
+FORMATOS_EXPORTACAO: dict[str, tuple[str, str, Callable, bool]] = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", exportar_xlsx, HAS_OPENPYXL),
+    "csv.gz": ("csv.gz", "application/gzip", exportar_csv_gzip, True),
+    "parquet": ("parquet", "application/vnd.apache.parquet", exportar_parquet, HAS_PYARROW),
+}
+
+
+def gerar_exportacao(formato: str, blocos: Iterable[pd.DataFrame], colunas: list[str]) -> BinaryIO:
+    """
+    Arquivo temporário (já no início, apagado ao fechar) com os blocos no formato
+    pedido (chave de FORMATOS_EXPORTACAO).
+    """
+    _, _, escrever, disponivel = FORMATOS_EXPORTACAO[formato]
+    if not disponivel:
+        raise RuntimeError(f"Exportação {formato} indisponível (dependência não instalada).")
+    arquivo = tempfile.TemporaryFile()
+    escrever(blocos, arquivo, colunas)
+    arquivo.seek(0)
+    return arquivo
@@ -0,0 +1,289 @@
+"""
+Fila de importações de ZIP em segundo plano, com progresso retomável.
+
+Cada job e o resultado de cada XML ficam numa base SQLite local: a interface
+só envia o ZIP e consulta o progresso, e a importação não recomeça quando a
+página é recarregada. Ao retomar um job, os XMLs já registrados não são lidos
+de novo (só as notas com "Falha ao gravar" voltam para a fila).
+A gravação das notas é injetada pelo app (gravar_lote).
+"""
+from datetime import datetime
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+from typing import Callable
+import uuid
+import zipfile
+
+from impressoes_nfe import STATUS_CONFIRMADOS, IndiceImpressoes, arquivo_conhecido
+from ingestao_nfe import LIMIAR_PARALELO, analisar_zip_em_paralelo, analisar_zip_sequencial
+
+# Diretório dos ZIPs enviados e da base SQLite da fila
+DIR_IMPORTACOES = Path(os.getenv("IMPORTACOES_DIR") or Path(tempfile.gettempdir()) / "auditoria_nfe_importacoes")
+
+# Status do job
+JOB_NA_FILA = "na_fila"
+JOB_EXECUTANDO = "executando"
+JOB_CONCLUIDO = "concluido"
+JOB_INTERROMPIDO = "interrompido"
+JOB_ERRO = "erro"
+
+# Status por XML (mesmo vocabulário do resumo da importação, mais erro de leitura/processamento)
+ARQUIVO_GRAVADA = "Gravada"
+ARQUIVO_JA_EXISTENTE = "Ja existente"
+ARQUIVO_FALHA = "Falha ao gravar"
+ARQUIVO_SEM_NUMERO = "Sem numero"
+ARQUIVO_ERRO = "Erro"
+
+# Notas analisadas por chamada de gravar_lote
+LOTE_JOB = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs_importacao (
+    id TEXT PRIMARY KEY,
+    nome_arquivo TEXT NOT NULL,
+    caminho_zip TEXT NOT NULL,
+    cliente_id TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    mensagem TEXT,
+    criado_em TEXT NOT NULL,
+    atualizado_em TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS arquivos_importacao (
+    job_id TEXT NOT NULL,
+    membro TEXT NOT NULL,
+    status TEXT NOT NULL,
+    numero_nfe TEXT,
+    mensagem TEXT,
+    PRIMARY KEY (job_id, membro)
+);
+"""
+
+
+def listar_xmls_zip(caminho_zip: str) -> list[str]:
+    """Membros .xml do ZIP, na ordem do arquivo."""
+    with zipfile.ZipFile(caminho_zip, "r") as zip_ref:
+        return [f for f in zip_ref.namelist() if f.lower().endswith(".xml")]
+
+
+class FilaImportacao:
+    """Tabela de jobs e de resultados por XML (SQLite; uma conexão por operação)."""
+
+    def __init__(self, caminho_db: str | Path | None = None):
+        self.caminho_db = Path(caminho_db or DIR_IMPORTACOES / "fila.sqlite3")
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        with self._conectar() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conectar(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.caminho_db, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def criar_job(self, nome_arquivo: str, caminho_zip: str, total: int, cliente_id: str | None = None) -> str:
+        job_id = uuid.uuid4().hex
+        agora = datetime.now().isoformat()
+        with self._conectar() as conn:
+            conn.execute(
+                "INSERT INTO jobs_importacao (id, nome_arquivo, caminho_zip, cliente_id, total, status, criado_em, atualizado_em)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, nome_arquivo, caminho_zip, cliente_id, total, JOB_NA_FILA, agora, agora),
+            )
+        return job_id
+
+    def atualizar_status(self, job_id: str, status: str, mensagem: str | None = None) -> None:
+        with self._conectar() as conn:
+            conn.execute(
+                "UPDATE jobs_importacao SET status = ?, mensagem = ?, atualizado_em = ? WHERE id = ?",
+                (status, mensagem, datetime.now().isoformat(), job_id),
+            )
+
+    def registrar(self, job_id: str, resultados: list[dict]) -> None:
+        """Grava o resultado de vários XMLs numa transação ({"membro", "status", "numero_nfe", "mensagem"})."""
+        if not resultados:
+            return
+        with self._conectar() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO arquivos_importacao (job_id, membro, status, numero_nfe, mensagem)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(job_id, r["membro"], r["status"], r.get("numero_nfe"), r.get("mensagem")) for r in resultados],
+            )
+            conn.execute(
+                "UPDATE jobs_importacao SET atualizado_em = ? WHERE id = ?",
+                (datetime.now().isoformat(), job_id),
+            )
+
+    def descartar_falhas(self, job_id: str) -> None:
+        """Remove os XMLs com falha de gravação para que sejam refeitos ao retomar."""
+        with self._conectar() as conn:
+            conn.execute(
+                "DELETE FROM arquivos_importacao WHERE job_id = ? AND status = ?",
+                (job_id, ARQUIVO_FALHA),
+            )
+
+    def membros_pendentes(self, job_id: str, membros: list[str]) -> list[str]:
+        with self._conectar() as conn:
+            feitos = {
+                r["membro"]
+                for r in conn.execute("SELECT membro FROM arquivos_importacao WHERE job_id = ?", (job_id,))
+            }
+        return [m for m in membros if m not in feitos]
+
+    def obter_job(self, job_id: str) -> dict | None:
+        """Job com contagens por status dos XMLs (processadas, gravadas, duplicadas, erros...)."""
+        with self._conectar() as conn:
+            job = conn.execute("SELECT * FROM jobs_importacao WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            contagem = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM arquivos_importacao WHERE job_id = ? GROUP BY status",
+                (job_id,),
+            ).fetchall())
+        return _com_progresso(dict(job), contagem)
+
+    def listar_jobs(self, limite: int = 20) -> list[dict]:
+        with self._conectar() as conn:
+            ids = [r["id"] for r in conn.execute(
+                "SELECT id FROM jobs_importacao ORDER BY criado_em DESC LIMIT ?", (limite,)
+            )]
+        return [j for j in (self.obter_job(i) for i in ids) if j is not None]
+
+    def resultados(self, job_id: str) -> list[dict]:
+        with self._conectar() as conn:
+            return [dict(r) for r in conn.execute(
+                "SELECT membro, status, numero_nfe, mensagem FROM arquivos_importacao WHERE job_id = ? ORDER BY rowid",
+                (job_id,),
+            )]
+
+
+def _com_progresso(job: dict, contagem: dict[str, int]) -> dict:
+    job["processadas"] = sum(contagem.values())
+    job["gravadas"] = contagem.get(ARQUIVO_GRAVADA, 0)
+    job["duplicadas"] = contagem.get(ARQUIVO_JA_EXISTENTE, 0)
+    job["sem_numero"] = contagem.get(ARQUIVO_SEM_NUMERO, 0)
+    job["erros"] = contagem.get(ARQUIVO_ERRO, 0) + contagem.get(ARQUIVO_FALHA, 0)
+    job["fracao"] = job["processadas"] / job["total"] if job["total"] else 1.0
+    return job
+
+
+def executar_job(
+    fila: FilaImportacao,
+    job_id: str,
+    base_normativa: list[dict],
+    gravar_lote: Callable[[list[dict]], list[dict]],
+    tamanho_lote: int = LOTE_JOB,
+    impressoes: IndiceImpressoes | None = None,
+) -> None:
+    """
+    Executa (ou retoma) um job: analisa os XMLs ainda não registrados e grava em lotes.
+    gravar_lote(analises) recebe análises de analisar_nfe e devolve, na mesma ordem,
+    {"status", "numero_nfe", "mensagem"} para cada uma.
+    Com impressoes, XMLs já importados são registrados como "Ja existente" sem parsing.
+    """
+    job = fila.obter_job(job_id)
+    if job is None:
+        return
+    fila.atualizar_status(job_id, JOB_EXECUTANDO)
+    try:
+        fila.descartar_falhas(job_id)
+        pendentes = fila.membros_pendentes(job_id, listar_xmls_zip(job["caminho_zip"]))
+        if len(pendentes) >= LIMIAR_PARALELO:
+            resultados = analisar_zip_em_paralelo(job["caminho_zip"], pendentes, base_normativa, impressoes=impressoes)
+        else:
+            resultados = analisar_zip_sequencial(job["caminho_zip"], pendentes, base_normativa, impressoes=impressoes)
+
+        lote: list[dict] = []
+        # Registros sem gravação (erros e já importados), salvos junto com o lote seguinte
+        erros: list[dict] = []
+        vistos: dict[str, str] = {}
+        for resultado in resultados:
+            conhecido = arquivo_conhecido(resultado, vistos) if impressoes is not None else None
+            if conhecido is not None:
+                erros.append({**conhecido, "status": ARQUIVO_JA_EXISTENTE})
+            elif "erro" in resultado:
+                erros.append({
+                    "membro": resultado["membro"],
+                    "status": ARQUIVO_ERRO,
+                    "mensagem": f"Erro de {resultado['etapa']}: {resultado['erro']}",
+                })
+            else:
+                lote.append(resultado)
+            if len(lote) + len(erros) >= tamanho_lote:
+                _gravar_lote_job(fila, job_id, lote, erros, gravar_lote, impressoes)
+        _gravar_lote_job(fila, job_id, lote, erros, gravar_lote, impressoes)
+        fila.atualizar_status(job_id, JOB_CONCLUIDO)
+        # O ZIP só é necessário para retomar; concluído, pode ser descartado
+        try:
+            os.unlink(job["caminho_zip"])
+        except OSError:
+            pass
+    except Exception as exc:
+        fila.atualizar_status(job_id, JOB_ERRO, str(exc))
+
+
+def _gravar_lote_job(
+    fila: FilaImportacao,
+    job_id: str,
+    lote: list[dict],
+    erros: list[dict],
+    gravar_lote,
+    impressoes: IndiceImpressoes | None = None,
+) -> None:
+    registros = list(erros)
+    confirmados = []
+    if lote:
+        gravados = gravar_lote([r["analise"] for r in lote])
+        for resultado, gravado in zip(lote, gravados):
+            registros.append({"membro": resultado["membro"], **gravado})
+            impressao = resultado.get("impressao")
+            if impressao and gravado["status"] in STATUS_CONFIRMADOS:
+                confirmados.append((*impressao, gravado.get("numero_nfe")))
+    fila.registrar(job_id, registros)
+    if impressoes is not None:
+        impressoes.registrar(confirmados)
+    lote.clear()
+    erros.clear()
+
+
+# --- Execução em segundo plano ---
+
+_THREADS: dict[str, threading.Thread] = {}
+_LOCK_THREADS = threading.Lock()
+
+
+def job_em_execucao(job_id: str) -> bool:
+    thread = _THREADS.get(job_id)
+    return thread is not None and thread.is_alive()
+
+
+def iniciar_em_segundo_plano(
+    fila: FilaImportacao,
+    job_id: str,
+    base_normativa: list[dict],
+    gravar_lote: Callable[[list[dict]], list[dict]],
+    impressoes: IndiceImpressoes | None = None,
+) -> bool:
+    """Inicia (ou retoma) o job numa thread do servidor. False se ele já estiver rodando."""
+    with _LOCK_THREADS:
+        if job_em_execucao(job_id):
+            return False
+        thread = threading.Thread(
+            target=executar_job,
+            args=(fila, job_id, base_normativa, gravar_lote),
+            kwargs={"impressoes": impressoes},
+            name=f"importacao-{job_id}",
+            daemon=True,
+        )
+        _THREADS[job_id] = thread
+        thread.start()
+        return True
+
+
+def status_efetivo(job: dict) -> str:
+    """Status para exibição: job "executando" sem thread viva (servidor reiniciado) está interrompido."""
+    if job["status"] in (JOB_EXECUTANDO, JOB_NA_FILA) and not job_em_execucao(job["id"]):
+        return JOB_INTERROMPIDO
+    return job["status"]
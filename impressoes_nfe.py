@@ -0,0 +1,108 @@
+"""
+Impressões digitais de XMLs de NF-e já importados: SHA-256 dos bytes e chave de acesso.
+
+Reconhece um XML reenviado (no mesmo ou em outro ZIP) antes de qualquer parsing e
+sem consultar o banco. Nos ZIPs a impressão é calculada por quem lê o membro
+(ingestao_nfe), para cada XML ser descompactado uma só vez. O índice é local
+(SQLite; o app usa DIR_IMPORTACOES) e só recebe arquivos cuja nota foi confirmada
+no banco ("Gravada" ou "Ja existente").
+Se notas forem apagadas do banco, limpe o índice (IndiceImpressoes.limpar).
+"""
+from datetime import datetime
+import hashlib
+from pathlib import Path
+import re
+import sqlite3
+
+# Chave de acesso (44 dígitos) no Id do infNFe, sem parsing do XML. O chNFe isolado não
+# serve: XMLs de evento (cancelamento, CC-e) trazem o chNFe da nota a que se referem.
+_RE_CHAVE = re.compile(rb'<(?:\w+:)?infNFe\b[^>]*?\bId\s*=\s*["\']NFe(\d{44})["\']')
+
+# Status da importação que confirmam a nota no banco
+STATUS_CONFIRMADOS = ("Gravada", "Ja existente")
+
+
+def impressao_xml(xml_bytes: bytes) -> tuple[str, str | None]:
+    """(SHA-256 hex dos bytes, chave de acesso ou None)."""
+    m = _RE_CHAVE.search(xml_bytes)
+    chave = m.group(1).decode("ascii") if m else None
+    return hashlib.sha256(xml_bytes).hexdigest(), chave
+
+
+class IndiceImpressoes:
+    """Índice local sha256/chave de acesso -> número da NF-e (SQLite; uma conexão por operação)."""
+
+    def __init__(self, caminho_db: str | Path):
+        self.caminho_db = Path(caminho_db)
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        with self._conectar() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS impressoes_xml (
+                    sha256 TEXT PRIMARY KEY,
+                    chave_acesso TEXT,
+                    numero_nfe TEXT,
+                    registrado_em TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_impressoes_chave ON impressoes_xml (chave_acesso);
+                """
+            )
+
+    def _conectar(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.caminho_db, timeout=30)
+
+    def buscar(self, sha256: str, chave_acesso: str | None = None) -> str | None:
+        """Número da NF-e já importada com o mesmo conteúdo ou a mesma chave (None se nova)."""
+        with self._conectar() as conn:
+            row = conn.execute(
+                "SELECT numero_nfe FROM impressoes_xml WHERE sha256 = ? OR (? IS NOT NULL AND chave_acesso = ?) LIMIT 1",
+                (sha256, chave_acesso, chave_acesso),
+            ).fetchone()
+        return (row[0] or "") if row else None
+
+    def registrar(self, registros: list[tuple[str, str | None, str | None]]) -> None:
+        """Registra (sha256, chave_acesso, numero_nfe) de arquivos confirmados no banco."""
+        if not registros:
+            return
+        agora = datetime.now().isoformat()
+        with self._conectar() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO impressoes_xml (sha256, chave_acesso, numero_nfe, registrado_em) VALUES (?, ?, ?, ?)",
+                [(sha, chave, numero, agora) for sha, chave, numero in registros],
+            )
+
+    def limpar(self) -> None:
+        with self._conectar() as conn:
+            conn.execute("DELETE FROM impressoes_xml")
+
+    def total(self) -> int:
+        with self._conectar() as conn:
+            return conn.execute("SELECT COUNT(*) FROM impressoes_xml").fetchone()[0]
+
+
+def arquivo_conhecido(resultado: dict, vistos: dict[str, str]) -> dict | None:
+    """
+    Confere um resultado da análise de ZIP (ingestao_nfe: a impressão é calculada no
+    worker, na única leitura do membro). Retorna {"membro", "numero_nfe", "mensagem"}
+    se o XML já foi importado ("ja_importado", consultado no índice pelo worker) ou é
+    cópia idêntica de um membro anterior do mesmo ZIP; senão None. vistos
+    (sha256 -> membro) é o mesmo dict para todos os resultados do ZIP.
+    Membros ilegíveis (sem "impressao") seguem como novos.
+    """
+    membro = resultado["membro"]
+    if "ja_importado" in resultado:
+        numero = resultado["ja_importado"]
+        return {"membro": membro, "numero_nfe": numero, "mensagem": mensagem_arquivo_conhecido(numero)}
+    impressao = resultado.get("impressao")
+    if impressao is None:
+        return None
+    sha = impressao[0]
+    if sha in vistos:
+        return {"membro": membro, "numero_nfe": None, "mensagem": f"Arquivo idêntico a {vistos[sha]}"}
+    vistos[sha] = membro
+    return None
+
+
+def mensagem_arquivo_conhecido(numero: str | None) -> str:
+    """Mensagem do resumo para arquivo reconhecido pelo índice."""
+    return f"Nota {numero} já existe no banco de dados (arquivo já importado)" if numero else "Arquivo já importado"
@@ -0,0 +1,338 @@
+"""
+Ingestão de NF-e: classificação pura de uma nota e processamento paralelo de ZIPs.
+
+analisar_nfe recebe o registro plano do nfe_parser e aplica as regras de ST,
+devolvendo tudo o que o app precisa para gravar e exibir a nota (sem
+Streamlit/Supabase). Os workers do ProcessPoolExecutor leem os membros do ZIP,
+extraem e classificam; o processo principal só persiste e exibe, na ordem
+dos arquivos.
+"""
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import os
+from typing import Any, Callable, Iterable, Iterator
+import zipfile
+
+from impressoes_nfe import IndiceImpressoes, impressao_xml
+from nfe_parser import extrair_registro_nfe, limpar_cnpj, limpar_ncm, safe_float
+from regras_st import STATUS_IRREGULAR_ST, STATUS_SUJEITO_ST, IndiceRegrasST, cfop_indica_st, classificacao_item_st
+
+# Abaixo deste número de XMLs no ZIP o custo de subir os processos não compensa
+LIMIAR_PARALELO = 50
+# Blocos enviados ao pool e ainda não consumidos, por worker
+BLOCOS_EM_VOO_POR_WORKER = 2
+
+
+def analisar_nfe(
+    registro: dict,
+    buscar_regra: Callable[[str, str | None], dict | None],
+    versao_regras: str | None = None,
+) -> dict:
+    """
+    Classifica uma NF-e já extraída (extrair_registro_nfe).
+    buscar_regra(ncm, cest) devolve a regra da base normativa ou None.
+    versao_regras (IndiceRegrasST.versao da base usada): quando informada, os itens
+    para gravação levam a classificação da auditoria (regras_st.classificacao_item_st).
+    Retorna dict plano com dados da nota, itens para exibição/gravação e avisos
+    (erros de item que o app exibe como warning).
+    """
+    n_nf = registro.get("numero_nfe") or "N/A"
+    raw_cnpj_dest = registro.get("cnpj_destinatario")
+    totais = registro.get("totais") or {}
+
+    # Valor de ICMS-ST da nota (vST no total) para sinalização de irregularidade
+    v_st = totais.get("vST") or totais.get("vICMSST") or "0.00"
+    try:
+        icms_st_zerado = float(v_st or 0) == 0
+    except (ValueError, TypeError):
+        icms_st_zerado = True
+
+    tem_cfop_6 = False
+    cfops_encontrados: set[str] = set()
+    csts_encontrados: set[str] = set()
+    itens_exibir: list[dict] = []
+    itens_salvar: list[dict] = []
+    avisos: list[str] = []
+    ncm_cache: dict[str, dict | None] = {}
+    sujeito_st_pr = False
+
+    for item in registro.get("itens") or []:
+        try:
+            codigo_produto = item["codigo_produto"]
+            descricao = item["descricao"]
+            ncm = item["ncm"]
+            cest = item["cest"]
+            cfop = item["cfop"]
+            valor_total = item["valor_total"]
+            quantidade = item["quantidade"]
+
+            # Calcula valor unitário
+            try:
+                valor_unitario = float(valor_total) / float(quantidade) if float(quantidade) > 0 else 0.0
+            except (ValueError, TypeError):
+                valor_unitario = 0.0
+
+            # Coleta CFOPs únicos
+            if cfop != "N/A":
+                cfops_encontrados.add(str(cfop))
+                if str(cfop).startswith("6"):
+                    tem_cfop_6 = True
+
+            # Verifica se o NCM/CEST está na base normativa (CEST primeiro, depois NCM)
+            regra_st = None
+            if ncm and ncm != "N/A":
+                cache_key = f"{ncm}|{cest or ''}"
+                if cache_key not in ncm_cache:
+                    ncm_cache[cache_key] = buscar_regra(ncm, cest)
+                regra_st = ncm_cache[cache_key]
+                if regra_st:
+                    sujeito_st_pr = True
+
+            # CFOP 54 ou 64: OBRIGATORIAMENTE marca como SUJEITO A ST (alerta mesmo sem NCM na base)
+            st_por_cfop = cfop_indica_st(cfop)
+            if st_por_cfop:
+                sujeito_st_pr = True
+            sujeito_st_item = bool(regra_st) or st_por_cfop
+
+            # Feedback visual: Status ST e MVA Remanescente (irregular se ST zerado na nota)
+            status_st_gravar = (STATUS_IRREGULAR_ST if icms_st_zerado else STATUS_SUJEITO_ST) if sujeito_st_item else None
+            mva_remanescente_val = None
+            if regra_st and regra_st.get("mva_remanescente") is not None:
+                mva_val = regra_st["mva_remanescente"]
+                mva_remanescente_val = f"{float(mva_val) * 100:.1f}%" if mva_val else None
+
+            # Impostos extraídos do XML (base, alíquota, valor, cst)
+            impostos = item["impostos"]
+            if impostos.get("cst"):
+                csts_encontrados.add(str(impostos["cst"]).strip())
+
+            # Dados para exibição (o app acrescenta a coluna Arquivo)
+            itens_exibir.append({
+                "Numero Nota": n_nf,
+                "Código do Produto": codigo_produto,
+                "Descrição": descricao,
+                "NCM": ncm,
+                "CFOP": cfop,
+                "CST": impostos.get("cst") or "—",
+                "Valor Produto": safe_float(valor_total),
+                "IPI": item["valor_ipi"],
+                "Frete": item["valor_frete"],
+                "ICMS Origem": item["icms_origem"],
+                "Status ST": status_st_gravar or "Não",
+                "MVA Remanescente": mva_remanescente_val,
+            })
+
+            # Dados para salvar no banco (NCM normalizado: só dígitos; status_st para Painel)
+            item_salvar = {
+                "codigo_produto": codigo_produto if codigo_produto != "N/A" else None,
+                "descricao": descricao if descricao != "N/A" else None,
+                "ncm": limpar_ncm(ncm) if ncm and ncm != "N/A" else None,
+                "cest": cest,
+                "cfop": cfop if cfop != "N/A" else None,
+                "valor_unitario": valor_unitario,
+                "valor_total": float(valor_total) if valor_total else 0.0,
+                "status_st": status_st_gravar,
+            }
+            if versao_regras is not None:
+                item_salvar.update(classificacao_item_st(
+                    status_st_gravar, regra_st, cfop, registro.get("uf_origem"), versao_regras,
+                ))
+            # Adiciona impostos ao item (base, alíquota, valor, cst)
+            for k, v in impostos.items():
+                if v is not None:
+                    if k == "cst":
+                        item_salvar[k] = str(v).strip()
+                    elif isinstance(v, (int, float)):
+                        item_salvar[k] = float(v)
+                    else:
+                        item_salvar[k] = v
+            itens_salvar.append(item_salvar)
+        except (KeyError, AttributeError, TypeError) as e:
+            avisos.append(f"Erro ao processar item: {e}")
+            continue
+
+    # CFOP principal (único ou "Múltiplos" se houver vários)
+    cfop_principal = "N/A"
+    if cfops_encontrados:
+        if len(cfops_encontrados) == 1:
+            cfop_principal = list(cfops_encontrados)[0]
+        else:
+            cfop_principal = f"Múltiplos ({', '.join(sorted(cfops_encontrados))})"
+
+    # CST principal (único ou "Múltiplos" se houver vários)
+    cst_principal = None
+    if csts_encontrados:
+        cst_principal = list(csts_encontrados)[0] if len(csts_encontrados) == 1 else f"Múltiplos ({', '.join(sorted(csts_encontrados))})"
+
+    return {
+        "numero_nfe": n_nf,
+        "data_emissao": registro.get("data_emissao"),
+        "cnpj_destinatario": limpar_cnpj(raw_cnpj_dest) if raw_cnpj_dest else None,
+        "uf_origem": registro.get("uf_origem"),
+        "chave_acesso": registro.get("chave_acesso"),
+        "itens_exibir": itens_exibir,
+        "itens_salvar": itens_salvar,
+        "cfop_principal": cfop_principal,
+        "cst_principal": cst_principal,
+        "tem_cfop_6": tem_cfop_6,
+        "sujeito_st_pr": sujeito_st_pr,
+        "v_nf": totais.get("vNF") or "0.00",
+        "v_icms": totais.get("vICMS") or "0.00",
+        "totais_impostos": {
+            "icms_bc_total": safe_float(totais.get("vBC")),
+            "icms_st_total": safe_float(totais.get("vST") or totais.get("vICMSST")),
+            "pis_total": safe_float(totais.get("vPIS")),
+            "cofins_total": safe_float(totais.get("vCOFINS")),
+            "ipi_total": safe_float(totais.get("vIPI")),
+            "ibs_total": safe_float(totais.get("vIBS")),
+            "cbs_total": safe_float(totais.get("vCBS")),
+        },
+        "avisos": avisos,
+    }
+
+
+# --- Processamento paralelo de ZIP ---
+
+# Estado de cada processo worker (definido no initializer)
+_INDICE_WORKER = IndiceRegrasST([])
+_IMPRESSOES_WORKER: IndiceImpressoes | None = None
+_ZIPS_WORKER: dict[str, zipfile.ZipFile] = {}
+
+
+def _inicializar_worker(base_normativa: list[dict], caminho_impressoes: str | None = None) -> None:
+    """
+    Initializer do pool: recebe a base normativa já preparada e indexa uma vez por
+    processo; com caminho_impressoes, abre o índice de arquivos já importados.
+    """
+    global _INDICE_WORKER, _IMPRESSOES_WORKER
+    _INDICE_WORKER = IndiceRegrasST(base_normativa)
+    _IMPRESSOES_WORKER = IndiceImpressoes(caminho_impressoes) if caminho_impressoes else None
+
+
+def _analisar_xml_zip(
+    membro: str,
+    xml_bytes: bytes,
+    indice: IndiceRegrasST,
+    impressoes: IndiceImpressoes | None,
+) -> dict:
+    """
+    Impressão (impressoes_nfe) dos bytes já descompactados e, se o XML não estiver no
+    índice de já importados, extração e classificação.
+    """
+    resultado = {"membro": membro, "impressao": impressao_xml(xml_bytes)}
+    if impressoes is not None:
+        numero = impressoes.buscar(*resultado["impressao"])
+        if numero is not None:
+            return {**resultado, "ja_importado": numero}
+    try:
+        registro = extrair_registro_nfe(xml_bytes.decode("utf-8", errors="ignore"))
+        analise = analisar_nfe(registro, lambda ncm, cest: indice.casar(ncm, cest)[0], indice.versao)
+        return {**resultado, "analise": analise}
+    except Exception as exc:
+        return {**resultado, "etapa": "processamento", "erro": str(exc)}
+
+
+def analisar_membro_zip(caminho_zip: str, membro: str) -> dict:
+    """
+    Worker: lê um XML do ZIP (uma única descompactação), calcula a impressão, confere
+    o índice de já importados e, se novo, extrai e classifica.
+    Retorna {"membro", "impressao", "analise"} ou {"membro", "impressao", "ja_importado"}.
+    Nunca lança exceção: erros voltam como {"erro": ..., "etapa": "leitura" | "processamento"}.
+    """
+    try:
+        zip_ref = _ZIPS_WORKER.get(caminho_zip)
+        if zip_ref is None:
+            zip_ref = zipfile.ZipFile(caminho_zip, "r")
+            _ZIPS_WORKER[caminho_zip] = zip_ref
+        xml_bytes = zip_ref.read(membro)
+    except Exception as exc:
+        return {"membro": membro, "etapa": "leitura", "erro": str(exc)}
+    return _analisar_xml_zip(membro, xml_bytes, _INDICE_WORKER, _IMPRESSOES_WORKER)
+
+
+def analisar_zip_sequencial(
+    caminho_zip: str,
+    membros: Iterable[str],
+    base_normativa: list[dict],
+    impressoes: IndiceImpressoes | None = None,
+) -> Iterator[dict]:
+    """Mesmo contrato de analisar_zip_em_paralelo, no processo atual (ZIPs pequenos)."""
+    indice = IndiceRegrasST(base_normativa)
+    with zipfile.ZipFile(caminho_zip, "r") as zip_ref:
+        for membro in membros:
+            try:
+                xml_bytes = zip_ref.read(membro)
+            except Exception as exc:
+                yield {"membro": membro, "etapa": "leitura", "erro": str(exc)}
+                continue
+            yield _analisar_xml_zip(membro, xml_bytes, indice, impressoes)
+
+
+def _analisar_bloco_zip(caminho_zip: str, membros: list[str]) -> list[dict]:
+    """Worker: analisa um bloco de membros (um envio ao pool por bloco)."""
+    return [analisar_membro_zip(caminho_zip, membro) for membro in membros]
+
+
+def mapear_em_janela(
+    executor: Executor,
+    funcao: Callable[[list], list],
+    itens: list,
+    tamanho_bloco: int,
+    blocos_em_voo: int,
+) -> Iterator[Any]:
+    """
+    Como executor.map por blocos, mas com no máximo blocos_em_voo blocos enviados e
+    ainda não consumidos: um novo bloco só é enviado quando quem consome retira o
+    resultado do mais antigo. Devolve os resultados item a item, na ordem de itens.
+    Ao interromper a iteração, os blocos ainda não iniciados são cancelados.
+    """
+    blocos = (itens[i : i + tamanho_bloco] for i in range(0, len(itens), tamanho_bloco))
+    pendentes: deque = deque()
+    try:
+        for bloco in blocos:
+            pendentes.append(executor.submit(funcao, bloco))
+            if len(pendentes) >= blocos_em_voo:
+                break
+        while pendentes:
+            resultados = pendentes.popleft().result()
+            proximo = next(blocos, None)
+            if proximo is not None:
+                pendentes.append(executor.submit(funcao, proximo))
+            yield from resultados
+    finally:
+        for futuro in pendentes:
+            futuro.cancel()
+
+
+def analisar_zip_em_paralelo(
+    caminho_zip: str,
+    membros: Iterable[str],
+    base_normativa: list[dict],
+    max_workers: int | None = None,
+    impressoes: IndiceImpressoes | None = None,
+) -> Iterator[dict]:
+    """
+    Distribui os membros do ZIP entre processos e devolve os resultados na ordem
+    dos arquivos, à medida que ficam prontos. Usa spawn: os workers importam
+    apenas este módulo (sem Streamlit). Com impressoes, cada worker consulta o
+    índice (SQLite) e XMLs já importados voltam com "ja_importado", sem parsing.
+    Ficam em voo no máximo BLOCOS_EM_VOO_POR_WORKER blocos por worker
+    (mapear_em_janela): com quem consome lento (gravação no Supabase), os
+    resultados prontos não se acumulam em memória.
+    """
+    membros = list(membros)
+    if not membros:
+        return
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, min(64, len(membros) // (max_workers * 4)))
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_inicializar_worker,
+        initargs=(base_normativa, str(impressoes.caminho_db) if impressoes is not None else None),
+    ) as executor:
+        yield from mapear_em_janela(
+            executor, partial(_analisar_bloco_zip, caminho_zip), membros, chunksize, BLOCOS_EM_VOO_POR_WORKER * max_workers,
+        )
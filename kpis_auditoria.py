@@ -0,0 +1,155 @@
+"""
+KPIs do Painel de Auditoria calculados em conjunto (pandas), sem laço por item.
+
+Mesma classificação de app._compute_auditoria_kpis item a item: o vínculo com a
+base normativa sai de um join dos NCMs/CESTs distintos contra as chaves do
+IndiceRegrasST, e as flags de CFOP de operações vetorizadas de string. Itens com
+a classificação gravada na importação/reprocessamento (categoria_st, migration
+016) na versão atual da base só têm as colunas lidas; o cálculo fica para os demais.
+"""
+import pandas as pd
+
+from regras_st import (
+    CATEGORIA_ANTECIPACAO,
+    CATEGORIA_IRREGULAR,
+    CATEGORIA_ST_RECOLHIDA,
+    CATEGORIA_ST_VIA_CFOP,
+    TAMANHOS_PREFIXO,
+    IndiceRegrasST,
+)
+
+# Flags booleanas acrescentadas por classificar_itens_auditoria (além de sujeito_st)
+FLAGS_AUDITORIA = ("na_base", "irregular", "st_recolhida", "antecipacao", "st_via_cfop")
+
+
+def _texto(serie: pd.Series) -> pd.Series:
+    """Valores como str ("" para nulos), como o `if not valor` das funções de regras_st."""
+    return serie.where(serie.notna() & serie.astype(bool), "").astype(str)
+
+
+def _somente_digitos(serie: pd.Series) -> pd.Series:
+    """Versão vetorizada de _sanitizar_ncm/_sanitizar_cest."""
+    return _texto(serie).str.replace(r"\D", "", regex=True)
+
+
+def _por_valor_distinto(serie: pd.Series, funcao) -> pd.Series:
+    """Aplica funcao (vetorizada) só aos valores distintos e junta de volta pelos códigos."""
+    codigos, distintos = pd.factorize(serie)
+    resultado = funcao(pd.Series(distintos, dtype=object).astype(str)).to_numpy(dtype=bool)
+    return pd.Series(resultado[codigos], index=serie.index)
+
+
+def ncm_na_base_vetorizado(ncm: pd.Series, cest: pd.Series, indice: IndiceRegrasST) -> pd.Series:
+    """
+    True onde IndiceRegrasST.casar(ncm, cest) encontraria regra (CEST, NCM exato ou
+    prefixo de 6, 4 ou 2 dígitos). Cada NCM e CEST distinto é resolvido uma vez
+    contra as chaves do índice e volta aos itens pelos códigos do factorize.
+    """
+    def ncm_casa(n: pd.Series) -> pd.Series:
+        casa = n.isin(indice.por_ncm.keys())
+        for tamanho in TAMANHOS_PREFIXO:
+            casa |= (n.str.len() >= tamanho) & n.str[:tamanho].isin(indice.por_prefixo[tamanho].keys())
+        return casa
+
+    def cest_casa(c: pd.Series) -> pd.Series:
+        return (c.str.len() >= 4) & c.isin(indice.por_cest.keys())
+
+    ncm_limpo = _somente_digitos(ncm)
+    # NCM inválido (menos de 2 dígitos) nunca casa, nem por CEST
+    ncm_valido = _por_valor_distinto(ncm_limpo, lambda n: n.str.len() >= 2)
+    return ncm_valido & (_por_valor_distinto(ncm_limpo, ncm_casa) | _por_valor_distinto(_somente_digitos(cest), cest_casa))
+
+
+def _flags_calculadas(df: pd.DataFrame, status: pd.Series, uf_origem_por_nota: dict[str, str], indice: IndiceRegrasST) -> pd.DataFrame:
+    """Flags da Lógica Tripla a partir de NCM/CEST (contra o índice), CFOP, status_st e UF de origem."""
+    irregular_db = status.str.contains("IRREGULAR", regex=False)
+    na_base = ncm_na_base_vetorizado(df["ncm"], df["cest"], indice)
+    cfop = _texto(df["cfop"]).str.strip()
+    cfop_54_64 = cfop.str.startswith("54") | cfop.str.startswith("64")
+    cfop_61 = cfop.str.startswith("61")
+    cfop_51 = cfop.str.startswith("51")
+    uf = df["nota_id"].astype(str).map(uf_origem_por_nota).fillna("")
+
+    irregular = irregular_db | (cfop_51 & na_base)
+    st_recolhida = ~irregular & na_base & cfop_54_64
+    antecipacao = ~irregular & ~st_recolhida & (
+        (cfop_61 & (uf != "") & (uf != "PR")) | (na_base & ~cfop_54_64 & ~cfop_51)
+    )
+    return pd.DataFrame({
+        "na_base": na_base,
+        "irregular": irregular,
+        "st_recolhida": st_recolhida,
+        "antecipacao": antecipacao,
+        "st_via_cfop": (status != "") & ~na_base & cfop_54_64,
+    })
+
+
+def _flags_gravadas(df: pd.DataFrame) -> pd.DataFrame:
+    """Flags a partir de categoria_st/regra_st gravados (regras_st.classificacao_item_st)."""
+    categoria = df["categoria_st"]
+    return pd.DataFrame({
+        "na_base": df["regra_st"].notna(),
+        "irregular": categoria == CATEGORIA_IRREGULAR,
+        "st_recolhida": categoria == CATEGORIA_ST_RECOLHIDA,
+        "antecipacao": categoria == CATEGORIA_ANTECIPACAO,
+        "st_via_cfop": categoria == CATEGORIA_ST_VIA_CFOP,
+    })
+
+
+def classificacao_vigente(df: pd.DataFrame, indice: IndiceRegrasST) -> pd.Series:
+    """True nos itens com classificação gravada na versão atual da base (indice.versao)."""
+    if "categoria_st" not in df.columns or "versao_regras_st" not in df.columns:
+        return pd.Series(False, index=df.index)
+    return df["categoria_st"].notna() & (df["versao_regras_st"] == indice.versao)
+
+
+def classificar_itens_auditoria(
+    itens: pd.DataFrame | list[dict],
+    uf_origem_por_nota: dict[str, str],
+    indice: IndiceRegrasST,
+) -> pd.DataFrame:
+    """
+    Itens com as flags booleanas da auditoria: na_base, irregular, st_recolhida,
+    antecipacao, sujeito_st (status_st preenchido) e st_via_cfop (sujeito sem regra,
+    CFOP 54/64). valor_total vira número (0 quando ausente). Itens com classificação
+    vigente (classificacao_vigente) usam as colunas gravadas.
+    """
+    df = pd.DataFrame(itens).copy()
+    for coluna in ("nota_id", "ncm", "cest", "cfop", "status_st", "valor_total"):
+        if coluna not in df.columns:
+            df[coluna] = None
+    df["valor_total"] = pd.to_numeric(df["valor_total"], errors="coerce").fillna(0.0)
+    status = _texto(df["status_st"])
+
+    vigente = classificacao_vigente(df, indice)
+    flags = pd.DataFrame(False, index=df.index, columns=list(FLAGS_AUDITORIA))
+    if vigente.any():
+        flags.loc[vigente] = _flags_gravadas(df[vigente])
+    if not vigente.all():
+        flags.loc[~vigente] = _flags_calculadas(df[~vigente], status[~vigente], uf_origem_por_nota, indice)
+    for coluna in FLAGS_AUDITORIA:
+        df[coluna] = flags[coluna].astype(bool)
+    df["sujeito_st"] = status != ""
+    return df
+
+
+def calcular_kpis_auditoria(
+    itens: pd.DataFrame | list[dict],
+    uf_origem_por_nota: dict[str, str],
+    indice: IndiceRegrasST,
+) -> dict:
+    """
+    KPIs (total_itens, st_recolhida, antecipacao_pendente, irregulars, valor_risco).
+    itens: colunas nota_id, ncm, cest, cfop, status_st, valor_total (ausentes contam como vazias).
+    uf_origem_por_nota: id da nota (str) -> UF de origem já normalizada ("" se desconhecida).
+    """
+    if len(itens) == 0:
+        return {"total_itens": 0, "st_recolhida": 0, "antecipacao_pendente": 0, "irregulars": 0, "valor_risco": 0.0}
+    df = classificar_itens_auditoria(itens, uf_origem_por_nota, indice)
+    return {
+        "total_itens": len(df),
+        "st_recolhida": int(df["st_recolhida"].sum()),
+        "antecipacao_pendente": int(df["antecipacao"].sum()),
+        "irregulars": int(df["irregular"].sum()),
+        "valor_risco": float(df.loc[df["antecipacao"], "valor_total"].sum()),
+    }
@@ -0,0 +1,23 @@
+-- Versão da base normativa: updated_at em base_normativa_ncm
+-- O app compara (total de linhas, maior updated_at) para invalidar o cache de regras
+-- compartilhado entre sessões sempre que o Anexo IX for re-importado ou editado.
+-- Execute no Supabase: app.supabase.com → SQL Editor → New Query → Cole e Execute
+
+ALTER TABLE base_normativa_ncm
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+-- Atualiza updated_at em todo UPDATE (inclusive upsert com on_conflict)
+CREATE OR REPLACE FUNCTION base_normativa_ncm_set_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = now();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_base_normativa_ncm_updated_at ON base_normativa_ncm;
+CREATE TRIGGER trg_base_normativa_ncm_updated_at
+BEFORE UPDATE ON base_normativa_ncm
+FOR EACH ROW EXECUTE FUNCTION base_normativa_ncm_set_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_base_normativa_updated_at ON base_normativa_ncm (updated_at DESC);
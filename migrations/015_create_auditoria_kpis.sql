@@ -0,0 +1,81 @@
+-- KPIs do Painel de Auditoria calculados no banco (RPC auditoria_kpis)
+-- Devolve só os agregados (total_itens, st_recolhida, antecipacao_pendente, irregulars,
+-- valor_risco) em vez de trafegar todos os itens_nota das notas selecionadas.
+-- Mesma classificação de kpis_auditoria.calcular_kpis_auditoria; sem esta função o app
+-- continua calculando localmente.
+-- O bloco entre "classificacao:inicio" e "classificacao:fim" é SQL comum a Postgres e
+-- SQLite: os testes o executam num SQLite local (tests/test_kpis_auditoria.py).
+-- Execute no Supabase: app.supabase.com → SQL Editor → New Query → Cole e Execute
+
+-- NCM/CEST só com dígitos (como _sanitizar_ncm/_sanitizar_cest)
+CREATE OR REPLACE FUNCTION so_digitos(valor TEXT)
+RETURNS TEXT AS $$
+  SELECT regexp_replace(coalesce(valor, ''), '\D', '', 'g');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION auditoria_kpis(p_nota_ids UUID[])
+RETURNS TABLE (
+  total_itens BIGINT,
+  st_recolhida BIGINT,
+  antecipacao_pendente BIGINT,
+  irregulars BIGINT,
+  valor_risco NUMERIC
+) AS $$
+WITH notas_alvo AS (SELECT unnest(p_nota_ids) AS id),
+-- classificacao:inicio
+regras AS (
+  SELECT so_digitos(ncm) AS ncm, so_digitos(cest) AS cest
+  FROM base_normativa_ncm
+  WHERE so_digitos(ncm) <> ''
+),
+itens AS (
+  SELECT
+    coalesce(i.valor_total, 0) AS valor,
+    coalesce(i.status_st, '') LIKE '%IRREGULAR%' AS irregular_db,
+    so_digitos(i.ncm) AS ncm,
+    so_digitos(i.cest) AS cest,
+    trim(coalesce(i.cfop, '')) AS cfop,
+    upper(trim(coalesce(n.uf_origem, ''))) AS uf
+  FROM itens_nota i
+  LEFT JOIN notas_fiscais n ON n.id = i.nota_id
+  WHERE i.nota_id IN (SELECT id FROM notas_alvo)
+),
+flags AS (
+  SELECT
+    valor,
+    irregular_db,
+    uf,
+    (cfop LIKE '54%' OR cfop LIKE '64%') AS cfop_54_64,
+    cfop LIKE '61%' AS cfop_61,
+    cfop LIKE '51%' AS cfop_51,
+    (length(ncm) >= 2 AND (
+      (length(cest) >= 4 AND cest IN (SELECT cest FROM regras WHERE cest <> ''))
+      OR ncm IN (SELECT ncm FROM regras)
+      OR (length(ncm) >= 6 AND substr(ncm, 1, 6) IN (SELECT ncm FROM regras WHERE length(ncm) = 6))
+      OR (length(ncm) >= 4 AND substr(ncm, 1, 4) IN (SELECT ncm FROM regras WHERE length(ncm) = 4))
+      OR substr(ncm, 1, 2) IN (SELECT ncm FROM regras WHERE length(ncm) = 2)
+    )) AS na_base
+  FROM itens
+),
+classificados AS (
+  SELECT
+    valor,
+    irregular,
+    (NOT irregular AND na_base AND cfop_54_64) AS st_ok,
+    (NOT irregular AND NOT (na_base AND cfop_54_64) AND (
+      (cfop_61 AND uf <> '' AND uf <> 'PR') OR (na_base AND NOT cfop_54_64 AND NOT cfop_51)
+    )) AS antecipacao
+  FROM (SELECT *, (irregular_db OR (cfop_51 AND na_base)) AS irregular FROM flags) f
+)
+SELECT
+  count(*) AS total_itens,
+  coalesce(sum(CASE WHEN st_ok THEN 1 ELSE 0 END), 0) AS st_recolhida,
+  coalesce(sum(CASE WHEN antecipacao THEN 1 ELSE 0 END), 0) AS antecipacao_pendente,
+  coalesce(sum(CASE WHEN irregular THEN 1 ELSE 0 END), 0) AS irregulars,
+  coalesce(sum(CASE WHEN antecipacao THEN valor ELSE 0 END), 0) AS valor_risco
+FROM classificados
+-- classificacao:fim
+;
+$$ LANGUAGE sql STABLE;
+
+GRANT EXECUTE ON FUNCTION auditoria_kpis(UUID[]) TO anon, authenticated, service_role;
@@ -0,0 +1,23 @@
+-- Classificação da auditoria (Lógica Tripla) gravada por item na importação e no reprocessamento
+-- O Painel de Auditoria lê e agrega estas colunas em vez de refazer o match com a base
+-- normativa a cada visualização. Itens sem classificação ou classificados com outra versão
+-- da base (versao_regras_st) continuam sendo calculados na hora; "Reprocessar" os preenche.
+-- Execute no Supabase: app.supabase.com → SQL Editor → New Query → Cole e Execute
+
+-- categoria_st: irregular | st_recolhida | antecipacao | st_via_cfop | comum
+-- diagnostico_st: código do diagnóstico (regras_st.DIAGNOSTICOS_CATEGORIA)
+ALTER TABLE itens_nota ADD COLUMN IF NOT EXISTS categoria_st TEXT;
+ALTER TABLE itens_nota ADD COLUMN IF NOT EXISTS diagnostico_st TEXT;
+
+-- regra_st: regra da base normativa que casou (NCM, ou NCM/CEST); NULL fora da base
+-- versao_regras_st: versão da base normativa usada na classificação (IndiceRegrasST.versao)
+ALTER TABLE itens_nota ADD COLUMN IF NOT EXISTS regra_st TEXT;
+ALTER TABLE itens_nota ADD COLUMN IF NOT EXISTS versao_regras_st TEXT;
+
+-- Flags de CFOP: 54/64 (ST), 61 (interestadual) e 51 (venda interna)
+ALTER TABLE itens_nota ADD COLUMN IF NOT EXISTS cfop_st BOOLEAN;
+ALTER TABLE itens_nota ADD COLUMN IF NOT EXISTS cfop_interestadual BOOLEAN;
+ALTER TABLE itens_nota ADD COLUMN IF NOT EXISTS cfop_venda_interna BOOLEAN;
+
+-- Reclassificação incremental: troca de versão dos itens não atingidos por uma mudança da base
+CREATE INDEX IF NOT EXISTS idx_itens_nota_versao_regras ON itens_nota (versao_regras_st);
@@ -0,0 +1,26 @@
+-- CEST da base normativa em massa (RPC atualizar_cest_base_normativa)
+-- Recebe todos os pares (ncm, cest) do Anexo IX num único JSON e faz um UPDATE ... FROM,
+-- em vez de um UPDATE por NCM (milhares de requisições numa carga completa).
+-- Só altera as linhas cujo CEST muda e devolve quantas foram alteradas.
+-- Sem esta função, scripts/extrator_anexo_ix.py faz os UPDATEs em lotes concorrentes.
+-- Execute no Supabase: app.supabase.com → SQL Editor → New Query → Cole e Execute
+
+CREATE OR REPLACE FUNCTION atualizar_cest_base_normativa(p_pares JSONB)
+RETURNS BIGINT AS $$
+WITH pares AS (
+  -- Um par por NCM (anexo_ix.mapa_ncm_cest já envia assim)
+  SELECT DISTINCT ON (ncm) ncm, cest
+  FROM jsonb_to_recordset(p_pares) AS p(ncm TEXT, cest TEXT)
+),
+alteradas AS (
+  UPDATE base_normativa_ncm b
+  SET cest = pares.cest
+  FROM pares
+  WHERE b.ncm = pares.ncm
+    AND b.cest IS DISTINCT FROM pares.cest
+  RETURNING 1
+)
+SELECT count(*) FROM alteradas;
+$$ LANGUAGE sql;
+
+GRANT EXECUTE ON FUNCTION atualizar_cest_base_normativa(JSONB) TO anon, authenticated, service_role;
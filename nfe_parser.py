@@ -0,0 +1,349 @@
+"""
+Motor de extração de NF-e por parsing incremental (iterparse).
+
+Em vez de montar o dicionário completo do XML (xmltodict), percorre os eventos
+do parser e materializa apenas os blocos usados pelo sistema:
+ide (nNF, dhEmi/dEmi), dest (CNPJ), emit/enderEmit (UF), det (prod + imposto)
+e total/ICMSTot. Cada det é convertido e descartado assim que termina,
+mantendo a memória proporcional a um item, não à nota inteira.
+
+As funções de extração de impostos e data de emissão ficam aqui e são
+reaproveitadas pelo app (extrair_impostos_item, extrair_data_emissao_ide).
+Módulo sem dependência de Streamlit: pode ser usado em scripts e workers.
+"""
+from io import BytesIO, StringIO
+import re
+import xml.etree.ElementTree as ET
+
+
+def limpar_ncm(valor: str | None) -> str | None:
+    """
+    Normalização total: remove qualquer caractere não numérico do NCM.
+    Ex: 85.27 -> 8527; 8527.10.00 -> 85271000. Usado no XML e no banco.
+    """
+    if not valor:
+        return None
+    s = str(valor).strip()
+    if not s:
+        return None
+    ncm = re.sub(r"\D", "", s)
+    return ncm if ncm else None
+
+
+def limpar_cnpj(valor: str | None) -> str | None:
+    """
+    Remove pontos, traços e barras do CNPJ antes de gravar ou comparar.
+    Ex: 23.420.405/0001-84 -> 23420405000184. Retorna só os 14 dígitos.
+    """
+    if not valor:
+        return None
+    s = str(valor).strip()
+    if not s:
+        return None
+    cnpj = re.sub(r"\D", "", s)
+    return cnpj if cnpj else None
+
+
+def safe_float(valor: object, default: float = 0.0) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return default
+
+
+def extrair_valor_ipi(item: dict) -> float:
+    try:
+        ipi = item.get("imposto", {}).get("IPI", {})
+        if not isinstance(ipi, dict):
+            return 0.0
+        if "IPITrib" in ipi:
+            return safe_float(ipi["IPITrib"].get("vIPI"))
+        return safe_float(ipi.get("vIPI"))
+    except Exception:
+        return 0.0
+
+
+def extrair_valor_icms_origem(item: dict) -> float:
+    try:
+        icms = item.get("imposto", {}).get("ICMS", {})
+        if not isinstance(icms, dict) or not icms:
+            return 0.0
+        # Pega o primeiro bloco ICMS encontrado (ICMS00, ICMS10, etc)
+        for _, icms_val in icms.items():
+            if isinstance(icms_val, dict):
+                return safe_float(icms_val.get("vICMS"))
+        return 0.0
+    except Exception:
+        return 0.0
+
+
+def extrair_valor_frete(item: dict) -> float:
+    try:
+        prod = item.get("prod", {})
+        return safe_float(prod.get("vFrete"))
+    except Exception:
+        return 0.0
+
+
+def _primeiro_bloco(objeto: dict) -> dict | None:
+    """Retorna o primeiro sub-bloco dict de um objeto (ex: ICMS00, ICMS10...)."""
+    if not isinstance(objeto, dict):
+        return None
+    for v in objeto.values():
+        if isinstance(v, dict):
+            return v
+    return None
+
+
+def extrair_data_emissao_ide(ide: dict) -> str | None:
+    """
+    Extrai a data de emissão (YYYY-MM-DD) do bloco ide da NF-e.
+    Aceita dhEmi (datetime) ou dEmi (date) em vários formatos.
+    """
+    if not isinstance(ide, dict):
+        return None
+    dh = ide.get("dhEmi") or ide.get("dEmi") or ide.get("dhemi") or ide.get("demi") or ""
+    if not dh:
+        return None
+    dh = str(dh)
+    if "T" in dh:
+        return dh.split("T")[0]  # "2024-01-15"
+    if len(dh) == 10 and dh[4] == "-":
+        return dh
+    if "/" in dh:
+        parts = dh.split("/")
+        if len(parts) == 3:
+            return f"{parts[2]}-{parts[1].zfill(2)}-{parts[0].zfill(2)}"
+    return None
+
+
+def _extrair_cst_icms(icms: dict) -> str | None:
+    """
+    Extrai CST do bloco ICMS do item.
+    Retorna CST (2 dígitos) ou CSOSN (1 dígito para Simples Nacional) ou None.
+    """
+    if not isinstance(icms, dict):
+        return None
+    bloco = _primeiro_bloco(icms)
+    if not bloco:
+        return None
+    cst = bloco.get("CST") or bloco.get("cst")
+    if cst is not None and str(cst).strip():
+        return str(cst).strip()
+    csosn = bloco.get("CSOSN") or bloco.get("csosn")
+    if csosn is not None and str(csosn).strip():
+        return str(csosn).strip()
+    # Fallback: deriva do nome do bloco (ICMS00 -> 00, ICMS10 -> 10)
+    for k, v in icms.items():
+        if isinstance(v, dict) and k.startswith("ICMS"):
+            suf = k.replace("ICMS", "").strip()
+            if suf.isdigit():
+                return suf.zfill(2)
+    return None
+
+
+def extrair_impostos_item(item: dict) -> dict:
+    """
+    Extrai base, alíquota e valor de ICMS, ICMS-ST, PIS, COFINS, IPI, IBS e CBS do item.
+    Também extrai CST (Código de Situação Tributária) do bloco ICMS.
+    Retorna dict com chaves em snake_case para persistência.
+    """
+    imp = item.get("imposto", {}) or {}
+    resultado = {
+        "icms_bc": None, "icms_aliq": None, "icms_valor": None,
+        "icms_st_bc": None, "icms_st_aliq": None, "icms_st_valor": None,
+        "pis_bc": None, "pis_aliq": None, "pis_valor": None,
+        "cofins_bc": None, "cofins_aliq": None, "cofins_valor": None,
+        "ipi_bc": None, "ipi_aliq": None, "ipi_valor": None,
+        "ibs_valor": None, "cbs_valor": None,
+        "cst": None,
+    }
+
+    try:
+        # ICMS (ICMS00, ICMS10, ICMS20, ICMS30, ICMS40, ICMS51, ICMS60, ICMS70, ICMS90, ICMSPart, ICMSST...)
+        icms = imp.get("ICMS", {}) or {}
+        bloco = _primeiro_bloco(icms)
+        if bloco:
+            resultado["icms_bc"] = safe_float(bloco.get("vBC"))
+            resultado["icms_aliq"] = safe_float(bloco.get("pICMS"))
+            resultado["icms_valor"] = safe_float(bloco.get("vICMS"))
+            resultado["icms_st_bc"] = safe_float(bloco.get("vBCST"))
+            resultado["icms_st_aliq"] = safe_float(bloco.get("pICMSST")) or safe_float(bloco.get("pMST"))
+            resultado["icms_st_valor"] = safe_float(bloco.get("vICMSST")) or safe_float(bloco.get("vST"))
+            resultado["cst"] = _extrair_cst_icms(icms)
+        # ICMSST pode estar em bloco próprio (ex: grupo ICMSST)
+        icms_st = imp.get("ICMSST", {}) or {}
+        if isinstance(icms_st, dict):
+            st_bloco = _primeiro_bloco(icms_st) or icms_st
+            if isinstance(st_bloco, dict) and not resultado["icms_st_valor"]:
+                resultado["icms_st_bc"] = safe_float(st_bloco.get("vBCST"))
+                resultado["icms_st_aliq"] = safe_float(st_bloco.get("pICMSST")) or safe_float(st_bloco.get("pMST"))
+                resultado["icms_st_valor"] = safe_float(st_bloco.get("vICMSST")) or safe_float(st_bloco.get("vST"))
+
+        # PIS (PISAliq/PIS01, PISNT/PIS04, PISOutr, PISST...)
+        pis = imp.get("PIS", {}) or {}
+        bloco_pis = _primeiro_bloco(pis) or pis
+        if isinstance(bloco_pis, dict):
+            resultado["pis_bc"] = safe_float(bloco_pis.get("vBC"))
+            resultado["pis_aliq"] = safe_float(bloco_pis.get("pPIS"))
+            resultado["pis_valor"] = safe_float(bloco_pis.get("vPIS"))
+
+        # COFINS (COFINSAliq/COFINS01, COFINSNT/COFINS04, COFINSOutr, COFINSST...)
+        cofins = imp.get("COFINS", {}) or {}
+        bloco_cof = _primeiro_bloco(cofins) or cofins
+        if isinstance(bloco_cof, dict):
+            resultado["cofins_bc"] = safe_float(bloco_cof.get("vBC"))
+            resultado["cofins_aliq"] = safe_float(bloco_cof.get("pCOFINS"))
+            resultado["cofins_valor"] = safe_float(bloco_cof.get("vCOFINS"))
+
+        # IPI (IPITrib)
+        ipi = imp.get("IPI", {}) or {}
+        ipi_trib = ipi.get("IPITrib", ipi) if isinstance(ipi, dict) else {}
+        if isinstance(ipi_trib, dict):
+            resultado["ipi_bc"] = safe_float(ipi_trib.get("vBC"))
+            resultado["ipi_aliq"] = safe_float(ipi_trib.get("pIPI"))
+            resultado["ipi_valor"] = safe_float(ipi_trib.get("vIPI"))
+
+        # IBS e CBS (Reforma Tributária - quando disponível)
+        ibs = imp.get("IBS", {}) or {}
+        cbs = imp.get("CBS", {}) or {}
+        if isinstance(ibs, dict):
+            resultado["ibs_valor"] = safe_float(ibs.get("vIBS")) or safe_float(ibs.get("vValor"))
+        if isinstance(cbs, dict):
+            resultado["cbs_valor"] = safe_float(cbs.get("vCBS")) or safe_float(cbs.get("vValor"))
+    except Exception:
+        pass
+
+    return resultado
+
+
+# --- Parsing incremental ---
+
+
+def _nome_local(tag: str) -> str:
+    """Remove o namespace do tag ({http://www.portalfiscal.inf.br/nfe}det -> det)."""
+    return tag.rsplit("}", 1)[-1] if "}" in tag else tag
+
+
+def _elemento_para_dict(elem: ET.Element) -> dict | str | None:
+    """
+    Converte um sub-bloco (prod, imposto, ICMSTot...) no mesmo formato do xmltodict:
+    folha -> texto; nó -> dict; tags repetidas -> lista. Atributos são ignorados.
+    """
+    if len(elem) == 0:
+        return elem.text
+    resultado: dict = {}
+    for filho in elem:
+        chave = _nome_local(filho.tag)
+        valor = _elemento_para_dict(filho)
+        if chave in resultado:
+            atual = resultado[chave]
+            if isinstance(atual, list):
+                atual.append(valor)
+            else:
+                resultado[chave] = [atual, valor]
+        else:
+            resultado[chave] = valor
+    return resultado
+
+
+def _filhos_texto(elem: ET.Element) -> dict[str, str | None]:
+    """Mapa tag -> texto dos filhos diretos (blocos planos como ide, dest, enderEmit)."""
+    return {_nome_local(filho.tag): filho.text for filho in elem}
+
+
+def _item_de_det(det: ET.Element) -> dict:
+    """Achata um det (prod + imposto) no registro de item usado pelo processamento."""
+    item = {"prod": {}, "imposto": {}}
+    for filho in det:
+        nome = _nome_local(filho.tag)
+        if nome == "prod":
+            item["prod"] = _filhos_texto(filho)
+        elif nome == "imposto":
+            item["imposto"] = _elemento_para_dict(filho) or {}
+    prod = item["prod"]
+    return {
+        "codigo_produto": prod.get("cProd") or prod.get("cEAN") or "N/A",
+        "descricao": prod.get("xProd") or "N/A",
+        "ncm": prod.get("NCM") or "N/A",
+        "cest": prod.get("CEST") or None,
+        "cfop": prod.get("CFOP") or "N/A",
+        "valor_total": prod.get("vProd") or "0.00",
+        "quantidade": prod.get("qCom") or "1.00",
+        "valor_ipi": extrair_valor_ipi(item),
+        "valor_frete": extrair_valor_frete(item),
+        "icms_origem": extrair_valor_icms_origem(item),
+        "impostos": extrair_impostos_item(item),
+    }
+
+
+def registro_nfe_vazio() -> dict:
+    """Registro plano de uma NF-e sem nenhum campo preenchido."""
+    return {
+        "numero_nfe": None,
+        "data_emissao": None,
+        "cnpj_destinatario": None,
+        "uf_origem": None,
+        "chave_acesso": None,
+        "itens": [],
+        "totais": {},
+    }
+
+
+def extrair_registro_nfe(xml: str | bytes) -> dict:
+    """
+    Extrai de uma NF-e apenas os campos usados pelo sistema, num registro plano:
+    numero_nfe (nNF), data_emissao, cnpj_destinatario (bruto), uf_origem,
+    chave_acesso (Id do infNFe ou chNFe do protocolo), itens (det achatados) e
+    totais (ICMSTot). Considera apenas o primeiro infNFe do documento.
+    Lança xml.etree.ElementTree.ParseError para XML malformado.
+    """
+    if isinstance(xml, bytes):
+        fonte = BytesIO(xml)
+    else:
+        # Declaração de encoding não se aplica a texto já decodificado
+        fonte = StringIO(xml)
+    registro = registro_nfe_vazio()
+    inf_processado = False
+
+    # Só eventos "end": cada bloco é lido quando fecha e descartado em seguida
+    for _, elem in ET.iterparse(fonte):
+        nome = _nome_local(elem.tag)
+        if inf_processado:
+            if nome == "chNFe" and not registro["chave_acesso"] and elem.text:
+                registro["chave_acesso"] = elem.text.strip()
+            continue
+
+        if nome == "det":
+            registro["itens"].append(_item_de_det(elem))
+            elem.clear()
+        elif nome == "ide":
+            ide = _filhos_texto(elem)
+            registro["numero_nfe"] = ide.get("nNF") or ide.get("nnf")
+            registro["data_emissao"] = extrair_data_emissao_ide(ide)
+            elem.clear()
+        elif nome == "dest":
+            dest = _filhos_texto(elem)
+            registro["cnpj_destinatario"] = dest.get("CNPJ") or dest.get("cnpj")
+            elem.clear()
+        elif nome == "emit":
+            for filho in elem:
+                if _nome_local(filho.tag) == "enderEmit":
+                    ender = _filhos_texto(filho)
+                    uf_raw = ender.get("UF") or ender.get("uf")
+                    registro["uf_origem"] = str(uf_raw).strip().upper()[:2] if uf_raw else None
+            elem.clear()
+        elif nome == "ICMSTot":
+            totais = _elemento_para_dict(elem)
+            registro["totais"] = totais if isinstance(totais, dict) else {}
+            elem.clear()
+        elif nome == "infNFe":
+            id_inf = elem.get("Id") or ""
+            if id_inf:
+                registro["chave_acesso"] = id_inf[3:] if id_inf.startswith("NFe") else id_inf
+            inf_processado = True
+            elem.clear()
+        elif nome in ("transp", "cobr", "pag", "infAdic"):
+            elem.clear()
+
+    return registro
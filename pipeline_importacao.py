@@ -0,0 +1,195 @@
+"""
+Importação de XMLs em pipeline: leitura, análise e gravação em threads ligadas por
+filas limitadas.
+
+No caminho sequencial cada nota é lida, extraída, classificada e gravada antes da
+próxima: a CPU fica parada durante as idas ao Supabase e a rede durante o parsing.
+Aqui cada etapa roda numa thread própria e as filas (queue.Queue com maxsize)
+seguram a etapa mais rápida quando a seguinte atrasa: entre as etapas ficam no
+máximo tamanho_fila XMLs e alguns lotes, e o tempo total tende ao da etapa mais
+lenta em vez da soma das três. Quem consome (o app, na thread do Streamlit) recebe
+os lotes já gravados, na ordem dos arquivos; com as fontes lidas do disco e os
+resultados levados para fora da memória (o app usa ArmazemResultados), a memória
+fica limitada pelo tamanho das filas.
+Sem Streamlit: as funções passadas às etapas não podem chamar st.*.
+"""
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+# XMLs lidos aguardando a análise
+TAMANHO_FILA_PIPELINE = 64
+# Resultados da análise por chamada de gravar_lote
+LOTE_PIPELINE = 200
+# Lotes aguardando a gravação e lotes gravados aguardando quem consome
+LOTES_EM_ESPERA = 2
+# Intervalo (segundos) em que as etapas bloqueadas conferem se o pipeline parou
+ESPERA_FILA = 0.1
+
+ETAPAS_PIPELINE = ("leitura", "analise", "gravacao")
+
+
+class _Fim:
+    """Marca de fim de fluxo entre as etapas."""
+
+
+class _Falha:
+    """Exceção inesperada de uma etapa, repassada até quem consome."""
+
+    def __init__(self, etapa: str, exc: BaseException):
+        self.etapa = etapa
+        self.exc = exc
+
+
+class _Parado(Exception):
+    """O pipeline foi interrompido (quem consome parou ou outra etapa falhou)."""
+
+
+class PipelineImportacao:
+    """
+    Três etapas em threads:
+    - leitura: para cada (nome, ler) de fontes, ler() devolve os bytes do XML;
+    - análise: analisar(nome, xml_bytes) devolve um dict (extração, classificação,
+      cliente) e os resultados são agrupados em lotes de tamanho_lote;
+    - gravação: gravar_lote(lote) grava o lote (o retorno vai junto com ele).
+    Erros de leitura ou de análise de um arquivo viram itens {"nome", "etapa", "erro"}
+    no lote, na posição do arquivo; exceções de fontes ou de gravar_lote interrompem
+    o pipeline e são relançadas em executar().
+    tempos: segundos ocupados por etapa (sem contar a espera nas filas).
+    """
+
+    def __init__(
+        self,
+        fontes: Iterable[tuple[str, Callable[[], bytes]]],
+        analisar: Callable[[str, bytes], dict],
+        gravar_lote: Callable[[list[dict]], Any],
+        tamanho_lote: int = LOTE_PIPELINE,
+        tamanho_fila: int = TAMANHO_FILA_PIPELINE,
+    ):
+        self.fontes = fontes
+        self.analisar = analisar
+        self.gravar_lote = gravar_lote
+        self.tamanho_lote = max(1, tamanho_lote)
+        self.tempos = {etapa: 0.0 for etapa in ETAPAS_PIPELINE}
+        self.contagem = {etapa: 0 for etapa in ETAPAS_PIPELINE}
+        self._xmls: queue.Queue = queue.Queue(maxsize=max(1, tamanho_fila))
+        self._lotes: queue.Queue = queue.Queue(maxsize=LOTES_EM_ESPERA)
+        self._gravados: queue.Queue = queue.Queue(maxsize=LOTES_EM_ESPERA)
+        self._parar = threading.Event()
+
+    # --- Filas com interrupção ---
+
+    def _colocar(self, fila: queue.Queue, item) -> None:
+        while True:
+            if self._parar.is_set():
+                raise _Parado
+            try:
+                fila.put(item, timeout=ESPERA_FILA)
+                return
+            except queue.Full:
+                continue
+
+    def _retirar(self, fila: queue.Queue):
+        while True:
+            if self._parar.is_set():
+                raise _Parado
+            try:
+                return fila.get(timeout=ESPERA_FILA)
+            except queue.Empty:
+                continue
+
+    def _etapa(self, nome: str, corpo: Callable[[], None], saida: queue.Queue) -> None:
+        """Roda uma etapa; exceção inesperada segue pela fila de saída como _Falha."""
+        try:
+            corpo()
+        except _Parado:
+            pass
+        except BaseException as exc:
+            try:
+                self._colocar(saida, _Falha(nome, exc))
+            except _Parado:
+                pass
+
+    # --- Etapas ---
+
+    def _ler(self) -> None:
+        for nome, ler in self.fontes:
+            inicio = time.perf_counter()
+            try:
+                item = (nome, ler())
+            except Exception as exc:
+                item = {"nome": nome, "etapa": "leitura", "erro": str(exc)}
+            self.tempos["leitura"] += time.perf_counter() - inicio
+            self.contagem["leitura"] += 1
+            self._colocar(self._xmls, item)
+        self._colocar(self._xmls, _Fim())
+
+    def _analisar(self) -> None:
+        lote: list[dict] = []
+        while True:
+            item = self._retirar(self._xmls)
+            if isinstance(item, _Falha):
+                self._colocar(self._lotes, item)
+                return
+            if isinstance(item, _Fim):
+                break
+            if isinstance(item, tuple):
+                nome, xml_bytes = item
+                inicio = time.perf_counter()
+                try:
+                    item = self.analisar(nome, xml_bytes)
+                except Exception as exc:
+                    item = {"nome": nome, "etapa": "processamento", "erro": str(exc)}
+                self.tempos["analise"] += time.perf_counter() - inicio
+            self.contagem["analise"] += 1
+            lote.append(item)
+            if len(lote) >= self.tamanho_lote:
+                self._colocar(self._lotes, lote)
+                lote = []
+        if lote:
+            self._colocar(self._lotes, lote)
+        self._colocar(self._lotes, _Fim())
+
+    def _gravar(self) -> None:
+        while True:
+            lote = self._retirar(self._lotes)
+            if isinstance(lote, (_Falha, _Fim)):
+                self._colocar(self._gravados, lote)
+                return
+            inicio = time.perf_counter()
+            gravados = self.gravar_lote(lote)
+            self.tempos["gravacao"] += time.perf_counter() - inicio
+            self.contagem["gravacao"] += len(lote)
+            self._colocar(self._gravados, (lote, gravados))
+
+    # --- Execução ---
+
+    def executar(self) -> Iterator[tuple[list[dict], Any]]:
+        """
+        Inicia as etapas e devolve (lote, retorno de gravar_lote) à medida que cada
+        lote é gravado. Interromper a iteração (ou uma exceção) para as threads.
+        """
+        threads = [
+            threading.Thread(target=self._etapa, args=("leitura", self._ler, self._xmls), name="pipeline-leitura", daemon=True),
+            threading.Thread(target=self._etapa, args=("analise", self._analisar, self._lotes), name="pipeline-analise", daemon=True),
+            threading.Thread(target=self._etapa, args=("gravacao", self._gravar, self._gravados), name="pipeline-gravacao", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._gravados.get()
+                if isinstance(item, _Fim):
+                    return
+                if isinstance(item, _Falha):
+                    raise item.exc
+                yield item
+        finally:
+            self._parar.set()
+            for thread in threads:
+                thread.join()
+
+    def etapa_mais_lenta(self) -> str:
+        """Etapa com mais tempo ocupado (a que limita o ritmo do pipeline)."""
+        return max(ETAPAS_PIPELINE, key=lambda etapa: self.tempos[etapa])
@@ -0,0 +1,351 @@
+"""
+Regras de ICMS-ST (PR): status, CFOPs de substituição e match contra a base normativa.
+
+Funções puras (sem Streamlit/Supabase), compartilhadas pelo app, pelos workers
+de importação e pelos scripts. A busca com cache e mensagens fica em
+app.buscar_regra_st; aqui ficam a regra de precedência do match
+(casar_regra_st, varredura linear de referência) e o índice usado na
+importação (IndiceRegrasST).
+"""
+from collections import Counter
+import hashlib
+import re
+import threading
+
+# Sinalização quando há match ST mas a nota está com ICMS-ST zerado
+STATUS_IRREGULAR_ST = "❌ IRREGULAR: SUJEITO A ST NÃO RECOLHIDA"
+STATUS_SUJEITO_ST = "⚠️ SUJEITO A ST (PR)"
+# Badges e mensagens no Painel de Auditoria — Lógica Tripla
+BADGE_ST_RECOLHIDA = "✅ ST RECOLHIDA (OK)"
+BADGE_ANTECIPACAO_PENDENTE = "🚨 ANTECIPAÇÃO PENDENTE"
+BADGE_OPERACAO_COMUM = "⚪ OPERAÇÃO COMUM"
+BADGE_SUJEITO_ST = "⚠️ SUJEITO A ST"  # fallback
+DIAGNOSTICO_ERRO_ST = "🚨 ERRO: ST não identificada no XML"
+DIAGNOSTICO_ANTECIPACAO_PENDENTE = "Item sujeito a ST no PR. Recolhimento obrigatório pelo destinatário"
+DIAGNOSTICO_ST_RECOLHIDA = "ST recolhida na origem. CFOP de substituição tributária."
+DIAGNOSTICO_NCM_BASE = "Identificado por NCM (Base PR)"
+DIAGNOSTICO_CFOP_XML = "⚠️ NCM ausente na base, mas ST identificada no XML"
+DIAGNOSTICO_NCM_MAIS_CFOP = "✅ Confirmado (NCM + CFOP)"
+
+
+# CFOPs de substituição tributária (ST recolhida na origem)
+CFOPS_SUBSTITUICAO = ("5401", "5403", "5405", "6401", "6403", "6405")
+
+
+def cfop_substituicao(cfop: str | None) -> bool:
+    """Retorna True se o CFOP for de substituição (5401, 5403, 5405, 6401, 6403, 6405)."""
+    if not cfop:
+        return False
+    s = str(cfop).strip()
+    return s in CFOPS_SUBSTITUICAO
+
+
+def cfop_indica_st(cfop: str | None) -> bool:
+    """Retorna True se o CFOP indica operação com ST (prefixo 54 ou 64)."""
+    if not cfop:
+        return False
+    s = str(cfop).strip()
+    return s.startswith("54") or s.startswith("64")
+
+
+def cfop_inicia_54_ou_64(cfop: str | None) -> bool:
+    """Retorna True se o CFOP inicia em 5.4 ou 6.4 (ST recolhida na origem)."""
+    if not cfop:
+        return False
+    s = str(cfop).strip()
+    return s.startswith("54") or s.startswith("64")
+
+
+def cfop_inicia_61(cfop: str | None) -> bool:
+    """Retorna True se o CFOP inicia em 6.1 (operação interestadual)."""
+    if not cfop:
+        return False
+    s = str(cfop).strip()
+    return s.startswith("61")
+
+
+def cfop_inicia_51(cfop: str | None) -> bool:
+    """Retorna True se o CFOP inicia em 5.1 (venda interna)."""
+    if not cfop:
+        return False
+    s = str(cfop).strip()
+    return s.startswith("51")
+
+
+def cfop_5405_ou_5403(cfop: str | None) -> bool:
+    """Retorna True se o CFOP for exatamente 5405 ou 5403 (prova por CFOP no diagnóstico)."""
+    if not cfop:
+        return False
+    s = str(cfop).strip()
+    return s in ("5405", "5403")
+
+
+def _sanitizar_ncm(valor: str | None) -> str:
+    """
+    Limpa NCM para comparação: remove pontos, espaços e demais não-dígitos.
+    Ex: "12.34.56.78" ou "1234 5678" -> "12345678".
+    """
+    if not valor:
+        return ""
+    s = str(valor).strip().replace(".", "").replace(" ", "")
+    return re.sub(r"\D", "", s)
+
+
+def _sanitizar_cest(valor: str | None) -> str:
+    """
+    Limpa CEST para comparação: remove pontos, espaços e demais não-dígitos.
+    Ex: "03.001.00" -> "0300100".
+    """
+    if not valor:
+        return ""
+    s = str(valor).strip().replace(".", "").replace(" ", "")
+    return re.sub(r"\D", "", s)
+
+
+def preparar_base_normativa(linhas: list[dict]) -> list[dict]:
+    """
+    Sanitiza as linhas de base_normativa_ncm para o match: adiciona _ncm_limpo e
+    _cest_limpo e descarta linhas sem NCM.
+    """
+    base: list[dict] = []
+    for row in linhas or []:
+        base_limpo = _sanitizar_ncm(row.get("ncm"))
+        if not base_limpo:
+            continue
+        r = dict(row)
+        r["_ncm_limpo"] = base_limpo
+        r["_cest_limpo"] = _sanitizar_cest(row.get("cest"))
+        base.append(r)
+    return base
+
+
+def casar_regra_st(base: list[dict], ncm: str | None, cest: str | None = None) -> tuple[dict | None, str]:
+    """
+    Match de NCM/CEST na base já preparada (preparar_base_normativa).
+    Precedência: 1) CEST exato; 2) NCM exato; 3) prefixo de 6, 4 e 2 dígitos.
+    Retorna (regra, critério): critério é "cest", "ncm", "prefixo_6", "prefixo_4",
+    "prefixo_2", "sem_match" ou "ncm_invalido".
+    Varredura linear: referência de precedência para IndiceRegrasST.
+    """
+    ncm_xml_limpo = _sanitizar_ncm(ncm)
+    cest_xml_limpo = _sanitizar_cest(cest) if cest else ""
+
+    if not ncm_xml_limpo or len(ncm_xml_limpo) < 2:
+        return None, "ncm_invalido"
+
+    # 1) Match por CEST (mais específico) — quando informado
+    if cest_xml_limpo and len(cest_xml_limpo) >= 4:
+        for row in base:
+            base_cest = row.get("_cest_limpo")
+            if base_cest and base_cest == cest_xml_limpo:
+                return row, "cest"
+
+    # 2) Fallback: NCM — match exato
+    for row in base:
+        base_limpo = row.get("_ncm_limpo")
+        if base_limpo and base_limpo == ncm_xml_limpo:
+            return row, "ncm"
+
+    # 3) Fallback: NCM — regra de prefixo (2, 4 ou 6 dígitos)
+    for length in (6, 4, 2):
+        if len(ncm_xml_limpo) < length:
+            continue
+        for row in base:
+            base_limpo = row.get("_ncm_limpo")
+            if base_limpo and len(base_limpo) == length and ncm_xml_limpo.startswith(base_limpo):
+                return row, f"prefixo_{length}"
+
+    return None, "sem_match"
+
+
+
+# --- Índice de regras ---
+
+TAMANHOS_PREFIXO = (6, 4, 2)
+
+
+class IndiceRegrasST:
+    """
+    Índice da base normativa preparada para o match de casar_regra_st sem varredura:
+    dicionário por CEST, por NCM exato e um por tamanho de prefixo (6, 4, 2).
+    Em chaves repetidas vale a primeira linha da base, como na varredura linear.
+    """
+
+    def __init__(self, base: list[dict]):
+        self.linhas = base
+        self._versao: str | None = None
+        self.por_cest: dict[str, dict] = {}
+        self.por_ncm: dict[str, dict] = {}
+        self.por_prefixo: dict[int, dict[str, dict]] = {n: {} for n in TAMANHOS_PREFIXO}
+        for row in base:
+            base_cest = row.get("_cest_limpo")
+            if base_cest:
+                self.por_cest.setdefault(base_cest, row)
+            base_limpo = row.get("_ncm_limpo")
+            if not base_limpo:
+                continue
+            self.por_ncm.setdefault(base_limpo, row)
+            if len(base_limpo) in self.por_prefixo:
+                self.por_prefixo[len(base_limpo)].setdefault(base_limpo, row)
+
+    def __len__(self) -> int:
+        return len(self.linhas)
+
+    @property
+    def versao(self) -> str:
+        """
+        Identifica o conteúdo da base (NCM, CEST e MVA de cada regra, na ordem):
+        gravada com a classificação dos itens (versao_regras_st).
+        """
+        if self._versao is None:
+            texto = "\n".join(
+                f"{r.get('_ncm_limpo') or ''}|{r.get('_cest_limpo') or ''}|{r.get('mva_remanescente')}" for r in self.linhas
+            )
+            self._versao = hashlib.sha1(texto.encode("utf-8")).hexdigest()[:16]
+        return self._versao
+
+    def casar(self, ncm: str | None, cest: str | None = None) -> tuple[dict | None, str]:
+        """Mesmo contrato e precedência de casar_regra_st, com consultas O(1)."""
+        ncm_xml_limpo = _sanitizar_ncm(ncm)
+        cest_xml_limpo = _sanitizar_cest(cest) if cest else ""
+
+        if not ncm_xml_limpo or len(ncm_xml_limpo) < 2:
+            return None, "ncm_invalido"
+
+        if cest_xml_limpo and len(cest_xml_limpo) >= 4:
+            row = self.por_cest.get(cest_xml_limpo)
+            if row is not None:
+                return row, "cest"
+
+        row = self.por_ncm.get(ncm_xml_limpo)
+        if row is not None:
+            return row, "ncm"
+
+        for length in TAMANHOS_PREFIXO:
+            if len(ncm_xml_limpo) < length:
+                continue
+            row = self.por_prefixo[length].get(ncm_xml_limpo[:length])
+            if row is not None:
+                return row, f"prefixo_{length}"
+
+        return None, "sem_match"
+
+
+# --- Classificação gravada por item (Lógica Tripla) ---
+
+# Categorias de itens_nota.categoria_st, na ordem de precedência do Painel de Auditoria
+CATEGORIA_IRREGULAR = "irregular"
+CATEGORIA_ST_RECOLHIDA = "st_recolhida"
+CATEGORIA_ANTECIPACAO = "antecipacao"
+CATEGORIA_ST_VIA_CFOP = "st_via_cfop"
+CATEGORIA_COMUM = "comum"
+# Código de itens_nota.diagnostico_st -> categoria
+DIAGNOSTICOS_CATEGORIA = {
+    "st_nao_recolhida": CATEGORIA_IRREGULAR,  # status IRREGULAR (ICMS-ST zerado na nota)
+    "cfop_51_na_base": CATEGORIA_IRREGULAR,  # venda interna de item da base
+    "cfop_st": CATEGORIA_ST_RECOLHIDA,  # item da base com CFOP 54/64
+    "interestadual_fora_pr": CATEGORIA_ANTECIPACAO,  # CFOP 61 vindo de outra UF
+    "na_base_sem_cfop_st": CATEGORIA_ANTECIPACAO,
+    "st_so_no_xml": CATEGORIA_ST_VIA_CFOP,  # sujeito pelo CFOP 54/64, NCM fora da base
+    "fora_da_base": CATEGORIA_COMUM,
+}
+# Colunas de itens_nota preenchidas por classificacao_item_st (migration 016)
+COLUNAS_CLASSIFICACAO_ST = (
+    "categoria_st", "diagnostico_st", "regra_st", "versao_regras_st",
+    "cfop_st", "cfop_interestadual", "cfop_venda_interna",
+)
+
+
+def chave_regra_st(regra: dict | None) -> str | None:
+    """Identificador da regra da base normativa: NCM limpo, com "/CEST" quando a regra tem CEST."""
+    if not regra:
+        return None
+    ncm = regra.get("_ncm_limpo") or _sanitizar_ncm(regra.get("ncm"))
+    cest = regra.get("_cest_limpo", _sanitizar_cest(regra.get("cest")))
+    return f"{ncm}/{cest}" if cest else ncm
+
+
+def diagnostico_item_st(status_st: str | None, na_base: bool, cfop: str | None, uf_origem: str | None) -> str:
+    """
+    Código do diagnóstico do item (chave de DIAGNOSTICOS_CATEGORIA), com a mesma
+    precedência de kpis_auditoria.classificar_itens_auditoria.
+    """
+    status = str(status_st or "")
+    cfop_limpo = str(cfop or "").strip()
+    cfop_st = cfop_limpo.startswith(("54", "64"))
+    uf = str(uf_origem or "").strip().upper()
+    if "IRREGULAR" in status:
+        return "st_nao_recolhida"
+    if na_base and cfop_limpo.startswith("51"):
+        return "cfop_51_na_base"
+    if na_base and cfop_st:
+        return "cfop_st"
+    if cfop_limpo.startswith("61") and uf and uf != "PR":
+        return "interestadual_fora_pr"
+    if na_base:
+        return "na_base_sem_cfop_st"
+    if status and cfop_st:
+        return "st_so_no_xml"
+    return "fora_da_base"
+
+
+def classificacao_item_st(
+    status_st: str | None,
+    regra: dict | None,
+    cfop: str | None,
+    uf_origem: str | None,
+    versao_regras: str,
+) -> dict:
+    """
+    Colunas COLUNAS_CLASSIFICACAO_ST do item: categoria, diagnóstico, regra que
+    casou (None fora da base), versão da base (IndiceRegrasST.versao) e flags de CFOP.
+    """
+    diagnostico = diagnostico_item_st(status_st, regra is not None, cfop, uf_origem)
+    cfop_limpo = str(cfop or "").strip()
+    return {
+        "categoria_st": DIAGNOSTICOS_CATEGORIA[diagnostico],
+        "diagnostico_st": diagnostico,
+        "regra_st": chave_regra_st(regra),
+        "versao_regras_st": versao_regras,
+        "cfop_st": cfop_limpo.startswith(("54", "64")),
+        "cfop_interestadual": cfop_limpo.startswith("61"),
+        "cfop_venda_interna": cfop_limpo.startswith("51"),
+    }
+
+
+# --- Estatísticas do match ---
+
+# Critérios que contam como acerto (regra encontrada)
+CRITERIOS_ACERTO = ("cest", "ncm", "prefixo_6", "prefixo_4", "prefixo_2")
+
+
+class EstatisticasMatch:
+    """
+    Contadores agregados do match por critério (os de casar_regra_st, mais
+    "base_vazia" e "erro"). Barato o bastante para ficar sempre ligado.
+    """
+
+    def __init__(self):
+        self.contagem: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def registrar(self, criterio: str) -> None:
+        with self._lock:
+            self.contagem[criterio] += 1
+
+    def zerar(self) -> None:
+        with self._lock:
+            self.contagem.clear()
+
+    def resumo(self) -> dict:
+        """{"total", "acertos", "taxa_acerto", "por_criterio"} (taxa em 0..1)."""
+        with self._lock:
+            por_criterio = dict(self.contagem)
+        total = sum(por_criterio.values())
+        acertos = sum(por_criterio.get(c, 0) for c in CRITERIOS_ACERTO)
+        return {
+            "total": total,
+            "acertos": acertos,
+            "taxa_acerto": acertos / total if total else 0.0,
+            "por_criterio": por_criterio,
+        }
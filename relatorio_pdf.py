@@ -0,0 +1,261 @@
+"""
+Relatório PDF da auditoria (itens de Antecipação Pendente) gerado página a página.
+
+Uma única Table com todos os itens faz o reportlab dividir a tabela a cada página
+(custo quadrático) e manter tudo em memória. Aqui as linhas chegam em blocos
+(DataFrames do cache_auditoria) e cada página recebe uma Table própria, de tamanho
+fixo, desenhada direto no canvas; o PDF vai para um arquivo temporário. Para
+relatórios muito grandes há o modo "ncm": um resumo por NCM (quantidade de itens
+e valor) em vez da lista de itens.
+"""
+from collections import defaultdict
+from datetime import datetime
+import tempfile
+from typing import BinaryIO, Iterable, Iterator
+
+import pandas as pd
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen.canvas import Canvas
+    from reportlab.platypus import Frame, Paragraph, Spacer, Table, TableStyle
+    HAS_REPORTLAB = True
+except ImportError:
+    HAS_REPORTLAB = False
+
+# Linhas de itens por página (na primeira, o cabeçalho do relatório ocupa o topo)
+LINHAS_POR_PAGINA_PDF = 28
+LINHAS_PRIMEIRA_PAGINA_PDF = 24
+# Acima deste número de itens o relatório sugerido é o resumo por NCM
+LIMITE_ITENS_DETALHADO = 5_000
+# Modo -> rótulo na tela
+MODOS_RELATORIO_PDF = {
+    "itens": "Itens (detalhado)",
+    "ncm": "Resumo por NCM",
+}
+# Colunas do cache_auditoria lidas pelo relatório
+COLUNAS_RELATORIO_PDF = ["NCM", "Descrição", "Valor Item", "Diagnóstico Fiscal"]
+
+
+def modo_padrao(total_itens: int) -> str:
+    """Modo sugerido: lista de itens até LIMITE_ITENS_DETALHADO; acima disso, resumo por NCM."""
+    return "ncm" if total_itens > LIMITE_ITENS_DETALHADO else "itens"
+
+
+def formatar_reais(valor: float) -> str:
+    """1234.5 -> "1.234,50"."""
+    return f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _texto(valor, limite: int) -> str:
+    """Texto numa linha só (quebras viram espaço), cortado em limite caracteres."""
+    texto = " ".join(str(valor).split()) if valor is not None and not pd.isna(valor) else ""
+    texto = texto or "—"
+    return texto[:limite] + "…" if len(texto) > limite else texto
+
+
+def linhas_itens(blocos: Iterable[pd.DataFrame]) -> Iterator[list[str]]:
+    """Linhas da tabela de itens (NCM, Descrição, Valor, Diagnóstico) a partir dos blocos."""
+    for bloco in blocos:
+        for ncm, descricao, valor, diagnostico in bloco[COLUNAS_RELATORIO_PDF].itertuples(index=False, name=None):
+            yield [
+                _texto(ncm, 20),
+                _texto(descricao, 50),
+                formatar_reais(float(valor or 0)),
+                _texto(diagnostico, 80),
+            ]
+
+
+def resumo_por_ncm(blocos: Iterable[pd.DataFrame]) -> list[dict]:
+    """
+    Itens agrupados por NCM, bloco a bloco: {"ncm", "itens", "valor", "descricao"}
+    (a primeira descrição do NCM), do maior valor para o menor.
+    """
+    grupos: dict[str, dict] = defaultdict(lambda: {"itens": 0, "valor": 0.0, "descricao": None})
+    for bloco in blocos:
+        if bloco.empty:
+            continue
+        agregado = (
+            bloco.assign(NCM=bloco["NCM"].fillna("—").astype(str), _valor=bloco["Valor Item"].fillna(0).astype(float))
+            .groupby("NCM", sort=False)
+            .agg(itens=("_valor", "size"), valor=("_valor", "sum"), descricao=("Descrição", "first"))
+        )
+        for ncm, itens, valor, descricao in agregado.itertuples(name=None):
+            grupo = grupos[ncm]
+            grupo["itens"] += int(itens)
+            grupo["valor"] += float(valor)
+            if grupo["descricao"] is None:
+                grupo["descricao"] = descricao
+    return sorted(
+        ({"ncm": ncm, **grupo} for ncm, grupo in grupos.items()),
+        key=lambda g: (-g["valor"], g["ncm"]),
+    )
+
+
+def _linhas_resumo(grupos: list[dict]) -> Iterator[list[str]]:
+    for grupo in grupos:
+        yield [
+            _texto(grupo["ncm"], 20),
+            str(grupo["itens"]),
+            formatar_reais(grupo["valor"]),
+            _texto(grupo["descricao"], 50),
+        ]
+
+
+# Modo -> (cabeçalho, larguras em cm, colunas alinhadas à direita)
+_TABELAS = {
+    "itens": (["NCM", "Descrição", "Valor (R$)", "Diagnóstico Fiscal"], [3, 6, 3, 6], (2,)),
+    "ncm": (["NCM", "Itens", "Valor (R$)", "Descrição (exemplo)"], [3, 2, 4, 9], (1, 2)),
+}
+
+
+def _estilo_tabela(colunas_direita: tuple[int, ...]) -> "TableStyle":
+    comandos = [
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#2c3e50")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), 10),
+        ("FONTSIZE", (0, 1), (-1, -1), 9),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 10),
+        ("TOPPADDING", (0, 0), (-1, 0), 10),
+        ("BOTTOMPADDING", (0, 1), (-1, -1), 6),
+        ("TOPPADDING", (0, 1), (-1, -1), 6),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f8f9fa")]),
+    ]
+    comandos += [("ALIGN", (c, 0), (c, -1), "RIGHT") for c in colunas_direita]
+    return TableStyle(comandos)
+
+
+class _PaginasPDF:
+    """Canvas com um Frame por página; nova_pagina() fecha a atual e numera o rodapé."""
+
+    def __init__(self, destino: BinaryIO):
+        self.canvas = Canvas(destino, pagesize=A4, pageCompression=1)
+        self.largura, self.altura = A4
+        self.paginas = 0
+        self._abrir()
+
+    def _abrir(self) -> None:
+        self.paginas += 1
+        self.frame = Frame(
+            2 * cm, 2 * cm, self.largura - 4 * cm, self.altura - 4 * cm,
+            leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0,
+        )
+
+    def _rodape(self) -> None:
+        self.canvas.setFont("Helvetica", 8)
+        self.canvas.setFillColor(colors.grey)
+        self.canvas.drawRightString(self.largura - 2 * cm, 1.2 * cm, f"Página {self.paginas}")
+
+    def nova_pagina(self) -> None:
+        self._rodape()
+        self.canvas.showPage()
+        self._abrir()
+
+    def adicionar(self, flowable) -> None:
+        """
+        Desenha na página atual ou, se não couber, no topo da próxima. O que não cabe
+        nem numa página vazia é dividido (Table por linhas, Paragraph por linhas de
+        texto) e continua nas seguintes; ValueError se não puder ser dividido.
+        """
+        pendentes = [flowable]
+        while pendentes:
+            atual = pendentes.pop(0)
+            if self.frame.add(atual, self.canvas):
+                continue
+            if not self.frame._atTop:
+                self.nova_pagina()
+                pendentes.insert(0, atual)
+                continue
+            partes = self.frame.split(atual, self.canvas)
+            if len(partes) < 2:
+                raise ValueError(f"{type(atual).__name__} não cabe numa página do relatório e não pode ser dividido.")
+            pendentes[:0] = partes
+
+    def fechar(self) -> None:
+        self._rodape()
+        self.canvas.save()
+
+
+def escrever_relatorio_pdf(
+    destino: BinaryIO,
+    blocos: Iterable[pd.DataFrame],
+    nome_cliente: str,
+    valor_total_antecipacao: float,
+    modo: str = "itens",
+    linhas_por_pagina: int = LINHAS_POR_PAGINA_PDF,
+    linhas_primeira_pagina: int = LINHAS_PRIMEIRA_PAGINA_PDF,
+) -> int:
+    """
+    Escreve o relatório em destino: no modo "itens", uma Table de até
+    linhas_por_pagina linhas por página, alimentada pelos blocos sem juntá-los;
+    no modo "ncm", o resumo_por_ncm. Retorna o número de páginas.
+    """
+    styles = getSampleStyleSheet()
+    titulo = ParagraphStyle(
+        name="TituloRelatorio",
+        parent=styles["Heading1"],
+        fontSize=18,
+        spaceAfter=12,
+        textColor=colors.HexColor("#1a1a1a"),
+    )
+    pdf = _PaginasPDF(destino)
+    pdf.adicionar(Paragraph("Relatório de Auditoria de ICMS-ST", titulo))
+    pdf.adicionar(Spacer(1, 0.5 * cm))
+    dados_cabecalho = f"<b>Cliente:</b> {nome_cliente}<br/><b>Data da análise:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+    pdf.adicionar(Paragraph(dados_cabecalho, styles["Normal"]))
+    pdf.adicionar(Spacer(1, 1 * cm))
+
+    total_itens = 0
+    if modo == "ncm":
+        grupos = resumo_por_ncm(blocos)
+        total_itens = sum(g["itens"] for g in grupos)
+        linhas = _linhas_resumo(grupos)
+    else:
+        linhas = linhas_itens(blocos)
+    cabecalho, larguras, colunas_direita = _TABELAS[modo]
+    estilo = _estilo_tabela(colunas_direita)
+    larguras = [w * cm for w in larguras]
+
+    pagina: list[list[str]] = []
+    capacidade = linhas_primeira_pagina
+    for linha in linhas:
+        pagina.append(linha)
+        if len(pagina) == capacidade:
+            pdf.adicionar(Table([cabecalho] + pagina, colWidths=larguras, style=estilo, repeatRows=1))
+            pdf.nova_pagina()
+            pagina, capacidade = [], linhas_por_pagina
+    if pagina:
+        pdf.adicionar(Table([cabecalho] + pagina, colWidths=larguras, style=estilo, repeatRows=1))
+    pdf.adicionar(Spacer(1, 1 * cm))
+
+    # Totalização
+    pdf.adicionar(Paragraph("<b>Totalização</b>", styles["Heading2"]))
+    total_text = f"Valor total de base de cálculo sujeito à antecipação de ICMS-ST: <b>R$ {formatar_reais(valor_total_antecipacao)}</b>"
+    pdf.adicionar(Paragraph(total_text, styles["Normal"]))
+    if modo == "ncm":
+        pdf.adicionar(Paragraph(f"{total_itens} itens agrupados em {len(grupos)} NCMs.", styles["Normal"]))
+    pdf.adicionar(Spacer(1, 0.5 * cm))
+    pdf.adicionar(Paragraph("Itens listados requerem regularização pelo destinatário no Estado do Paraná.", styles["Normal"]))
+    pdf.fechar()
+    return pdf.paginas
+
+
+def gerar_relatorio_pdf(
+    blocos: Iterable[pd.DataFrame],
+    nome_cliente: str,
+    valor_total_antecipacao: float,
+    modo: str = "itens",
+) -> BinaryIO:
+    """Arquivo temporário (já no início, apagado ao fechar) com o relatório de escrever_relatorio_pdf."""
+    if not HAS_REPORTLAB:
+        raise RuntimeError("Relatório PDF indisponível (reportlab não instalado).")
+    arquivo = tempfile.TemporaryFile()
+    escrever_relatorio_pdf(arquivo, blocos, nome_cliente, valor_total_antecipacao, modo)
+    arquivo.seek(0)
+    return arquivo
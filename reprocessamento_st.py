@@ -0,0 +1,345 @@
+"""
+Reprocessamento em massa do status ST dos itens já gravados.
+
+Os itens de muitas notas são lidos de uma vez (consultas_paginadas), reclassificados
+em memória com o IndiceRegrasST e só as linhas cujo status_st ou mva_remanescente
+mudou voltam ao banco, em upserts por lote. O progresso é informado por callback
+a cada bloco de notas.
+
+Reclassificação incremental: quando a base normativa muda (upload do Anexo IX ou
+scripts/extrator_anexo_ix.py), só os itens com NCM/CEST atingidos pela diferença
+entre as regras antigas e novas são relidos, com um relatório por cliente.
+
+Com a migration 016 (esquema informado), os dois caminhos gravam também a
+classificação da auditoria de cada item (regras_st.classificacao_item_st) com a
+versão da base que a produziu.
+"""
+from typing import Callable
+
+from consultas_paginadas import buscar_paginado, buscar_por_ids, em_paralelo, lotes
+from esquema_banco import EsquemaBanco
+from regras_st import (
+    COLUNAS_CLASSIFICACAO_ST,
+    STATUS_IRREGULAR_ST,
+    STATUS_SUJEITO_ST,
+    EstatisticasMatch,
+    IndiceRegrasST,
+    cfop_indica_st,
+    classificacao_item_st,
+    preparar_base_normativa,
+)
+
+# Notas lidas e reclassificadas por bloco (uma atualização de progresso por bloco)
+LOTE_REPROCESSAMENTO = 500
+# Itens alterados por upsert
+LOTE_UPSERT_ITENS = 1000
+# Condições (ncm.like / cest.eq) por filtro or_ na busca incremental
+LOTE_CHAVES_OR = 50
+# Colunas dos itens lidos para reclassificar
+COLUNAS_ITEM_REPROCESSAMENTO = "id, nota_id, ncm, cest, cfop, status_st, mva_remanescente"
+
+
+def grava_classificacao(esquema: EsquemaBanco | None) -> bool:
+    """True se o esquema tem as colunas de classificação da auditoria (migration 016)."""
+    return esquema is not None and all(esquema.tem("itens_nota", c) for c in COLUNAS_CLASSIFICACAO_ST)
+
+
+def _colunas_itens(classificar: bool) -> str:
+    if not classificar:
+        return COLUNAS_ITEM_REPROCESSAMENTO
+    return COLUNAS_ITEM_REPROCESSAMENTO + ", " + ", ".join(COLUNAS_CLASSIFICACAO_ST)
+
+
+def uf_origem_por_nota(supabase, nota_ids, esquema: EsquemaBanco) -> dict[str, str]:
+    """id da nota (str) -> UF de origem normalizada ("" sem UF ou sem a migration 012)."""
+    if not esquema.tem("notas_fiscais", "uf_origem"):
+        return {}
+    return {
+        str(n["id"]): str(n.get("uf_origem") or "").strip().upper()
+        for n in buscar_por_ids(
+            lambda lote: supabase.table("notas_fiscais").select("id, uf_origem").in_("id", lote).order("id"),
+            nota_ids,
+        )
+    }
+
+
+def carregar_base_normativa(supabase) -> list[dict]:
+    """
+    base_normativa_ncm inteira, paginada e preparada para o match (com CEST e MVA
+    remanescente quando as colunas existirem).
+    """
+    for colunas in ("ncm, descricao, cest, mva_remanescente", "ncm, descricao, cest"):
+        try:
+            linhas = buscar_paginado(lambda: supabase.table("base_normativa_ncm").select(colunas).order("ncm").order("cest"))
+            return preparar_base_normativa(linhas)
+        except Exception:
+            continue
+    linhas = buscar_paginado(lambda: supabase.table("base_normativa_ncm").select("ncm, descricao").order("ncm"))
+    return preparar_base_normativa(linhas)
+
+
+def _casar_item(item: dict, indice: IndiceRegrasST, estatisticas: EstatisticasMatch | None) -> dict | None:
+    regra = None
+    if item.get("ncm"):
+        regra, criterio = indice.casar(item.get("ncm"), item.get("cest"))
+        if estatisticas is not None:
+            estatisticas.registrar(criterio)
+    return regra
+
+
+def _status_e_mva(item: dict, regra: dict | None) -> tuple[str | None, float | None]:
+    """
+    Status e MVA pela regra atual. O IRREGULAR gravado na importação (ICMS-ST zerado
+    no XML) não depende da base: segue valendo enquanto o item continuar sujeito.
+    """
+    sujeito = regra is not None or cfop_indica_st(item.get("cfop"))
+    mva_rem = regra.get("mva_remanescente") if regra else None
+    if not sujeito:
+        status_st = None
+    elif item.get("status_st") == STATUS_IRREGULAR_ST:
+        status_st = STATUS_IRREGULAR_ST
+    else:
+        status_st = STATUS_SUJEITO_ST
+    return status_st, (float(mva_rem) if mva_rem is not None else None)
+
+
+def classificar_item_st(
+    item: dict,
+    indice: IndiceRegrasST,
+    estatisticas: EstatisticasMatch | None = None,
+) -> tuple[str | None, float | None]:
+    """(status_st, mva_remanescente) do item: regra na base ou CFOP de ST tornam o item sujeito."""
+    return _status_e_mva(item, _casar_item(item, indice, estatisticas))
+
+
+def _mesmo_mva(a, b) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(float(a) - float(b)) < 1e-9
+
+
+def reclassificar_itens(
+    itens: list[dict],
+    indice: IndiceRegrasST,
+    estatisticas: EstatisticasMatch | None = None,
+    uf_por_nota: dict[str, str] | None = None,
+) -> tuple[list[dict], int]:
+    """
+    (linhas {id, nota_id, status_st, mva_remanescente} dos itens cuja classificação
+    mudou, total de itens sujeitos a ST). Com uf_por_nota, as linhas levam também
+    as COLUNAS_CLASSIFICACAO_ST e contam como alteradas quando elas mudam (a troca
+    só de versão fica para atualizar_versao_classificacao).
+    """
+    alterados = []
+    sujeitos = 0
+    for item in itens:
+        regra = _casar_item(item, indice, estatisticas)
+        status_st, mva_rem = _status_e_mva(item, regra)
+        if status_st:
+            sujeitos += 1
+        linha = {
+            "id": item["id"],
+            "nota_id": item.get("nota_id"),
+            "status_st": status_st,
+            "mva_remanescente": mva_rem,
+        }
+        # Mudança é entrar ou sair de ST (ou trocar a MVA), não o texto do status
+        mudou = bool(item.get("status_st")) != bool(status_st) or not _mesmo_mva(item.get("mva_remanescente"), mva_rem)
+        if uf_por_nota is not None:
+            classificacao = classificacao_item_st(
+                status_st, regra, item.get("cfop"), uf_por_nota.get(str(item.get("nota_id")), ""), indice.versao,
+            )
+            linha.update(classificacao)
+            mudou = mudou or any(
+                item.get(c) != v for c, v in classificacao.items() if c != "versao_regras_st"
+            )
+        if mudou:
+            alterados.append(linha)
+    return alterados, sujeitos
+
+
+def atualizar_versao_classificacao(
+    supabase,
+    itens: list[dict],
+    alterados: list[dict],
+    versao: str,
+) -> int:
+    """
+    Grava a versão nova nos itens cuja classificação não mudou mas foi feita com
+    outra versão da base (UPDATE só de versao_regras_st, por lotes de ids).
+    Retorna o número de itens atualizados.
+    """
+    gravados = {r["id"] for r in alterados}
+    ids = [
+        item["id"] for item in itens
+        if item["id"] not in gravados and item.get("categoria_st") and item.get("versao_regras_st") != versao
+    ]
+    for lote in lotes(ids):
+        supabase.table("itens_nota").update({"versao_regras_st": versao}, returning="minimal").in_("id", lote).execute()
+    return len(ids)
+
+
+def reprocessar_notas(
+    supabase,
+    nota_ids: list,
+    indice: IndiceRegrasST,
+    ao_progredir: Callable[[int, int, dict], None] | None = None,
+    estatisticas: EstatisticasMatch | None = None,
+    lote_notas: int = LOTE_REPROCESSAMENTO,
+    lote_upsert: int = LOTE_UPSERT_ITENS,
+    esquema: EsquemaBanco | None = None,
+) -> dict:
+    """
+    Reclassifica os itens das notas em blocos de lote_notas e grava só os alterados.
+    ao_progredir(notas_feitas, total_notas, resumo) é chamado ao fim de cada bloco.
+    Com esquema da migration 016, grava também a classificação da auditoria.
+    Retorna {"notas", "itens", "itens_st", "alterados"}.
+    """
+    resumo = {"notas": 0, "itens": 0, "itens_st": 0, "alterados": 0}
+    ids = list(dict.fromkeys(nota_ids))
+    classificar = grava_classificacao(esquema)
+    colunas = _colunas_itens(classificar)
+    for inicio in range(0, len(ids), lote_notas):
+        bloco = ids[inicio : inicio + lote_notas]
+        tarefas = {
+            "itens": lambda bloco=bloco: buscar_por_ids(
+                lambda lote: supabase.table("itens_nota").select(colunas).in_("nota_id", lote).order("id"),
+                bloco,
+                paralelo=True,
+            ),
+        }
+        if classificar:
+            tarefas["ufs"] = lambda bloco=bloco: uf_origem_por_nota(supabase, bloco, esquema)
+        lidos = em_paralelo(tarefas)
+        itens = lidos["itens"]
+        alterados, sujeitos = reclassificar_itens(itens, indice, estatisticas, lidos.get("ufs"))
+        for i in range(0, len(alterados), lote_upsert):
+            supabase.table("itens_nota").upsert(alterados[i : i + lote_upsert], on_conflict="id").execute()
+        if classificar:
+            atualizar_versao_classificacao(supabase, itens, alterados, indice.versao)
+        resumo["notas"] += len(bloco)
+        resumo["itens"] += len(itens)
+        resumo["itens_st"] += sujeitos
+        resumo["alterados"] += len(alterados)
+        if ao_progredir is not None:
+            ao_progredir(resumo["notas"], len(ids), dict(resumo))
+    return resumo
+
+
+# --- Reclassificação incremental ---
+
+def _chave_regra(row: dict) -> tuple:
+    mva = row.get("mva_remanescente")
+    return (row.get("_ncm_limpo") or "", row.get("_cest_limpo") or "", None if mva is None else round(float(mva), 9))
+
+
+def diferenca_regras(antigas: list[dict], novas: list[dict]) -> tuple[set[str], set[str]]:
+    """
+    (NCMs, CESTs) das regras incluídas, removidas ou alteradas (MVA) entre duas bases
+    preparadas. Só itens cujo NCM começa por um desses NCMs (exato ou prefixo) ou
+    cujo CEST é um desses CESTs podem mudar de classificação.
+    """
+    mudadas = {_chave_regra(r) for r in antigas} ^ {_chave_regra(r) for r in novas}
+    ncms = {ncm for ncm, _, _ in mudadas if ncm}
+    cests = {cest for _, cest, _ in mudadas if len(cest) >= 4}
+    return ncms, cests
+
+
+def buscar_itens_por_chaves(
+    supabase,
+    ncms: set[str],
+    cests: set[str],
+    lote_chaves: int = LOTE_CHAVES_OR,
+    colunas: str = COLUNAS_ITEM_REPROCESSAMENTO,
+) -> list[dict]:
+    """Itens com NCM iniciado por algum de ncms ou CEST em cests (filtros or_ em lotes, paginados)."""
+    condicoes = [f"ncm.like.{ncm}*" for ncm in sorted(ncms)] + [f"cest.eq.{cest}" for cest in sorted(cests)]
+    vistos: dict = {}
+    for i in range(0, len(condicoes), lote_chaves):
+        filtro = ",".join(condicoes[i : i + lote_chaves])
+        for item in buscar_paginado(
+            lambda: supabase.table("itens_nota").select(colunas).or_(filtro).order("id")
+        ):
+            vistos.setdefault(item["id"], item)
+    return list(vistos.values())
+
+
+def relatorio_por_cliente(supabase, itens: list[dict], alterados: list[dict]) -> list[dict]:
+    """
+    Uma linha por cliente afetado: notas e itens alterados, itens que passaram a
+    ser sujeitos a ST e que deixaram de ser.
+    """
+    antes = {item["id"]: item.get("status_st") for item in itens}
+    notas = buscar_por_ids(
+        lambda lote: supabase.table("notas_fiscais").select("id, cliente_id").in_("id", lote).order("id"),
+        {str(r["nota_id"]) for r in alterados if r.get("nota_id") is not None},
+    )
+    cliente_por_nota = {str(n["id"]): str(n["cliente_id"]) if n.get("cliente_id") else "" for n in notas}
+    ids_clientes = {c for c in cliente_por_nota.values() if c}
+    nomes = {
+        str(c["id"]): c.get("nome_fantasia") or c.get("razao_social") or str(c["id"])
+        for c in buscar_por_ids(
+            lambda lote: supabase.table("clientes").select("id, razao_social, nome_fantasia").in_("id", lote).order("id"),
+            ids_clientes,
+        )
+    }
+    por_cliente: dict[str, dict] = {}
+    for r in alterados:
+        cliente_id = cliente_por_nota.get(str(r.get("nota_id")), "")
+        linha = por_cliente.setdefault(cliente_id, {
+            "cliente_id": cliente_id or None,
+            "cliente": nomes.get(cliente_id, "Sem cliente vinculado" if not cliente_id else cliente_id),
+            "notas": set(),
+            "itens_alterados": 0,
+            "passaram_a_st": 0,
+            "deixaram_st": 0,
+        })
+        linha["notas"].add(str(r.get("nota_id")))
+        linha["itens_alterados"] += 1
+        tinha_st, tem_st = bool(antes.get(r["id"])), bool(r["status_st"])
+        linha["passaram_a_st"] += int(tem_st and not tinha_st)
+        linha["deixaram_st"] += int(tinha_st and not tem_st)
+    relatorio = [{**linha, "notas": len(linha["notas"])} for linha in por_cliente.values()]
+    return sorted(relatorio, key=lambda linha: -linha["itens_alterados"])
+
+
+def reclassificar_incremental(
+    supabase,
+    antigas: list[dict],
+    novas: list[dict],
+    estatisticas: EstatisticasMatch | None = None,
+    lote_upsert: int = LOTE_UPSERT_ITENS,
+    esquema: EsquemaBanco | None = None,
+) -> dict:
+    """
+    Reclassifica só os itens atingidos pela mudança de antigas para novas (bases
+    preparadas) e grava os alterados. Com esquema da migration 016, grava também a
+    classificação da auditoria e passa para a versão nova, num único UPDATE, os
+    itens classificados com a versão antiga que a mudança não atinge.
+    Retorna {"ncms", "cests", "itens", "alterados", "relatorio"} (relatório por
+    cliente, ver relatorio_por_cliente).
+    """
+    ncms, cests = diferenca_regras(antigas, novas)
+    resultado = {"ncms": len(ncms), "cests": len(cests), "itens": 0, "alterados": 0, "relatorio": []}
+    if not ncms and not cests:
+        return resultado
+    classificar = grava_classificacao(esquema)
+    indice = IndiceRegrasST(novas)
+    itens = buscar_itens_por_chaves(supabase, ncms, cests, colunas=_colunas_itens(classificar))
+    ufs = uf_origem_por_nota(supabase, {str(i["nota_id"]) for i in itens if i.get("nota_id")}, esquema) if classificar else None
+    alterados, _ = reclassificar_itens(itens, indice, estatisticas, ufs)
+    for i in range(0, len(alterados), lote_upsert):
+        supabase.table("itens_nota").upsert(alterados[i : i + lote_upsert], on_conflict="id").execute()
+    if classificar:
+        versao_antiga = IndiceRegrasST(antigas).versao
+        if versao_antiga != indice.versao:
+            (
+                supabase.table("itens_nota")
+                .update({"versao_regras_st": indice.versao}, returning="minimal")
+                .eq("versao_regras_st", versao_antiga)
+                .execute()
+            )
+    resultado.update(itens=len(itens), alterados=len(alterados))
+    if alterados:
+        resultado["relatorio"] = relatorio_por_cliente(supabase, itens, alterados)
+    return resultado
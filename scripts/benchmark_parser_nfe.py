@@ -0,0 +1,123 @@
+"""
+Benchmark: extração de NF-e via xmltodict (caminho antigo) x nfe_parser (iterparse).
+
+Gera NF-e sintéticas com N itens e mede tempo e pico de memória (tracemalloc)
+das duas abordagens extraindo os mesmos campos (ide, dest, emit, det, ICMSTot).
+
+Uso: python scripts/benchmark_parser_nfe.py [--notas 2000] [--itens 30]
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import xmltodict  # type: ignore
+
+from nfe_parser import (
+    extrair_data_emissao_ide,
+    extrair_impostos_item,
+    extrair_registro_nfe,
+    extrair_valor_frete,
+    extrair_valor_icms_origem,
+    extrair_valor_ipi,
+)
+
+DET_TEMPLATE = """
+      <det nItem="{n}">
+        <prod><cProd>P{n}</cProd><cEAN>7890000{n:05d}</cEAN><xProd>Produto {n}</xProd><NCM>8202{n:04d}</NCM>
+          <CEST>0800400</CEST><CFOP>6403</CFOP><uCom>UN</uCom><qCom>2.0000</qCom><vUnCom>10.00</vUnCom>
+          <vProd>20.00</vProd><uTrib>UN</uTrib><qTrib>2.0000</qTrib><vUnTrib>10.00</vUnTrib><indTot>1</indTot></prod>
+        <imposto><vTotTrib>3.00</vTotTrib>
+          <ICMS><ICMS10><orig>0</orig><CST>10</CST><modBC>3</modBC><vBC>20.00</vBC><pICMS>12.00</pICMS><vICMS>2.40</vICMS>
+            <modBCST>4</modBCST><pMVAST>40.00</pMVAST><vBCST>28.00</vBCST><pICMSST>19.50</pICMSST><vICMSST>3.06</vICMSST></ICMS10></ICMS>
+          <IPI><cEnq>999</cEnq><IPITrib><CST>50</CST><vBC>20.00</vBC><pIPI>5.00</pIPI><vIPI>1.00</vIPI></IPITrib></IPI>
+          <PIS><PISAliq><CST>01</CST><vBC>20.00</vBC><pPIS>1.65</pPIS><vPIS>0.33</vPIS></PISAliq></PIS>
+          <COFINS><COFINSAliq><CST>01</CST><vBC>20.00</vBC><pCOFINS>7.60</pCOFINS><vCOFINS>1.52</vCOFINS></COFINSAliq></COFINS>
+        </imposto>
+      </det>"""
+
+NFE_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+  <NFe>
+    <infNFe Id="NFe4124031234567800019955001{numero:09d}1000012345" versao="4.00">
+      <ide><cUF>41</cUF><nNF>{numero}</nNF><dhEmi>2024-03-01T08:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>
+      <emit><CNPJ>99888777000166</CNPJ><xNome>Fornecedor</xNome>
+        <enderEmit><xLgr>Rua A</xLgr><nro>1</nro><xMun>Sao Paulo</xMun><UF>SP</UF></enderEmit></emit>
+      <dest><CNPJ>12345678000199</CNPJ><xNome>Cliente</xNome></dest>{dets}
+      <total><ICMSTot><vBC>600.00</vBC><vICMS>72.00</vICMS><vST>91.80</vST><vProd>600.00</vProd>
+        <vIPI>30.00</vIPI><vPIS>9.90</vPIS><vCOFINS>45.60</vCOFINS><vNF>721.80</vNF></ICMSTot></total>
+      <transp><modFrete>0</modFrete></transp>
+      <infAdic><infCpl>{obs}</infCpl></infAdic>
+    </infNFe>
+    <Signature><SignedInfo/><SignatureValue>{assinatura}</SignatureValue></Signature>
+  </NFe>
+  <protNFe><infProt><chNFe>4124031234567800019955001{numero:09d}1000012345</chNFe></infProt></protNFe>
+</nfeProc>
+"""
+
+
+def gerar_xml(numero: int, n_itens: int) -> bytes:
+    dets = "".join(DET_TEMPLATE.format(n=i + 1) for i in range(n_itens))
+    return NFE_TEMPLATE.format(numero=numero, dets=dets, obs="x" * 500, assinatura="A" * 344).encode("utf-8")
+
+
+def extrair_via_xmltodict(xml_bytes: bytes) -> dict:
+    """Caminho antigo do processar_xml: dict completo + .get() em cadeia."""
+    xml_dict = xmltodict.parse(xml_bytes.decode("utf-8", errors="ignore"))
+    inf_nfe = xml_dict["nfeProc"]["NFe"]["infNFe"]
+    ide = inf_nfe.get("ide", {})
+    det = inf_nfe.get("det", [])
+    if not isinstance(det, list):
+        det = [det]
+    itens = []
+    for item in det:
+        prod = item.get("prod", {})
+        itens.append({
+            "ncm": prod.get("NCM"),
+            "valor_ipi": extrair_valor_ipi(item),
+            "valor_frete": extrair_valor_frete(item),
+            "icms_origem": extrair_valor_icms_origem(item),
+            "impostos": extrair_impostos_item(item),
+        })
+    return {
+        "numero_nfe": ide.get("nNF"),
+        "data_emissao": extrair_data_emissao_ide(ide),
+        "cnpj_destinatario": inf_nfe.get("dest", {}).get("CNPJ"),
+        "uf_origem": inf_nfe.get("emit", {}).get("enderEmit", {}).get("UF"),
+        "itens": itens,
+        "totais": inf_nfe.get("total", {}).get("ICMSTot", {}),
+    }
+
+
+def medir(nome: str, funcao, xmls: list[bytes]) -> float:
+    """Tempo total sobre todas as notas e pico de memória de uma nota (tracemalloc à parte)."""
+    inicio = time.perf_counter()
+    for xml in xmls:
+        funcao(xml)
+    duracao = time.perf_counter() - inicio
+    tracemalloc.start()
+    funcao(xmls[0])
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{nome:12} | {duracao:8.3f} s | {len(xmls) / duracao:9.0f} notas/s | pico/nota {pico / 1024:8.0f} KiB")
+    return duracao
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de extração de NF-e.")
+    parser.add_argument("--notas", type=int, default=2000)
+    parser.add_argument("--itens", type=int, default=30)
+    args = parser.parse_args()
+
+    xmls = [gerar_xml(i + 1, args.itens) for i in range(args.notas)]
+    print(f"{args.notas} notas x {args.itens} itens ({sum(map(len, xmls)) / 1024 / 1024:.1f} MiB de XML)")
+    t_antigo = medir("xmltodict", extrair_via_xmltodict, xmls)
+    t_novo = medir("iterparse", extrair_registro_nfe, xmls)
+    print(f"Ganho: {t_antigo / t_novo:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: relatório PDF da auditoria numa Table única (como era feito) x página a
+página (relatorio_pdf), nos modos de itens e de resumo por NCM.
+
+Gera itens sintéticos de Antecipação Pendente em blocos e mede o tempo de cada
+abordagem e, com --memoria, o pico de memória numa segunda execução (tracemalloc
+deixa o código bem mais lento). A Table única só roda até --limite-tabela-unica
+itens, pois o custo cresce de forma quadrática.
+
+Uso: python scripts/benchmark_pdf_auditoria.py [--itens 1000 10000 100000] [--limite-tabela-unica 10000] [--memoria]
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd
+
+from relatorio_pdf import HAS_REPORTLAB, escrever_relatorio_pdf, linhas_itens
+
+LINHAS_POR_BLOCO = 10_000
+
+
+def gerar_blocos(n_itens: int, seed: int = 0):
+    rnd = random.Random(seed)
+    ncms = ["".join(rnd.choices("0123456789", k=8)) for _ in range(300)]
+    for inicio in range(0, n_itens, LINHAS_POR_BLOCO):
+        n = min(LINHAS_POR_BLOCO, n_itens - inicio)
+        yield pd.DataFrame({
+            "NCM": [rnd.choice(ncms) for _ in range(n)],
+            "Descrição": [f"Produto {inicio + i} embalagem com 12 unidades" for i in range(n)],
+            "Valor Item": [round(rnd.uniform(1, 5000), 2) for _ in range(n)],
+            "Diagnóstico Fiscal": ["Sujeito a ST no PR sem destaque na nota: antecipação pendente."] * n,
+        })
+
+
+def tabela_unica(destino, blocos) -> None:
+    """Abordagem anterior: todas as linhas numa Table com repeatRows, via SimpleDocTemplate."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Table
+
+    dados = [["NCM", "Descrição", "Valor (R$)", "Diagnóstico Fiscal"]] + list(linhas_itens(blocos))
+    doc = SimpleDocTemplate(destino, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
+    doc.build([Table(dados, colWidths=[3*cm, 6*cm, 3*cm, 6*cm], repeatRows=1)])
+
+
+def medir(nome: str, n_itens: int, funcao, memoria: bool) -> None:
+    with tempfile.TemporaryFile() as destino:
+        inicio = time.perf_counter()
+        funcao(destino, gerar_blocos(n_itens))
+        duracao = time.perf_counter() - inicio
+        tamanho = destino.seek(0, 2)
+    texto_pico = "—"
+    if memoria:
+        with tempfile.TemporaryFile() as destino:
+            tracemalloc.start()
+            funcao(destino, gerar_blocos(n_itens))
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        texto_pico = f"{pico / 2**20:.1f} MiB"
+    print(f"{n_itens:>8} | {nome:16} | {duracao:8.2f} s | {texto_pico:>12} | {tamanho / 2**20:7.1f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark do relatório PDF da auditoria.")
+    parser.add_argument("--itens", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--limite-tabela-unica", type=int, default=10_000)
+    parser.add_argument("--memoria", action="store_true", help="mede também o pico de memória")
+    args = parser.parse_args()
+    if not HAS_REPORTLAB:
+        sys.exit("reportlab não instalado.")
+
+    print("   itens | abordagem        |      tempo |   pico memória |  arquivo")
+    for n_itens in args.itens:
+        if n_itens <= args.limite_tabela_unica:
+            medir("tabela única", n_itens, tabela_unica, args.memoria)
+        medir("por página", n_itens, lambda d, b: escrever_relatorio_pdf(d, b, "Benchmark", 0.0), args.memoria)
+        medir("resumo por NCM", n_itens, lambda d, b: escrever_relatorio_pdf(d, b, "Benchmark", 0.0, modo="ncm"), args.memoria)
+
+
+if __name__ == "__main__":
+    main()
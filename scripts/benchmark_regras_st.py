@@ -0,0 +1,68 @@
+"""
+Benchmark: match de regras ST por varredura linear (casar_regra_st) x índice (IndiceRegrasST).
+
+Gera uma base sintética no formato do Anexo IX (NCMs de 2, 4, 6 e 8 dígitos,
+parte com CEST) e consulta NCMs/CESTs aleatórios nas duas abordagens.
+
+Uso: python scripts/benchmark_regras_st.py [--regras 2000] [--consultas 100000]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from regras_st import IndiceRegrasST, casar_regra_st, preparar_base_normativa
+
+
+def gerar_base(n_regras: int, rnd: random.Random) -> list[dict]:
+    linhas = []
+    for _ in range(n_regras):
+        tamanho = rnd.choice((2, 4, 6, 8, 8, 8))
+        ncm = "".join(rnd.choices("0123456789", k=tamanho))
+        cest = "".join(rnd.choices("0123456789", k=7)) if rnd.random() < 0.4 else None
+        linhas.append({"ncm": ncm, "descricao": f"Regra {ncm}", "cest": cest})
+    return preparar_base_normativa(linhas)
+
+
+def medir(nome: str, funcao, consultas: list[tuple[str, str | None]]) -> float:
+    inicio = time.perf_counter()
+    for ncm, cest in consultas:
+        funcao(ncm, cest)
+    duracao = time.perf_counter() - inicio
+    print(f"{nome:10} | {duracao:8.3f} s | {len(consultas) / duracao:12.0f} consultas/s")
+    return duracao
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark do match de regras ST.")
+    parser.add_argument("--regras", type=int, default=2000)
+    parser.add_argument("--consultas", type=int, default=100000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    base = gerar_base(args.regras, rnd)
+    consultas = []
+    for _ in range(args.consultas):
+        if rnd.random() < 0.5:
+            # NCM derivado de uma regra existente (match exato ou por prefixo)
+            ncm = (rnd.choice(base)["_ncm_limpo"] + "00000000")[:8]
+        else:
+            ncm = "".join(rnd.choices("0123456789", k=8))
+        cest = "".join(rnd.choices("0123456789", k=7)) if rnd.random() < 0.3 else None
+        consultas.append((ncm, cest))
+
+    inicio = time.perf_counter()
+    indice = IndiceRegrasST(base)
+    print(f"{len(base)} regras, {len(consultas)} consultas (índice montado em {(time.perf_counter() - inicio) * 1000:.1f} ms)")
+    # A varredura linear usa uma amostra para não dominar o tempo do script
+    amostra = consultas[: max(1, len(consultas) // 20)]
+    t_linear = medir("linear", lambda n, c: casar_regra_st(base, n, c), amostra) / len(amostra)
+    t_indice = medir("índice", indice.casar, consultas) / len(consultas)
+    print(f"Ganho por consulta: {t_linear / t_indice:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
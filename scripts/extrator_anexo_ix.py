@@ -1,22 +1,41 @@
 """
 Extrator de NCMs do Anexo IX — Fonte: dados_anexo_ix.csv
 
-- Leitura: pd.read_csv(..., sep=';', encoding='latin-1')
+- Leitura e limpeza: anexo_ix.carregar_anexo_ix (sep=';', UTF-8 ou latin-1)
 - NCM: remove todos os pontos e espaços (só dígitos). Ex: 18.06.90.00 -> 18069000
 - MVA decimal: mva / 100
 - MVA remanescente (Art. 17): mva_decimal * 0.7
-- Upsert: on_conflict='ncm'
-- Após carga: teste de busca NCM 8202 (Serrote)
+- --dry-run: só mostra o que mudaria na base (novos/alterados), sem gravar
+- Upsert: on_conflict='ncm'; CEST gravado em massa (RPC da migration 017 ou lotes
+  concorrentes), não um UPDATE por NCM
+- Ao final, o tempo de cada fase
+- Após carga: reclassifica só os itens_nota atingidos pelas regras alteradas
+  (relatório por cliente) e testa a busca NCM 8202 (Serrote)
 
-Uso: python scripts/extrator_anexo_ix.py [--csv caminho.csv]
+Uso: python scripts/extrator_anexo_ix.py [--csv caminho.csv] [--sem-reclassificar] [--dry-run]
 """
 import argparse
+from contextlib import contextmanager
 import os
-import re
+import sys
+import time
+from pathlib import Path
 
-import pandas as pd
 from supabase import create_client, Client  # type: ignore
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anexo_ix import (
+    atualizar_cest_em_massa,
+    carregar_anexo_ix,
+    comparar_com_base,
+    linhas_base_normativa,
+    mapa_ncm_cest,
+    registros_anexo_ix,
+)
+from esquema_banco import detectar_esquema
+from reprocessamento_st import carregar_base_normativa, reclassificar_incremental
+
 try:
     from dotenv import load_dotenv
     load_dotenv()
@@ -29,7 +48,6 @@ COL_DESCRICAO = "descricao"
 COL_MVA_ST_INTERNA = "mva_st_interna"  # MVA original em decimal
 COL_MVA_REMANESCENTE = "mva_remanescente"  # 70% da MVA (Art. 17)
 BATCH_SIZE = 500
-FATOR_ART_17 = 0.7  # 70% (Art. 17)
 
 
 def get_supabase_client() -> Client:
@@ -42,76 +60,24 @@ def get_supabase_client() -> Client:
     return create_client(url, key)
 
 
-def apenas_digitos(s: str) -> str:
-    """Remove tudo exceto dígitos."""
-    return re.sub(r"\D", "", str(s)) if pd.notna(s) else ""
-
-
 def carregar_csv(csv_path: str) -> list[dict]:
     """
-    Lê dados_anexo_ix.csv e prepara registros para upsert.
+    Lê dados_anexo_ix.csv (anexo_ix.carregar_anexo_ix) e prepara registros para upsert.
     """
-    # 1. Leitura Segura
     print(f"Lendo CSV: {csv_path}")
-    df = pd.read_csv(csv_path, sep=';', encoding='latin-1')
-    df.columns = df.columns.str.strip().str.lower()
-    
-    print(f"Colunas: {list(df.columns)}")
-    print(f"Total de linhas: {len(df)}")
-    
-    # 2. Limpeza no ato: NCM só dígitos
-    df["ncm"] = df["ncm"].astype(str).apply(apenas_digitos)
-    df = df[df["ncm"].str.len() >= 2]
-    df = df[~df["ncm"].isin(["", "nan", "None"])]
-    # CEST: normaliza (só dígitos, ex: 03.001.00 -> 0300100)
-    if "cest" in df.columns:
-        df["cest"] = df["cest"].astype(str).apply(apenas_digitos)
-    else:
-        df["cest"] = ""
-    
-    # MVA: converte para decimal real (40 -> 0.40)
-    df['mva'] = pd.to_numeric(df['mva'], errors='coerce').fillna(0)
-    df['mva_decimal'] = df['mva'] / 100
-    df['mva_remanescente'] = df['mva_decimal'] * FATOR_ART_17
-    
-    desc_col = 'descricao do produto' if 'descricao do produto' in df.columns else 'descricao'
-    registros: list[dict] = []
-    ncms_vistos: set[str] = set()
-    
+    tabela, avisos = carregar_anexo_ix(csv_path)
+    for aviso in avisos:
+        print(f"Aviso: {aviso}")
+    print(f"Total de linhas válidas: {len(tabela)}")
+    registros = registros_anexo_ix(tabela)
+
     print("\n" + "="*70)
     print("LOG DE CONFERÊNCIA")
     print("="*70)
-    
-    for _, row in df.iterrows():
-        ncm = str(row['ncm']).strip()
-        if not ncm or ncm in ncms_vistos:
-            continue
-        ncms_vistos.add(ncm)
-        
-        descricao = None
-        if desc_col in df.columns:
-            desc_raw = row.get(desc_col)
-            if pd.notna(desc_raw) and str(desc_raw).strip():
-                descricao = str(desc_raw).strip()[:500]
-        
-        mva_original = row['mva_decimal']
-        mva_remanescente = row['mva_remanescente']
-        cest = str(row.get('cest', '')).strip() if pd.notna(row.get('cest')) else ""
-        
-        mva_pct = row['mva']
-        mva_ajust_pct = mva_remanescente * 100
-        print(f"NCM: {ncm:10} | CEST: {cest or '-'} | MVA Original: {mva_pct:6.2f}% | MVA Ajustada: {mva_ajust_pct:6.2f}%")
-        
-        reg = {
-            COL_NCM: ncm,
-            COL_DESCRICAO: descricao,
-            COL_MVA_ST_INTERNA: float(mva_original) if pd.notna(mva_original) else None,
-            COL_MVA_REMANESCENTE: float(mva_remanescente) if pd.notna(mva_remanescente) else None,
-        }
-        if cest and len(cest) >= 4:
-            reg[COL_CEST] = cest
-        registros.append(reg)
-    
+    for reg in registros:
+        mva_pct = (reg.get(COL_MVA_ST_INTERNA) or 0) * 100
+        mva_ajust_pct = (reg.get(COL_MVA_REMANESCENTE) or 0) * 100
+        print(f"NCM: {reg[COL_NCM]:10} | CEST: {reg.get(COL_CEST) or '-'} | MVA Original: {mva_pct:6.2f}% | MVA Ajustada: {mva_ajust_pct:6.2f}%")
     print("="*70)
     return registros
 
@@ -121,26 +87,28 @@ def obter_mapa_ncm_cest(csv_path: str) -> dict[str, str]:
     Retorna mapa NCM -> CEST de todas as linhas do CSV (não deduplica por NCM).
     Usa o primeiro CEST encontrado por NCM para consistência.
     """
-    df = pd.read_csv(csv_path, sep=';', encoding='latin-1')
-    df.columns = df.columns.str.strip().str.lower()
-    if "cest" not in df.columns:
-        return {}
-    df["ncm"] = df["ncm"].astype(str).apply(apenas_digitos)
-    df["cest"] = df["cest"].astype(str).apply(apenas_digitos)
-    mapa: dict[str, str] = {}
-    for _, row in df.iterrows():
-        ncm = str(row.get("ncm", "")).strip()
-        cest = str(row.get("cest", "")).strip()
-        if ncm and len(ncm) >= 2 and cest and len(cest) >= 4 and ncm not in mapa:
-            mapa[ncm] = cest  # primeiro CEST vence por NCM
-    return mapa
+    tabela, _ = carregar_anexo_ix(csv_path)
+    return mapa_ncm_cest(tabela)
+
+
+def simular_carga(supabase: Client, registros: list[dict]) -> None:
+    """Dry-run: mostra o que a carga mudaria em base_normativa_ncm, sem gravar."""
+    diff = comparar_com_base(registros, linhas_base_normativa(supabase))
+    print(
+        f"\nDry-run: {diff['novos']} NCM(s) novo(s), {diff['alterados']} alterado(s), "
+        f"{diff['iguais']} sem alteração, {diff['so_no_banco']} só no banco (mantidos)."
+    )
+    alteracoes = diff["detalhe"][diff["detalhe"]["situacao"] != "só no banco"]
+    if not alteracoes.empty:
+        print(alteracoes.to_string(index=False))
 
 
 def atualizar_cest_explicito(supabase: Client, csv_path: str) -> int:
     """
-    Atualiza a coluna CEST em base_normativa_ncm via UPDATE explícito.
+    Atualiza a coluna CEST em base_normativa_ncm com UPDATE explícito, em massa
+    (anexo_ix.atualizar_cest_em_massa: RPC da migration 017 ou lotes concorrentes).
     Funciona mesmo quando a tabela tem unique em (ncm, uf) ou outra estrutura.
-    Retorna quantidade de linhas atualizadas.
+    Retorna quantidade de linhas cujo CEST mudou.
     """
     mapa = obter_mapa_ncm_cest(csv_path)
     if not mapa:
@@ -148,22 +116,12 @@ def atualizar_cest_explicito(supabase: Client, csv_path: str) -> int:
         return 0
     
     print(f"\nAtualizando CEST para {len(mapa)} NCMs...")
-    atualizados = 0
-    for ncm, cest in mapa.items():
-        try:
-            resp = (
-                supabase.table("base_normativa_ncm")
-                .update({COL_CEST: cest})
-                .eq(COL_NCM, ncm)
-                .execute()
-            )
-            if resp.data:
-                atualizados += len(resp.data)
-        except Exception as e:
-            print(f"  Erro ao atualizar NCM {ncm}: {e}")
-    
-    print(f"✓ {atualizados} linhas atualizadas com CEST.")
-    return atualizados
+    resultado = atualizar_cest_em_massa(supabase, mapa)
+    for erro in resultado["erros"]:
+        print(f"  Erro ao atualizar {erro}")
+    modo = "RPC atualizar_cest_base_normativa" if resultado["modo"] == "rpc" else "lotes concorrentes (sem a RPC da migration 017)"
+    print(f"✓ {resultado['alteradas']} linhas com CEST alterado ({resultado['requisicoes']} requisição(ões), {modo}).")
+    return resultado["alteradas"]
 
 
 def upsert_registros(supabase: Client, registros: list[dict]) -> None:
@@ -199,6 +157,44 @@ def upsert_registros(supabase: Client, registros: list[dict]) -> None:
                         print(f"  Falha NCM {r.get(COL_NCM)}: {ins}")
 
 
+def reclassificar_itens_afetados(supabase: Client, regras_antigas: list[dict]) -> None:
+    """Reclassifica os itens_nota atingidos pela diferença entre as regras antigas e as atuais."""
+    print("\n--- Reclassificação incremental de itens_nota ---")
+    try:
+        resultado = reclassificar_incremental(
+            supabase, regras_antigas, carregar_base_normativa(supabase), esquema=detectar_esquema(supabase)
+        )
+    except Exception as e:
+        print(f"  Erro na reclassificação (reprocesse pelo Painel de Auditoria): {e}")
+        return
+    print(
+        f"  Regras alteradas: {resultado['ncms']} NCM(s), {resultado['cests']} CEST(s). "
+        f"{resultado['alterados']} de {resultado['itens']} item(ns) conferido(s) reclassificado(s)."
+    )
+    for linha in resultado["relatorio"]:
+        print(
+            f"  {linha['cliente']}: {linha['notas']} nota(s), {linha['itens_alterados']} item(ns) "
+            f"(+{linha['passaram_a_st']} ST, -{linha['deixaram_st']} ST)"
+        )
+
+
+@contextmanager
+def fase(nome: str, tempos: dict[str, float]):
+    """Cronometra um trecho do main e guarda a duração em tempos[nome]."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempos[nome] = time.perf_counter() - inicio
+
+
+def imprimir_tempos(tempos: dict[str, float]) -> None:
+    print("\n--- Tempo por fase ---")
+    for nome, segundos in tempos.items():
+        print(f"  {nome:28} {segundos:8.2f} s")
+    print(f"  {'total':28} {sum(tempos.values()):8.2f} s")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Carrega dados_anexo_ix.csv na base_normativa_ncm."
@@ -208,12 +204,24 @@ def main() -> None:
         default=os.path.join(os.path.dirname(__file__), "dados_anexo_ix.csv"),
         help="Caminho para o CSV",
     )
+    parser.add_argument(
+        "--sem-reclassificar",
+        action="store_true",
+        help="Não reclassifica os itens_nota atingidos pelas regras alteradas",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Só compara o CSV com a base atual (novos/alterados), sem gravar",
+    )
     args = parser.parse_args()
 
     if not os.path.exists(args.csv):
         raise FileNotFoundError(f"CSV nao encontrado: {args.csv}")
 
-    registros = carregar_csv(args.csv)
+    tempos: dict[str, float] = {}
+    with fase("leitura do CSV", tempos):
+        registros = carregar_csv(args.csv)
     print(f"\nTotal de registros unicos: {len(registros)}")
 
     if not registros:
@@ -221,12 +229,27 @@ def main() -> None:
         return
 
     supabase = get_supabase_client()
+    if args.dry_run:
+        with fase("dry-run", tempos):
+            simular_carga(supabase, registros)
+        imprimir_tempos(tempos)
+        return
+    regras_antigas = None
+    if not args.sem_reclassificar:
+        with fase("leitura das regras atuais", tempos):
+            regras_antigas = carregar_base_normativa(supabase)
     print("\nEnviando para Supabase (base_normativa_ncm)...")
-    upsert_registros(supabase, registros)
+    with fase("upsert dos NCMs", tempos):
+        upsert_registros(supabase, registros)
     print(f"\n✓ {len(registros)} NCMs enviados para base_normativa_ncm.")
 
     # Atualização explícita de CEST (garante que a coluna CEST seja preenchida)
-    atualizar_cest_explicito(supabase, args.csv)
+    with fase("atualização de CEST", tempos):
+        atualizar_cest_explicito(supabase, args.csv)
+
+    if regras_antigas is not None:
+        with fase("reclassificação", tempos):
+            reclassificar_itens_afetados(supabase, regras_antigas)
 
     # Teste de busca: NCM 8202 (Serrote)
     print("\n--- Teste de busca (NCM Serrote 8202) ---")
@@ -248,6 +271,7 @@ def main() -> None:
                 print("  Nenhum registro com NCM 8202 ou prefixo encontrado na base.")
     except Exception as e:
         print(f"  Erro no teste: {e}")
+    imprimir_tempos(tempos)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+"""
+Cliente Supabase em memória para os testes: o subconjunto do query builder do
+supabase-py/PostgREST usado pelo app (select/eq/in_/or_/gte/lte/order/range/limit,
+insert/upsert/update e rpc), com as tabelas como listas de dicts.
+
+Registra o que os testes conferem (requisições, tamanhos dos filtros in_, filtros
+or_, upserts, updates e chamadas de RPC) e imita os limites do servidor: max_rows
+corta cada resposta, colunas recusa colunas inexistentes (PGRST204) e uma RPC não
+cadastrada falha como função ausente (PGRST202).
+"""
+import threading
+import uuid
+from typing import Any, Callable
+
+
+class Resposta:
+    def __init__(self, data, count=None):
+        self.data, self.count = data, count
+
+
+def _dividir(expressao: str) -> list[str]:
+    """Termos de uma expressão or_/and() separados pelas vírgulas de primeiro nível."""
+    termos, nivel, atual = [], 0, ""
+    for caractere in expressao:
+        if caractere == "," and nivel == 0:
+            termos.append(atual)
+            atual = ""
+            continue
+        nivel += {"(": 1, ")": -1}.get(caractere, 0)
+        atual += caractere
+    return termos + [atual]
+
+
+def _condicao(termo: str) -> Callable[[dict], bool]:
+    """Um termo do PostgREST: and(...), or(...) ou coluna.operador.valor (eq, neq, like, is)."""
+    for juncao, combinar in (("and(", all), ("or(", any)):
+        if termo.startswith(juncao):
+            partes = [_condicao(t) for t in _dividir(termo[len(juncao) : -1])]
+            return lambda r: combinar(p(r) for p in partes)
+    coluna, operador, valor = termo.split(".", 2)
+    if operador == "is":
+        return lambda r: r.get(coluna) is None if valor == "null" else str(r.get(coluna)).lower() == valor
+    if operador == "like":
+        return lambda r: r.get(coluna) is not None and str(r[coluna]).startswith(valor.rstrip("*"))
+    if operador == "neq":
+        return lambda r: r.get(coluna) is not None and str(r[coluna]) != valor
+    assert operador == "eq", f"operador não suportado: {operador}"
+    return lambda r: r.get(coluna) is not None and str(r[coluna]) == valor
+
+
+class Consulta:
+    """Uma consulta sobre uma tabela do SupabaseFalso (montada por encadeamento, como no supabase-py)."""
+
+    def __init__(self, banco: "SupabaseFalso", tabela: str):
+        self.banco, self.tabela = banco, tabela
+        self.op, self.payload, self.opcoes = "select", None, {}
+        self.colunas: list[str] | None = None
+        self.contar = False
+        self.filtros: list[Callable[[dict], bool]] = []
+        self.filtros_in: dict[str, list] = {}
+        self.ordens: list[tuple[str, bool]] = []
+        self.intervalo: tuple[int, int] | None = None
+        self.limite: int | None = None
+
+    # --- Operações ---
+
+    def select(self, colunas: str = "*", count=None):
+        self.colunas = None if colunas.strip() == "*" else [c.strip() for c in colunas.split(",")]
+        self.contar = count == "exact"
+        return self
+
+    def insert(self, payload):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = "id", ignore_duplicates: bool = False):
+        self.op, self.payload = "upsert", payload
+        self.opcoes = {"on_conflict": on_conflict, "ignore_duplicates": ignore_duplicates}
+        return self
+
+    def update(self, payload, count=None, returning=None):
+        self.op, self.payload = "update", payload
+        self.opcoes = {"count": count, "returning": returning}
+        return self
+
+    # --- Filtros e modificadores ---
+
+    def eq(self, coluna, valor):
+        self.filtros.append(lambda r: str(r.get(coluna)) == str(valor))
+        return self
+
+    def neq(self, coluna, valor):
+        self.filtros.append(lambda r: str(r.get(coluna)) != str(valor))
+        return self
+
+    def in_(self, coluna, valores):
+        valores = list(valores)
+        self.banco.tamanhos_in.append(len(valores))
+        self.filtros_in[coluna] = valores
+        esperados = {str(v) for v in valores}
+        self.filtros.append(lambda r: str(r.get(coluna)) in esperados)
+        return self
+
+    def or_(self, expressao: str):
+        self.banco.filtros_or.append(expressao)
+        self.filtros.append(_condicao(f"or({expressao})"))
+        return self
+
+    def gte(self, coluna, valor):
+        self.filtros.append(lambda r: r.get(coluna) is not None and r[coluna] >= valor)
+        return self
+
+    def lte(self, coluna, valor):
+        self.filtros.append(lambda r: r.get(coluna) is not None and r[coluna] <= valor)
+        return self
+
+    def order(self, coluna, desc=False):
+        self.ordens.append((coluna, desc))
+        return self
+
+    def range(self, inicio, fim):
+        assert self.intervalo is None, "range() aplicado duas vezes na mesma consulta"
+        self.intervalo = (inicio, fim)
+        return self
+
+    def limit(self, quantidade):
+        self.limite = quantidade
+        return self
+
+    # --- Execução ---
+
+    def execute(self) -> Resposta:
+        with self.banco.lock:
+            self.banco.requisicoes += 1
+            if self.banco.fora_do_ar:
+                raise ConnectionError("timeout")
+            linhas = self.banco.tabelas.setdefault(self.tabela, [])
+            if self.op == "insert":
+                return Resposta(self._inserir(linhas, self.payload))
+            if self.op == "upsert":
+                return Resposta(self._upsert(linhas))
+            if self.op == "update":
+                return self._atualizar(linhas)
+            return self._selecionar(linhas)
+
+    def _inserir(self, linhas: list[dict], payload) -> list[dict]:
+        novas = [{"id": str(uuid.uuid4()), **r} for r in (payload if isinstance(payload, list) else [payload])]
+        linhas.extend(novas)
+        return [dict(r) for r in novas]
+
+    def _upsert(self, linhas: list[dict]) -> list[dict]:
+        self.banco.upserts.append(len(self.payload))
+        chaves = [c.strip() for c in self.opcoes["on_conflict"].split(",")]
+        afetadas = []
+        for r in self.payload:
+            existente = next((x for x in linhas if all(str(x.get(c)) == str(r.get(c)) for c in chaves)), None)
+            if existente is None:
+                afetadas += self._inserir(linhas, [r])
+            elif not self.opcoes["ignore_duplicates"]:
+                existente.update(r)
+                afetadas.append(dict(existente))
+        return afetadas
+
+    def _atualizar(self, linhas: list[dict]) -> Resposta:
+        alvo = [r for r in linhas if all(f(r) for f in self.filtros)]
+        for r in alvo:
+            r.update(self.payload)
+        self.banco.updates.append({
+            "tabela": self.tabela, "valores": self.payload, "in": self.filtros_in, "linhas": len(alvo), **self.opcoes,
+        })
+        data = [] if self.opcoes["returning"] == "minimal" else [dict(r) for r in alvo]
+        return Resposta(data, len(alvo) if self.opcoes["count"] == "exact" else None)
+
+    def _selecionar(self, linhas: list[dict]) -> Resposta:
+        colunas_tabela = self.banco.colunas.get(self.tabela) if self.banco.colunas is not None else None
+        for coluna in self.colunas or []:
+            if colunas_tabela is not None and coluna not in colunas_tabela:
+                raise Exception(f"{{'code': 'PGRST204', 'message': \"Could not find the '{coluna}' column\"}}")
+        selecionadas = [r for r in linhas if all(f(r) for f in self.filtros)]
+        for coluna, desc in reversed(self.ordens):
+            selecionadas.sort(key=lambda r: (r.get(coluna) is None, r.get(coluna)), reverse=desc)
+        total = len(selecionadas)
+        inicio, fim = self.intervalo or (0, len(selecionadas) - 1)
+        fim = min(fim + 1, inicio + self.banco.max_rows) if self.banco.max_rows else fim + 1
+        if self.limite is not None:
+            fim = min(fim, inicio + self.limite)
+        pagina = [
+            dict(r) if self.colunas is None else {c: r.get(c) for c in self.colunas}
+            for r in selecionadas[inicio:fim]
+        ]
+        return Resposta(pagina, total if self.contar else None)
+
+
+class _ChamadaRpc:
+    def __init__(self, banco: "SupabaseFalso", nome: str, params: dict):
+        self.banco, self.nome, self.params = banco, nome, params
+
+    def execute(self) -> Resposta:
+        with self.banco.lock:
+            self.banco.requisicoes += 1
+        if self.nome not in self.banco.funcoes:
+            raise Exception({"code": "PGRST202", "message": f"Could not find the function public.{self.nome}"})
+        return Resposta(self.banco.funcoes[self.nome](self.params))
+
+
+class SupabaseFalso:
+    """
+    tabelas: {nome: [linhas]} (tabelas novas são criadas no primeiro uso);
+    max_rows: linhas por resposta no servidor (None: sem corte);
+    colunas: {tabela: colunas existentes} para recusar select de colunas ausentes;
+    funcoes: {nome: função(params) -> data} das RPCs disponíveis.
+    """
+
+    def __init__(
+        self,
+        tabelas: dict[str, list[dict]] | None = None,
+        max_rows: int | None = None,
+        colunas: dict[str, set[str]] | None = None,
+        funcoes: dict[str, Callable[[dict], Any]] | None = None,
+    ):
+        self.tabelas = dict(tabelas or {})
+        self.max_rows = max_rows
+        self.colunas = colunas
+        self.funcoes = dict(funcoes or {})
+        self.fora_do_ar = False
+        self.lock = threading.Lock()
+        self.requisicoes = 0
+        self.consultas: list[str] = []
+        self.tamanhos_in: list[int] = []
+        self.filtros_or: list[str] = []
+        self.upserts: list[int] = []
+        self.updates: list[dict] = []
+        self.rpcs: list[tuple[str, dict]] = []
+
+    def table(self, nome: str) -> Consulta:
+        self.consultas.append(nome)
+        return Consulta(self, nome)
+
+    def rpc(self, nome: str, params: dict) -> _ChamadaRpc:
+        self.rpcs.append((nome, params))
+        return _ChamadaRpc(self, nome, params)
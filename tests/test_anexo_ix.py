@@ -0,0 +1,152 @@
+"""
+Testes da leitura do CSV do Anexo IX (anexo_ix): esquema, limpeza, registros e dry-run.
+"""
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anexo_ix import (
+    ErroEsquemaAnexoIX,
+    atualizar_cest_em_massa,
+    carregar_anexo_ix,
+    comparar_com_base,
+    mapa_ncm_cest,
+    registros_anexo_ix,
+)
+from tests.supabase_falso import SupabaseFalso
+
+CSV_ANEXO_IX = (
+    "Descricao do produto;NCM;cest;mva\n"
+    "Outros acumuladores;8507.80.00;21.039.00;40\n"
+    "Água mineral 500 ml;2201.10.00;1.2;250\n"
+    "Água mineral 5 l;2201.10.00;03.002.00;100\n"
+    "Sem NCM;-;;10\n"
+    "Cerveja;2203.00.00;03.021.00;69,43%\n"
+    ";0403;;x\n"
+)
+
+
+def _carregar(texto: str = CSV_ANEXO_IX, encoding: str = "utf-8"):
+    return carregar_anexo_ix(BytesIO(texto.encode(encoding)))
+
+
+class TestCarregarAnexoIX:
+    """Testes para carregar_anexo_ix, registros_anexo_ix e mapa_ncm_cest."""
+
+    def test_limpeza_e_avisos(self):
+        tabela, avisos = _carregar()
+        assert tabela["ncm"].tolist() == ["85078000", "22011000", "22011000", "22030000", "0403"]
+        assert tabela["cest"].fillna("").tolist() == ["2103900", "", "0300200", "0302100", ""]
+        assert tabela["descricao"].isna().tolist() == [False] * 4 + [True]
+        assert tabela["mva_remanescente"].round(6).tolist() == [0.28, 1.75, 0.7, round(0.6943 * 0.7, 6), 0.0]
+        assert any("1 linha(s) sem NCM" in a for a in avisos)
+        assert any("NCM repetido" in a for a in avisos)
+
+    def test_latin1(self):
+        tabela, _ = _carregar(encoding="latin-1")
+        assert tabela["descricao"].iloc[1] == "Água mineral 500 ml"
+
+    def test_registros_primeira_linha_por_ncm(self):
+        tabela, _ = _carregar()
+        registros = registros_anexo_ix(tabela, {"versao": 1})
+        assert [r["ncm"] for r in registros] == ["85078000", "22011000", "22030000", "0403"]
+        assert registros[1] == {
+            "ncm": "22011000", "cest": None, "descricao": "Água mineral 500 ml",
+            "mva_st_interna": 2.5, "mva_remanescente": 1.75, "versao": 1,
+        }
+        # CEST válido de outra linha do mesmo NCM vale para o mapa
+        assert mapa_ncm_cest(tabela) == {"85078000": "2103900", "22011000": "0300200", "22030000": "0302100"}
+
+    def test_sem_coluna_ncm(self):
+        with pytest.raises(ErroEsquemaAnexoIX):
+            _carregar("descricao;cest\nx;1\n")
+
+    def test_sem_mva(self):
+        tabela, avisos = _carregar("ncm;descricao\n8202.10.00;Serrote\n")
+        assert "mva_remanescente" not in registros_anexo_ix(tabela)[0]
+        assert any("mva" in a for a in avisos)
+
+
+class TestCompararComBase:
+    """Testes para comparar_com_base (dry-run)."""
+
+    def test_novos_alterados_e_so_no_banco(self):
+        tabela, _ = _carregar()
+        registros = registros_anexo_ix(tabela)
+        atuais = [
+            {"ncm": "8507.80.00", "descricao": "Outros acumuladores", "cest": "2103900", "mva_st_interna": "0.40", "mva_remanescente": 0.28},
+            {"ncm": "22011000", "descricao": "Água mineral 500 ml", "cest": None, "mva_st_interna": 2.5, "mva_remanescente": 1.0},
+            {"ncm": "99999999", "descricao": "x", "cest": None, "mva_st_interna": 0, "mva_remanescente": 0},
+        ]
+        diff = comparar_com_base(registros, atuais)
+        assert (diff["novos"], diff["alterados"], diff["iguais"], diff["so_no_banco"]) == (2, 1, 1, 1)
+        detalhe = diff["detalhe"].set_index("ncm")
+        assert detalhe.loc["22011000", "campos"] == "mva_remanescente"
+        assert detalhe.loc["99999999", "situacao"] == "só no banco"
+
+    def test_base_vazia(self):
+        tabela, _ = _carregar()
+        diff = comparar_com_base(registros_anexo_ix(tabela), [])
+        assert diff["novos"] == 4 and diff["alterados"] == 0
+
+
+def _base_cest(atuais: dict, com_rpc=True, erro_rpc=None) -> SupabaseFalso:
+    """base_normativa_ncm com os CESTs atuais; com_rpc=False simula a migration 017 ausente."""
+    linhas = [{"ncm": ncm, "cest": cest} for ncm, cest in atuais.items()]
+
+    def atualizar_cest_base_normativa(params):
+        if erro_rpc is not None:
+            raise erro_rpc
+        novos = {par["ncm"]: par["cest"] for par in params["p_pares"]}
+        alteradas = [r for r in linhas if r["ncm"] in novos and r["cest"] != novos[r["ncm"]]]
+        for r in alteradas:
+            r["cest"] = novos[r["ncm"]]
+        return len(alteradas)
+
+    funcoes = {"atualizar_cest_base_normativa": atualizar_cest_base_normativa} if com_rpc else {}
+    return SupabaseFalso({"base_normativa_ncm": linhas}, funcoes=funcoes)
+
+
+def _cests(sb: SupabaseFalso) -> dict:
+    return {r["ncm"]: r["cest"] for r in sb.tabelas["base_normativa_ncm"]}
+
+
+class TestAtualizarCestEmMassa:
+    """Testes para atualizar_cest_em_massa."""
+
+    MAPA = {"22011000": "0300100", "22021000": "0300100", "22030000": "0302100", "85078000": "2103900"}
+    ATUAIS = {"22011000": None, "22021000": "0300100", "22030000": "9999999"}
+
+    def test_rpc_uma_requisicao(self):
+        sb = _base_cest(self.ATUAIS, com_rpc=True)
+        resultado = atualizar_cest_em_massa(sb, self.MAPA)
+        assert resultado == {"modo": "rpc", "alteradas": 2, "requisicoes": 1, "erros": []}
+        assert len(sb.rpcs[0][1]["p_pares"]) == 4
+        assert sb.updates == []
+
+    def test_sem_rpc_um_update_por_cest_em_lotes(self):
+        sb = _base_cest(self.ATUAIS, com_rpc=False)
+        resultado = atualizar_cest_em_massa(sb, self.MAPA)
+        assert resultado["modo"] == "lotes" and resultado["alteradas"] == 2 and resultado["erros"] == []
+        assert sorted((u["valores"]["cest"], tuple(u["in"]["ncm"])) for u in sb.updates) == [
+            ("0300100", ("22011000", "22021000")),
+            ("0302100", ("22030000",)),
+            ("2103900", ("85078000",)),
+        ]
+        assert all(u["returning"] == "minimal" and u["count"] == "exact" for u in sb.updates)
+        assert _cests(sb)["22030000"] == "0302100"
+
+    def test_outro_erro_da_rpc_e_relancado(self):
+        sb = _base_cest(self.ATUAIS, erro_rpc=Exception({"code": "57014", "message": "statement timeout"}))
+        with pytest.raises(Exception, match="statement timeout"):
+            atualizar_cest_em_massa(sb, self.MAPA)
+        assert sb.updates == []
+
+    def test_mapa_vazio(self):
+        sb = _base_cest({}, com_rpc=True)
+        assert atualizar_cest_em_massa(sb, {})["alteradas"] == 0
+        assert sb.rpcs == []
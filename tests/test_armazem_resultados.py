@@ -0,0 +1,37 @@
+"""
+Testes do armazém em disco do modo streaming (ArmazemResultados, ListaEmDisco).
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import armazem_resultados
+from armazem_resultados import ArmazemResultados
+
+
+class TestListaEmDisco:
+    """Testes para ListaEmDisco."""
+
+    def test_comporta_se_como_lista(self, tmp_path, monkeypatch):
+        """len, índice, fatia e iteração enxergam o buffer e as linhas já gravadas"""
+        monkeypatch.setattr(armazem_resultados, "TAMANHO_BUFFER", 3)
+        armazem = ArmazemResultados.novo(tmp_path)
+        lista = armazem.lista("resumo")
+        lista.extend({"n": i, "valor": i * 1.5} for i in range(7))
+        assert len(lista) == 7 and lista
+        assert lista[0]["n"] == 0 and lista[-1]["n"] == 6
+        assert [r["n"] for r in lista[2:5]] == [2, 3, 4]
+        assert [r["n"] for r in lista] == list(range(7))
+        assert [r["n"] for r in lista.pagina(3, 3)] == [6]
+        assert lista.somar("valor") == sum(i * 1.5 for i in range(7))
+
+    def test_reabre_do_disco(self, tmp_path):
+        """Outro ArmazemResultados no mesmo arquivo lê o que foi gravado"""
+        armazem = ArmazemResultados.novo(tmp_path)
+        armazem.lista("alertas").extend(["a", "b"])
+        armazem.fechar()
+        reaberta = ArmazemResultados(armazem.caminho_db).lista("alertas")
+        assert len(reaberta) == 2
+        assert reaberta[1] == "b"
+        assert not ArmazemResultados(armazem.caminho_db).lista("itens")
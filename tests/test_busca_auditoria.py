@@ -0,0 +1,82 @@
+"""
+Testes da busca paginada do Painel de Auditoria (busca_auditoria) com um
+PostgREST em memória.
+"""
+import sys
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from busca_auditoria import SelecaoNotas, buscar_ids_notas, buscar_pagina_notas
+from esquema_banco import COLUNAS_OPCIONAIS, EsquemaBanco
+from tests.supabase_falso import SupabaseFalso
+
+
+NOTAS = [
+    {
+        "id": f"n{i:03d}",
+        "numero_nfe": str(i),
+        "cliente_id": "c1" if i % 3 else None,
+        "cnpj_destinatario": "12345678000199" if i % 6 == 0 else "99999999000199",
+        "valor_total": float(i),
+        "icms_total": 0.0,
+        "data_importacao": "2024-02-01T10:00:00",
+        "data_emissao": f"2024-01-{1 + i % 28:02d}",
+        "cst_principal": None,
+    }
+    for i in range(250)
+]
+FILTROS = ("c1", "12345678000199", None, None)
+
+
+class TestBuscarPaginaNotas:
+    """Testes para buscar_pagina_notas e buscar_ids_notas."""
+
+    def test_pagina_total_e_ordem(self):
+        """Notas do cliente + sem vínculo com o CNPJ dele, num único or_, páginas pela ordem pedida"""
+        banco = SupabaseFalso({"notas_fiscais": NOTAS})
+        esperadas = [n for n in NOTAS if n["cliente_id"] == "c1" or n["cnpj_destinatario"] == "12345678000199"]
+        pagina, total = buscar_pagina_notas(banco, EsquemaBanco.completo(), FILTROS, 2, "Valor Total", True, tamanho=50)
+        assert total == len(esperadas)
+        assert [n["id"] for n in pagina] == [n["id"] for n in sorted(esperadas, key=lambda n: -n["valor_total"])[50:100]]
+        assert banco.filtros_or == ["cliente_id.eq.c1,and(cliente_id.is.null,cnpj_destinatario.eq.12345678000199)"]
+        assert sorted(buscar_ids_notas(banco, EsquemaBanco.completo(), FILTROS)) == sorted(n["id"] for n in esperadas)
+
+    def test_esquema_antigo(self):
+        """Sem cnpj_destinatario nem data_emissao: só cliente_id e período por data_importacao"""
+        banco = SupabaseFalso({"notas_fiscais": NOTAS})
+        esquema = EsquemaBanco({"notas_fiscais": set(COLUNAS_OPCIONAIS["notas_fiscais"]) - {"cnpj_destinatario", "data_emissao"}})
+        filtros = ("c1", "12345678000199", date(2024, 2, 1), date(2024, 2, 1))
+        pagina, total = buscar_pagina_notas(banco, esquema, filtros, 1, tamanho=500)
+        assert total == sum(1 for n in NOTAS if n["cliente_id"] == "c1")
+        assert banco.filtros_or == []
+        assert "data_emissao" not in pagina[0] and "cnpj_destinatario" not in pagina[0]
+
+
+class TestSelecaoNotas:
+    """Testes para SelecaoNotas."""
+
+    def test_todas_menos_desmarcadas(self):
+        selecao = SelecaoNotas()
+        selecao.definir("n1", False)
+        selecao.definir("n2", True)
+        assert not selecao.selecionada("n1") and selecao.selecionada("n2")
+        assert selecao.quantidade(10) == 9
+        assert selecao.ids(lambda: ["n0", "n1", "n2"]) == ["n0", "n2"]
+
+    def test_limpar_e_marcar(self):
+        """Depois de limpar, só as marcadas contam e a lista completa não é lida"""
+        selecao = SelecaoNotas()
+        selecao.limpar()
+        selecao.definir("n5", True)
+        selecao.definir("n3", True)
+        selecao.definir("n5", False)
+
+        def nao_deve_ler():
+            raise AssertionError("lista completa lida sem necessidade")
+
+        assert selecao.ids(nao_deve_ler) == ["n3"]
+        assert selecao.quantidade(10) == 1
+        selecao.selecionar_todas()
+        assert selecao.quantidade(10) == 10
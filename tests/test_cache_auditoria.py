@@ -0,0 +1,125 @@
+"""
+Testes do cache colunar do Painel de Auditoria (cache_auditoria): tabela de
+detalhes montada em conjunto, filtros e ordenação lidos do Parquet.
+"""
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cache_auditoria
+from cache_auditoria import CacheAuditoria, montar_tabela_auditoria
+from regras_st import (
+    BADGE_ANTECIPACAO_PENDENTE,
+    BADGE_OPERACAO_COMUM,
+    BADGE_ST_RECOLHIDA,
+    STATUS_IRREGULAR_ST,
+    STATUS_SUJEITO_ST,
+    IndiceRegrasST,
+    cfop_indica_st,
+    cfop_inicia_51,
+    cfop_inicia_54_ou_64,
+    cfop_inicia_61,
+    preparar_base_normativa,
+)
+
+INDICE = IndiceRegrasST(preparar_base_normativa([
+    {"ncm": "8202.10.00", "cest": None},
+    {"ncm": "3923", "cest": "20.001.00"},
+    {"ncm": "84", "cest": None},
+]))
+NOTAS = [
+    {"id": "n1", "numero_nfe": "101", "uf_origem": "SP"},
+    {"id": "n2", "numero_nfe": "102", "uf_origem": "pr"},
+    {"id": "n3", "numero_nfe": "103", "uf_origem": None},
+]
+
+
+def _itens(n, seed=3):
+    rnd = random.Random(seed)
+    return [
+        {
+            "id": f"i{i}",
+            "nota_id": rnd.choice(["n1", "n2", "n3"]),
+            "ncm": rnd.choice(["8202.10.00", "39231090", "84713012", "9", None, "", "12345678"]),
+            "cest": rnd.choice([None, "", "20.001.00", "99"]),
+            "cfop": rnd.choice(["5102", " 5405", "6403", "6102", "1102", None]),
+            "status_st": rnd.choice([None, "", STATUS_SUJEITO_ST, STATUS_IRREGULAR_ST]),
+            "valor_total": rnd.choice([None, 0, 12.5, 100.0]),
+            "descricao": rnd.choice([None, "Parafuso", "X" * 90]),
+            "codigo_produto": rnd.choice([None, "A1"]),
+        }
+        for i in range(n)
+    ]
+
+
+def _status_item_a_item(item, uf):
+    """Laço original de _exibir_resultados_auditoria (referência para Status)."""
+    status_db = (item.get("status_st") or "").strip()
+    irregular_db = bool(item.get("status_st")) and "IRREGULAR" in status_db
+    na_base = INDICE.casar(item.get("ncm"), item.get("cest"))[0] is not None
+    cfop = item.get("cfop")
+    if irregular_db or (cfop_inicia_51(cfop) and na_base):
+        return "❌ IRREGULAR"
+    if na_base and cfop_inicia_54_ou_64(cfop):
+        return BADGE_ST_RECOLHIDA
+    if (cfop_inicia_61(cfop) and uf and uf != "PR") or (na_base and not cfop_inicia_54_ou_64(cfop) and not cfop_inicia_51(cfop)):
+        return BADGE_ANTECIPACAO_PENDENTE
+    if item.get("status_st") and not na_base and cfop_indica_st(cfop):
+        return "⚠️ SUJEITO A ST (via CFOP)"
+    return BADGE_OPERACAO_COMUM
+
+
+class TestMontarTabela:
+    """Testes para montar_tabela_auditoria."""
+
+    def test_igual_ao_laco_item_a_item(self):
+        itens = _itens(400)
+        uf = {n["id"]: str(n["uf_origem"] or "").strip().upper() for n in NOTAS}
+        df = montar_tabela_auditoria(itens, NOTAS, INDICE)
+        assert list(df["Status"]) == [_status_item_a_item(i, uf[i["nota_id"]]) for i in itens]
+        assert list(df["Número NF"]) == [{"n1": "101", "n2": "102", "n3": "103"}[i["nota_id"]] for i in itens]
+        assert list(df["_sujeito_st"]) == [bool(i["status_st"]) for i in itens]
+        longas = df["Descrição"].str.len() > 80
+        assert (df.loc[longas, "Descrição"] == "X" * 80 + "…").all()
+        assert set(df.loc[df["Descrição"] == "—", "Descrição"]) <= {"—"}
+
+
+@pytest.fixture(params=[True, False], ids=["parquet", "memoria"])
+def cache(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_auditoria, "HAS_PYARROW", request.param and cache_auditoria.HAS_PYARROW)
+    return CacheAuditoria(tmp_path / "sessao", max_selecoes=2)
+
+
+class TestCacheAuditoria:
+    """Testes para CacheAuditoria (com pyarrow e sem)."""
+
+    def test_filtro_ordem_e_resumo(self, cache):
+        df = montar_tabela_auditoria(_itens(300), NOTAS, INDICE)
+        chave = CacheAuditoria.chave(["n2", "n1", "n1"], 7, 0)
+        assert chave == CacheAuditoria.chave(["n1", "n2"], 7, 0) != CacheAuditoria.chave(["n1", "n2"], 7, 1)
+        resumo = cache.guardar(chave, df, meta={"nome_cliente": "Cliente"})
+        pendente = df[df["Status"] == BADGE_ANTECIPACAO_PENDENTE]
+        assert resumo["antecipacao_pendente"] == len(pendente)
+        assert resumo["valor_risco"] == pytest.approx(pendente["Valor Item"].sum())
+        assert cache.meta(chave) == {"nome_cliente": "Cliente"}
+
+        lido = cache.ler(chave, "antecipacao_pendente", ["Número NF", "Valor Item"], ordenar_por="Valor Item", decrescente=True)
+        esperado = pendente.sort_values("Valor Item", ascending=False, kind="stable")
+        assert list(lido.columns) == ["Número NF", "Valor Item"]
+        assert list(lido["Número NF"]) == list(esperado["Número NF"])
+        assert len(cache.ler(chave, "sujeitos_st")) == int(df["_sujeito_st"].sum())
+
+    def test_selecoes_antigas_saem(self, cache):
+        df = montar_tabela_auditoria(_itens(10), NOTAS, INDICE)
+        chaves = [CacheAuditoria.chave([f"n{i}"]) for i in range(3)]
+        for chave in chaves:
+            cache.guardar(chave, df)
+        assert not cache.contem(chaves[0]) and cache.contem(chaves[2])
+        with pytest.raises(KeyError):
+            cache.ler(chaves[0])
+        cache.limpar()
+        assert not cache.diretorio.exists()
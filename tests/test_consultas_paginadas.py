@@ -0,0 +1,88 @@
+"""
+Testes da leitura paginada (consultas_paginadas) com um PostgREST em memória que
+corta as respostas em max-rows.
+"""
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from consultas_paginadas import buscar_paginado, buscar_por_ids, em_paralelo, lotes
+from tests.supabase_falso import SupabaseFalso
+
+
+ITENS = [{"id": i, "nota_id": f"n{i % 700}"} for i in range(5000)]
+
+
+def _banco(max_rows=1000):
+    return SupabaseFalso({"itens_nota": ITENS}, max_rows=max_rows)
+
+
+class TestBuscarPaginado:
+    """Testes para buscar_paginado e buscar_por_ids."""
+
+    def test_le_todas_as_paginas(self):
+        """Sem filtro, 5000 linhas em páginas de 1000 (a última, vazia, encerra)"""
+        banco = _banco()
+        linhas = buscar_paginado(lambda: banco.table("itens_nota").order("id"))
+        assert [r["id"] for r in linhas] == list(range(5000))
+        assert banco.requisicoes == 6
+
+    def test_max_rows_menor_que_a_pagina(self):
+        """Servidor cortando em 300 linhas por resposta: nada se perde com páginas de 1000"""
+        banco = _banco(max_rows=300)
+        linhas = buscar_paginado(lambda: banco.table("itens_nota").order("id"), tamanho_pagina=1000)
+        assert [r["id"] for r in linhas] == list(range(5000))
+        assert banco.requisicoes == 18
+
+    def test_ids_em_lotes(self):
+        """700 ids: in_ com no máximo tamanho_lote ids, nenhum item perdido, ordem dos lotes"""
+        ids = [f"n{i}" for i in range(700)] + ["n0"]
+        for paralelo in (False, True):
+            banco = _banco(max_rows=300)
+            linhas = buscar_por_ids(
+                lambda lote: banco.table("itens_nota").in_("nota_id", lote).order("id"),
+                ids,
+                tamanho_lote=150,
+                tamanho_pagina=300,
+                paralelo=paralelo,
+            )
+            assert sorted(r["id"] for r in linhas) == list(range(5000))
+            assert max(banco.tamanhos_in) == 150
+            indice_lote = [int(r["nota_id"][1:]) // 150 for r in linhas]
+            assert indice_lote == sorted(indice_lote)
+
+    def test_lotes(self):
+        assert lotes([3, 1, 3, 2], 2) == [[3, 1], [2]]
+        assert lotes([], 2) == []
+
+
+class TestEmParalelo:
+    """Testes para em_paralelo (consultas independentes em threads)."""
+
+    def test_resultados_por_nome_e_concorrencia(self):
+        """As tarefas rodam ao mesmo tempo (a barreira só libera com as três juntas)"""
+        barreira = threading.Barrier(3, timeout=5)
+
+        def tarefa(valor):
+            def executar():
+                barreira.wait()
+                return valor
+            return executar
+
+        assert em_paralelo({"a": tarefa(1), "b": tarefa(2), "c": tarefa(3)}) == {"a": 1, "b": 2, "c": 3}
+        assert em_paralelo({}) == {}
+
+    def test_erros(self):
+        """Sem capturar_erros a exceção é relançada; com capturar_erros vira o resultado"""
+        def falhar():
+            raise ValueError("coluna inexistente")
+
+        with pytest.raises(ValueError):
+            em_paralelo({"ok": lambda: 1, "erro": falhar})
+        resultados = em_paralelo({"ok": lambda: 1, "erro": falhar}, capturar_erros=True)
+        assert resultados["ok"] == 1
+        assert isinstance(resultados["erro"], ValueError)
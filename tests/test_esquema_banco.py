@@ -0,0 +1,49 @@
+"""
+Testes da detecção das colunas opcionais (esquema_banco) com um PostgREST em
+memória que recusa colunas inexistentes como o Supabase (PGRST204).
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from esquema_banco import COLUNAS_OPCIONAIS, EsquemaBanco, detectar_esquema
+from tests.supabase_falso import SupabaseFalso
+
+
+class TestDetectarEsquema:
+    """Testes para detectar_esquema e EsquemaBanco."""
+
+    def test_esquema_completo_uma_consulta_por_tabela(self):
+        banco = SupabaseFalso(colunas={t: set(cs) for t, cs in COLUNAS_OPCIONAIS.items()})
+        esquema = detectar_esquema(banco)
+        assert all(not esquema.ausentes(t) for t in COLUNAS_OPCIONAIS)
+        assert banco.requisicoes == len(COLUNAS_OPCIONAIS)
+
+    def test_esquema_antigo(self):
+        """Sem migrations 012/013: uf_origem, cst_principal e cst ausentes; o resto presente"""
+        banco = SupabaseFalso(colunas={
+            "notas_fiscais": set(COLUNAS_OPCIONAIS["notas_fiscais"]) - {"uf_origem", "cst_principal"},
+            "itens_nota": set(COLUNAS_OPCIONAIS["itens_nota"]) - {"cst"},
+        })
+        esquema = detectar_esquema(banco)
+        assert esquema.ausentes("notas_fiscais") == ["uf_origem", "cst_principal"]
+        assert esquema.ausentes("itens_nota") == ["cst"]
+        assert esquema.colunas("notas_fiscais", ("id", "numero_nfe", "uf_origem", "data_emissao")) == "id, numero_nfe, data_emissao"
+        linhas = [{"numero_nfe": "1", "uf_origem": "SP", "cst_principal": "10"}]
+        assert esquema.filtrar("notas_fiscais", linhas) == [{"numero_nfe": "1"}]
+        assert linhas[0]["uf_origem"] == "SP"
+
+    def test_erro_de_rede_e_relancado(self):
+        banco = SupabaseFalso(colunas={t: set() for t in COLUNAS_OPCIONAIS})
+        banco.fora_do_ar = True
+        with pytest.raises(ConnectionError):
+            detectar_esquema(banco)
+
+    def test_completo(self):
+        esquema = EsquemaBanco.completo()
+        linhas = [{"numero_nfe": "1", "cst_principal": "10"}]
+        assert esquema.filtrar("notas_fiscais", linhas) is linhas
+        assert esquema.tem("clientes", "qualquer")
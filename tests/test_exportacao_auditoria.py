@@ -0,0 +1,75 @@
+"""
+Testes da exportação em fluxo da auditoria (exportacao_auditoria) e da leitura em
+blocos do cache colunar.
+"""
+import gzip
+import io
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import exportacao_auditoria
+from cache_auditoria import CacheAuditoria
+from exportacao_auditoria import excede_limite_excel, gerar_exportacao
+
+COLUNAS = ["Status", "Número NF", "Valor Item"]
+
+
+def _blocos(n, tamanho):
+    df = pd.DataFrame({
+        "Status": ["A" if i % 2 else "B" for i in range(n)],
+        "Número NF": [str(i) for i in range(n)],
+        "Valor Item": [i / 4 for i in range(n)],
+        "Extra": 0,
+    })
+    return [df.iloc[i : i + tamanho] for i in range(0, n, tamanho)], df
+
+
+class TestExportacao:
+    """Testes para gerar_exportacao e o limite de linhas do Excel."""
+
+    def test_csv_gzip(self):
+        blocos, df = _blocos(2500, 1000)
+        arquivo = gerar_exportacao("csv.gz", iter(blocos), COLUNAS)
+        lido = pd.read_csv(io.BytesIO(gzip.decompress(arquivo.read())), sep=";", dtype={"Número NF": str})
+        pd.testing.assert_frame_equal(lido, df[COLUNAS])
+
+    def test_parquet(self):
+        pytest.importorskip("pyarrow")
+        blocos, df = _blocos(2500, 1000)
+        lido = pd.read_parquet(gerar_exportacao("parquet", iter(blocos), COLUNAS))
+        pd.testing.assert_frame_equal(lido, df[COLUNAS])
+        vazio = pd.read_parquet(gerar_exportacao("parquet", iter([]), COLUNAS))
+        assert list(vazio.columns) == COLUNAS and vazio.empty
+
+    def test_xlsx_cortado_no_limite(self, monkeypatch):
+        openpyxl = pytest.importorskip("openpyxl")
+        monkeypatch.setattr(exportacao_auditoria, "LIMITE_LINHAS_EXCEL", 101)
+        blocos, _ = _blocos(250, 40)
+        planilha = openpyxl.load_workbook(gerar_exportacao("xlsx", iter(blocos), COLUNAS)).active
+        assert planilha.max_row == 101
+        assert [c.value for c in planilha[1]] == COLUNAS
+
+    def test_limite_excel(self):
+        assert not excede_limite_excel(1_048_575)
+        assert excede_limite_excel(1_048_576)
+
+
+class TestBlocosDoCache:
+    """CacheAuditoria.blocos: mesmas linhas de ler(), em pedaços."""
+
+    @pytest.mark.parametrize("ordenar_por", [None, "Valor Item"])
+    def test_blocos_iguais_a_ler(self, tmp_path, ordenar_por):
+        _, df = _blocos(2345, 2345)
+        tabela = df.drop(columns="Extra").assign(_sujeito_st=df["Status"] == "A", _irregular=False)
+        cache = CacheAuditoria(tmp_path)
+        cache.guardar("k", tabela)
+        blocos = list(cache.blocos("k", "sujeitos_st", COLUNAS, ordenar_por, True, linhas_por_bloco=500))
+        assert all(len(b) <= 500 for b in blocos)
+        juntos = pd.concat(blocos, ignore_index=True)
+        pd.testing.assert_frame_equal(juntos, cache.ler("k", "sujeitos_st", COLUNAS, ordenar_por, True))
+        assert list(juntos.columns) == COLUNAS and (juntos["Status"] == "A").all()
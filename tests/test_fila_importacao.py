@@ -0,0 +1,120 @@
+"""
+Testes da fila de importações em segundo plano (FilaImportacao, executar_job) e do
+índice de arquivos já importados (impressoes_nfe).
+"""
+import sys
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fila_importacao import (
+    ARQUIVO_FALHA,
+    ARQUIVO_GRAVADA,
+    JOB_CONCLUIDO,
+    FilaImportacao,
+    executar_job,
+)
+from impressoes_nfe import IndiceImpressoes, impressao_xml
+import ingestao_nfe
+from tests.test_nfe_parser import XML_EVENTO, XML_NFE_NAMESPACE
+
+
+def _criar_zip(caminho: Path, n: int) -> None:
+    with zipfile.ZipFile(caminho, "w") as zf:
+        for i in range(n):
+            xml = XML_NFE_NAMESPACE.replace("<nNF>12345</nNF>", f"<nNF>{i}</nNF>")
+            zf.writestr(f"notas/{i}.xml", xml.replace("550010000123451", f"55001{i:09d}1"))
+        zf.writestr("notas/quebrado.xml", "<nfeProc>")
+
+
+class TestExecutarJob:
+    """Testes para executar_job."""
+
+    def test_retomar_nao_reanalisa_registrados(self, tmp_path):
+        """Ao retomar, só XMLs sem registro (ou com falha de gravação) vão para gravar_lote"""
+        caminho_zip = tmp_path / "notas.zip"
+        _criar_zip(caminho_zip, 5)
+        fila = FilaImportacao(tmp_path / "fila.sqlite3")
+        job_id = fila.criar_job("notas.zip", str(caminho_zip), 6)
+        # Execução anterior interrompida: 2 gravadas e 1 com falha de gravação
+        fila.registrar(job_id, [
+            {"membro": "notas/0.xml", "status": ARQUIVO_GRAVADA, "numero_nfe": "0"},
+            {"membro": "notas/1.xml", "status": ARQUIVO_GRAVADA, "numero_nfe": "1"},
+            {"membro": "notas/2.xml", "status": ARQUIVO_FALHA, "numero_nfe": "2"},
+        ])
+
+        recebidas = []
+
+        def gravar_lote(analises):
+            recebidas.extend(a["numero_nfe"] for a in analises)
+            return [{"status": ARQUIVO_GRAVADA, "numero_nfe": a["numero_nfe"], "mensagem": ""} for a in analises]
+
+        executar_job(fila, job_id, [], gravar_lote, tamanho_lote=2)
+
+        assert recebidas == ["2", "3", "4"]
+        job = fila.obter_job(job_id)
+        assert job["status"] == JOB_CONCLUIDO
+        assert (job["processadas"], job["gravadas"], job["erros"]) == (6, 5, 1)
+        assert not caminho_zip.exists()
+
+    def test_impressoes_pulam_arquivos_ja_importados(self, tmp_path):
+        """Com o índice, XMLs já importados e cópias idênticas não chegam a gravar_lote"""
+        caminho_zip = tmp_path / "notas.zip"
+        _criar_zip(caminho_zip, 3)
+        with zipfile.ZipFile(caminho_zip, "a") as zf:
+            zf.writestr("copia/0.xml", zf.read("notas/0.xml"))
+        impressoes = IndiceImpressoes(tmp_path / "impressoes.sqlite3")
+        with zipfile.ZipFile(caminho_zip) as zf:
+            sha, chave = impressao_xml(zf.read("notas/1.xml"))
+        impressoes.registrar([(sha, chave, "1")])
+
+        fila = FilaImportacao(tmp_path / "fila.sqlite3")
+        job_id = fila.criar_job("notas.zip", str(caminho_zip), 5)
+        recebidas = []
+
+        def gravar_lote(analises):
+            recebidas.extend(a["numero_nfe"] for a in analises)
+            return [{"status": ARQUIVO_GRAVADA, "numero_nfe": a["numero_nfe"], "mensagem": ""} for a in analises]
+
+        executar_job(fila, job_id, [], gravar_lote, impressoes=impressoes)
+
+        assert recebidas == ["0", "2"]
+        job = fila.obter_job(job_id)
+        assert (job["gravadas"], job["duplicadas"], job["erros"]) == (2, 2, 1)
+        assert impressoes.total() == 3
+
+    def test_cada_membro_lido_uma_vez(self, tmp_path, monkeypatch):
+        """A impressão sai da mesma leitura da análise; XML já importado não passa pelo parsing"""
+        caminho_zip = tmp_path / "notas.zip"
+        _criar_zip(caminho_zip, 3)
+        impressoes = IndiceImpressoes(tmp_path / "impressoes.sqlite3")
+        with zipfile.ZipFile(caminho_zip) as zf:
+            impressoes.registrar([(*impressao_xml(zf.read("notas/1.xml")), "1")])
+
+        lidos = []
+        ler_original = zipfile.ZipFile.read
+        monkeypatch.setattr(zipfile.ZipFile, "read", lambda zf, nome, *a: lidos.append(nome) or ler_original(zf, nome, *a))
+        extraidos = []
+        extrair_original = ingestao_nfe.extrair_registro_nfe
+        monkeypatch.setattr(ingestao_nfe, "extrair_registro_nfe", lambda xml: extraidos.append(xml) or extrair_original(xml))
+
+        fila = FilaImportacao(tmp_path / "fila.sqlite3")
+        job_id = fila.criar_job("notas.zip", str(caminho_zip), 4)
+        executar_job(
+            fila, job_id, [],
+            lambda analises: [{"status": ARQUIVO_GRAVADA, "numero_nfe": a["numero_nfe"], "mensagem": ""} for a in analises],
+            impressoes=impressoes,
+        )
+        assert sorted(lidos) == ["notas/0.xml", "notas/1.xml", "notas/2.xml", "notas/quebrado.xml"]
+        assert len(extraidos) == 3
+        assert fila.obter_job(job_id)["duplicadas"] == 1
+
+
+class TestImpressaoXml:
+    """Testes para impressao_xml."""
+
+    def test_chave_somente_do_infnfe(self):
+        """Chave vem do Id do infNFe; evento (só chNFe) fica sem chave"""
+        assert impressao_xml(XML_NFE_NAMESPACE.encode())[1] == "41240312345678000199550010000123451000012345"
+        assert impressao_xml(XML_EVENTO.encode())[1] is None
@@ -0,0 +1,121 @@
+"""
+Testes da ingestão de NF-e: classificação pura (analisar_nfe) e ZIP em paralelo.
+"""
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from impressoes_nfe import IndiceImpressoes, impressao_xml
+from ingestao_nfe import analisar_nfe, analisar_zip_em_paralelo, mapear_em_janela
+from nfe_parser import extrair_registro_nfe
+from regras_st import STATUS_IRREGULAR_ST, IndiceRegrasST, preparar_base_normativa
+from tests.test_import import XML_NFE_MINIMO
+from tests.test_nfe_parser import XML_NFE_NAMESPACE
+
+BASE = preparar_base_normativa([{"ncm": "8202", "descricao": "Serrote", "mva_remanescente": 0.28}])
+
+
+def _buscar(ncm, cest):
+    from regras_st import casar_regra_st
+    return casar_regra_st(BASE, ncm, cest)[0]
+
+
+class TestAnalisarNfe:
+    """Testes para analisar_nfe."""
+
+    def test_nota_com_st(self):
+        """NCM na base + CFOP 64xx: sujeito a ST, CFOP interestadual e totais"""
+        a = analisar_nfe(extrair_registro_nfe(XML_NFE_NAMESPACE), _buscar)
+        assert a["numero_nfe"] == "12345"
+        assert a["cnpj_destinatario"] == "12345678000199"
+        assert a["sujeito_st_pr"] is True
+        assert a["tem_cfop_6"] is True
+        assert a["cfop_principal"] == "Múltiplos (6102, 6403)"
+        assert a["itens_exibir"][0]["MVA Remanescente"] == "28.0%"
+        assert a["itens_salvar"][1]["ncm"] == "18069000"
+        assert a["itens_salvar"][1]["status_st"] is None
+        assert a["totais_impostos"]["icms_st_total"] == 6.9
+
+    def test_st_zerado_irregular(self):
+        """CFOP 5401 com vST zerado na nota: status irregular"""
+        a = analisar_nfe(extrair_registro_nfe(XML_NFE_MINIMO), _buscar)
+        assert a["itens_salvar"][0]["status_st"] == STATUS_IRREGULAR_ST
+        assert a["itens_exibir"][0]["Status ST"] == STATUS_IRREGULAR_ST
+        assert a["cst_principal"] == "00"
+
+    def test_classificacao_para_gravar(self):
+        """Com a versão da base: categoria, diagnóstico, regra e flags de CFOP em cada item"""
+        a = analisar_nfe(extrair_registro_nfe(XML_NFE_NAMESPACE), _buscar, "v1")
+        serrote, chocolate = a["itens_salvar"]
+        assert serrote["categoria_st"] == "st_recolhida" and serrote["diagnostico_st"] == "cfop_st"
+        assert serrote["regra_st"] == "8202" and serrote["versao_regras_st"] == "v1"
+        assert serrote["cfop_st"] is True and serrote["cfop_interestadual"] is False
+        # CFOP 6102 vindo de SP, NCM fora da base
+        assert chocolate["categoria_st"] == "antecipacao" and chocolate["diagnostico_st"] == "interestadual_fora_pr"
+        assert chocolate["regra_st"] is None and chocolate["cfop_interestadual"] is True
+        assert "categoria_st" not in analisar_nfe(extrair_registro_nfe(XML_NFE_NAMESPACE), _buscar)["itens_salvar"][0]
+
+    def test_registro_vazio(self):
+        """Registro sem infNFe: nota 'N/A' sem itens"""
+        a = analisar_nfe(extrair_registro_nfe("<procEventoNFe/>"), _buscar)
+        assert a["numero_nfe"] == "N/A"
+        assert a["itens_salvar"] == []
+        assert a["v_nf"] == "0.00"
+
+
+class TestZipParalelo:
+    """Testes para analisar_zip_em_paralelo."""
+
+    def test_ordem_e_erros_por_arquivo(self, tmp_path):
+        """Resultados na ordem do ZIP; XML inválido e membro ausente viram erro"""
+        caminho = tmp_path / "notas.zip"
+        with zipfile.ZipFile(caminho, "w") as zf:
+            zf.writestr("a/nota1.xml", XML_NFE_NAMESPACE)
+            zf.writestr("a/quebrado.xml", "<nfeProc><NFe>")
+            zf.writestr("a/nota2.xml", XML_NFE_MINIMO)
+        membros = ["a/nota1.xml", "a/quebrado.xml", "a/inexistente.xml", "a/nota2.xml"]
+        resultados = list(analisar_zip_em_paralelo(str(caminho), membros, BASE, max_workers=2))
+        assert [r["membro"] for r in resultados] == membros
+        assert resultados[0]["analise"]["numero_nfe"] == "12345"
+        assert resultados[1]["etapa"] == "processamento"
+        assert resultados[2]["etapa"] == "leitura"
+        assert resultados[3]["analise"]["numero_nfe"] == "123456"
+        assert resultados[0]["analise"]["itens_salvar"][0]["versao_regras_st"] == IndiceRegrasST(BASE).versao
+
+    def test_workers_consultam_impressoes(self, tmp_path):
+        """Com o índice, o worker devolve a impressão e marca o XML já importado sem analisar"""
+        caminho = tmp_path / "notas.zip"
+        with zipfile.ZipFile(caminho, "w") as zf:
+            zf.writestr("nota1.xml", XML_NFE_NAMESPACE)
+            zf.writestr("nota2.xml", XML_NFE_MINIMO)
+        impressoes = IndiceImpressoes(tmp_path / "impressoes.sqlite3")
+        impressoes.registrar([(*impressao_xml(XML_NFE_NAMESPACE.encode()), "12345")])
+        resultados = list(analisar_zip_em_paralelo(str(caminho), ["nota1.xml", "nota2.xml"], BASE, 2, impressoes))
+        assert resultados[0]["ja_importado"] == "12345" and "analise" not in resultados[0]
+        assert resultados[1]["impressao"] == impressao_xml(XML_NFE_MINIMO.encode())
+        assert resultados[1]["analise"]["numero_nfe"] == "123456"
+
+    def test_janela_limita_envios_com_consumo_lento(self):
+        """Com quem consome lento, os envios não passam da janela (blocos em voo + o bloco sendo consumido)"""
+        enviados = []
+        lock = threading.Lock()
+
+        def dobrar(bloco):
+            with lock:
+                enviados.extend(bloco)
+            return [x * 2 for x in bloco]
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            saida = mapear_em_janela(executor, dobrar, list(range(100)), tamanho_bloco=5, blocos_em_voo=4)
+            consumidos = []
+            for valor in saida:
+                consumidos.append(valor)
+                time.sleep(0.001)
+                with lock:
+                    assert len(enviados) - len(consumidos) < (4 + 1) * 5
+        assert consumidos == [x * 2 for x in range(100)]
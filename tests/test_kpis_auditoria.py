@@ -0,0 +1,183 @@
+"""
+Testes dos KPIs do Painel de Auditoria: cálculo vetorizado (kpis_auditoria) e função
+auditoria_kpis da migration 015, executada num SQLite local no lugar do Postgres.
+"""
+import json
+import random
+import re
+import sqlite3
+import sys
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import _compute_auditoria_kpis
+from kpis_auditoria import FLAGS_AUDITORIA, calcular_kpis_auditoria, classificar_itens_auditoria, ncm_na_base_vetorizado
+from regras_st import (
+    STATUS_IRREGULAR_ST,
+    STATUS_SUJEITO_ST,
+    IndiceRegrasST,
+    cfop_inicia_51,
+    cfop_inicia_54_ou_64,
+    cfop_inicia_61,
+    classificacao_item_st,
+    preparar_base_normativa,
+)
+from tests.supabase_falso import SupabaseFalso
+
+BASE = preparar_base_normativa([
+    {"ncm": "8202.10.00", "cest": None},
+    {"ncm": "3923", "cest": "20.001.00"},
+    {"ncm": "84", "cest": None},
+    {"ncm": "401110", "cest": "16.001.00"},
+])
+
+
+def _kpis_item_a_item(itens, uf_origem_por_nota, indice):
+    """Laço original de _compute_auditoria_kpis (referência)."""
+    kpis = {"total_itens": len(itens), "st_recolhida": 0, "antecipacao_pendente": 0, "irregulars": 0, "valor_risco": 0.0}
+    for item in itens:
+        status_db = (item.get("status_st") or "").strip()
+        irregular_db = bool(item.get("status_st")) and (STATUS_IRREGULAR_ST in status_db or "IRREGULAR" in status_db)
+        ncm_na_base = indice.casar(item.get("ncm"), item.get("cest"))[0] is not None
+        cfop = item.get("cfop")
+        uf_origem = uf_origem_por_nota.get(str(item.get("nota_id", "")), "")
+        if irregular_db or (cfop_inicia_51(cfop) and ncm_na_base):
+            kpis["irregulars"] += 1
+        elif ncm_na_base and cfop_inicia_54_ou_64(cfop):
+            kpis["st_recolhida"] += 1
+        elif (cfop_inicia_61(cfop) and uf_origem and uf_origem != "PR") or (
+            ncm_na_base and not cfop_inicia_54_ou_64(cfop) and not cfop_inicia_51(cfop)
+        ):
+            kpis["antecipacao_pendente"] += 1
+            kpis["valor_risco"] += float(item.get("valor_total", 0) or 0)
+    return kpis
+
+
+MIGRACAO_KPIS = Path(__file__).resolve().parent.parent / "migrations" / "015_create_auditoria_kpis.sql"
+
+
+def _itens_aleatorios(n, notas, seed=11):
+    rnd = random.Random(seed)
+    return [
+        {
+            "nota_id": rnd.choice(notas),
+            "ncm": rnd.choice(["8202.10.00", "82021000", "39231090", "84713012", "401110", "9", None, "", "12345678"]),
+            "cest": rnd.choice([None, "", "20.001.00", "1600100", "99"]),
+            "cfop": rnd.choice(["5102", " 5405", "6403", "6102", "1102", None, ""]),
+            "status_st": rnd.choice([None, "", STATUS_SUJEITO_ST, STATUS_IRREGULAR_ST]),
+            "valor_total": rnd.choice([None, 0, 12.5, 100.0, 3.25]),
+        }
+        for _ in range(n)
+    ]
+
+
+def _auditoria_kpis_sqlite(itens, ufs, base, nota_ids):
+    """auditoria_kpis em SQLite: o bloco de classificação da migration, com notas_alvo por json_each."""
+    sql = MIGRACAO_KPIS.read_text(encoding="utf-8")
+    bloco = re.search(r"-- classificacao:inicio\n(.*?)-- classificacao:fim", sql, re.S).group(1)
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("so_digitos", 1, lambda v: re.sub(r"\D", "", str(v)) if v else "", deterministic=True)
+    conn.execute("CREATE TABLE base_normativa_ncm (ncm TEXT, cest TEXT)")
+    conn.execute("CREATE TABLE notas_fiscais (id TEXT, uf_origem TEXT)")
+    conn.execute("CREATE TABLE itens_nota (nota_id TEXT, ncm TEXT, cest TEXT, cfop TEXT, status_st TEXT, valor_total REAL)")
+    conn.executemany("INSERT INTO base_normativa_ncm VALUES (?, ?)", [(r["ncm"], r["cest"]) for r in base])
+    conn.executemany("INSERT INTO notas_fiscais VALUES (?, ?)", list(ufs.items()))
+    conn.executemany(
+        "INSERT INTO itens_nota VALUES (:nota_id, :ncm, :cest, :cfop, :status_st, :valor_total)", itens
+    )
+    conn.row_factory = sqlite3.Row
+    linha = conn.execute(
+        "WITH notas_alvo AS (SELECT value AS id FROM json_each(?)),\n" + bloco, (json.dumps(nota_ids),)
+    ).fetchone()
+    return dict(linha)
+
+
+class TestAuditoriaKpisSql:
+    """Testes da função auditoria_kpis (migration 015) contra o cálculo local."""
+
+    def test_sql_equivale_ao_calculo_local(self):
+        """Mesmos KPIs do calcular_kpis_auditoria, só para as notas pedidas"""
+        ufs = {"n1": "pr", "n2": " SP", "n3": None}
+        itens = _itens_aleatorios(1500, ["n1", "n2", "n3", "n4"])
+        obtido = _auditoria_kpis_sqlite(itens, ufs, BASE, ["n1", "n2", "n4"])
+        selecionados = [i for i in itens if i["nota_id"] in ("n1", "n2", "n4")]
+        ufs_normalizadas = {k: str(v).strip().upper() if v else "" for k, v in ufs.items()}
+        esperado = calcular_kpis_auditoria(selecionados, ufs_normalizadas, IndiceRegrasST(BASE))
+        assert obtido == {**esperado, "valor_risco": pytest.approx(esperado["valor_risco"])}
+
+    def test_app_usa_rpc(self):
+        """_compute_auditoria_kpis devolve os agregados do banco sem buscar itens"""
+        nota = str(uuid.uuid4())
+        itens = _itens_aleatorios(50, [nota], seed=3)
+        banco = SupabaseFalso(funcoes={
+            "auditoria_kpis": lambda params: [_auditoria_kpis_sqlite(itens, {nota: "SP"}, BASE, params["p_nota_ids"])]
+        })
+        kpis = _compute_auditoria_kpis(banco, [nota])
+        assert [nome for nome, _ in banco.rpcs] == ["auditoria_kpis"]
+        assert banco.consultas == []
+        assert kpis["total_itens"] == 50
+        esperado = calcular_kpis_auditoria(itens, {nota: "SP"}, IndiceRegrasST(BASE))
+        assert kpis == {**esperado, "valor_risco": pytest.approx(esperado["valor_risco"])}
+
+
+class TestCalcularKpisAuditoria:
+    """Testes para calcular_kpis_auditoria."""
+
+    def test_equivale_ao_laco_por_item(self):
+        """Itens aleatórios (NCM/CEST formatados, nulos, CFOPs e UFs variados): mesmos KPIs"""
+        indice = IndiceRegrasST(BASE)
+        ufs = {"n1": "PR", "n2": "SP", "n3": ""}
+        itens = _itens_aleatorios(2000, ["n1", "n2", "n3", "n4"])
+        esperado = _kpis_item_a_item(itens, ufs, indice)
+        obtido = calcular_kpis_auditoria(itens, ufs, indice)
+        assert obtido == {**esperado, "valor_risco": pytest.approx(esperado["valor_risco"])}
+
+    def test_sem_itens(self):
+        assert calcular_kpis_auditoria([], {}, IndiceRegrasST(BASE))["total_itens"] == 0
+
+    def test_ncm_invalido_nao_casa_por_cest(self):
+        """Como casar: NCM com menos de 2 dígitos não casa nem com CEST da base"""
+        na_base = ncm_na_base_vetorizado(pd.Series(["1", "00000000"]), pd.Series(["2000100", "2000100"]), IndiceRegrasST(BASE))
+        assert na_base.tolist() == [False, True]
+
+
+class TestClassificacaoGravada:
+    """classificacao_item_st (gravada na importação) x classificação vetorizada do painel."""
+
+    def _gravados(self, itens, ufs, indice, versao):
+        return [
+            {**item, **classificacao_item_st(
+                item["status_st"], indice.casar(item["ncm"], item["cest"])[0] if item["ncm"] else None,
+                item["cfop"], ufs.get(item["nota_id"], ""), versao,
+            )}
+            for item in itens
+        ]
+
+    def test_mesmas_flags_do_calculo(self):
+        """Item a item, a categoria gravada reproduz as flags calculadas"""
+        indice = IndiceRegrasST(BASE)
+        ufs = {"n1": "PR", "n2": "SP", "n3": ""}
+        itens = _itens_aleatorios(2000, ["n1", "n2", "n3", "n4"], seed=5)
+        calculado = classificar_itens_auditoria(itens, ufs, indice)
+        gravado = classificar_itens_auditoria(self._gravados(itens, ufs, indice, indice.versao), {}, indice)
+        for flag in ("na_base", "irregular", "st_recolhida", "antecipacao"):
+            assert gravado[flag].tolist() == calculado[flag].tolist(), flag
+        # st_via_cfop só vale fora das categorias anteriores (ordem do painel)
+        fora = ~calculado["irregular"]
+        assert gravado.loc[fora, "st_via_cfop"].tolist() == calculado.loc[fora, "st_via_cfop"].tolist()
+
+    def test_usa_colunas_gravadas_so_na_versao_atual(self):
+        """Classificação de outra versão da base é ignorada e recalculada"""
+        indice = IndiceRegrasST(BASE)
+        item = {"nota_id": "n1", "ncm": "82021000", "cest": None, "cfop": "5102", "status_st": None, "valor_total": 1}
+        # Gravado como "comum" (diferente do cálculo, que dá irregular)
+        gravado = {**item, "categoria_st": "comum", "regra_st": None}
+        atual = classificar_itens_auditoria([{**gravado, "versao_regras_st": indice.versao}], {}, indice)
+        antiga = classificar_itens_auditoria([{**gravado, "versao_regras_st": "outra"}], {}, indice)
+        assert not atual.loc[0, list(FLAGS_AUDITORIA)].any()
+        assert antiga.loc[0, "irregular"] and antiga.loc[0, "na_base"]
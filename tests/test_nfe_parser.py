@@ -0,0 +1,108 @@
+"""
+Testes do motor de extração incremental de NF-e (nfe_parser).
+Compara o registro plano com o caminho antigo (xmltodict + .get()).
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import xmltodict  # type: ignore
+
+from nfe_parser import extrair_impostos_item, extrair_registro_nfe
+from tests.test_import import XML_NFE_DATA_BR, XML_NFE_MINIMO
+
+# NF-e com namespace, emitente, dois itens (um com ICMS-ST) e protocolo
+XML_NFE_NAMESPACE = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+  <NFe>
+    <infNFe Id="NFe41240312345678000199550010000123451000012345" versao="4.00">
+      <ide><nNF>12345</nNF><dhEmi>2024-03-01T08:00:00-03:00</dhEmi></ide>
+      <emit><CNPJ>99888777000166</CNPJ><enderEmit><UF>sp</UF></enderEmit></emit>
+      <dest><CNPJ>12.345.678/0001-99</CNPJ></dest>
+      <det nItem="1">
+        <prod>
+          <cProd>A1</cProd><xProd>Serrote</xProd><NCM>82021000</NCM><CEST>0800400</CEST>
+          <CFOP>6403</CFOP><qCom>4</qCom><vProd>40.00</vProd><vFrete>2.50</vFrete>
+        </prod>
+        <imposto>
+          <ICMS><ICMS10><CST>10</CST><vBC>40.00</vBC><pICMS>12.00</pICMS><vICMS>4.80</vICMS>
+            <vBCST>60.00</vBCST><pICMSST>19.50</pICMSST><vICMSST>6.90</vICMSST></ICMS10></ICMS>
+          <IPI><IPITrib><vBC>40.00</vBC><pIPI>5.00</pIPI><vIPI>2.00</vIPI></IPITrib></IPI>
+        </imposto>
+      </det>
+      <det nItem="2">
+        <prod><cEAN>789</cEAN><NCM>1806.90.00</NCM><CFOP>6102</CFOP><vProd>10.00</vProd></prod>
+        <imposto><ICMS><ICMSSN102><CSOSN>102</CSOSN></ICMSSN102></ICMS></imposto>
+      </det>
+      <total><ICMSTot><vBC>40.00</vBC><vICMS>4.80</vICMS><vST>6.90</vST><vNF>58.90</vNF></ICMSTot></total>
+    </infNFe>
+  </NFe>
+  <protNFe><infProt><chNFe>41240312345678000199550010000123451000012345</chNFe></infProt></protNFe>
+</nfeProc>
+"""
+
+XML_EVENTO = """<?xml version="1.0" encoding="UTF-8"?>
+<procEventoNFe><evento><infEvento><chNFe>123</chNFe></infEvento></evento></procEventoNFe>
+"""
+
+
+def _det_xmltodict(xml: str) -> list:
+    d = xmltodict.parse(xml)
+    raiz = d.get("nfeProc", d)
+    det = raiz["NFe"]["infNFe"].get("det", [])
+    return det if isinstance(det, list) else [det]
+
+
+class TestExtrairRegistroNfe:
+    """Testes para extrair_registro_nfe."""
+
+    def test_campos_da_nota(self):
+        """ide, dest, emit e ICMSTot vão para o registro plano"""
+        r = extrair_registro_nfe(XML_NFE_NAMESPACE)
+        assert r["numero_nfe"] == "12345"
+        assert r["data_emissao"] == "2024-03-01"
+        assert r["cnpj_destinatario"] == "12.345.678/0001-99"
+        assert r["uf_origem"] == "SP"
+        assert r["chave_acesso"] == "41240312345678000199550010000123451000012345"
+        assert r["totais"]["vNF"] == "58.90"
+        assert r["totais"]["vST"] == "6.90"
+
+    def test_itens_equivalentes_ao_xmltodict(self):
+        """Impostos por item iguais ao caminho antigo (xmltodict)"""
+        r = extrair_registro_nfe(XML_NFE_NAMESPACE)
+        antigos = [extrair_impostos_item(item) for item in _det_xmltodict(XML_NFE_NAMESPACE)]
+        assert [i["impostos"] for i in r["itens"]] == antigos
+
+    def test_campos_do_produto(self):
+        """Defaults de prod iguais ao processar_xml (N/A, 0.00, 1.00)"""
+        itens = extrair_registro_nfe(XML_NFE_NAMESPACE)["itens"]
+        assert itens[0]["codigo_produto"] == "A1"
+        assert itens[0]["cest"] == "0800400"
+        assert itens[0]["valor_ipi"] == 2.0
+        assert itens[0]["valor_frete"] == 2.5
+        assert itens[0]["icms_origem"] == 4.8
+        assert itens[1]["codigo_produto"] == "789"
+        assert itens[1]["descricao"] == "N/A"
+        assert itens[1]["quantidade"] == "1.00"
+        assert itens[1]["cest"] is None
+        assert itens[1]["impostos"]["cst"] == "102"
+
+    def test_bytes_e_str(self):
+        """Aceita bytes (com declaração de encoding) e str"""
+        por_bytes = extrair_registro_nfe(XML_NFE_MINIMO.encode("utf-8"))
+        por_str = extrair_registro_nfe(XML_NFE_MINIMO)
+        assert por_bytes == por_str
+        assert por_str["numero_nfe"] == "123456"
+        assert por_str["cnpj_destinatario"] == "12345678000199"
+
+    def test_data_br(self):
+        """dEmi no formato BR reaproveita extrair_data_emissao_ide"""
+        assert extrair_registro_nfe(XML_NFE_DATA_BR)["data_emissao"] == "2024-06-15"
+
+    def test_xml_sem_infnfe(self):
+        """Evento sem infNFe: registro vazio (nota 'Sem numero')"""
+        r = extrair_registro_nfe(XML_EVENTO)
+        assert r["numero_nfe"] is None
+        assert r["itens"] == []
+        assert r["totais"] == {}
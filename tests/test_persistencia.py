@@ -0,0 +1,62 @@
+"""
+Testes da persistência da importação (salvar_notas_em_lote, ResolvedorClientes)
+com um cliente Supabase em memória.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import ResolvedorClientes, salvar_notas_em_lote
+from esquema_banco import EsquemaBanco
+from tests.supabase_falso import SupabaseFalso
+
+
+def _nota(numero, n_itens=1):
+    itens = [{"ncm": "8202.10.00", "valor_total": 10.0, "cst": "10"} for _ in range(n_itens)]
+    return {"numero_nfe": numero, "cliente_id": None, "valor_total": 10.0, "icms_total": 1.0, "itens": itens}
+
+
+class TestSalvarNotasEmLote:
+    """Testes para salvar_notas_em_lote."""
+
+    def test_status_e_duplicidade(self):
+        """Nota já no banco e repetida no upload: Ja existente; demais gravadas com itens"""
+        banco = SupabaseFalso()
+        banco.tabelas["notas_fiscais"] = [{"id": "x", "numero_nfe": "1"}]
+        resultados = salvar_notas_em_lote(
+            banco, [_nota("1"), _nota("2", 2), _nota("3"), _nota("2")], esquema=EsquemaBanco.completo()
+        )
+        assert [r["status"] for r in resultados] == ["Ja existente", "Gravada", "Gravada", "Ja existente"]
+        assert len(banco.tabelas["itens_nota"]) == 3
+        assert banco.tabelas["itens_nota"][0]["ncm"] == "82021000"
+        # 1 SELECT + 1 upsert de notas + 1 INSERT de itens
+        assert banco.requisicoes == 3
+
+    def test_esquema_antigo_sem_tentativa_e_erro(self):
+        """Sem as migrations 006/013: colunas ausentes saem antes do envio, sem repetir a gravação"""
+        banco = SupabaseFalso()
+        nota = {**_nota("1"), "data_emissao": "2024-01-02", "cst_principal": "10"}
+        esquema = EsquemaBanco({"notas_fiscais": {"cnpj_destinatario"}, "itens_nota": set()})
+        resultados = salvar_notas_em_lote(banco, [nota], esquema=esquema)
+        assert resultados[0]["status"] == "Gravada"
+        assert "data_emissao" not in banco.tabelas["notas_fiscais"][0]
+        assert "cst_principal" not in banco.tabelas["notas_fiscais"][0]
+        assert "cst" not in banco.tabelas["itens_nota"][0]
+        assert banco.requisicoes == 3
+
+
+class TestResolvedorClientes:
+    """Testes para ResolvedorClientes."""
+
+    def test_uma_consulta_por_cnpj(self):
+        """CNPJ formatado ou não resolve o mesmo cliente; não cadastrado também fica em memória"""
+        banco = SupabaseFalso()
+        banco.tabelas["clientes"] = [{"id": "c1", "cnpj": "12345678000199", "razao_social": "Cliente"}]
+        clientes = ResolvedorClientes(banco)
+        for _ in range(3):
+            assert clientes.por_cnpj("12.345.678/0001-99")["id"] == "c1"
+            assert clientes.por_cnpj("12345678000199")["id"] == "c1"
+            assert clientes.por_cnpj("99999999000199") is None
+            assert clientes.por_id("c1")["razao_social"] == "Cliente"
+        assert banco.requisicoes == 3
@@ -0,0 +1,105 @@
+"""
+Testes da importação em pipeline (PipelineImportacao): ordem, erros por arquivo,
+filas limitadas e sobreposição das etapas.
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pipeline_importacao import PipelineImportacao
+
+
+def _fontes(n, lidos=None):
+    for i in range(n):
+        def ler(i=i):
+            if lidos is not None:
+                lidos.append(i)
+            return f"<xml>{i}</xml>".encode()
+        yield f"{i}.xml", ler
+
+
+class TestPipelineImportacao:
+    """Testes para PipelineImportacao."""
+
+    def test_lotes_na_ordem_dos_arquivos(self):
+        pipeline = PipelineImportacao(
+            _fontes(25),
+            lambda nome, xml: {"nome": nome, "tamanho": len(xml)},
+            lambda lote: [item["nome"] for item in lote],
+            tamanho_lote=10,
+        )
+        saida = list(pipeline.executar())
+        assert [len(lote) for lote, _ in saida] == [10, 10, 5]
+        assert [nome for _, gravados in saida for nome in gravados] == [f"{i}.xml" for i in range(25)]
+        assert pipeline.contagem == {"leitura": 25, "analise": 25, "gravacao": 25}
+
+    def test_erros_de_leitura_e_analise_ficam_no_lote(self):
+        def fontes():
+            yield "ok.xml", lambda: b"<a/>"
+            yield "ilegivel.xml", lambda: (_ for _ in ()).throw(OSError("CRC"))
+            yield "quebrado.xml", lambda: b"<quebrado"
+
+        def analisar(nome, xml):
+            if nome == "quebrado.xml":
+                raise ValueError("XML inválido")
+            return {"nome": nome}
+
+        (lote, _), = PipelineImportacao(fontes(), analisar, lambda lote: None).executar()
+        assert lote[0] == {"nome": "ok.xml"}
+        assert lote[1] == {"nome": "ilegivel.xml", "etapa": "leitura", "erro": "CRC"}
+        assert lote[2] == {"nome": "quebrado.xml", "etapa": "processamento", "erro": "XML inválido"}
+
+    def test_falha_na_gravacao_interrompe(self):
+        lidos = []
+
+        def gravar(lote):
+            raise ConnectionError("Supabase fora do ar")
+
+        pipeline = PipelineImportacao(_fontes(10_000, lidos), lambda n, x: {}, gravar, tamanho_lote=5, tamanho_fila=4)
+        with pytest.raises(ConnectionError):
+            list(pipeline.executar())
+        # As threads param: a leitura não segue até o fim do upload
+        assert len(lidos) < 10_000
+        assert not any(t.name.startswith("pipeline-") for t in threading.enumerate())
+
+    def test_fila_limitada_segura_a_leitura(self):
+        """Com a gravação parada, a leitura avança só até encher as filas"""
+        lidos = []
+        liberar = threading.Event()
+
+        def gravar(lote):
+            liberar.wait(5)
+            return None
+
+        pipeline = PipelineImportacao(_fontes(1000, lidos), lambda n, x: {}, gravar, tamanho_lote=10, tamanho_fila=8)
+        saida = pipeline.executar()
+        consumidor = threading.Thread(target=lambda: list(saida))
+        consumidor.start()
+        time.sleep(0.3)
+        # fila de XMLs + lote em montagem + lotes em espera + lote na gravação
+        assert len(lidos) <= 8 + 10 + 2 * 10 + 10 + 2
+        liberar.set()
+        consumidor.join(10)
+        assert len(lidos) == 1000
+
+    def test_etapas_se_sobrepoem(self):
+        """Tempo total perto da etapa mais lenta, não da soma das etapas"""
+        def analisar(nome, xml):
+            time.sleep(0.01)
+            return {}
+
+        def gravar(lote):
+            time.sleep(0.01 * len(lote))
+
+        pipeline = PipelineImportacao(_fontes(40), analisar, gravar, tamanho_lote=5)
+        inicio = time.perf_counter()
+        list(pipeline.executar())
+        duracao = time.perf_counter() - inicio
+        soma = pipeline.tempos["analise"] + pipeline.tempos["gravacao"]
+        assert duracao < 0.8 * soma
+        assert pipeline.etapa_mais_lenta() in ("analise", "gravacao")
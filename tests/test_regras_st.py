@@ -0,0 +1,87 @@
+"""
+Testes do índice de regras ST (IndiceRegrasST) contra a varredura linear (casar_regra_st)
+e das estatísticas do match.
+"""
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from regras_st import EstatisticasMatch, IndiceRegrasST, casar_regra_st, chave_regra_st, preparar_base_normativa
+
+BASE = preparar_base_normativa([
+    {"ncm": "8202", "descricao": "Serrote", "cest": "08.001.00"},
+    {"ncm": "8202.10.00", "descricao": "Serrote manual", "cest": None},
+    {"ncm": "820210", "descricao": "Serrote 6 dígitos", "cest": "0800200"},
+    {"ncm": "82", "descricao": "Capítulo 82", "cest": ""},
+    {"ncm": "8202", "descricao": "Duplicada", "cest": "0800100"},
+    {"ncm": "3917.21.00", "descricao": "Tubos", "cest": "10.006.00"},
+    {"ncm": "", "descricao": "Sem NCM"},
+])
+
+
+class TestIndiceRegrasST:
+    """Testes para IndiceRegrasST.casar."""
+
+    def test_precedencia(self):
+        """CEST > NCM exato > prefixo mais longo; repetida: vale a primeira linha"""
+        indice = IndiceRegrasST(BASE)
+        assert indice.casar("8202.10.00", "10.006.00")[0]["descricao"] == "Tubos"
+        assert indice.casar("82021000", None) == (BASE[1], "ncm")
+        assert indice.casar("82021099", None) == (BASE[2], "prefixo_6")
+        assert indice.casar("82029999", "0800100") == (BASE[0], "cest")
+        assert indice.casar("82030000", None) == (BASE[3], "prefixo_2")
+        assert indice.casar("9", None) == (None, "ncm_invalido")
+        assert indice.casar("01012100", "123") == (None, "sem_match")
+
+    def test_equivalente_a_varredura_linear(self):
+        """Mesmo (regra, critério) que casar_regra_st para NCMs/CESTs aleatórios"""
+        rnd = random.Random(42)
+        linhas = []
+        for _ in range(400):
+            tamanho = rnd.choice((2, 4, 6, 8, 8))
+            cest = "".join(rnd.choices("0123", k=7)) if rnd.random() < 0.3 else None
+            linhas.append({"ncm": "".join(rnd.choices("0123", k=tamanho)), "cest": cest})
+        base = preparar_base_normativa(linhas)
+        indice = IndiceRegrasST(base)
+        for _ in range(3000):
+            ncm = "".join(rnd.choices("0123", k=rnd.choice((1, 4, 8))))
+            cest = "".join(rnd.choices("0123", k=7)) if rnd.random() < 0.5 else None
+            esperado = casar_regra_st(base, ncm, cest)
+            obtido = indice.casar(ncm, cest)
+            assert obtido[1] == esperado[1]
+            assert obtido[0] is esperado[0]
+
+
+class TestVersaoRegras:
+    """Testes para IndiceRegrasST.versao e chave_regra_st (gravados com a classificação)."""
+
+    def test_versao_muda_com_o_conteudo(self):
+        assert IndiceRegrasST(BASE).versao == IndiceRegrasST([dict(r) for r in BASE]).versao
+        alterada = [dict(r) for r in BASE]
+        alterada[0]["mva_remanescente"] = 0.4
+        assert IndiceRegrasST(alterada).versao != IndiceRegrasST(BASE).versao
+        assert IndiceRegrasST(BASE[:-1]).versao != IndiceRegrasST(BASE).versao
+
+    def test_chave_regra(self):
+        assert chave_regra_st(BASE[0]) == "8202/0800100"
+        assert chave_regra_st(BASE[1]) == "82021000"
+        assert chave_regra_st(None) is None
+
+
+class TestEstatisticasMatch:
+    """Testes para EstatisticasMatch."""
+
+    def test_resumo(self):
+        """Acertos somam CEST, NCM e prefixos; sem_match/ncm_invalido não"""
+        est = EstatisticasMatch()
+        indice = IndiceRegrasST(BASE)
+        for ncm, cest in [("82021000", None), ("82021099", None), ("0101", None), ("9", None), ("1", "0800100")]:
+            est.registrar(indice.casar(ncm, cest)[1])
+        resumo = est.resumo()
+        assert resumo["total"] == 5
+        assert resumo["acertos"] == 2
+        assert resumo["por_criterio"]["ncm_invalido"] == 2
+        est.zerar()
+        assert est.resumo()["total"] == 0
@@ -0,0 +1,107 @@
+"""
+Testes do relatório PDF da auditoria gerado página a página (relatorio_pdf).
+"""
+import math
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from relatorio_pdf import (
+    LIMITE_ITENS_DETALHADO,
+    LINHAS_POR_PAGINA_PDF,
+    LINHAS_PRIMEIRA_PAGINA_PDF,
+    escrever_relatorio_pdf,
+    gerar_relatorio_pdf,
+    linhas_itens,
+    modo_padrao,
+    resumo_por_ncm,
+)
+
+
+def _blocos(n, tamanho, ncms=("22021000", "22030000", "33049900")):
+    df = pd.DataFrame({
+        "NCM": [ncms[i % len(ncms)] for i in range(n)],
+        "Descrição": [f"Produto {i} " + "x" * 60 for i in range(n)],
+        "Valor Item": [float(i % 7) for i in range(n)],
+        "Diagnóstico Fiscal": ["Antecipação pendente " + "y" * 80] * n,
+    })
+    return [df.iloc[i : i + tamanho] for i in range(0, n, tamanho)], df
+
+
+class TestLinhasRelatorio:
+    """Testes para linhas_itens, resumo_por_ncm e modo_padrao."""
+
+    def test_linhas_itens_formatadas(self):
+        bloco = pd.DataFrame({
+            "NCM": [None], "Descrição": ["Linha 1\nLinha 2"], "Valor Item": [1234.5], "Diagnóstico Fiscal": ["z" * 90],
+        })
+        ncm, descricao, valor, diagnostico = next(linhas_itens([bloco]))
+        assert ncm == "—"
+        assert descricao == "Linha 1 Linha 2"
+        assert valor == "1.234,50"
+        assert len(diagnostico) == 81 and diagnostico.endswith("…")
+
+    def test_resumo_por_ncm_entre_blocos(self):
+        blocos, df = _blocos(1000, 300)
+        grupos = resumo_por_ncm(iter(blocos))
+        esperado = df.groupby("NCM")["Valor Item"].agg(["size", "sum"])
+        assert {g["ncm"]: (g["itens"], g["valor"]) for g in grupos} == {
+            ncm: (int(linha["size"]), float(linha["sum"])) for ncm, linha in esperado.iterrows()
+        }
+        assert [g["valor"] for g in grupos] == sorted((g["valor"] for g in grupos), reverse=True)
+        assert grupos[0]["descricao"].startswith("Produto")
+
+    def test_modo_padrao(self):
+        assert modo_padrao(LIMITE_ITENS_DETALHADO) == "itens"
+        assert modo_padrao(LIMITE_ITENS_DETALHADO + 1) == "ncm"
+
+
+class TestRelatorioPDF:
+    """PDF com uma tabela de tamanho fixo por página."""
+
+    def test_paginas_de_tamanho_fixo(self, tmp_path):
+        pytest.importorskip("reportlab")
+        blocos, _ = _blocos(1000, 128)
+        with open(tmp_path / "r.pdf", "wb") as destino:
+            paginas = escrever_relatorio_pdf(destino, iter(blocos), "Cliente", 3000.0)
+        # Cada tabela cabe na sua página (nenhuma é empurrada para a seguinte)
+        assert paginas == 1 + math.ceil((1000 - LINHAS_PRIMEIRA_PAGINA_PDF) / LINHAS_POR_PAGINA_PDF)
+        assert (tmp_path / "r.pdf").read_bytes().startswith(b"%PDF")
+
+    def test_tabela_maior_que_a_pagina_e_dividida(self, tmp_path, monkeypatch):
+        """linhas_por_pagina acima do que cabe: a tabela continua na página seguinte, sem perder linhas"""
+        pytest.importorskip("reportlab")
+        from reportlab.platypus import Frame, Table
+
+        linhas_desenhadas = []
+        adicionar = Frame.add
+
+        def add(frame, flowable, canv, trySplit=0):
+            desenhado = adicionar(frame, flowable, canv, trySplit)
+            if desenhado and isinstance(flowable, Table):
+                linhas_desenhadas.append(len(flowable._cellvalues) - 1)
+            return desenhado
+
+        monkeypatch.setattr(Frame, "add", add)
+        blocos, _ = _blocos(200, 64)
+        with open(tmp_path / "r.pdf", "wb") as destino:
+            paginas = escrever_relatorio_pdf(
+                destino, iter(blocos), "Cliente", 1.0, linhas_por_pagina=100, linhas_primeira_pagina=100
+            )
+        assert sum(linhas_desenhadas) == 200
+        assert paginas > 2
+
+    def test_resumo_por_ncm_em_uma_pagina(self):
+        pytest.importorskip("reportlab")
+        blocos, _ = _blocos(20000, 5000)
+        arquivo = gerar_relatorio_pdf(iter(blocos), "Cliente", 60000.0, modo="ncm")
+        assert arquivo.read(4) == b"%PDF"
+
+    def test_sem_itens(self, tmp_path):
+        pytest.importorskip("reportlab")
+        with open(tmp_path / "r.pdf", "wb") as destino:
+            assert escrever_relatorio_pdf(destino, iter([]), "Cliente", 0.0) == 1
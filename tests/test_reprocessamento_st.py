@@ -0,0 +1,167 @@
+"""
+Testes do reprocessamento em massa do status ST (reprocessamento_st).
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from esquema_banco import EsquemaBanco
+from regras_st import STATUS_IRREGULAR_ST, STATUS_SUJEITO_ST, IndiceRegrasST, preparar_base_normativa
+from reprocessamento_st import diferenca_regras, reclassificar_incremental, reprocessar_notas
+from tests.supabase_falso import SupabaseFalso
+
+
+def _banco(itens, **tabelas):
+    return SupabaseFalso({"itens_nota": itens, **tabelas})
+
+
+BASE = preparar_base_normativa([{"ncm": "8202", "cest": None, "mva_remanescente": 0.35}])
+
+
+class TestReprocessarNotas:
+    """Testes para reprocessar_notas."""
+
+    def test_grava_so_alterados_em_lotes(self):
+        """Itens já corretos não são regravados; progresso a cada bloco de notas"""
+        itens = []
+        for i in range(30):
+            ncm = "82021000" if i % 2 else "39231090"
+            correto = i % 3 == 0
+            itens.append({
+                "id": i,
+                "nota_id": f"n{i % 10}",
+                "ncm": ncm,
+                "cest": None,
+                "cfop": "5102",
+                "status_st": (STATUS_SUJEITO_ST if i % 2 else None) if correto else "desatualizado",
+                "mva_remanescente": (0.35 if i % 2 else None) if correto else None,
+            })
+        banco = _banco(itens)
+        progresso = []
+        resumo = reprocessar_notas(
+            banco,
+            [f"n{i}" for i in range(10)],
+            IndiceRegrasST(BASE),
+            ao_progredir=lambda feitas, total, _: progresso.append((feitas, total)),
+            lote_notas=4,
+            lote_upsert=7,
+        )
+        assert resumo == {"notas": 10, "itens": 30, "itens_st": 15, "alterados": 20}
+        assert progresso == [(4, 10), (8, 10), (10, 10)]
+        assert sum(banco.upserts) == 20 and max(banco.upserts) <= 7
+        for item in itens:
+            assert item["status_st"] == (STATUS_SUJEITO_ST if item["id"] % 2 else None)
+            assert item["mva_remanescente"] == (0.35 if item["id"] % 2 else None)
+
+        # Segunda passada: nada a gravar
+        banco.upserts.clear()
+        assert reprocessar_notas(banco, [f"n{i}" for i in range(10)], IndiceRegrasST(BASE))["alterados"] == 0
+        assert banco.upserts == []
+
+
+    def test_grava_classificacao_e_versao(self):
+        """Com a migration 016: classificação gravada; depois, troca de versão sem upsert"""
+        itens = [
+            {"id": 1, "nota_id": "n1", "ncm": "82021000", "cest": None, "cfop": "6102", "status_st": None, "mva_remanescente": None},
+            {"id": 2, "nota_id": "n2", "ncm": "39231090", "cest": None, "cfop": "6102", "status_st": None, "mva_remanescente": None},
+        ]
+        banco = _banco(itens, notas_fiscais=[{"id": "n1", "uf_origem": "pr"}, {"id": "n2", "uf_origem": "SP"}])
+        indice = IndiceRegrasST(BASE)
+        esquema = EsquemaBanco.completo()
+        assert reprocessar_notas(banco, ["n1", "n2"], indice, esquema=esquema)["alterados"] == 2
+        assert (itens[0]["categoria_st"], itens[0]["regra_st"], itens[0]["versao_regras_st"]) == ("antecipacao", "8202", indice.versao)
+        assert (itens[1]["diagnostico_st"], itens[1]["cfop_interestadual"]) == ("interestadual_fora_pr", True)
+
+        # Classificação igual, versão antiga: só versao_regras_st é atualizada
+        for item in itens:
+            item["versao_regras_st"] = "antiga"
+        banco.upserts.clear()
+        assert reprocessar_notas(banco, ["n1", "n2"], indice, esquema=esquema)["alterados"] == 0
+        assert banco.upserts == [] and [u["linhas"] for u in banco.updates] == [2]
+        assert {item["versao_regras_st"] for item in itens} == {indice.versao}
+
+
+class TestReclassificarIncremental:
+    """Testes para diferenca_regras e reclassificar_incremental."""
+
+    def test_diferenca_por_ncm_cest_e_mva(self):
+        antigas = preparar_base_normativa([
+            {"ncm": "8202", "cest": None, "mva_remanescente": 0.35},
+            {"ncm": "3923", "cest": "2000100"},
+            {"ncm": "84", "cest": None},
+        ])
+        novas = preparar_base_normativa([
+            {"ncm": "8202", "cest": None, "mva_remanescente": 0.40},
+            {"ncm": "3923", "cest": "2000100"},
+            {"ncm": "4011", "cest": "1600100"},
+        ])
+        assert diferenca_regras(antigas, novas) == ({"8202", "84", "4011"}, {"1600100"})
+        assert diferenca_regras(antigas, antigas) == (set(), set())
+
+    def test_so_itens_atingidos_e_relatorio(self):
+        """Só itens com NCM/CEST da diferença são lidos; relatório por cliente"""
+        antigas = preparar_base_normativa([{"ncm": "8202", "cest": None}])
+        novas = preparar_base_normativa([{"ncm": "8202", "cest": None}, {"ncm": "3923", "cest": None}])
+        itens = [
+            {"id": "i1", "nota_id": "n1", "ncm": "39231090", "cest": None, "cfop": "5102", "status_st": None, "mva_remanescente": None},
+            {"id": "i2", "nota_id": "n2", "ncm": "39239000", "cest": None, "cfop": "5102", "status_st": None, "mva_remanescente": None},
+            {"id": "i3", "nota_id": "n1", "ncm": "82021000", "cest": None, "cfop": "5102", "status_st": None, "mva_remanescente": None},
+        ]
+        banco = _banco(
+            itens,
+            notas_fiscais=[{"id": "n1", "cliente_id": "c1"}, {"id": "n2", "cliente_id": None}],
+            clientes=[{"id": "c1", "razao_social": "Cliente Um", "nome_fantasia": None}],
+        )
+        resultado = reclassificar_incremental(banco, antigas, novas)
+        # Um filtro or_ por página lida (a última, vazia, encerra)
+        assert set(banco.filtros_or) == {"ncm.like.3923*"}
+        assert (resultado["ncms"], resultado["itens"], resultado["alterados"]) == (1, 2, 2)
+        assert [(r["cliente"], r["notas"], r["passaram_a_st"]) for r in resultado["relatorio"]] == [
+            ("Cliente Um", 1, 1),
+            ("Sem cliente vinculado", 1, 1),
+        ]
+        # i3 (regra 8202 inalterada) nem foi lido: continua com o status antigo
+        assert itens[2]["status_st"] is None
+        assert itens[0]["status_st"] == STATUS_SUJEITO_ST
+
+    def test_mantem_irregular_quando_a_regra_muda(self):
+        """IRREGULAR da importação não vira SUJEITO A ST: só a MVA nova é gravada"""
+        antigas = preparar_base_normativa([{"ncm": "8202", "cest": None, "mva_remanescente": 0.35}])
+        novas = preparar_base_normativa([{"ncm": "8202", "cest": None, "mva_remanescente": 0.40}])
+        itens = [
+            {"id": "i1", "nota_id": "n1", "ncm": "82021000", "cest": None, "cfop": "5102",
+             "status_st": STATUS_IRREGULAR_ST, "mva_remanescente": 0.35},
+            {"id": "i2", "nota_id": "n1", "ncm": "82029100", "cest": None, "cfop": "5102",
+             "status_st": STATUS_IRREGULAR_ST, "mva_remanescente": 0.40},
+        ]
+        banco = _banco(itens, notas_fiscais=[{"id": "n1", "cliente_id": None}], clientes=[])
+        resultado = reclassificar_incremental(banco, antigas, novas)
+        assert resultado["alterados"] == 1
+        assert [(item["status_st"], item["mva_remanescente"]) for item in itens] == [
+            (STATUS_IRREGULAR_ST, 0.40),
+            (STATUS_IRREGULAR_ST, 0.40),
+        ]
+        assert [(r["passaram_a_st"], r["deixaram_st"]) for r in resultado["relatorio"]] == [(0, 0)]
+
+    def test_versao_nova_nos_itens_nao_atingidos(self):
+        """Com a migration 016, itens da versão antiga fora da diferença mudam só de versão"""
+        antigas = preparar_base_normativa([{"ncm": "8202", "cest": None}])
+        novas = preparar_base_normativa([{"ncm": "8202", "cest": None}, {"ncm": "3923", "cest": None}])
+        versao_antiga, versao_nova = IndiceRegrasST(antigas).versao, IndiceRegrasST(novas).versao
+        itens = [
+            {"id": "i1", "nota_id": "n1", "ncm": "39231090", "cest": None, "cfop": "5102", "status_st": None,
+             "mva_remanescente": None, "categoria_st": "comum", "versao_regras_st": versao_antiga},
+            {"id": "i2", "nota_id": "n1", "ncm": "82021000", "cest": None, "cfop": "5102", "status_st": STATUS_SUJEITO_ST,
+             "mva_remanescente": None, "categoria_st": "irregular", "versao_regras_st": versao_antiga},
+        ]
+        banco = _banco(
+            itens,
+            notas_fiscais=[{"id": "n1", "cliente_id": None, "uf_origem": "PR"}],
+            clientes=[],
+        )
+        resultado = reclassificar_incremental(banco, antigas, novas, esquema=EsquemaBanco.completo())
+        assert resultado["alterados"] == 1
+        assert (itens[0]["categoria_st"], itens[0]["regra_st"]) == ("irregular", "3923")
+        assert itens[1]["categoria_st"] == "irregular"
+        assert {item["versao_regras_st"] for item in itens} == {versao_nova}